@@ -0,0 +1,43 @@
+# app/config.py
+"""
+Cấu hình dùng chung cho toàn bộ app.
+
+- `get_var(key)`: ưu tiên st.secrets (Streamlit Cloud) nhưng CHỈ khi streamlit đã được import
+  (tức đang chạy trong app Streamlit) → CLI / batch / worker không phải import streamlit.
+- `.env` được load đúng 1 lần, ở lần đọc cấu hình đầu tiên.
+"""
+import os
+import sys
+import threading
+
+
+_DOTENV_LOADED = False
+_LOCK = threading.Lock()
+
+
+def load_env():
+    """Load .env một lần (idempotent)."""
+    global _DOTENV_LOADED
+    if _DOTENV_LOADED:
+        return
+    with _LOCK:
+        if not _DOTENV_LOADED:
+            from dotenv import load_dotenv
+            load_dotenv()
+            _DOTENV_LOADED = True
+
+
+def _streamlit_secret(key: str, section: str):
+    st = sys.modules.get("streamlit")
+    if st is None:
+        raise KeyError(key)
+    return st.secrets[section][key]
+
+
+def get_var(key: str, default=None, section: str = "general"):
+    """st.secrets[section][key] (nếu đang chạy Streamlit) → biến môi trường / .env → default."""
+    try:
+        return _streamlit_secret(key, section)
+    except Exception:
+        load_env()
+        return os.getenv(key, default)
@@ -1,30 +1,21 @@
 """
 Hybrid RAG BATCH: chạy nhiều câu hỏi giống hệt CLI và lưu kết quả ra CSV.
 """
-import os, sys, csv, time, asyncio, traceback
+import os, sys, csv, asyncio, argparse, traceback
+from contextlib import nullcontext
 from datetime import datetime
 from dotenv import load_dotenv
-from openai import OpenAI
 
 # === Thêm đường dẫn để import ===
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 # === Import nội bộ ===
-from app.retrievers.hybrid_retriever import HybridRetrieverParallel
-from app.retrievers.vector_tools import VectorClient
-from app.utils.hybrid_helpers import (
-    load_answer_rule,
-    build_id_map_from_graph_records,
-    select_topN_by_priority,
-    build_synthesis_input,
-    llm_summarize_answer,
-)
+from app.utils.answer_pipeline import get_answer_pipeline
+from app.utils.profiling import DEFAULT_MODES, QueryProfiler
 
 # === Cấu hình ===
 load_dotenv()
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
-client = OpenAI(api_key=OPENAI_API_KEY)
 
 INPUT_PATH = "data/Question.csv"
 OUTPUT_DIR = "results"
@@ -39,31 +30,18 @@ OUTPUT_PATH = os.path.join(
 # 🚀 CHẠY 1 CÂU HỎI GIỐNG HỆT CLI
 # =======================================================
 async def run_query_once(user_query: str, top_k: int = 10, limit: int = 3, show_debug: bool = False):
-    synth_rule = load_answer_rule()
-    hybrid = HybridRetrieverParallel()
-    vclient = hybrid.vector
+    pipeline = get_answer_pipeline()
 
     print(f"\n❓ {user_query}\n")
     print("⏳ Đang truy vấn dữ liệu song song từ Neo4j và FAISS...\n")
 
-    total_start = time.time()
-    hybrid_start = time.time()
-    hybrid_result = await hybrid.search(user_query=user_query, top_k=top_k)
-    hybrid_time = int((time.time() - hybrid_start) * 1000)
-
-    graph_records = hybrid_result["graph_records"]
-    graph_ids = hybrid_result["graph_ids"]
-    vector_passages = hybrid_result["vector_passages"]
+    result = await pipeline.answer_async(user_query, top_k=top_k, limit=limit, model=OPENAI_MODEL)
 
-    # Xây map Graph
-    graph_id_map = build_id_map_from_graph_records(graph_records)
-
-    # Chọn topN passage theo ID
-    fusion_start = time.time()
-    chosen_passages = select_topN_by_priority(
-        graph_ids, vector_passages, vclient, graph_id_map, fill_limit=limit
-    )
-    fusion_time = int((time.time() - fusion_start) * 1000)
+    graph_ids = result["graph_ids"]
+    vector_passages = result["vector_passages"]
+    chosen_passages = result["chosen_passages"]
+    timings = result["timings"]
+    answer = result["answer"]
 
     # Debug nếu cần
     if show_debug:
@@ -75,18 +53,11 @@ async def run_query_once(user_query: str, top_k: int = 10, limit: int = 3, show_
         print(f"✅ Chosen IDs ({len(chosen_passages)}): {[p.id for p in chosen_passages]}")
         print("───────────────────────────────\n")
 
-    # Chuẩn bị dữ liệu tổng hợp
-    synthesis_payload = build_synthesis_input(chosen_passages, graph_id_map)
-
-    # Gọi LLM tổng hợp 
-    print("🧠 Đang tổng hợp câu trả lời bằng GPT...\n")
-    llm_start = time.time()
-    answer = llm_summarize_answer(client, user_query, synth_rule, synthesis_payload, OPENAI_MODEL)
-    llm_time = int((time.time() - llm_start) * 1000)
-    total_time = int((time.time() - total_start) * 1000)
-
     # === In ra giống CLI ===
-    print("\n✨ CÂU TRẢ LỜI:\n───────────────────────────────")
+    source_note = {"cache": " (từ cache)", "template": " (dựng theo khung, không gọi LLM)"}.get(result["answer_source"], "")
+    if result.get("partial"):
+        source_note += f" (một phần, thiếu nhánh: {', '.join(result['missing_branches'])})"
+    print(f"\n✨ CÂU TRẢ LỜI{source_note}:\n───────────────────────────────")
     print(answer)
     print("───────────────────────────────")
 
@@ -102,10 +73,10 @@ async def run_query_once(user_query: str, top_k: int = 10, limit: int = 3, show_
     print("\n───────────────────────────────")
     print("⏱ THỜI GIAN XỬ LÝ")
     print("───────────────────────────────")
-    print(f"🔸 Graph + Vector: {hybrid_time} ms")
-    print(f"🔸 Fusion chọn topN: {fusion_time} ms")
-    print(f"🔸 LLM tổng hợp: {llm_time} ms")
-    print(f"⚡ Tổng thời gian: {total_time} ms")
+    print(f"🔸 Graph + Vector: {timings['hybrid_ms']} ms")
+    print(f"🔸 Fusion chọn topN: {timings['fusion_ms']} ms")
+    print(f"🔸 LLM tổng hợp: {timings['llm_ms']} ms")
+    print(f"⚡ Tổng thời gian: {timings['total_ms']} ms")
     print("───────────────────────────────\n")
 
     return answer.strip()
@@ -114,7 +85,7 @@ async def run_query_once(user_query: str, top_k: int = 10, limit: int = 3, show_
 # =======================================================
 # 🔁 CHẠY NHIỀU CÂU HỎI TRONG FILE
 # =======================================================
-async def main():
+async def main(profiler: QueryProfiler = None):
     print("🏠 Hybrid RAG – Batch Mode (y hệt CLI)")
     print("=========================================================")
     print(f"📂 Đọc file câu hỏi: {INPUT_PATH}")
@@ -126,12 +97,28 @@ async def main():
 
     print(f"✅ Tổng số câu hỏi: {len(questions)}\n")
 
+    # --profile: khởi động pipeline, bước nạp trước và từng câu hỏi được profile riêng
+    def profile(label):
+        return profiler.profile(label) if profiler is not None else nullcontext()
+
+    with profile("khởi động pipeline"):
+        get_answer_pipeline()
+
+    # Gộp embedding câu hỏi + tìm ví dụ few-shot cho cả lô (vài request lớn thay cho hàng trăm request nhỏ)
+    try:
+        with profile("nạp trước embedding + few-shot"):
+            warm = get_answer_pipeline().prewarm(questions)
+        print(f"🔥 Đã nạp trước embedding + few-shot cho {len(questions)} câu hỏi: {warm}\n")
+    except Exception as e:
+        print(f"⚠️ Bỏ qua bước nạp trước: {e}\n")
+
     results = []
 
     for idx, query in enumerate(questions, 1):
         print(f"🔹 [{idx}/{len(questions)}] {query}")
         try:
-            answer = await run_query_once(query, top_k=10, limit=3)
+            with profile(query):
+                answer = await run_query_once(query, top_k=10, limit=3)
             results.append({"id": idx, "question": query, "answer": answer})
         except Exception as e:
             print(f"❌ Lỗi ở câu {idx}: {e}")
@@ -146,7 +133,14 @@ async def main():
 
     print("\n✅ Hoàn tất! Kết quả lưu tại:")
     print(f"👉 {os.path.abspath(OUTPUT_PATH)}")
+    if profiler is not None:
+        profiler.report()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Hybrid RAG batch: chạy toàn bộ data/Question.csv")
+    parser.add_argument("--profile", nargs="?", const=",".join(DEFAULT_MODES), default=None, metavar="MODES",
+                        help="Profile từng câu hỏi: cprofile,tracemalloc[,sample] (mặc định cprofile,tracemalloc)")
+    parser.add_argument("--profile-dir", default=None, help="Thư mục ghi profile (mặc định results/profiles/<thời gian>)")
+    args = parser.parse_args()
+    asyncio.run(main(QueryProfiler(args.profile, args.profile_dir) if args.profile else None))
@@ -12,29 +12,16 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
 
 import streamlit as st
-from dotenv import load_dotenv
 from openai import OpenAI
 
-# Local modules
-from app.retrievers.hybrid_retriever import HybridRetrieverParallel
-from app.retrievers.vector_tools import VectorClient, Passage
-from app.utils.hybrid_helpers import (
-    load_answer_rule,
-    build_id_map_from_graph_records,
-    select_topN_by_priority,
-    build_synthesis_input,
-    llm_summarize_answer,
-)
+# Local modules (streamlit đã được import → get_var đọc được st.secrets)
+from app.config import get_var
+from app.retrievers.graph_tools import neo4j_cache_stats
+from app.utils.answer_pipeline import HybridAnswerPipeline
+from app.utils.conversation import ConversationSession
 
 
 # Cấu hình hệ thống
-load_dotenv()
-
-def get_var(key, default=None, section="general"):
-    try:
-        return st.secrets[section].get(key, default)
-    except Exception:
-        return os.getenv(key, default)
 
 OPENAI_MODEL = get_var("OPENAI_MODEL", "gpt-4o-mini")
 ANSWER_RULE_PATH = get_var("ANSWER_RULE_PATH", "app/prompts/answer_synthesis.txt")
@@ -43,6 +30,12 @@ os.environ["OPENAI_API_KEY"] = OPENAI_API_KEY
 client = OpenAI(api_key=OPENAI_API_KEY)
 
 
+# Pipeline dùng chung giữa các lượt chạy lại của Streamlit (không load lại FAISS / Neo4j)
+@st.cache_resource
+def get_pipeline() -> HybridAnswerPipeline:
+    return HybridAnswerPipeline(model=OPENAI_MODEL, client=client)
+
+
 
 # Giao diện chính
 def main():
@@ -57,6 +50,12 @@ def main():
         top_k = st.slider("Số kết quả Vector (k)", min_value=5, max_value=20, value=10)
         limit_ids = st.slider("Giới hạn ID trả lời", min_value=1, max_value=5, value=3)
         show_debug = st.checkbox("🧩 Hiển thị debug (IDs & mô tả)", value=True)
+        # Mỗi phiên trình duyệt giữ kết quả câu trước: câu tinh chỉnh chỉ lọc lại, không truy xuất lại
+        use_session = st.checkbox("💬 Hỏi tiếp trên kết quả trước", value=True)
+        if "conversation" not in st.session_state:
+            st.session_state["conversation"] = ConversationSession()
+        if st.button("🆕 Bắt đầu tìm kiếm mới"):
+            st.session_state["conversation"].reset()
 
     # Input
     user_query = st.text_input(
@@ -69,33 +68,30 @@ def main():
     # Xử lý khi người dùng nhấn tìm kiếm
     if run and user_query.strip():
         try:
-            client = OpenAI(api_key=OPENAI_API_KEY)
-            synth_rule = load_answer_rule()
-            hybrid = HybridRetrieverParallel()
-            vclient = hybrid.vector
+            pipeline = get_pipeline()
 
-            # 1 Chạy truy vấn song song Graph + Vector
+            # 1 Chạy truy vấn song song Graph + Vector, chọn topN và tổng hợp
             st.info("⏳ Đang truy vấn dữ liệu song song từ Neo4j và FAISS...")
-            start = time.time()
-            hybrid_result = asyncio.run(hybrid.search(user_query=user_query, top_k=top_k))
-            took = int((time.time() - start) * 1000)
-
-            graph_records = hybrid_result["graph_records"]
-            graph_ids = hybrid_result["graph_ids"]
-            vector_passages = hybrid_result["vector_passages"]
+            if use_session:
+                result = st.session_state["conversation"].ask(pipeline, user_query, top_k=top_k, limit=limit_ids,
+                                                              model=model)
+            else:
+                result = pipeline.answer(user_query, top_k=top_k, limit=limit_ids, model=model)
+            conv = result.get("session") or {}
+            took = result["timings"]["hybrid_ms"]
+
+            graph_ids = result["graph_ids"]
+            vector_passages = result["vector_passages"]
+            graph_id_map = result["graph_id_map"]
+            chosen_passages = result["chosen_passages"]
 
             # 📜 Hiển thị Cypher Query nếu có
-            if "cypher_query" in hybrid_result and hybrid_result["cypher_query"]:
+            if result.get("cypher_query"):
                 st.markdown("---")
                 st.subheader("📜 Truy vấn Cypher được sinh ra")
-                st.code(hybrid_result["cypher_query"], language="cypher")
-
-
-            # 2 Kết hợp dữ liệu
-            graph_id_map = build_id_map_from_graph_records(graph_records)
-            chosen_passages = select_topN_by_priority(
-                graph_ids, vector_passages, vclient, graph_id_map, fill_limit=limit_ids
-            )
+                if result.get("sub_queries"):
+                    st.caption("🔀 Câu hỏi ghép được tách, truy xuất song song: " + " · ".join(result["sub_queries"]))
+                st.code(result["cypher_query"], language="cypher")
 
 
             # Debug
@@ -121,20 +117,26 @@ def main():
                     )
 
                 st.info(f"⏱ Tổng thời gian truy vấn song song: **{took} ms**")
+                st.caption(f"🗃️ Neo4j cache: {neo4j_cache_stats()}")
+                if pipeline.answer_cache is not None:
+                    st.caption(f"🗃️ Answer cache: {pipeline.answer_cache.stats()}")
 
-            # 3 Chuẩn bị dữ liệu cho LLM
-            synthesis_payload = build_synthesis_input(chosen_passages, graph_id_map)
-
-            # 4 Gọi LLM để tổng hợp câu trả lời
-            st.write("🧠 Đang tổng hợp câu trả lời...")
-            answer = llm_summarize_answer(client, user_query, synth_rule, synthesis_payload, model)
-
-            # 5 Hiển thị kết quả
+            # 2 Hiển thị kết quả
             st.markdown("---")
             st.subheader("✨ Câu trả lời")
-            st.write(answer)
-
-            # 6 Bảng dữ liệu chi tiết
+            if result["answer_source"] == "cache":
+                st.caption(f"⚡ Trả lời từ cache (độ tương đồng {result['cache_similarity']})")
+            elif result["answer_source"] == "template":
+                st.caption("⚡ Dựng câu trả lời theo khung từ dữ liệu có cấu trúc (không gọi LLM)")
+            if conv.get("mode") == "refine":
+                st.caption(f"💬 Lọc lại kết quả của câu \"{conv['base_query']}\" trong {result['timings']['refine_ms']} ms "
+                           f"(không truy xuất lại) · bộ lọc {conv['filter']}")
+            if result.get("partial"):
+                st.warning(f"⏳ Câu trả lời một phần: nhánh {', '.join(result['missing_branches'])} "
+                           "chưa kịp trả kết quả trong thời hạn.")
+            st.write(result["answer"])
+
+            # 3 Bảng dữ liệu chi tiết
             with st.expander("📋 Xem dữ liệu đã hợp nhất (debug)"):
                 merged_rows = []
                 for p in chosen_passages:
@@ -1,63 +1,46 @@
 """
 Hybrid RAG CLI: chạy song song Graph (Neo4j) + Vector (FAISS)
 """
-import os, sys, json, traceback, argparse, asyncio, time
+import os, sys, traceback, argparse
 from dotenv import load_dotenv
-from openai import OpenAI
 
 # Thêm đường dẫn
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 # Module nội bộ
-from app.retrievers.hybrid_retriever import HybridRetrieverParallel
-from app.retrievers.vector_tools import VectorClient
-from app.utils.hybrid_helpers import (
-    load_answer_rule,
-    build_id_map_from_graph_records,
-    select_topN_by_priority,
-    build_synthesis_input,
-    llm_summarize_answer,
-)
+from app.retrievers.graph_tools import neo4j_cache_stats
+from app.utils.answer_pipeline import get_answer_pipeline
+from app.utils.conversation import ConversationSession
+from app.utils.llm_calls import llm_call_stats
+from app.utils.profiling import DEFAULT_MODES, QueryProfiler
 
 # Load config
 load_dotenv()
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
-client = OpenAI(api_key=OPENAI_API_KEY)
 
 
 
 # CHẠY 1 TRUY VẤN HYBRID RAG SONG SONG
-def run_query_once(user_query: str, top_k: int = 10, limit: int = 3, show_debug: bool = False):
-    """Chạy một truy vấn Hybrid RAG duy nhất (song song Graph + Vector)."""
+def run_query_once(user_query: str, top_k: int = 10, limit: int = 3, show_debug: bool = False, budget_ms: int = None,
+                   session: ConversationSession = None):
+    """Chạy một truy vấn Hybrid RAG duy nhất (song song Graph + Vector); có session → câu tinh chỉnh lọc lại kết quả trước."""
     print(f"\n❓ {user_query}\n")
 
-    synth_rule = load_answer_rule()
-    hybrid = HybridRetrieverParallel()
-    vclient = hybrid.vector
+    pipeline = get_answer_pipeline()
 
-    print("⏳ Đang truy vấn dữ liệu song song từ Neo4j và FAISS...\n")
-
-    # Đo thời gian tổng
-    total_start = time.time()
-    hybrid_start = time.time()
-    hybrid_result = asyncio.run(hybrid.search(user_query=user_query, top_k=top_k))
-    hybrid_time = int((time.time() - hybrid_start) * 1000)
+    if session is not None:
+        result = session.ask(pipeline, user_query, top_k=top_k, limit=limit, model=OPENAI_MODEL, budget_ms=budget_ms)
+    else:
+        print("⏳ Đang truy vấn dữ liệu song song từ Neo4j và FAISS...\n")
+        result = pipeline.answer(user_query, top_k=top_k, limit=limit, model=OPENAI_MODEL, budget_ms=budget_ms)
+    conv = result.get("session") or {}
 
     # Lấy kết quả 
-    graph_records = hybrid_result["graph_records"]
-    graph_ids = hybrid_result["graph_ids"]
-    vector_passages = hybrid_result["vector_passages"]
-    
-    # Xây map Graph
-    graph_id_map = build_id_map_from_graph_records(graph_records)
-
-    # Chọn topN passage theo ID
-    fusion_start = time.time()
-    chosen_passages = select_topN_by_priority(
-        graph_ids, vector_passages, vclient, graph_id_map, fill_limit=limit
-    )
-    fusion_time = int((time.time() - fusion_start) * 1000)
+    graph_ids = result["graph_ids"]
+    vector_passages = result["vector_passages"]
+    chosen_passages = result["chosen_passages"]
+    timings = result["timings"]
+    answer = result["answer"]
 
    
     # Debug chi tiết
@@ -68,6 +51,8 @@ def run_query_once(user_query: str, top_k: int = 10, limit: int = 3, show_debug:
         print(f"📊 Graph IDs ({len(graph_ids)}): {graph_ids[:20]}")
         print(f"📚 Vector IDs ({len(vector_passages)}): {[p.id for p in vector_passages[:20]]}")
         print(f"✅ Chosen IDs ({len(chosen_passages)}): {[p.id for p in chosen_passages]}")
+        if result.get("sub_queries"):
+            print(f"🔀 Câu hỏi con (chạy song song): {result['sub_queries']}")
         print()
         print("📝 Snippet mô tả:")
         for p in chosen_passages:
@@ -76,23 +61,30 @@ def run_query_once(user_query: str, top_k: int = 10, limit: int = 3, show_debug:
                 snippet = snippet[:160] + "..."
             print(f"• ID {p.id or 'N/A'} → {snippet}")
         print("───────────────────────────────")
-        print(f"⚙️  Graph + Vector time: {hybrid_time} ms")
-        print(f"⚙️  Fusion (chọn topN): {fusion_time} ms\n")
-
-    # Chuẩn bị dữ liệu tổng hợp
-    synthesis_payload = build_synthesis_input(chosen_passages, graph_id_map)
-
-    # Gọi LLM tổng hợp 
-    print("🧠 Đang tổng hợp câu trả lời bằng GPT...\n")
-    llm_start = time.time()
-    answer = llm_summarize_answer(client, user_query, synth_rule, synthesis_payload, OPENAI_MODEL)
-    llm_time = int((time.time() - llm_start) * 1000)
-
-    total_time = int((time.time() - total_start) * 1000)
+        print(f"⚙️  Graph + Vector time: {timings['hybrid_ms']} ms")
+        print(f"⚙️  Fusion (chọn topN): {timings['fusion_ms']} ms")
+        stages = {k: timings[k] for k in ("few_shot_ms", "cypher_llm_ms", "neo4j_ms", "vector_ms") if k in timings}
+        print(f"⚙️  Từng bước: {stages}")
+        plan = result.get("retrieval_plan") or {}
+        if plan.get("budget_ms"):
+            print(f"🎯 Ngân sách {plan['budget_ms']} ms → top_k={plan['top_k']}, few_shot_k={plan['few_shot_k']}, "
+                  f"fetch_k={plan['fetch_k']}, mmr={plan['mmr']}, limit={plan['fill_limit']} {plan['reasons']}")
+        print(f"🗃️  Neo4j cache: {neo4j_cache_stats()}")
+        print(f"🤖 LLM calls: {llm_call_stats()}")
+        if conv:
+            print(f"💬 Phiên hội thoại: {conv['mode']} ({conv['reason']}), bộ lọc {conv['filter']}")
+        if pipeline.answer_cache is not None:
+            print(f"🗃️  Answer cache: {pipeline.answer_cache.stats()}")
+        print()
 
 
     # Hiển thị kết quả
-    print("\n✨ CÂU TRẢ LỜI:\n───────────────────────────────")
+    source_note = {"cache": " (từ cache)", "template": " (dựng theo khung, không gọi LLM)"}.get(result["answer_source"], "")
+    if result.get("partial"):
+        source_note += f" (một phần, thiếu nhánh: {', '.join(result['missing_branches'])})"
+    if conv.get("mode") == "refine":
+        source_note += " (lọc lại kết quả trước, không truy xuất lại)"
+    print(f"\n✨ CÂU TRẢ LỜI{source_note}:\n───────────────────────────────")
     print(answer)
     print("───────────────────────────────")
 
@@ -107,10 +99,13 @@ def run_query_once(user_query: str, top_k: int = 10, limit: int = 3, show_debug:
     print("\n───────────────────────────────")
     print("⏱ THỜI GIAN XỬ LÝ")
     print("───────────────────────────────")
-    print(f"🔸 Graph + Vector song song: {hybrid_time} ms")
-    print(f"🔸 Fusion chọn topN:         {fusion_time} ms")
-    print(f"🔸 LLM tổng hợp:             {llm_time} ms")
-    print(f"⚡ Tổng thời gian:           {total_time} ms")
+    if "refine_ms" in timings:
+        print(f"🔸 Lọc lại trong phiên:      {timings['refine_ms']} ms")
+    else:
+        print(f"🔸 Graph + Vector song song: {timings['hybrid_ms']} ms")
+    print(f"🔸 Fusion chọn topN:         {timings['fusion_ms']} ms")
+    print(f"🔸 LLM tổng hợp:             {timings['llm_ms']} ms")
+    print(f"⚡ Tổng thời gian:           {timings['total_ms']} ms")
     print("───────────────────────────────\n")
 
 
@@ -122,17 +117,36 @@ def main():
     parser.add_argument("--k", type=int, default=10, help="Số lượng top-k kết quả vector")
     parser.add_argument("--limit", type=int, default=3, help="Giới hạn số căn để tổng hợp")
     parser.add_argument("--show-debug", action="store_true", help="Hiển thị debug chi tiết")
+    parser.add_argument("--budget-ms", type=int, default=None,
+                        help="Ngân sách độ trễ (ms): tự chọn top-k / few-shot / MMR (mặc định LATENCY_BUDGET_MS)")
+    parser.add_argument("--no-session", action="store_true",
+                        help="Chế độ nhập tay: coi mọi câu hỏi là mới (không lọc lại kết quả câu trước)")
+    parser.add_argument("--profile", nargs="?", const=",".join(DEFAULT_MODES), default=None, metavar="MODES",
+                        help="Profile từng câu hỏi: cprofile,tracemalloc[,sample] (mặc định cprofile,tracemalloc)")
+    parser.add_argument("--profile-dir", default=None, help="Thư mục ghi profile (mặc định results/profiles/<thời gian>)")
     args = parser.parse_args()
+    profiler = QueryProfiler(args.profile, args.profile_dir) if args.profile else None
+
+    def run(user_query: str, session: ConversationSession = None):
+        if profiler is None:
+            return run_query_once(user_query, args.k, args.limit, args.show_debug, args.budget_ms, session=session)
+        with profiler.profile(user_query):
+            run_query_once(user_query, args.k, args.limit, args.show_debug, args.budget_ms, session=session)
 
     print("🏠 Hybrid RAG – Bất động sản Hà Nội (CLI mode, Parallel)")
     print("========================================================")
 
     try:
+        if profiler is not None:
+            # Nạp pipeline (FAISS / pickle, index few-shot, driver Neo4j) được profile riêng, không lẫn vào câu hỏi đầu
+            with profiler.profile("khởi động pipeline"):
+                get_answer_pipeline()
         if args.query:
-            run_query_once(args.query, args.k, args.limit, args.show_debug)
+            run(args.query)
             return
 
-        print("🗨️  Nhập câu hỏi của bạn (gõ 'exit' để thoát):\n")
+        session = None if args.no_session else ConversationSession()
+        print("🗨️  Nhập câu hỏi của bạn (gõ 'exit' để thoát, '/new' để bắt đầu tìm kiếm mới):\n")
         while True:
             user_query = input("❓> ").strip()
             if not user_query:
@@ -140,13 +154,21 @@ def main():
             if user_query.lower() in ["exit", "quit", "q"]:
                 print("👋 Tạm biệt!")
                 break
-            run_query_once(user_query, args.k, args.limit, args.show_debug)
+            if user_query.lower() == "/new":
+                if session is not None:
+                    session.reset()
+                print("🆕 Đã xóa ngữ cảnh hội thoại.\n")
+                continue
+            run(user_query, session=session)
 
     except KeyboardInterrupt:
         print("\n🛑 Dừng chương trình.")
     except Exception as e:
         print("❌ Lỗi khi xử lý truy vấn:", e)
         print(traceback.format_exc())
+    finally:
+        if profiler is not None:
+            profiler.report()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,227 @@
+# retrievers/cypher_compiler.py
+"""
+Biên dịch FilterSpec (app/utils/filter_spec.py) thành Cypher có tham số (NL2CYPHER_MODE=spec | rules).
+
+Thay vì để LLM viết lại cả chuỗi MATCH / OPTIONAL MATCH dài của template, LLM chỉ trả về JSON bộ lọc (vài chục token)
+và Cypher được ghép tại chỗ → luôn đúng cú pháp, giá trị đi qua tham số ($districts, $price_max, ...) nên
+Neo4j dùng lại được plan đã cache cho mọi câu hỏi cùng hình dạng.
+
+Hình dạng truy vấn:
+- Lọc trước trên (:City)-[:HAS_LOCATION]->(:District)-[:HAS_PROPERTY]->(:Property), điều kiện quan hệ bằng EXISTS { }
+  (không nhân bản dòng như MATCH + DISTINCT).
+- Giá / diện tích lấy 1 lần bằng pattern comprehension rồi lọc, sắp xếp, LIMIT.
+- Chỉ các căn sau LIMIT mới đọc chi tiết (loại nhà, pháp lý, tiện ích, liên hệ...) → không còn chuỗi 10+ OPTIONAL MATCH
+  nhân chéo trên mọi căn của quận. Cột trả về giống hệt phần RETURN của template.
+- use_read_model=True (đồ thị đã có read model, app/retrievers/read_model.py): lọc + đọc thẳng trên node Property,
+  không mở rộng quan hệ nào.
+"""
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.retrievers import read_model
+from app.utils.filter_spec import DIRECTIONS, HANOI_DISTRICTS, SORTS, FilterSpec, find_districts
+
+
+CITY_NAME = "bất động sản hà nội"
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+
+_ORDER_BY = {
+    "price_asc": "price_ty_vnd ASC",
+    "price_desc": "price_ty_vnd IS NULL, price_ty_vnd DESC",
+    "area_asc": "area_m2 ASC",
+    "area_desc": "area_m2 IS NULL, area_m2 DESC",
+}
+_DISTRICT_PREFIX_RE = re.compile(r"^(?:quận|huyện|thị xã|q\.|h\.)\s*")
+
+RETURN_CYPHER = """RETURN
+  p.id AS id,
+  d.name AS district_name,
+  head([(p)-[:HAS_PROPERTY_TYPE]->(x:PropertyType) | x.name]) AS property_type,
+  [(p)-[:HAS_DESIGN]->(x:HouseDesign) | toLower(x.name)] AS house_design,
+  area_m2,
+  price_ty_vnd,
+  head([(p)-[:LOCATED_AT]->(x:Address) | x.name]) AS full_address,
+  [(p)-[:HAS_LEGAL_STATUS]->(x:LegalStatus) | toLower(x.name)] AS legal_status,
+  [(p)-[:HAS_DIRECTION]->(x:Direction) | toLower(x.name)] AS direction,
+  [(p)-[:HAS_AMENITY]->(x:Amenity) | toLower(x.name)] AS internal_amenities,
+  [(p)-[:NEAR_FACILITY]->(x:Facility) | toLower(x.name)] AS near_facilities,
+  head([(p)-[:HAS_CONTACT]->(:Contact)-[:HAS_CONTACT_NAME]->(x:ContactName) | x.name]) AS contact_name,
+  head([(p)-[:HAS_CONTACT]->(:Contact)-[:HAS_CONTACT_PHONE]->(x:ContactPhone) | x.number]) AS contact_phone"""
+
+
+# CHUẨN HÓA SPEC TỪ LLM
+def _str_list(value: Any) -> List[str]:
+    if value is None:
+        return []
+    items = value if isinstance(value, list) else [value]
+    out = []
+    for item in items:
+        s = " ".join(str(item).lower().split())
+        if s and s not in out:
+            out.append(s)
+    return out
+
+
+def _num(value: Any) -> Optional[float]:
+    try:
+        out = float(str(value).replace(",", ".")) if value not in (None, "") else None
+    except ValueError:
+        return None
+    return out if out is None or out >= 0 else None
+
+
+def _district(name: str) -> Optional[str]:
+    name = _DISTRICT_PREFIX_RE.sub("", name)
+    if name in HANOI_DISTRICTS:
+        return name
+    found = find_districts(name)
+    return found[0][2] if found else None
+
+
+def normalize_spec(data: Any) -> FilterSpec:
+    """dict JSON do LLM trả về → FilterSpec hợp lệ (bỏ trường lạ, quận không có trong danh sách, số âm...)."""
+    data = data if isinstance(data, dict) else {}
+    spec = FilterSpec()
+    spec.districts = list(dict.fromkeys(d for d in map(_district, _str_list(data.get("districts"))) if d))
+    spec.property_types = _str_list(data.get("property_types"))
+    for lo_name, hi_name in (("price_min", "price_max"), ("area_min", "area_max")):
+        lo, hi = _num(data.get(lo_name)), _num(data.get(hi_name))
+        if lo is not None and hi is not None and lo > hi:
+            lo, hi = hi, lo
+        setattr(spec, lo_name, lo)
+        setattr(spec, hi_name, hi)
+    spec.directions = [d for d in _str_list(data.get("directions")) if d in DIRECTIONS]
+    spec.legal = _str_list(data.get("legal"))
+    spec.amenities = _str_list(data.get("amenities"))
+    spec.facilities = _str_list(data.get("facilities"))
+    spec.sort = data.get("sort") if data.get("sort") in SORTS else None
+    limit = _num(data.get("limit"))
+    spec.limit = int(limit) if limit else None
+    return spec
+
+
+def parse_spec_json(text: str) -> FilterSpec:
+    """Nội dung trả về của LLM (JSON, có thể bọc ```json) → FilterSpec; JSON hỏng → ValueError."""
+    text = (text or "").strip()
+    if text.startswith("```"):
+        text = text.strip("`").removeprefix("json").strip()
+    return normalize_spec(json.loads(text))
+
+
+# BIÊN DỊCH
+def _keyword_params(params: Dict[str, Any], name: str, keywords: List[str]) -> List[str]:
+    keys = []
+    for i, kw in enumerate(keywords):
+        keys.append(f"{name}_{i}")
+        params[keys[-1]] = kw
+    return keys
+
+
+def _exists(params: Dict[str, Any], name: str, pattern: str, var: str, keywords: List[str], combine: str) -> str:
+    """
+    EXISTS { } cho danh sách từ khóa: combine="OR" → khớp 1 từ là đủ, "AND" → mỗi từ 1 EXISTS riêng.
+    Mỗi nhóm dùng biến riêng có label → prepare_cypher viết lại được toLower(var.name) thành var.name_lc (TEXT index).
+    """
+    preds = [f"toLower({var}.name) CONTAINS ${key}" for key in _keyword_params(params, name, keywords)]
+    if combine == "OR":
+        return f"EXISTS {{ MATCH {pattern} WHERE {' OR '.join(preds)} }}"
+    return " AND ".join(f"EXISTS {{ MATCH {pattern} WHERE {p} }}" for p in preds)
+
+
+def _any(field: str, keys: List[str], combine: str) -> str:
+    """Điều kiện trên trường danh sách của read model (cùng quy tắc OR / AND như _exists)."""
+    if combine == "OR":
+        return f"any(v IN {field} WHERE {' OR '.join(f'v CONTAINS ${k}' for k in keys)})"
+    return " AND ".join(f"any(v IN {field} WHERE v CONTAINS ${k})" for k in keys)
+
+
+def _compile_read_model(spec: FilterSpec, params: Dict[str, Any]) -> str:
+    where = ["p.district_name IN $districts" if spec.districts else "p.district_name IS NOT NULL"]
+    if spec.districts:
+        params["districts"] = list(spec.districts)
+    if spec.property_types:
+        keys = _keyword_params(params, "property_type", spec.property_types)
+        where.append("(" + " OR ".join(f"p.property_type CONTAINS ${k}" for k in keys) + ")")
+    if spec.directions:
+        where.append(_any("p.direction", _keyword_params(params, "direction", spec.directions), "OR"))
+    if spec.legal:
+        where.append(_any("p.legal_status", _keyword_params(params, "legal", spec.legal), "AND"))
+    if spec.amenities:
+        where.append(_any("coalesce(p.internal_amenities, []) + coalesce(p.house_design, [])",
+                          _keyword_params(params, "amenity", spec.amenities), "AND"))
+    if spec.facilities:
+        where.append(_any("p.near_facilities", _keyword_params(params, "facility", spec.facilities), "AND"))
+    for column, lo_name, hi_name in (("price_ty_vnd", "price_min", "price_max"), ("area_m2", "area_min", "area_max")):
+        for name, op in ((lo_name, ">="), (hi_name, "<=")):
+            value = getattr(spec, name)
+            if value is not None:
+                params[name] = float(value)
+                where.append(f"p.{column} {op} ${name}")
+    return "\n".join([
+        "MATCH (p:Property)",
+        "WHERE " + "\n  AND ".join(where),
+        read_model.RETURN_CYPHER,
+        f"ORDER BY {_ORDER_BY.get(spec.sort or 'price_asc')}",
+        "LIMIT $limit",
+    ])
+
+
+def compile_spec(spec: FilterSpec, min_limit: int = 0, use_read_model: bool = False) -> Tuple[str, Dict[str, Any]]:
+    """
+    FilterSpec → (Cypher, params). Ý nghĩa các điều kiện giống FilterSpec.matches():
+    quận / loại nhà / hướng: khớp 1 giá trị là đủ; pháp lý / tiện ích / tiện ích xung quanh: phải có đủ.
+    LIMIT = spec.limit (mặc định DEFAULT_LIMIT, tối đa MAX_LIMIT), nâng lên min_limit nếu lớn hơn (GRAPH_RESULT_LIMIT).
+    use_read_model: đọc trường phi chuẩn hóa trên Property thay vì mở rộng quan hệ.
+    """
+    limit = max(1, min(MAX_LIMIT, int(spec.limit or DEFAULT_LIMIT)), int(min_limit or 0))
+    if use_read_model:
+        params: Dict[str, Any] = {}
+        cypher = _compile_read_model(spec, params)
+        params["limit"] = limit
+        return cypher, params
+
+    params = {"city": CITY_NAME}
+    where: List[str] = []
+    if spec.districts:
+        params["districts"] = list(spec.districts)
+        where.append("d.name IN $districts")
+    if spec.property_types:
+        where.append(_exists(params, "property_type", "(p)-[:HAS_PROPERTY_TYPE]->(pt:PropertyType)", "pt",
+                             spec.property_types, "OR"))
+    if spec.directions:
+        where.append(_exists(params, "direction", "(p)-[:HAS_DIRECTION]->(dir:Direction)", "dir",
+                             spec.directions, "OR"))
+    if spec.legal:
+        where.append(_exists(params, "legal", "(p)-[:HAS_LEGAL_STATUS]->(ls:LegalStatus)", "ls", spec.legal, "AND"))
+    if spec.amenities:
+        # "5 tầng", "mặt tiền"... nằm ở HouseDesign, "thang máy", "nội thất"... ở Amenity
+        where.append(_exists(params, "amenity", "(p)-[:HAS_AMENITY|HAS_DESIGN]->(am)", "am", spec.amenities, "AND"))
+    if spec.facilities:
+        where.append(_exists(params, "facility", "(p)-[:NEAR_FACILITY]->(fac:Facility)", "fac",
+                             spec.facilities, "AND"))
+
+    ranges: List[str] = []
+    for column, lo_name, hi_name in (("price_ty_vnd", "price_min", "price_max"), ("area_m2", "area_min", "area_max")):
+        for name, op in ((lo_name, ">="), (hi_name, "<=")):
+            value = getattr(spec, name)
+            if value is not None:
+                params[name] = float(value)
+                ranges.append(f"{column} {op} ${name}")
+
+    params["limit"] = limit
+    lines = ["MATCH (:City {name: $city})-[:HAS_LOCATION]->(d:District)-[:HAS_PROPERTY]->(p:Property)"]
+    if where:
+        lines.append("WHERE " + "\n  AND ".join(where))
+    lines.append("WITH DISTINCT p, d,\n"
+                 "  head([(p)-[:HAS_PRICE]->(x:PriceVND) | toFloat(x.value)]) AS price_ty_vnd,\n"
+                 "  head([(p)-[:HAS_AREA]->(x:Area) | toFloat(x.value)]) AS area_m2")
+    if ranges:
+        # WHERE của WITH đứng sau LIMIT → lọc ở 1 WITH, sắp xếp + LIMIT ở WITH tiếp theo
+        lines.append("WHERE " + " AND ".join(ranges))
+        lines.append("WITH p, d, price_ty_vnd, area_m2")
+    lines.append(f"ORDER BY {_ORDER_BY.get(spec.sort or 'price_asc')}")
+    lines.append("LIMIT $limit")
+    lines.append(RETURN_CYPHER)
+    return "\n".join(lines), params
@@ -0,0 +1,211 @@
+# app/retrievers/graph_schema.py
+"""
+Schema / index cho đồ thị Neo4j Bất động sản Hà Nội.
+
+- Khai báo constraint + range index + text index + full-text index.
+- Chuẩn hóa thuộc tính `name_lc` (= toLower(trim(name))) cho các node dạng "tên".
+- Viết lại `toLower(x.name) CONTAINS "..."` thành `x.name_lc CONTAINS "..."`
+  để planner dùng được TEXT INDEX thay vì quét toàn bộ label.
+- Range index cho read model trên Property (district_name, price_ty_vnd, area_m2).
+"""
+import re
+from typing import Any, Dict, List, Optional
+
+from app.retrievers import read_model
+
+
+# Cấu hình index
+INDEX_PREFIX = "rag_"
+LC_PROPERTY = "name_lc"
+
+# Các label có thuộc tính `name` bị so khớp bằng toLower(...) CONTAINS trong template
+TEXT_INDEXED_LABELS = [
+    "District",
+    "Direction",
+    "LegalStatus",
+    "Amenity",
+    "Facility",
+    "PropertyType",
+    "HouseDesign",
+    "Address",
+]
+
+# Full-text index cho các trường văn bản tự do (tiện ích, địa chỉ...)
+FULLTEXT_INDEX_NAME = f"{INDEX_PREFIX}name_fulltext"
+FULLTEXT_LABELS = ["Amenity", "Facility", "HouseDesign", "Address", "LegalStatus", "Direction"]
+
+
+# DDL
+def constraint_statements() -> List[str]:
+    """Constraint trên các khóa được MERGE (Property.id, City.name, District.name)."""
+    return [
+        f"CREATE CONSTRAINT {INDEX_PREFIX}property_id IF NOT EXISTS "
+        f"FOR (n:Property) REQUIRE n.id IS UNIQUE",
+        f"CREATE CONSTRAINT {INDEX_PREFIX}city_name IF NOT EXISTS "
+        f"FOR (n:City) REQUIRE n.name IS UNIQUE",
+        f"CREATE CONSTRAINT {INDEX_PREFIX}district_name IF NOT EXISTS "
+        f"FOR (n:District) REQUIRE n.name IS UNIQUE",
+    ]
+
+
+def index_statements() -> List[str]:
+    """Range index trên `name` + TEXT index trên `name_lc` + 1 full-text index + index của read model."""
+    stmts = []
+    for label in TEXT_INDEXED_LABELS:
+        low = label.lower()
+        if label != "District":
+            stmts.append(
+                f"CREATE INDEX {INDEX_PREFIX}{low}_name IF NOT EXISTS FOR (n:{label}) ON (n.name)"
+            )
+        stmts.append(
+            f"CREATE TEXT INDEX {INDEX_PREFIX}{low}_{LC_PROPERTY} IF NOT EXISTS "
+            f"FOR (n:{label}) ON (n.{LC_PROPERTY})"
+        )
+    stmts.append(
+        f"CREATE FULLTEXT INDEX {FULLTEXT_INDEX_NAME} IF NOT EXISTS "
+        f"FOR (n:{'|'.join(FULLTEXT_LABELS)}) ON EACH [n.name]"
+    )
+    stmts.extend(read_model.index_statements(INDEX_PREFIX))
+    return stmts
+
+
+def normalize_statements() -> List[str]:
+    """Gán `name_lc` cho các node còn thiếu hoặc lệch so với `name`."""
+    return [
+        f"MATCH (n:{label}) WHERE n.name IS NOT NULL "
+        f"AND (n.{LC_PROPERTY} IS NULL OR n.{LC_PROPERTY} <> toLower(trim(n.name))) "
+        f"SET n.{LC_PROPERTY} = toLower(trim(n.name)) "
+        f"RETURN count(n) AS updated"
+        for label in TEXT_INDEXED_LABELS
+    ]
+
+
+def bootstrap_schema(executor, verbose: bool = True) -> Dict[str, Any]:
+    """
+    Chạy toàn bộ DDL + chuẩn hóa `name_lc` + điền read model cho Property. Idempotent (IF NOT EXISTS).
+    Lỗi của từng câu lệnh được ghi lại, không dừng cả quá trình
+    (vd: constraint UNIQUE thất bại do dữ liệu cũ bị trùng).
+    """
+    report: Dict[str, Any] = {"ok": [], "failed": [], "normalized": {}, "read_model": 0}
+    for stmt in constraint_statements() + index_statements():
+        try:
+            executor.run_query(stmt)
+            report["ok"].append(stmt)
+        except Exception as e:
+            report["failed"].append({"statement": stmt, "error": str(e)})
+            if verbose:
+                print(f"⚠️ Bỏ qua: {stmt}\n   ↳ {e}")
+
+    for label, stmt in zip(TEXT_INDEXED_LABELS, normalize_statements()):
+        rows = executor.run_query(stmt)
+        report["normalized"][label] = int((rows[0] if rows else {}).get("updated") or 0)
+    report["read_model"] = read_model.backfill_read_model(executor)
+
+    # Chờ index ONLINE trước khi profile / phục vụ truy vấn
+    try:
+        executor.run_query("CALL db.awaitIndexes(300)")
+    except Exception as e:
+        if verbose:
+            print("⚠️ Không chờ được index ONLINE:", e)
+
+    if verbose:
+        print(f"✅ Đã áp dụng {len(report['ok'])} câu lệnh schema, lỗi {len(report['failed'])}.")
+        print(f"🔤 Chuẩn hóa {LC_PROPERTY}: {report['normalized']}")
+        print(f"🗃️ Read model: điền {report['read_model']} căn")
+    return report
+
+
+def has_text_indexes(executor) -> bool:
+    """Kiểm tra các TEXT index `*_name_lc` đã tồn tại và ONLINE chưa."""
+    rows = executor.run_query(
+        "SHOW INDEXES YIELD name, type, state "
+        "WHERE name STARTS WITH $prefix AND type = 'TEXT' AND state = 'ONLINE' "
+        "RETURN count(*) AS n",
+        {"prefix": INDEX_PREFIX},
+    )
+    return bool(rows) and int(rows[0].get("n") or 0) >= len(TEXT_INDEXED_LABELS)
+
+
+# VIẾT LẠI CYPHER
+_VAR_LABEL_RE = re.compile(r"\(\s*(\w+)\s*:\s*(\w+)")
+_TOLOWER_PRED_RE = re.compile(
+    r"toLower\(\s*(\w+)\.name\s*\)(\s+)(CONTAINS|STARTS WITH|ENDS WITH|=)(?=\s)",
+    re.IGNORECASE,
+)
+
+
+def rewrite_cypher_for_indexes(cypher: str) -> str:
+    """
+    `toLower(ls.name) CONTAINS "sổ đỏ"` → `ls.name_lc CONTAINS "sổ đỏ"`
+    Chỉ áp dụng cho biến được gắn với label nằm trong TEXT_INDEXED_LABELS.
+    Các `toLower(...)` trong RETURN/COLLECT giữ nguyên.
+    """
+    if not cypher:
+        return cypher
+    var_labels = {var: label for var, label in _VAR_LABEL_RE.findall(cypher)}
+
+    def _sub(m: "re.Match") -> str:
+        var, space, op = m.group(1), m.group(2), m.group(3)
+        if var_labels.get(var) in TEXT_INDEXED_LABELS:
+            return f"{var}.{LC_PROPERTY}{space}{op}"
+        return m.group(0)
+
+    return _TOLOWER_PRED_RE.sub(_sub, cypher)
+
+
+_LIMIT_RE = re.compile(r"\bLIMIT\s+(\d+)\s*;?\s*$", re.IGNORECASE)
+
+
+def raise_cypher_limit(cypher: str, limit: int) -> str:
+    """Nâng `LIMIT n` ở cuối câu Cypher lên `limit` (chỉ khi n < limit) để fusion có nhiều ứng viên hơn."""
+    if not cypher or not limit:
+        return cypher
+    m = _LIMIT_RE.search(cypher)
+    if not m or int(m.group(1)) >= limit:
+        return cypher
+    return cypher[: m.start()] + f"LIMIT {int(limit)}"
+
+
+# PROFILE
+def summarize_profile(plan: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Cộng dồn dbHits / rows và đếm các operator quét label hay dùng index."""
+    summary = {"db_hits": 0, "label_scans": 0, "index_seeks": 0, "operators": []}
+
+    def _walk(node: Dict[str, Any]):
+        op = str(node.get("operatorType") or "")
+        summary["db_hits"] += int(node.get("dbHits") or 0)
+        summary["operators"].append(op)
+        if "NodeByLabelScan" in op or "AllNodesScan" in op:
+            summary["label_scans"] += 1
+        if "Index" in op:
+            summary["index_seeks"] += 1
+        for child in node.get("children") or []:
+            _walk(child)
+
+    if plan:
+        _walk(plan)
+    return summary
+
+
+# GRAPH VERSION (dùng để vô hiệu hóa cache kết quả khi dữ liệu đồ thị thay đổi)
+GRAPH_VERSION_READ_CYPHER = (
+    "OPTIONAL MATCH (m:GraphMeta {key: 'graph'}) RETURN m.version AS version"
+)
+GRAPH_VERSION_BUMP_CYPHER = (
+    "MERGE (m:GraphMeta {key: 'graph'}) "
+    "SET m.version = coalesce(m.version, 0) + 1, m.updated_at = datetime() "
+    "RETURN m.version AS version"
+)
+
+
+def read_graph_version(executor) -> Optional[int]:
+    rows = executor.run_query(GRAPH_VERSION_READ_CYPHER)
+    version = (rows[0] if rows else {}).get("version")
+    return int(version) if version is not None else None
+
+
+def bump_graph_version(executor) -> Optional[int]:
+    """Tăng version sau mỗi lần nạp dữ liệu → mọi cache kết quả cũ bị bỏ."""
+    rows = executor.run_query(GRAPH_VERSION_BUMP_CYPHER)
+    version = (rows[0] if rows else {}).get("version")
+    return int(version) if version is not None else None
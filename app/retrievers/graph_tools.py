@@ -1,27 +1,39 @@
-import os
-from neo4j import GraphDatabase
-from openai import OpenAI
-from dotenv import load_dotenv
-from app.retrievers.nl2cypher_retriever import NL2CypherRetriever
-import streamlit as st
-
-
-# Cấu hình
-load_dotenv()
-
-
-def get_var(key: str, default=None, section="general"):
-    try:
-        # ưu tiên đọc từ secrets trên Streamlit Cloud
-        return st.secrets[section].get(key, default)
-    except Exception:
-        # fallback về .env khi chạy local
-        return os.getenv(key, default)
-    
+import re
+import time
+from app.config import get_var
+from app.retrievers.graph_schema import (
+    has_text_indexes,
+    raise_cypher_limit,
+    read_graph_version,
+    rewrite_cypher_for_indexes,
+    summarize_profile,
+)
+from app.retrievers.read_model import has_read_model, rewrite_cypher_for_read_model
+from app.utils.caching import LRUCache, canonicalize_cypher, make_cache_key
+from app.utils.llm_calls import chat_completion
+
+
+# Cấu hình (neo4j / openai / langchain chỉ được import khi khởi tạo pipeline)
 NEO4J_URI = get_var("NEO4J_URI")
 NEO4J_USER = get_var("NEO4J_USER")
 NEO4J_PASSWORD = get_var("NEO4J_PASSWORD")
 OPENAI_MODEL = get_var("OPENAI_MODEL", "gpt-4o-mini")
+# auto: chỉ viết lại Cypher khi TEXT index đã được bootstrap | on | off
+CYPHER_INDEX_REWRITE = str(get_var("CYPHER_INDEX_REWRITE", "auto")).lower()
+# Cache kết quả Neo4j (0 = tắt), TTL an toàn cho mỗi entry, chu kỳ đọc lại graph version
+NEO4J_CACHE_SIZE = int(get_var("NEO4J_CACHE_SIZE", 512))
+NEO4J_CACHE_TTL_S = float(get_var("NEO4J_CACHE_TTL_S", 3600))
+GRAPH_VERSION_CHECK_S = float(get_var("GRAPH_VERSION_CHECK_S", 30))
+# Nâng LIMIT cuối câu Cypher lên giá trị này (0 = giữ nguyên), dùng cùng FUSION_STRATEGY=weighted
+GRAPH_RESULT_LIMIT = int(get_var("GRAPH_RESULT_LIMIT", 0))
+# Cypher đã sinh theo câu hỏi (đã chuẩn hóa): nhánh Graph về muộn vẫn để lại Cypher cho lần hỏi sau
+CYPHER_CACHE_SIZE = int(get_var("CYPHER_CACHE_SIZE", 1024))
+# cypher: LLM viết cả câu Cypher theo ví dụ few-shot | spec: LLM trả JSON bộ lọc, biên dịch tại chỗ thành Cypher
+# có tham số (app/retrievers/cypher_compiler.py) | rules: bộ lọc tách bằng luật (filter_spec.parse_question), không gọi LLM
+NL2CYPHER_MODE = str(get_var("NL2CYPHER_MODE", "cypher")).lower()
+FILTER_SPEC_PROMPT = "app/prompts/filter_spec_vi.txt"
+# auto: đọc read model trên Property khi GraphMeta đánh dấu đã sẵn sàng (app/retrievers/read_model.py) | on | off
+GRAPH_READ_MODEL = str(get_var("GRAPH_READ_MODEL", "auto")).lower()
 
 
 
@@ -29,26 +41,167 @@ OPENAI_MODEL = get_var("OPENAI_MODEL", "gpt-4o-mini")
 # Kết nối với Neo4j và thực thi Cypher
 class Neo4jExecutor:
     def __init__(self):
+        from neo4j import GraphDatabase
         self.driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
 
-    def run_query(self, cypher_query: str):
+    def run_query(self, cypher_query: str, params: dict = None):
         """Thực thi Cypher và trả kết quả dạng list[dict]"""
         with self.driver.session() as session:
-            result = session.run(cypher_query)
+            result = session.run(cypher_query, params or {})
             return [record.data() for record in result]
 
+    def write_query(self, cypher_query: str, params: dict = None):
+        """Ghi trong transaction được driver tự retry khi gặp lỗi tạm thời (DeadlockDetected, mất leader...)."""
+        def _work(tx):
+            return [record.data() for record in tx.run(cypher_query, params or {})]
+        with self.driver.session() as session:
+            return session.execute_write(_work)
+
+    def profile_query(self, cypher_query: str, params: dict = None):
+        """Chạy PROFILE và trả về số dòng, thời gian, dbHits, số lần quét label."""
+        query = cypher_query.strip().rstrip(";")
+        start = time.time()
+        with self.driver.session() as session:
+            result = session.run(f"PROFILE {query}", params or {})
+            rows = [record.data() for record in result]
+            summary = result.consume()
+        took_ms = int((time.time() - start) * 1000)
+        stats = summarize_profile(summary.profile)
+        stats.update({"rows": len(rows), "took_ms": took_ms, "ids": [r.get("id") for r in rows]})
+        return stats
+
     def close(self):
         self.driver.close()
 
 
 
+# CACHE KẾT QUẢ NEO4J
+# Khóa = Cypher đã chuẩn hóa + params + graph version; dùng chung trong cả process
+_WRITE_CLAUSE_RE = re.compile(r"\b(CREATE|MERGE|SET|DELETE|REMOVE|DROP|CALL|LOAD\s+CSV|FOREACH)\b", re.IGNORECASE)
+_RESULT_CACHE = LRUCache(maxsize=NEO4J_CACHE_SIZE, ttl_s=NEO4J_CACHE_TTL_S)
+_CYPHER_CACHE = LRUCache(maxsize=CYPHER_CACHE_SIZE)
+
+
+class CachedNeo4jExecutor:
+    """
+    Bọc Neo4jExecutor bằng LRU cache cho các truy vấn chỉ đọc.
+    Graph version (do loader tăng sau mỗi lần nạp) được đọc lại tối đa mỗi
+    GRAPH_VERSION_CHECK_S giây; version đổi → xóa toàn bộ cache.
+    """
+
+    _version = None
+    _version_checked_at = 0.0
+
+    def __init__(self, executor: Neo4jExecutor, cache: LRUCache = _RESULT_CACHE,
+                 version_check_s: float = GRAPH_VERSION_CHECK_S):
+        self.executor = executor
+        self.cache = cache
+        self.version_check_s = version_check_s
+
+    def graph_version(self):
+        cls = type(self)
+        now = time.time()
+        if now - cls._version_checked_at >= self.version_check_s:
+            try:
+                version = read_graph_version(self.executor)
+            except Exception:
+                version = cls._version
+            if version != cls._version:
+                self.cache.clear()
+                cls._version = version
+            cls._version_checked_at = now
+        return cls._version
+
+    def run_query(self, cypher_query: str, params: dict = None):
+        canonical = canonicalize_cypher(cypher_query)
+        if _WRITE_CLAUSE_RE.search(canonical):
+            return self.executor.run_query(cypher_query, params)
+
+        key = make_cache_key(self.graph_version(), canonical, params or {})
+        hit, records = self.cache.get(key)
+        if hit:
+            return [dict(r) for r in records]
+        records = self.executor.run_query(cypher_query, params)
+        self.cache.set(key, records)
+        return [dict(r) for r in records]
+
+    def profile_query(self, cypher_query: str, params: dict = None):
+        return self.executor.profile_query(cypher_query, params)
+
+    def is_cached(self, cypher_query: str, params: dict = None) -> bool:
+        """Kết quả của Cypher đã có trong cache với graph version hiện tại (không tính hit/miss)."""
+        key = make_cache_key(type(self)._version, canonicalize_cypher(cypher_query), params or {})
+        return self.cache.peek(key)[0]
+
+    def stats(self):
+        return {**self.cache.stats(), "graph_version": type(self)._version}
+
+    def close(self):
+        self.executor.close()
+
+
+def cypher_cache_key(user_query: str) -> str:
+    return " ".join(user_query.lower().split())
+
+
+def neo4j_cache_stats():
+    """Bộ đếm hit/miss của cache kết quả Neo4j trong process hiện tại."""
+    return {**_RESULT_CACHE.stats(), "graph_version": CachedNeo4jExecutor._version}
+
+
+
 # GRAPH QUERY PIPELINE
 class GraphQueryPipeline:
     # Khởi tạo các thành phần
     def __init__(self):
+        from openai import OpenAI
+        from app.retrievers.nl2cypher_retriever import NL2CypherRetriever
         self.retriever = NL2CypherRetriever()
+        # Index ví dụ few-shot đổi phiên bản → Cypher đã sinh từ ví dụ cũ không còn đáng tin
+        self.retriever.on_swap = _CYPHER_CACHE.clear
         self.client = OpenAI()
         self.neo4j = Neo4jExecutor()
+        if NEO4J_CACHE_SIZE > 0:
+            self.neo4j = CachedNeo4jExecutor(self.neo4j)
+        self._use_text_index = None
+        self._use_read_model = None
+        self.mode = NL2CYPHER_MODE
+        self._spec_prompt = None
+
+    def use_read_model(self) -> bool:
+        """Read model đã được loader / backfill đánh dấu chưa (kiểm tra 1 lần mỗi process)."""
+        if self._use_read_model is None:
+            if GRAPH_READ_MODEL in ("on", "off"):
+                self._use_read_model = GRAPH_READ_MODEL == "on"
+            else:
+                try:
+                    self._use_read_model = has_read_model(self.neo4j)
+                except Exception as e:
+                    print("⚠️ Không kiểm tra được read model, dùng Cypher theo quan hệ:", e)
+                    self._use_read_model = False
+        return self._use_read_model
+
+    # Nâng LIMIT nếu được cấu hình, đọc read model nếu nhận ra dạng template,
+    # không thì viết lại Cypher để dùng TEXT index (name_lc) nếu đã bootstrap
+    def prepare_cypher(self, cypher_query: str) -> str:
+        if GRAPH_RESULT_LIMIT > 0:
+            cypher_query = raise_cypher_limit(cypher_query, GRAPH_RESULT_LIMIT)
+        if self.use_read_model():
+            rewritten = rewrite_cypher_for_read_model(cypher_query)
+            if rewritten:
+                return rewritten
+        if CYPHER_INDEX_REWRITE == "off":
+            return cypher_query
+        if self._use_text_index is None:
+            if CYPHER_INDEX_REWRITE == "on":
+                self._use_text_index = True
+            else:
+                try:
+                    self._use_text_index = has_text_indexes(self.neo4j)
+                except Exception as e:
+                    print("⚠️ Không kiểm tra được TEXT index, giữ nguyên Cypher:", e)
+                    self._use_text_index = False
+        return rewrite_cypher_for_indexes(cypher_query) if self._use_text_index else cypher_query
 
     # Làm sạch kết quả LLM trả về
     def clean_cypher(self, text: str) -> str:
@@ -62,11 +215,22 @@ class GraphQueryPipeline:
         )
 
     # Gửi prompt đến LLM để sinh Cypher
-    def generate_cypher(self, user_query: str, k: int = 10) -> str:
-        """Dùng LLM để sinh Cypher từ câu hỏi"""
-        # Build prompt từ nl2cypher
-        prompt = self.retriever.build_prompt(user_query, k=k)
-        examples = self.retriever.retrieve_examples(user_query, k=k)
+    def generate_cypher(self, user_query: str, k: int = 10, strong_k: int = None, timings: dict = None) -> str:
+        """
+        Dùng LLM để sinh Cypher từ câu hỏi.
+        strong_k: ví dụ gần nhất khớp mạnh với mẫu → chỉ gửi strong_k ví dụ (prompt ngắn hơn).
+        timings: nếu truyền vào, ghi few_shot_ms / cypher_llm_ms / few_shot_k.
+        """
+        t0 = time.time()
+        if strong_k:
+            from app.utils.latency_budget import choose_few_shot
+            examples = choose_few_shot(self.retriever.retrieve_examples_scored(user_query, k=k), k, strong_k)
+        else:
+            examples = self.retriever.retrieve_examples(user_query, k=k)
+        prompt = self.retriever.build_prompt(user_query, k=len(examples), examples=examples)
+        if timings is not None:
+            timings["few_shot_ms"] = int((time.time() - t0) * 1000)
+            timings["few_shot_k"] = len(examples)
         print(f"\n📚 Đã lấy {len(examples)} ví dụ few-shot gần nhất cho: '{user_query}'\n")
 
         for i, ex in enumerate(examples, 1):
@@ -76,46 +240,113 @@ class GraphQueryPipeline:
             print()
             
         print("\n📤 GỬI PROMPT ĐẾN OPENAI...\n")
-        response = self.client.chat.completions.create(
+        t0 = time.time()
+        response = chat_completion(
+            self.client, "cypher",
             model=OPENAI_MODEL,
             messages=[{"role": "user", "content": prompt}],
             temperature=0.1,
         )
+        if timings is not None:
+            timings["cypher_llm_ms"] = int((time.time() - t0) * 1000)
 
         cypher = self.clean_cypher(response.choices[0].message.content)
         print("\n✅ Cypher sinh ra:\n", cypher)
         return cypher
-    
+
+    # Sinh bộ lọc JSON (NL2CYPHER_MODE=spec): LLM chỉ trả vài chục token thay vì cả câu Cypher
+    def generate_spec(self, user_query: str, timings: dict = None):
+        """LLM → FilterSpec (JSON mode); JSON hỏng → bộ lọc tách bằng luật từ câu hỏi."""
+        from app.retrievers.cypher_compiler import parse_spec_json
+        from app.utils.filter_spec import parse_question
+        if self._spec_prompt is None:
+            with open(FILTER_SPEC_PROMPT, "r", encoding="utf-8") as f:
+                self._spec_prompt = f.read()
+        t0 = time.time()
+        response = chat_completion(
+            self.client, "cypher",
+            model=OPENAI_MODEL,
+            messages=[{"role": "system", "content": self._spec_prompt},
+                      {"role": "user", "content": user_query}],
+            temperature=0,
+            max_tokens=200,
+            response_format={"type": "json_object"},
+        )
+        if timings is not None:
+            timings["cypher_llm_ms"] = int((time.time() - t0) * 1000)
+        try:
+            return parse_spec_json(response.choices[0].message.content)
+        except ValueError as e:
+            print("⚠️ LLM trả JSON bộ lọc không hợp lệ, dùng bộ lọc tách bằng luật:", e)
+            return parse_question(user_query)
+
+    def generate_query(self, user_query: str, k: int = 10, strong_k: int = None, timings: dict = None):
+        """(Cypher, params) theo NL2CYPHER_MODE; chế độ cypher không có params."""
+        if self.mode not in ("spec", "rules"):
+            return self.generate_cypher(user_query, k=k, strong_k=strong_k, timings=timings), {}
+        from app.retrievers.cypher_compiler import compile_spec
+        from app.utils.filter_spec import parse_question
+        spec = self.generate_spec(user_query, timings) if self.mode == "spec" else parse_question(user_query)
+        cypher, params = compile_spec(spec, min_limit=GRAPH_RESULT_LIMIT,
+                                      use_read_model=self.use_read_model())
+        print(f"\n🧩 Bộ lọc ({self.mode}): {spec.to_dict()}\n✅ Cypher biên dịch:\n", cypher)
+        return cypher, params
+
+    def cached_layers(self, user_query: str) -> dict:
+        """Câu hỏi đã có Cypher trong cache chưa, kết quả Neo4j của Cypher đó đã được cache chưa."""
+        hit, cached = _CYPHER_CACHE.peek(cypher_cache_key(user_query))
+        neo4j_hit = False
+        if hit and isinstance(self.neo4j, CachedNeo4jExecutor):
+            cypher_query, params = cached
+            neo4j_hit = self.neo4j.is_cached(self.prepare_cypher(cypher_query), params)
+        return {"cypher": hit, "neo4j": neo4j_hit}
+
     # Thực thi pineline nhận câu hỏi => Cypher => Kết quả
-    def run_pipeline(self, user_query: str):
-        """Full pipeline: NL → Cypher → Query → Result"""
-        cypher_query = self.generate_cypher(user_query)
+    def run_pipeline(self, user_query: str, cypher_query: str = None, few_shot_k: int = 10,
+                     few_shot_strong_k: int = None, cypher_params: dict = None):
+        """
+        Full pipeline: NL → Cypher → Query → Result
+        (truyền sẵn cypher_query + cypher_params để bỏ qua bước LLM).
+        """
+        timings = {}
+        cypher_params = dict(cypher_params or {})
+        if not cypher_query:
+            key = cypher_cache_key(user_query)
+            hit, cached = _CYPHER_CACHE.get(key)
+            if hit:
+                cypher_query, cypher_params = cached
+            else:
+                cypher_query, cypher_params = self.generate_query(user_query, k=few_shot_k, strong_k=few_shot_strong_k,
+                                                                  timings=timings)
+                if cypher_query:
+                    _CYPHER_CACHE.set(key, (cypher_query, cypher_params))
+        cypher_query = self.prepare_cypher(cypher_query)
         print("\n⚙️ Đang chạy truy vấn trên Neo4j...\n")
+        t0 = time.time()
         try:
-            records = self.neo4j.run_query(cypher_query)
+            records = self.neo4j.run_query(cypher_query, cypher_params)
+            timings["neo4j_ms"] = int((time.time() - t0) * 1000)
             print(f"📊 Trả về {len(records)} kết quả.")
-            return {"cypher_query": cypher_query, "result": records}
+            return {"cypher_query": cypher_query, "cypher_params": cypher_params, "result": records,
+                    "timings": timings}
         except Exception as e:
+            timings["neo4j_ms"] = int((time.time() - t0) * 1000)
             print("❌ Lỗi khi chạy Cypher:", e)
-            return {"cypher_query": cypher_query, "error": str(e)}
+            return {"cypher_query": cypher_query, "cypher_params": cypher_params, "error": str(e), "timings": timings}
 
 
 
 # DEMO CHẠY THỬ
 if __name__ == "__main__":
+    print(" DEBUG NEO4J TEST KẾT NỐI ")
+    print("NEO4J_URI:", repr(NEO4J_URI))
+    print("NEO4J_USER:", repr(NEO4J_USER))
+    print("NEO4J_PASSWORD:", "SET" if NEO4J_PASSWORD else "None")
+    print("=======================================")
+
     pipeline = GraphQueryPipeline()
     question = "Tìm nhà 5 tầng sổ đỏ chính chủ đầy đủ nội thất tại Thanh Xuân"
     result = pipeline.run_pipeline(question)
 
     print("\n===== KẾT QUẢ TRẢ VỀ =====")
     print(result)
-
-
-
-# Test bug 
-print(" DEBUG NEO4J TEST KẾT NỐI ")
-print("NEO4J_URI:", repr(NEO4J_URI))
-print("NEO4J_USER:", repr(NEO4J_USER))
-print("NEO4J_PASSWORD:", "SET" if NEO4J_PASSWORD else "None")
-print("=======================================")
-
@@ -4,36 +4,97 @@ Hybrid Retriever: chạy song song Graph (Neo4j) + Vector (FAISS)
 import os
 import time
 import asyncio
-from typing import Dict, Any
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional
 from app.retrievers.graph_tools import GraphQueryPipeline
-from app.retrievers.vector_tools import VectorClient
-from openai import OpenAI
+from app.retrievers.vector_tools import VectorClient, VectorResult
+from app.utils.profiling import profiled
+
+
+# Hạn chót cho bước Graph + Vector (0 = chờ đủ cả hai nhánh như trước)
+RETRIEVAL_DEADLINE_MS = int(os.getenv("RETRIEVAL_DEADLINE_MS", 0))
+HYBRID_WORKERS = int(os.getenv("HYBRID_WORKERS", 16))
+
+
+def make_vector_client() -> VectorClient:
+    """VECTOR_SEARCH_MODE=sharded → tìm trên các shard (scripts/build_vector_shards.py), mặc định 1 FAISS index."""
+    if os.getenv("VECTOR_SEARCH_MODE", "single").lower() == "sharded":
+        from app.retrievers.sharded_vector import ShardedVectorClient, read_manifest
+        if read_manifest() is not None:
+            return ShardedVectorClient()
+        print("⚠️ VECTOR_SEARCH_MODE=sharded nhưng chưa có manifest shard → dùng index đơn")
+    return VectorClient()
 
 
 class HybridRetrieverParallel:
     def __init__(self):
+        from openai import OpenAI
         self.graph = GraphQueryPipeline()
-        self.vector = VectorClient()
+        self.vector = make_vector_client()
         self.client = OpenAI()
         self.openai_model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+        # Executor riêng (không dùng executor mặc định của event loop): asyncio.run() không phải chờ
+        # nhánh về muộn, nhánh đó chạy tiếp ở nền và vẫn ghi vào cache Cypher / Neo4j / embedding
+        self._executor = ThreadPoolExecutor(max_workers=HYBRID_WORKERS, thread_name_prefix="hybrid")
+
+    def _graph_call(self, query: str, cypher_query: str = None, plan=None, cypher_params: dict = None):
+        if plan is None:
+            return functools.partial(self.graph.run_pipeline, query, cypher_query, cypher_params=cypher_params)
+        return functools.partial(self.graph.run_pipeline, query, cypher_query,
+                                 few_shot_k=plan.few_shot_k, few_shot_strong_k=plan.few_shot_strong_k,
+                                 cypher_params=cypher_params)
 
-    async def _graph_search(self, query: str):
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, self.graph.run_pipeline, query)
+    def _vector_call(self, query: str, top_k: int, plan=None):
+        if plan is None:
+            return functools.partial(self.vector.search, query, top_k, True)
+        return functools.partial(self.vector.search, query, top_k, plan.mmr, fetch_k=plan.fetch_k,
+                                 diversity_threshold=plan.mmr_diversity_threshold)
 
-    async def _vector_search(self, query: str, top_k: int):
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, self.vector.search, query, top_k, True)
+    @staticmethod
+    def _log_late(branch: str, query: str, started: float):
+        def done(fut):
+            took = int((time.time() - started) * 1000)
+            status = "lỗi: " + str(fut.exception()) if fut.exception() else "đã ghi cache"
+            print(f"🕒 Nhánh {branch} về muộn ({took}ms) cho '{query[:40]}' → {status}")
+        return done
 
-    async def search(self, user_query: str, top_k: int = 10) -> Dict[str, Any]:
-        """Chạy song song giữa Graph và Vector."""
+    async def search(self, user_query: str, top_k: int = 10, cypher_query: str = None, plan=None,
+                     deadline_ms: Optional[int] = None, cypher_params: Optional[dict] = None) -> Dict[str, Any]:
+        """
+        Chạy song song giữa Graph và Vector (cypher_query + cypher_params: dùng lại Cypher đã sinh, bỏ qua LLM).
+        plan: RetrievalPlan (app/utils/latency_budget.py) → few-shot k / fetch_k / bỏ MMR theo ngân sách độ trễ.
+        deadline_ms: hết hạn → trả về nhánh đã xong (partial=True), nhánh còn lại chạy tiếp ở nền.
+            Nhánh nào lỗi cũng chỉ bị bỏ qua, không làm hỏng cả request.
+        """
         start = time.time()
+        deadline_ms = RETRIEVAL_DEADLINE_MS if deadline_ms is None else deadline_ms
         print("\n🚀 Đang chạy song song Graph + Vector...\n")
 
         # Chạy hai nhiệm vụ song song
-        graph_task = asyncio.create_task(self._graph_search(user_query))
-        vector_task = asyncio.create_task(self._vector_search(user_query, top_k))
-        graph_result, vector_result = await asyncio.gather(graph_task, vector_task)
+        # profiled(): khi chạy --profile, nhánh trong thread pool cũng được cProfile (không profile → giữ nguyên hàm)
+        graph_fut = self._executor.submit(profiled(self._graph_call(user_query, cypher_query, plan, cypher_params)))
+        vector_fut = self._executor.submit(profiled(self._vector_call(user_query, top_k, plan)))
+        branches = {"graph": graph_fut, "vector": vector_fut}
+        await asyncio.wait([asyncio.wrap_future(f) for f in branches.values()],
+                           timeout=deadline_ms / 1000 if deadline_ms else None)
+
+        missing, errors = [], {}
+        for name, fut in branches.items():
+            if not fut.done():
+                missing.append(name)
+                fut.add_done_callback(self._log_late(name, user_query, start))
+            elif fut.exception() is not None:
+                missing.append(name)
+                errors[name] = str(fut.exception())
+                print(f"⚠️ Nhánh {name} lỗi, trả lời bằng nhánh còn lại:", fut.exception())
+        graph_result = graph_fut.result() if "graph" not in missing else {}
+        vector_result = vector_fut.result() if "vector" not in missing else VectorResult(passages=[], took_ms=0)
+        # Lỗi đã được nhánh tự bắt (Neo4j / vector store hỏng) cũng là thiếu nhánh → partial, không lưu answer cache
+        for name, error in (("graph", graph_result.get("error")), ("vector", vector_result.error)):
+            if error and name not in missing:
+                missing.append(name)
+                print(f"⚠️ Nhánh {name} lỗi, trả lời bằng nhánh còn lại:", error)
 
         took = int((time.time() - start) * 1000)
 
@@ -45,15 +106,23 @@ class HybridRetrieverParallel:
         print(f"✅ Graph xong: {len(graph_records)} kết quả")
         print(f"✅ Vector xong: {len(vector_passages)} kết quả")
         print(f"⚡ Tổng thời gian song song: {took}ms")
+        if missing:
+            print(f"⏳ Kết quả một phần (thiếu: {', '.join(missing)})")
 
         return {
             "query": user_query,
             "graph_records": graph_records,
             "graph_ids": graph_ids,
             "vector_passages": vector_passages,
-            "vector_time_ms": vector_result.took_ms,
-            "vector_error": vector_result.error,
+            "vector_time_ms": vector_result.took_ms if vector_fut.done() and not vector_fut.exception() else None,
+            "vector_error": vector_result.error or errors.get("vector"),
+            "vector_mmr_skipped": getattr(vector_result, "mmr_skipped", False),
+            "graph_timings": graph_result.get("timings") or {},
+            "graph_error": graph_result.get("error") or errors.get("graph"),
             "cypher_query": cypher_query,
+            "cypher_params": graph_result.get("cypher_params") or {},
+            "partial": bool(missing),
+            "missing_branches": missing,
             "took_ms": took,
         }
 
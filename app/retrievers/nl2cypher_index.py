@@ -0,0 +1,225 @@
+# retrievers/nl2cypher_index.py
+"""
+Index ví dụ few-shot NL2Cypher (data/Cypher_template.csv) build tăng dần theo hash nội dung, đổi phiên bản nguyên tử.
+
+Bố cục trong store_dir (.vector_store/nl2cypher_index):
+    versions/v<N>/   index.faiss + index.pkl (metadata mỗi dòng: Cypher, hash) + embedding_config.json + index_meta.json
+    CURRENT          đường dẫn tương đối của phiên bản đang phục vụ (ghi bằng os.replace)
+Index cũ (index.faiss nằm ngay trong store_dir, chưa có CURRENT) vẫn được đọc và dùng lại vector khi build bản đầu tiên.
+
+sync_index(): so hash từng dòng CSV với phiên bản hiện tại
+- dòng giữ nguyên → dùng lại vector; chỉ đổi Cypher → dùng lại vector (embedding chỉ phụ thuộc câu hỏi)
+- câu hỏi mới / đã sửa → embedding (1 request cho tất cả); dòng đã xóa → bỏ
+- không có gì thay đổi → không tạo phiên bản mới.
+Build vào thư mục mới rồi mới ghi CURRENT → process đang phục vụ luôn thấy bản cũ hoặc bản mới đầy đủ.
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.utils.embedding_config import VECTORS_FILE, EmbeddingConfig, apply_storage
+
+
+CURRENT_FILE = "CURRENT"
+VERSIONS_DIR = "versions"
+META_FILE = "index_meta.json"
+LOCK_FILE = "rebuild.lock"
+# Lock của 1 lượt build bị bỏ dở (process chết giữa chừng) được coi là hết hạn sau chừng này giây
+LOCK_STALE_S = 600
+
+
+# HASH
+def row_hash(question: str, cypher: str) -> str:
+    return hashlib.sha1(f"{question.strip()}\x1f{cypher.strip()}".encode("utf-8")).hexdigest()
+
+
+def question_hash(question: str) -> str:
+    return hashlib.sha1(question.strip().encode("utf-8")).hexdigest()
+
+
+def file_hash(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def read_template_rows(csv_path: str) -> List[Dict[str, str]]:
+    import pandas as pd
+    df = pd.read_csv(csv_path)
+    if not {"Question", "Cypher"}.issubset(df.columns):
+        raise ValueError("❌ CSV phải có 2 cột: 'Question' và 'Cypher'")
+    rows = []
+    for q, c in zip(df["Question"].astype(str), df["Cypher"].astype(str)):
+        rows.append({"Question": q, "Cypher": c, "hash": row_hash(q, c)})
+    return rows
+
+
+# PHIÊN BẢN
+def current_dir(store_dir: str) -> Optional[str]:
+    """Thư mục index đang phục vụ (theo CURRENT, hoặc index cũ trong store_dir), None nếu chưa có."""
+    pointer = os.path.join(store_dir, CURRENT_FILE)
+    if os.path.exists(pointer):
+        with open(pointer, "r", encoding="utf-8") as f:
+            folder = os.path.join(store_dir, f.read().strip())
+        if os.path.exists(os.path.join(folder, "index.faiss")):
+            return folder
+    if os.path.exists(os.path.join(store_dir, "index.faiss")):
+        return store_dir
+    return None
+
+
+def read_meta(folder: Optional[str]) -> Dict[str, Any]:
+    path = os.path.join(folder, META_FILE) if folder else ""
+    if not folder or not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def is_stale(csv_path: str, store_dir: str) -> bool:
+    """CSV đã khác với CSV lúc build phiên bản hiện tại (index cũ không có meta → coi là cũ)."""
+    folder = current_dir(store_dir)
+    return folder is None or read_meta(folder).get("csv_hash") != file_hash(csv_path)
+
+
+def _next_version(store_dir: str) -> Tuple[int, str]:
+    versions = os.path.join(store_dir, VERSIONS_DIR)
+    os.makedirs(versions, exist_ok=True)
+    taken = [int(e[1:]) for e in os.listdir(versions) if e.startswith("v") and e[1:].isdigit()]
+    version = max(taken, default=0) + 1
+    return version, os.path.join(VERSIONS_DIR, f"v{version}")
+
+
+def _switch_current(store_dir: str, rel: str) -> None:
+    path = os.path.join(store_dir, CURRENT_FILE)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(rel)
+    os.replace(tmp, path)
+
+
+def _cleanup(store_dir: str, keep: List[str]) -> None:
+    """Xóa phiên bản cũ, giữ bản hiện tại + bản ngay trước (process khác có thể chưa kịp chuyển)."""
+    versions = os.path.join(store_dir, VERSIONS_DIR)
+    keep_names = {os.path.basename(os.path.normpath(k)) for k in keep if k}
+    for entry in os.listdir(versions):
+        if entry not in keep_names:
+            shutil.rmtree(os.path.join(versions, entry), ignore_errors=True)
+
+
+def _acquire_lock(store_dir: str) -> bool:
+    """Chỉ 1 process build tại 1 thời điểm (nhiều worker cùng thấy CSV đổi)."""
+    path = os.path.join(store_dir, LOCK_FILE)
+    try:
+        if time.time() - os.path.getmtime(path) > LOCK_STALE_S:
+            os.remove(path)
+    except OSError:
+        pass
+    try:
+        os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        return True
+    except FileExistsError:
+        return False
+
+
+def _release_lock(store_dir: str) -> None:
+    try:
+        os.remove(os.path.join(store_dir, LOCK_FILE))
+    except OSError:
+        pass
+
+
+def _existing_vectors(folder: Optional[str], config: EmbeddingConfig) -> Dict[str, Any]:
+    """question_hash → vector float32 của phiên bản hiện tại (rỗng nếu khác model / số chiều)."""
+    import pickle
+    import faiss
+    import numpy as np
+    if folder is None:
+        return {}
+    built = EmbeddingConfig.for_index(folder, model=config.model)
+    if (built.model, built.dimensions) != (config.model, config.dimensions):
+        print(f"⚠️ Index few-shot build bằng {built.model}/{built.dimensions or 'mặc định'} chiều → embedding lại toàn bộ")
+        return {}
+    vec_path = os.path.join(folder, VECTORS_FILE)
+    if os.path.exists(vec_path):
+        vectors = np.load(vec_path)
+    else:
+        index = faiss.read_index(os.path.join(folder, "index.faiss"))
+        vectors = np.asarray(index.reconstruct_n(0, index.ntotal), dtype=np.float32)
+    with open(os.path.join(folder, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    out = {}
+    for row, doc_id in index_to_docstore_id.items():
+        doc = docstore.search(doc_id)
+        out.setdefault(question_hash(doc.page_content), vectors[int(row)])
+    return out
+
+
+# BUILD
+def sync_index(csv_path: str, store_dir: str, embeddings, config: EmbeddingConfig,
+               force: bool = False) -> Dict[str, Any]:
+    """
+    Đồng bộ index với CSV, chỉ embedding câu hỏi mới / đã sửa.
+    Trả về thống kê; "path" = thư mục phiên bản đang phục vụ sau khi đồng bộ, "swapped" = có tạo phiên bản mới.
+    Process khác đang build → bỏ qua ("locked": True), process này sẽ thấy CURRENT mới khi bên kia xong.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    if not _acquire_lock(store_dir):
+        return {"path": current_dir(store_dir), "swapped": False, "locked": True}
+    try:
+        return _sync(csv_path, store_dir, embeddings, config, force)
+    finally:
+        _release_lock(store_dir)
+
+
+def _sync(csv_path: str, store_dir: str, embeddings, config: EmbeddingConfig, force: bool) -> Dict[str, Any]:
+    from langchain_community.vectorstores import FAISS
+
+    start = time.time()
+    rows = read_template_rows(csv_path)
+    csv_hash = file_hash(csv_path)
+    old_dir = current_dir(store_dir)
+    old_meta = read_meta(old_dir)
+    old_hashes = set(old_meta.get("row_hashes") or [])
+    new_hashes = [r["hash"] for r in rows]
+    stats = {"rows": len(rows), "added": len(set(new_hashes) - old_hashes),
+             "removed": len(old_hashes - set(new_hashes)), "embedded": 0, "reused": 0}
+
+    if not force and old_dir is not None and old_meta.get("row_hashes") == new_hashes:
+        # CSV chỉ đổi định dạng / không đổi nội dung → cập nhật csv_hash, giữ nguyên index
+        if old_meta.get("csv_hash") != csv_hash:
+            old_meta["csv_hash"] = csv_hash
+            with open(os.path.join(old_dir, META_FILE), "w", encoding="utf-8") as f:
+                json.dump(old_meta, f)
+        return {**stats, "path": old_dir, "swapped": False, "took_s": round(time.time() - start, 2)}
+
+    cached = {} if force else _existing_vectors(old_dir, config)
+    missing = list(dict.fromkeys(r["Question"] for r in rows if question_hash(r["Question"]) not in cached))
+    if missing:
+        for q, vec in zip(missing, embeddings.embed_documents(missing)):
+            cached[question_hash(q)] = vec
+    stats["embedded"] = len(missing)
+    fresh = set(missing)
+    stats["reused"] = sum(1 for r in rows if r["Question"] not in fresh)
+
+    pairs = [(r["Question"], [float(x) for x in cached[question_hash(r["Question"])]]) for r in rows]
+    metadatas = [{"Cypher": r["Cypher"], "hash": r["hash"]} for r in rows]
+    vdb = FAISS.from_embeddings(pairs, embedding=embeddings, metadatas=metadatas)
+
+    version, rel = _next_version(store_dir)
+    folder = os.path.join(store_dir, rel)
+    apply_storage(vdb, folder, config)
+    vdb.save_local(folder)
+    meta = {"version": version, "csv_hash": csv_hash, "row_hashes": new_hashes, "built_at": time.time(),
+            "embedding": {"model": config.model, "dimensions": config.dimensions, "storage": config.storage}}
+    with open(os.path.join(folder, META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+    _switch_current(store_dir, rel)
+    _cleanup(store_dir, [folder, old_dir if old_dir != store_dir else None])
+    stats.update({"path": folder, "swapped": True, "version": version, "took_s": round(time.time() - start, 2)})
+    print(f"✅ Index few-shot v{version}: {len(rows)} ví dụ, embedding {stats['embedded']} câu, "
+          f"dùng lại {stats['reused']}, bỏ {stats['removed']} dòng cũ ({stats['took_s']}s)")
+    return stats
@@ -1,8 +1,18 @@
 import os
-import pandas as pd
-from dotenv import load_dotenv
-from langchain_openai import OpenAIEmbeddings
-from langchain_community.vectorstores import FAISS
+import time
+import threading
+
+from app.config import load_env
+from app.utils.caching import LRUCache
+from app.utils.embedding_config import EMBED_MODEL, EmbeddingConfig, attach_rescoring, make_embeddings
+from app.retrievers.nl2cypher_index import current_dir, is_stale, sync_index
+
+
+EXAMPLES_CACHE_SIZE = int(os.getenv("NL2CYPHER_EXAMPLES_CACHE_SIZE", 1024))
+# CSV mẫu đổi → background: build tăng dần ở nền rồi đổi index | sync: build ngay (chặn request) | off: chỉ cảnh báo
+NL2CYPHER_AUTO_REBUILD = os.getenv("NL2CYPHER_AUTO_REBUILD", "background").lower()
+# Chu kỳ kiểm tra CSV / phiên bản index (CURRENT) đổi, không tốn gì thêm giữa 2 lần kiểm tra
+NL2CYPHER_CHECK_S = float(os.getenv("NL2CYPHER_CHECK_S", 10))
 
 
 class NL2CypherRetriever:
@@ -18,15 +28,28 @@ class NL2CypherRetriever:
         csv_path="data/Cypher_template.csv",
         schema_path="app/prompts/nl2cypher_vi.txt",
         store_dir=".vector_store/nl2cypher_index",
-        embed_model="text-embedding-3-small",
+        embed_model=EMBED_MODEL,
     ):
-        load_dotenv()
+        load_env()
         self.csv_path = csv_path
         self.schema_path = schema_path
         self.store_dir = store_dir
         self.embed_model = embed_model
-        self.embeddings = OpenAIEmbeddings(model=self.embed_model)
+        # Cùng cấu hình embedding (số chiều / kiểu lưu) với VectorClient, khớp với index đã build
+        self.emb_config = EmbeddingConfig.for_index(current_dir(self.store_dir) or self.store_dir, model=self.embed_model)
+        self.embeddings = make_embeddings(self.emb_config)
         self.vdb = None
+        self.index_dir = None
+        # Gọi sau mỗi lần đổi sang index mới (vd GraphQueryPipeline xóa cache Cypher sinh từ ví dụ cũ)
+        self.on_swap = None
+        # Ví dụ few-shot kèm khoảng cách theo (câu hỏi, k): build_prompt + generate_cypher (có / không ngân sách độ trễ)
+        # cùng dùng 1 entry, batch có thể nạp trước
+        self._examples_cache = LRUCache(maxsize=EXAMPLES_CACHE_SIZE)
+        self._refresh_lock = threading.Lock()
+        self._refresh_thread = None
+        self._checked_at = time.time()
+        self._csv_mtime = None
+        self.last_sync = None
 
         os.makedirs(self.store_dir, exist_ok=True)
         self.schema_text = self._load_schema()
@@ -43,40 +66,166 @@ class NL2CypherRetriever:
         return schema_text
 
 
-    # LOAD / BUILD INDEX nếu chưa có
+    # LOAD / BUILD INDEX
     def _load_or_build_index(self):
-        faiss_path = os.path.join(self.store_dir, "index.faiss")
-        if os.path.exists(faiss_path):
-            print("📦 Đang load FAISS index có sẵn...")
-            self.vdb = FAISS.load_local(
-                folder_path=self.store_dir,
-                embeddings=self.embeddings,
-                allow_dangerous_deserialization=True,
-            )
-        else:
+        """Có index → load ngay (CSV đã đổi thì build lại theo NL2CYPHER_AUTO_REBUILD); chưa có → build trước khi phục vụ."""
+        self._csv_mtime = self._mtime(self.csv_path)
+        folder = current_dir(self.store_dir)
+        if folder is None:
             print("🚀 Chưa có index — đang tạo mới từ CSV...")
-            self._build_index()
+            self.refresh(wait=True)
+            return
+        print("📦 Đang load FAISS index có sẵn...")
+        self._load(folder)
+        if is_stale(self.csv_path, self.store_dir):
+            self._on_stale()
+
+    @staticmethod
+    def _mtime(path):
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            return None
+
+    def _load(self, folder):
+        """Nạp 1 phiên bản rồi mới thay self.vdb (request đang chạy vẫn dùng bản cũ tới khi xong)."""
+        from langchain_community.vectorstores import FAISS
+        config = EmbeddingConfig.for_index(folder, model=self.embed_model)
+        if (config.model, config.dimensions) != (self.emb_config.model, self.emb_config.dimensions):
+            self.embeddings = make_embeddings(config)
+        self.emb_config = config
+        vdb = FAISS.load_local(folder_path=folder, embeddings=self.embeddings, allow_dangerous_deserialization=True)
+        self.vdb = attach_rescoring(vdb, folder)
+        swapped = self.index_dir is not None
+        self.index_dir = folder
+        self._examples_cache.clear()
+        if swapped:
+            print(f"🔁 Đã chuyển sang index few-shot mới: {folder}")
+            if self.on_swap is not None:
+                self.on_swap()
+
+    def _on_stale(self):
+        if NL2CYPHER_AUTO_REBUILD == "off":
+            print(f"⚠️ {self.csv_path} đã đổi nhưng NL2CYPHER_AUTO_REBUILD=off → chạy python -m scripts.build_nl2cypher_index")
+        else:
+            self.refresh(wait=NL2CYPHER_AUTO_REBUILD == "sync")
 
-    def _build_index(self):
-        df = pd.read_csv(self.csv_path)
-        if not {"Question", "Cypher"}.issubset(df.columns):
-            raise ValueError("❌ CSV phải có 2 cột: 'Question' và 'Cypher'")
+    def _sync_and_load(self, force: bool = False):
+        try:
+            if force or is_stale(self.csv_path, self.store_dir):
+                config = EmbeddingConfig(model=self.embed_model) if force else self.emb_config
+                embeddings = make_embeddings(config) if force else self.embeddings
+                self.last_sync = sync_index(self.csv_path, self.store_dir, embeddings, config, force=force)
+            folder = current_dir(self.store_dir)
+            if folder is not None and folder != self.index_dir:
+                self._load(folder)
+        except Exception as e:
+            print("⚠️ Không build lại được index few-shot, giữ index hiện tại:", e)
+            if self.vdb is None:
+                raise
+        return self.last_sync
 
-        texts = df["Question"].astype(str).tolist()
-        metadatas = [{"Cypher": row["Cypher"]} for _, row in df.iterrows()]
+    def refresh(self, wait: bool = False, force: bool = False):
+        """
+        Đồng bộ index với CSV (chỉ embedding dòng mới / đã sửa) và nạp phiên bản mới nhất.
+        wait=False → chạy ở nền, request tiếp tục dùng index hiện tại; chỉ 1 lượt chạy tại 1 thời điểm.
+        """
+        with self._refresh_lock:
+            running = self._refresh_thread is not None and self._refresh_thread.is_alive()
+            if not wait and not running:
+                self._refresh_thread = threading.Thread(target=self._sync_and_load, args=(force,),
+                                                        name="nl2cypher-rebuild", daemon=True)
+                self._refresh_thread.start()
+            thread = self._refresh_thread
+        if not wait:
+            return None
+        if running and thread is not None:
+            thread.join()
+        return self._sync_and_load(force)
 
-        self.vdb = FAISS.from_texts(texts, embedding=self.embeddings, metadatas=metadatas)
-        self.vdb.save_local(self.store_dir)
-        print(f"✅ Đã tạo FAISS index từ {len(df)} ví dụ.")
+    def _maybe_refresh(self):
+        """Tối đa mỗi NL2CYPHER_CHECK_S giây: CSV đổi → build lại; CURRENT đổi (script / process khác) → nạp bản mới."""
+        now = time.time()
+        if now - self._checked_at < NL2CYPHER_CHECK_S:
+            return
+        self._checked_at = now
+        csv_mtime = self._mtime(self.csv_path)
+        rebuilding = self._refresh_thread is not None and self._refresh_thread.is_alive()
+        if csv_mtime != self._csv_mtime:
+            # đang build dở → để lần kiểm tra sau (bản đang build có thể chưa gồm thay đổi mới nhất)
+            if not rebuilding:
+                self._csv_mtime = csv_mtime
+                self._on_stale()
+        elif current_dir(self.store_dir) != self.index_dir:
+            self.refresh(wait=NL2CYPHER_AUTO_REBUILD == "sync")
 
 
     # TRUY XUẤT VÍ DỤ
+    @staticmethod
+    def _to_example(doc):
+        return {"Question": doc.page_content, "Cypher": doc.metadata["Cypher"]}
+
+    def _search_scored(self, query: str, k: int):
+        """[(ví dụ, khoảng cách L2)] của 1 câu hỏi: cache theo (câu hỏi, k), dùng chung cho cả 2 kiểu truy xuất."""
+        if not self.vdb:
+            raise RuntimeError("⚠️ VectorDB chưa được load hoặc build.")
+        self._maybe_refresh()
+        key = (query.strip(), k)
+        hit, scored = self._examples_cache.get(key)
+        if hit:
+            return scored
+        results = self.vdb.similarity_search_with_score(query, k=k)
+        scored = [(self._to_example(doc), float(dist)) for doc, dist in results]
+        self._examples_cache.set(key, scored)
+        return scored
+
     def retrieve_examples(self, query: str, k: int = 10):
         """Tìm top-k ví dụ semantic gần nhất trong index"""
+        return [ex for ex, _ in self._search_scored(query, k)]
+
+    def retrieve_examples_scored(self, query: str, k: int = 10):
+        """Top-k ví dụ kèm khoảng cách L2 (nhỏ = khớp mẫu tốt) — dùng để quyết định số ví dụ few-shot."""
+        return self._search_scored(query, k)
+
+    def retrieve_examples_many(self, queries, k: int = 10, verbose: bool = False):
+        """
+        Top-k ví dụ cho nhiều câu hỏi: 1 request embed_documents + 1 lần FAISS search trên ma trận.
+        Kết quả (kèm khoảng cách) được nạp vào cache nên retrieve_examples() / retrieve_examples_scored()
+        sau đó không gọi API nữa. Danh sách trả về lấy từ kết quả vừa tính, không đọc lại cache
+        (lô lớn hơn NL2CYPHER_EXAMPLES_CACHE_SIZE thì entry đầu đã bị đẩy ra).
+        """
         if not self.vdb:
             raise RuntimeError("⚠️ VectorDB chưa được load hoặc build.")
-        results = self.vdb.similarity_search(query, k=k)
-        return [{"Question": r.page_content, "Cypher": r.metadata["Cypher"]} for r in results]
+        self._maybe_refresh()
+        vdb = self.vdb
+        keys = [q.strip() for q in queries]
+        found, todo = {}, []
+        for q in dict.fromkeys(keys):
+            hit, scored = self._examples_cache.get((q, k))
+            if hit:
+                found[q] = scored
+            else:
+                todo.append(q)
+        if todo:
+            import numpy as np
+
+            t0 = time.time()
+            qmat = np.asarray(self.embeddings.embed_documents(todo), dtype=np.float32)
+            embed_ms = int((time.time() - t0) * 1000)
+            t0 = time.time()
+            if getattr(vdb, "_normalize_L2", False):
+                import faiss
+                faiss.normalize_L2(qmat)
+            dists, idxs = vdb.index.search(qmat, k)
+            for query, drow, irow in zip(todo, dists, idxs):
+                scored = [(self._to_example(vdb.docstore.search(vdb.index_to_docstore_id[int(j)])), float(d))
+                          for d, j in zip(drow, irow) if j != -1]
+                found[query] = scored
+                self._examples_cache.set((query, k), scored)
+            if verbose:
+                print(f"📚 Đã lấy ví dụ few-shot cho {len(todo)} câu hỏi "
+                      f"(embedding {embed_ms} ms, FAISS {int((time.time() - t0) * 1000)} ms)")
+        return [[ex for ex, _ in found[q]] for q in keys]
 
     def debug_retrieve(self, query: str, k: int = 10):
         """In ra ví dụ gần nghĩa nhất để debug"""
@@ -90,9 +239,10 @@ class NL2CypherRetriever:
 
 
     # TẠO PROMPT CHO GPT
-    def build_prompt(self, user_query: str, k: int = 10):
-        """Ghép prompt hoàn chỉnh để gửi GPT"""
-        examples = self.retrieve_examples(user_query, k=k)
+    def build_prompt(self, user_query: str, k: int = 10, examples=None):
+        """Ghép prompt hoàn chỉnh để gửi GPT (examples: ví dụ đã chọn sẵn, mặc định lấy top-k)"""
+        if examples is None:
+            examples = self.retrieve_examples(user_query, k=k)
         few_shot_text = "\n\n".join(
             [
                 f"(Ví dụ {i+1})\n"
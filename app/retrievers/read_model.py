@@ -0,0 +1,285 @@
+# retrievers/read_model.py
+"""
+Read model phi chuẩn hóa trên node Property: mỗi căn giữ sẵn các trường mà template RETURN
+(cùng tên cột: district_name, property_type, price_ty_vnd, area_m2, house_design, legal_status, direction,
+internal_amenities, near_facilities, full_address, contact_name, contact_phone).
+
+- Loader (app/utils/graph_loader.py) ghi các trường này cùng lúc với node Property (cùng dữ liệu đã chuẩn hóa
+  dùng để tạo quan hệ) → luôn đồng bộ, kể cả chế độ incremental. Đồ thị nạp trước đây được điền lại từ quan hệ
+  (backfill_read_model), GraphMeta.read_model đánh dấu phiên bản read model đã sẵn sàng.
+- Truy vấn đọc 1 node / căn thay vì 8+ OPTIONAL MATCH:
+  compile_spec(use_read_model=True) sinh thẳng dạng này; Cypher dạng template (LLM sinh theo ví dụ few-shot)
+  được viết lại bằng rewrite_cypher_for_read_model() lúc chạy, dạng không nhận ra thì giữ nguyên.
+"""
+import re
+from typing import Dict, List, Optional
+
+
+READ_MODEL_VERSION = 1
+
+# label → trường trên Property (1 giá trị / danh sách chữ thường)
+SCALAR_FIELDS = {
+    "District": "district_name",
+    "PropertyType": "property_type",
+    "Address": "full_address",
+    "PriceVND": "price_ty_vnd",
+    "Area": "area_m2",
+}
+LIST_FIELDS = {
+    "HouseDesign": "house_design",
+    "Amenity": "internal_amenities",
+    "LegalStatus": "legal_status",
+    "Direction": "direction",
+    "Facility": "near_facilities",
+}
+# Chỉ xuất hiện ở OPTIONAL MATCH (phần RETURN), read model giữ sẵn contact_name / contact_phone
+CONTACT_LABELS = {"Contact", "ContactName", "ContactPhone"}
+
+# Ghi từ dữ liệu listing đã chuẩn hóa (row của PROPERTY_CYPHER)
+PROPERTY_SET_CYPHER = """
+SET p.district_name = row.district,
+    p.property_type = row.property_type,
+    p.full_address = row.address,
+    p.price_ty_vnd = row.price,
+    p.area_m2 = row.area,
+    p.house_design = row.designs,
+    p.internal_amenities = row.amenities,
+    p.legal_status = row.legal,
+    p.direction = row.directions,
+    p.near_facilities = row.facilities,
+    p.contact_name = row.contact_name,
+    p.contact_phone = head(row.contact_phones),
+    p.read_model = $read_model"""
+
+# Điền lại từ quan hệ cho Property chưa có read model phiên bản hiện tại (đồ thị nạp trước đây)
+BACKFILL_CYPHER = """
+MATCH (p:Property)
+WHERE p.read_model IS NULL OR p.read_model <> $read_model
+WITH p LIMIT $batch
+SET p.district_name = head([(d:District)-[:HAS_PROPERTY]->(p) | toLower(d.name)]),
+    p.property_type = head([(p)-[:HAS_PROPERTY_TYPE]->(x:PropertyType) | toLower(x.name)]),
+    p.full_address = head([(p)-[:LOCATED_AT]->(x:Address) | toLower(x.name)]),
+    p.price_ty_vnd = head([(p)-[:HAS_PRICE]->(x:PriceVND) | toFloat(x.value)]),
+    p.area_m2 = head([(p)-[:HAS_AREA]->(x:Area) | toFloat(x.value)]),
+    p.house_design = [(p)-[:HAS_DESIGN]->(x:HouseDesign) | toLower(x.name)],
+    p.internal_amenities = [(p)-[:HAS_AMENITY]->(x:Amenity) | toLower(x.name)],
+    p.legal_status = [(p)-[:HAS_LEGAL_STATUS]->(x:LegalStatus) | toLower(x.name)],
+    p.direction = [(p)-[:HAS_DIRECTION]->(x:Direction) | toLower(x.name)],
+    p.near_facilities = [(p)-[:NEAR_FACILITY]->(x:Facility) | toLower(x.name)],
+    p.contact_name = head([(p)-[:HAS_CONTACT]->(:Contact)-[:HAS_CONTACT_NAME]->(x:ContactName) | x.name]),
+    p.contact_phone = head([(p)-[:HAS_CONTACT]->(:Contact)-[:HAS_CONTACT_PHONE]->(x:ContactPhone) | x.number]),
+    p.read_model = $read_model
+RETURN count(p) AS updated"""
+
+READ_MODEL_MARK_CYPHER = "MERGE (m:GraphMeta {key: 'graph'}) SET m.read_model = $read_model"
+READ_MODEL_READ_CYPHER = "OPTIONAL MATCH (m:GraphMeta {key: 'graph'}) RETURN m.read_model AS read_model"
+
+RETURN_CYPHER = """RETURN
+  p.id AS id,
+  p.district_name AS district_name,
+  p.property_type AS property_type,
+  coalesce(p.house_design, []) AS house_design,
+  p.area_m2 AS area_m2,
+  p.price_ty_vnd AS price_ty_vnd,
+  p.full_address AS full_address,
+  coalesce(p.legal_status, []) AS legal_status,
+  coalesce(p.direction, []) AS direction,
+  coalesce(p.internal_amenities, []) AS internal_amenities,
+  coalesce(p.near_facilities, []) AS near_facilities,
+  p.contact_name AS contact_name,
+  p.contact_phone AS contact_phone"""
+
+
+def index_statements(prefix: str) -> List[str]:
+    """Range index cho các trường lọc / sắp xếp của read model."""
+    return [
+        f"CREATE INDEX {prefix}property_{field} IF NOT EXISTS FOR (n:Property) ON (n.{field})"
+        for field in ("district_name", "price_ty_vnd", "area_m2")
+    ]
+
+
+def backfill_read_model(executor, batch_size: int = 1000) -> int:
+    """Điền read model cho các Property còn thiếu rồi đánh dấu GraphMeta; trả về số căn được cập nhật."""
+    total = 0
+    while True:
+        rows = executor.run_query(BACKFILL_CYPHER, {"read_model": READ_MODEL_VERSION, "batch": int(batch_size)})
+        updated = int((rows[0] if rows else {}).get("updated") or 0)
+        total += updated
+        if updated < batch_size:
+            break
+    executor.run_query(READ_MODEL_MARK_CYPHER, {"read_model": READ_MODEL_VERSION})
+    return total
+
+
+def has_read_model(executor) -> bool:
+    rows = executor.run_query(READ_MODEL_READ_CYPHER)
+    return (rows[0] if rows else {}).get("read_model") == READ_MODEL_VERSION
+
+
+# VIẾT LẠI CYPHER DẠNG TEMPLATE
+_STRING_RE = re.compile(r'"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\'')
+_CLAUSE_RE = re.compile(r"\b(OPTIONAL\s+MATCH|MATCH|WHERE|RETURN|ORDER\s+BY|LIMIT)\b", re.IGNORECASE)
+_UNSUPPORTED_RE = re.compile(r"\b(WITH|UNWIND|CALL|UNION|EXISTS|CREATE|MERGE|SET|DELETE|REMOVE|FOREACH)\b|\[\s*\w+\s+IN\b",
+                             re.IGNORECASE)
+_NODE_RE = re.compile(r"\(\s*(\w*)\s*(?::\s*(\w+))?\s*(\{[^}]*\})?\s*\)")
+_NAME_MAP_RE = re.compile(r"^\{\s*name\s*:\s*(__S\d+__)\s*\}$")
+_VAR_REF_RE = re.compile(r"\b(\w+)\.(name|value|number)\b")
+_RETURN_ALIAS_RE = re.compile(r"\bAS\s+(\w+)", re.IGNORECASE)
+_KNOWN_COLUMNS = {"id"} | set(SCALAR_FIELDS.values()) | set(LIST_FIELDS.values()) | {"contact_name", "contact_phone"}
+
+
+def _mask_strings(cypher: str):
+    strings: List[str] = []
+
+    def _sub(m: "re.Match") -> str:
+        strings.append(m.group(0))
+        return f"__S{len(strings) - 1}__"
+
+    return _STRING_RE.sub(_sub, cypher), strings
+
+
+def _unmask(text: str, strings: List[str]) -> str:
+    return re.sub(r"__S(\d+)__", lambda m: strings[int(m.group(1))], text)
+
+
+def _split_and(expr: str) -> Optional[List[str]]:
+    """Tách biểu thức theo AND ở ngoài cùng (không nằm trong ngoặc); ngoặc lệch → None."""
+    parts, depth, start = [], 0, 0
+    for m in re.finditer(r"[()]|\s+AND\s+", expr, re.IGNORECASE):
+        tok = m.group(0)
+        if tok == "(":
+            depth += 1
+        elif tok == ")":
+            depth -= 1
+            if depth < 0:
+                return None
+        elif depth == 0:
+            parts.append(expr[start:m.start()])
+            start = m.end()
+    if depth != 0:
+        return None
+    parts.append(expr[start:])
+    return [p.strip() for p in parts if p.strip()]
+
+
+def _substitute(expr: str, scalars: Dict[str, str], list_var: Optional[str]) -> str:
+    """toLower(x.name) / x.name / toFloat(x.value) → p.<trường> (hoặc biến lặp của danh sách)."""
+    for var, field in scalars.items():
+        expr = re.sub(rf"\b(?:toLower|toFloat)\(\s*{var}\.(?:name|value)\s*\)|\b{var}\.(?:name|value)\b",
+                      f"p.{field}", expr)
+    if list_var:
+        expr = re.sub(rf"\btoLower\(\s*{list_var}\.name\s*\)|\b{list_var}\.name\b", list_var, expr)
+    return expr
+
+
+def rewrite_cypher_for_read_model(cypher: str) -> Optional[str]:
+    """
+    Cypher dạng template (MATCH chuỗi City → District → Property, MATCH / WHERE trên node thuộc tính,
+    OPTIONAL MATCH phần còn lại, RETURN các cột chuẩn) → MATCH (p:Property) + điều kiện trên read model.
+    Điều kiện trên cùng 1 biến danh sách được gộp vào 1 any(...) (cùng 1 node phải thỏa hết như MATCH gốc).
+    Không nhận ra dạng (WITH, nhiều biến trong 1 điều kiện, WHERE sau OPTIONAL MATCH, cột lạ...) → None.
+    """
+    if not cypher:
+        return None
+    text, strings = _mask_strings(cypher.strip().rstrip(";"))
+    if _UNSUPPORTED_RE.search(text):
+        return None
+    tokens = list(_CLAUSE_RE.finditer(text))
+    if not tokens or tokens[0].start() != 0:
+        return None
+    clauses = []
+    for i, m in enumerate(tokens):
+        end = tokens[i + 1].start() if i + 1 < len(tokens) else len(text)
+        clauses.append((" ".join(m.group(1).upper().split()), text[m.end():end].strip()))
+
+    scalars: Dict[str, str] = {}
+    lists: Dict[str, str] = {}
+    contacts = set()
+    required: List[str] = []
+    conds: List[str] = []
+    where_exprs: List[str] = []
+    returns = order_by = limit = None
+    prev = None
+    for kind, body in clauses:
+        if kind in ("MATCH", "OPTIONAL MATCH"):
+            for var, label, props in _NODE_RE.findall(body):
+                if label == "City" or label == "Property" or (var == "p" and not label):
+                    if label == "Property" and var != "p":
+                        return None
+                    continue
+                if label in CONTACT_LABELS or (not label and var in contacts):
+                    if kind == "MATCH":
+                        return None
+                    contacts.add(var)
+                    continue
+                if label in SCALAR_FIELDS:
+                    scalars[var] = SCALAR_FIELDS[label]
+                elif label in LIST_FIELDS:
+                    lists[var] = LIST_FIELDS[label]
+                elif not label and (var in scalars or var in lists):
+                    continue
+                else:
+                    return None
+                if props:
+                    m = _NAME_MAP_RE.match(props.strip())
+                    if label != "District" or not m:
+                        return None
+                    conds.append(f"p.district_name = {m.group(1)}")
+                elif kind == "MATCH":
+                    required.append(var)
+        elif kind == "WHERE":
+            if prev != "MATCH":
+                return None
+            where_exprs.append(body)
+        elif kind == "RETURN":
+            returns = body
+        elif kind == "ORDER BY":
+            order_by = body
+        elif kind == "LIMIT":
+            limit = body
+        prev = kind
+
+    if returns is None or not set(_RETURN_ALIAS_RE.findall(returns)) <= _KNOWN_COLUMNS:
+        return None
+    if limit is not None and not re.fullmatch(r"\d+", limit):
+        return None
+
+    grouped: Dict[str, List[str]] = {}
+    for expr in where_exprs:
+        parts = _split_and(expr)
+        if parts is None:
+            return None
+        for part in parts:
+            refs = {v for v, _ in _VAR_REF_RE.findall(part)} - {"p"}
+            if not refs <= set(scalars) | set(lists):
+                return None
+            list_refs = refs & set(lists)
+            if len(list_refs) > 1:
+                return None
+            if list_refs:
+                var = list_refs.pop()
+                grouped.setdefault(var, []).append(_substitute(part, scalars, var))
+            else:
+                conds.append(_substitute(part, scalars, None))
+
+    for var, parts in grouped.items():
+        conds.append(f"any({var} IN p.{lists[var]} WHERE {' AND '.join(parts)})")
+    for var in required:
+        if var in lists and var not in grouped:
+            conds.append(f"size(coalesce(p.{lists[var]}, [])) > 0")
+        elif var in scalars and not any(f"p.{scalars[var]}" in c for c in conds):
+            conds.append(f"p.{scalars[var]} IS NOT NULL")
+    conds = list(dict.fromkeys(conds))
+
+    lines = ["MATCH (p:Property)"]
+    if conds:
+        lines.append("WHERE " + "\n  AND ".join(conds))
+    lines.append(RETURN_CYPHER)
+    if order_by:
+        order_refs = {v for v, _ in _VAR_REF_RE.findall(order_by)}
+        if not order_refs <= set(scalars):
+            return None
+        lines.append("ORDER BY " + _substitute(order_by, scalars, None))
+    if limit is not None:
+        lines.append(f"LIMIT {limit}")
+    return _unmask("\n".join(lines), strings)
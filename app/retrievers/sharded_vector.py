@@ -0,0 +1,279 @@
+# retrievers/sharded_vector.py
+"""
+Vector search chia shard trên nhiều process.
+
+- Kho văn bản được chia thành N shard (theo quận hoặc theo hash id) bởi scripts/build_vector_shards.py:
+    <shards_dir>/manifest.json
+    <shards_dir>/shard_00.v3/index.faiss + docs.json
+- Mỗi shard được ghim vào 1 process riêng (ProcessPoolExecutor 1 worker) → mỗi process chỉ giữ 1 phần index.
+- Câu hỏi được embedding 1 lần ở process chính, fan-out tới mọi shard song song, gộp top-k theo khoảng cách
+  (MMR, nếu bật, chạy trên tập ứng viên đã gộp — cùng ngữ nghĩa với VectorClient.search).
+- Hot reload: build lại 1 shard → thư mục mới + cập nhật manifest; chỉ worker của shard đó nạp lại,
+  các shard khác vẫn phục vụ bình thường.
+"""
+from __future__ import annotations
+
+import os
+import json
+import time
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from app.config import get_var
+from app.retrievers.vector_tools import EMBED_MODEL, Passage, VectorClient, VectorResult
+from app.utils.embedding_config import EmbeddingConfig
+
+
+VECTOR_SHARDS_DIR = get_var("VECTOR_SHARDS_DIR", ".vector_store/text_shards")
+MANIFEST_FILE = "manifest.json"
+
+
+# PHÍA WORKER (chạy trong process của từng shard)
+_SHARDS: Dict[str, Dict[str, Any]] = {}
+
+
+def _ensure_shard(name: str, path: str) -> Dict[str, Any]:
+    shard = _SHARDS.get(name)
+    if shard is None or shard["path"] != path:
+        import faiss
+        index = faiss.read_index(os.path.join(path, "index.faiss"))
+        with open(os.path.join(path, "docs.json"), "r", encoding="utf-8") as f:
+            docs = json.load(f)
+        shard = {"path": path, "index": index, "docs": docs,
+                 "by_id": {str(d["id"]): i for i, d in enumerate(docs)}}
+        _SHARDS[name] = shard
+    return shard
+
+
+def _shard_load(name: str, path: str) -> int:
+    return _ensure_shard(name, path)["index"].ntotal
+
+
+def _shard_search(name: str, path: str, qmat, k: int, with_vectors: bool):
+    """Top-k của shard cho từng câu hỏi: [(khoảng cách, doc, vector | None), ...]."""
+    import numpy as np
+    shard = _ensure_shard(name, path)
+    index = shard["index"]
+    if index.ntotal == 0:
+        return [[] for _ in range(len(qmat))]
+    dists, idxs = index.search(np.asarray(qmat, dtype=np.float32), min(k, index.ntotal))
+    out = []
+    for drow, irow in zip(dists, idxs):
+        hits = []
+        for d, i in zip(drow, irow):
+            if i < 0:
+                continue
+            vec = np.asarray(index.reconstruct(int(i)), dtype=np.float32) if with_vectors else None
+            hits.append((float(d), shard["docs"][int(i)], vec))
+        out.append(hits)
+    return out
+
+
+def _shard_fetch(name: str, path: str, ids: List[str]):
+    shard = _ensure_shard(name, path)
+    return [shard["docs"][shard["by_id"][i]] for i in ids if i in shard["by_id"]]
+
+
+# BUILD SHARD
+def assign_shards(ids: List[str], n_shards: int, partition: str = "hash",
+                  districts: Optional[Dict[str, str]] = None) -> Dict[str, List[str]]:
+    """
+    shard name → danh sách id.
+    hash: crc32(id) % N · district: gom quận vào N shard (quận lớn trước, vào shard đang ít bài nhất).
+    """
+    import zlib
+    names = [f"shard_{i:02d}" for i in range(n_shards)]
+    out: Dict[str, List[str]] = {name: [] for name in names}
+    if partition == "hash":
+        for i in ids:
+            out[names[zlib.crc32(str(i).encode("utf-8")) % n_shards]].append(i)
+        return out
+    by_district: Dict[str, List[str]] = {}
+    for i in ids:
+        by_district.setdefault((districts or {}).get(str(i)) or "khác", []).append(i)
+    for _, members in sorted(by_district.items(), key=lambda kv: -len(kv[1])):
+        target = min(names, key=lambda n: len(out[n]))
+        out[target].extend(members)
+    return out
+
+
+def write_shard(shards_dir: str, name: str, version: int, vectors, docs: List[Dict[str, Any]],
+                storage: str = "float32") -> str:
+    """Ghi 1 shard vào thư mục mới `<name>.v<version>` (không đụng tới thư mục đang được phục vụ)."""
+    import faiss
+    from app.utils.embedding_config import build_index
+    rel = f"{name}.v{version}"
+    folder = os.path.join(shards_dir, rel)
+    os.makedirs(folder, exist_ok=True)
+    faiss.write_index(build_index(vectors, storage), os.path.join(folder, "index.faiss"))
+    with open(os.path.join(folder, "docs.json"), "w", encoding="utf-8") as f:
+        json.dump(docs, f, ensure_ascii=False)
+    return rel
+
+
+def write_manifest(shards_dir: str, manifest: Dict[str, Any]) -> str:
+    """Ghi manifest nguyên tử (os.replace) → client thấy bản cũ hoặc bản mới, không bao giờ nửa chừng."""
+    path = os.path.join(shards_dir, MANIFEST_FILE)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+    return path
+
+
+# PHÍA CLIENT
+def read_manifest(shards_dir: str = VECTOR_SHARDS_DIR) -> Optional[Dict[str, Any]]:
+    path = os.path.join(shards_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class ShardedVectorClient(VectorClient):
+    """Cùng giao diện với VectorClient (search / search_many / embed_query), tìm kiếm trên nhiều shard."""
+
+    def __init__(self, shards_dir: str = VECTOR_SHARDS_DIR, emb_model: str = EMBED_MODEL) -> None:
+        super().__init__(index_path=shards_dir, emb_model=emb_model)
+        self.shards_dir = shards_dir
+        self._manifest: Optional[Dict[str, Any]] = None
+        self._manifest_mtime = None
+        self._pools: Dict[str, ProcessPoolExecutor] = {}
+        self._paths: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    # Cấu hình embedding lấy từ manifest (khớp với index gốc đã chia shard)
+    @property
+    def emb_config(self) -> EmbeddingConfig:
+        if self._emb_config is None:
+            manifest = self._refresh_manifest()
+            self._emb_config = EmbeddingConfig(**manifest.get("embedding", {"model": self.emb_model}))
+        return self._emb_config
+
+    def _load_vs(self):
+        raise RuntimeError("ShardedVectorClient không có 1 FAISS vectorstore duy nhất")
+
+    def _pool(self, name: str) -> ProcessPoolExecutor:
+        pool = self._pools.get(name)
+        if pool is None:
+            import multiprocessing as mp
+            # spawn: worker không kế thừa thread / driver của process chính
+            pool = ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context("spawn"))
+            self._pools[name] = pool
+        return pool
+
+    def _refresh_manifest(self) -> Dict[str, Any]:
+        """Đọc lại manifest khi file thay đổi; shard nào đổi thư mục thì nạp lại riêng shard đó."""
+        path = os.path.join(self.shards_dir, MANIFEST_FILE)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            raise FileNotFoundError(f"Vector shards not found: {path}")
+        with self._lock:
+            if mtime != self._manifest_mtime:
+                manifest = read_manifest(self.shards_dir)
+                new_paths = {s["name"]: os.path.join(self.shards_dir, s["path"]) for s in manifest["shards"]}
+                for name in set(self._paths) - set(new_paths):
+                    self._paths.pop(name)
+                    pool = self._pools.pop(name, None)
+                    if pool is not None:
+                        pool.shutdown(wait=False)
+                for name, shard_path in new_paths.items():
+                    if self._paths.get(name) != shard_path:
+                        self._paths[name] = shard_path
+                        self.reload_shard(name)
+                self._manifest, self._manifest_mtime = manifest, mtime
+            return self._manifest
+
+    def reload_shard(self, name: str) -> Future:
+        """Nạp (lại) 1 shard trong worker của nó; các shard khác không bị ảnh hưởng."""
+        return self._pool(name).submit(_shard_load, name, self._paths[name])
+
+    def reload_if_changed(self) -> bool:
+        """Manifest đổi → nạp lại các shard đổi thư mục (xem _refresh_manifest)."""
+        before = self._manifest_mtime
+        self._refresh_manifest()
+        return self._manifest_mtime != before
+
+    def warmup(self) -> Dict[str, int]:
+        """Khởi động mọi worker + nạp shard, trả về số vector mỗi shard."""
+        self._refresh_manifest()
+        futures = {name: self.reload_shard(name) for name in self._paths}
+        return {name: f.result() for name, f in futures.items()}
+
+    def _search_matrix(self, qmat, k: int, mmr: bool, fetch_k: Optional[int] = None,
+                       diversity_threshold: Optional[float] = None) -> List[List[Passage]]:
+        import numpy as np
+        from langchain_community.vectorstores.utils import maximal_marginal_relevance
+        from app.utils.latency_budget import is_diverse
+
+        self._refresh_manifest()
+        fetch_k = max(k, fetch_k or min(25, max(10, k*2))) if mmr else k
+        futures = [
+            self._pool(name).submit(_shard_search, name, path, qmat, fetch_k, mmr)
+            for name, path in list(self._paths.items())
+        ]
+        per_shard = [f.result() for f in futures]
+
+        results = []
+        for qi in range(len(qmat)):
+            hits = sorted((h for shard in per_shard for h in shard[qi]), key=lambda h: h[0])[:fetch_k]
+            if mmr and hits and not (diversity_threshold is not None
+                                     and is_diverse([h[2] for h in hits[:k]], diversity_threshold)):
+                picked = maximal_marginal_relevance(np.asarray(qmat[qi]), np.vstack([h[2] for h in hits]),
+                                                    k=k, lambda_mult=0.5)
+                hits = [hits[i] for i in picked]
+            results.append([
+                Passage(
+                    id=(doc.get("metadata") or {}).get("id", doc.get("id")),
+                    text=doc.get("text") or "",
+                    # cùng quy ước với VectorClient.search(): MMR → 1/(1+d), không MMR → khoảng cách gốc
+                    score=1.0 / (1.0 + dist) if mmr else dist,
+                    metadata=doc.get("metadata") or {},
+                )
+                for dist, doc, _ in hits[:k]
+            ])
+        return results
+
+    def search(self, query: str, k: int = 10, mmr: bool = True, fetch_k: Optional[int] = None,
+               diversity_threshold: Optional[float] = None) -> VectorResult:
+        start = time.time()
+        try:
+            import numpy as np
+            qmat = np.asarray([self.embed_query(query)], dtype=np.float32)
+            passages = self._search_matrix(qmat, k, mmr, fetch_k, diversity_threshold)[0]
+            err = None
+        except Exception as e:
+            passages, err = [], str(e)
+        return VectorResult(passages=passages, took_ms=int((time.time() - start) * 1000), error=err)
+
+    def search_many(self, queries: List[str], k: int = 10, mmr: bool = True) -> List[VectorResult]:
+        if not queries:
+            return []
+        start = time.time()
+        try:
+            import numpy as np
+            qmat = np.asarray(self.embed_many(queries), dtype=np.float32)
+            all_passages = self._search_matrix(qmat, k, mmr)
+        except Exception as e:
+            took_ms = int((time.time() - start) * 1000)
+            return [VectorResult(passages=[], took_ms=took_ms, error=str(e)) for _ in queries]
+        took_ms = int((time.time() - start) * 1000 / len(queries))
+        return [VectorResult(passages=p, took_ms=took_ms) for p in all_passages]
+
+    def fetch_by_ids(self, ids: List[str], limit: int = 3) -> List[Passage]:
+        """Lấy lại bài theo id từ mọi shard (dùng bởi hybrid_helpers.vector_fetch_by_ids)."""
+        self._refresh_manifest()
+        wanted = list(dict.fromkeys(str(x).strip() for x in ids if x))
+        futures = [self._pool(name).submit(_shard_fetch, name, path, wanted) for name, path in list(self._paths.items())]
+        by_id = {str(d["id"]): d for f in futures for d in f.result()}
+        return [
+            Passage(id=i, text=by_id[i].get("text") or "", score=None, metadata=by_id[i].get("metadata") or {})
+            for i in wanted if i in by_id
+        ][:limit]
+
+    def close(self):
+        for pool in self._pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+        self._pools.clear()
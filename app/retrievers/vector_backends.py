@@ -0,0 +1,272 @@
+# retrievers/vector_backends.py
+"""
+Backend lưu trữ vector phía sau VectorClient (VECTOR_DB_BACKEND=faiss | chroma).
+
+Mỗi backend cung cấp cùng 1 giao diện, làm việc trực tiếp với vector câu hỏi (embedding do VectorClient lo + cache):
+- candidates_many(qmat, k, with_vectors): top-k gần nhất cho từng câu hỏi [(khoảng cách, Passage, vector | None)]
+  → dùng cho tìm kiếm thường, MMR và kiểm tra độ đa dạng.
+- fetch_by_ids(ids): lấy lại bài theo id (đúng thứ tự id yêu cầu), không quét toàn bộ docstore.
+- upsert(texts, metadatas, vectors): thêm / thay bài theo metadata "id".
+- count(): số vector.
+
+Khoảng cách của cả 2 backend là L2 bình phương (IndexFlatL2 của FAISS, space "l2" mặc định của Chroma)
+→ điểm 1/(1+d) của nhánh MMR có cùng ý nghĩa dù đổi backend.
+"""
+from __future__ import annotations
+
+import os
+from typing import Any, Dict, List, Optional, Sequence, Tuple, TYPE_CHECKING
+
+# vector_tools import module này lúc khởi động → Passage chỉ import khi cần (tránh import vòng)
+if TYPE_CHECKING:
+    from app.retrievers.vector_tools import Passage
+
+
+BACKENDS = ("faiss", "chroma")
+# Thư mục mặc định theo backend (trùng với nơi scripts/ingest_vector_db.py ghi ra)
+DEFAULT_PATHS = {
+    "faiss": ".vector_store/text_embeddings",
+    "chroma": ".vector_store/text_embeddings_chroma",
+}
+
+Hit = Tuple[float, "Passage", Any]
+
+
+def _passage(text: str, metadata: Optional[Dict[str, Any]], score: Optional[float] = None) -> Passage:
+    from app.retrievers.vector_tools import Passage
+    metadata = metadata or {}
+    pid = metadata.get("id")
+    return Passage(id=str(pid).strip() if pid is not None else None, text=text or "", score=score, metadata=metadata)
+
+
+class VectorBackend:
+    name = "base"
+
+    def __init__(self, path: str, embeddings) -> None:
+        self.path = path
+        self.embeddings = embeddings
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+    def candidates_many(self, qmat, k: int, with_vectors: bool = False) -> List[List[Hit]]:
+        raise NotImplementedError
+
+    def candidates(self, qvec, k: int, with_vectors: bool = False) -> List[Hit]:
+        return self.candidates_many([qvec], k, with_vectors)[0]
+
+    def fetch_by_ids(self, ids: Sequence[str]) -> List[Passage]:
+        raise NotImplementedError
+
+    def upsert(self, texts: List[str], metadatas: List[Dict[str, Any]],
+               vectors: Optional[List[List[float]]] = None) -> int:
+        raise NotImplementedError
+
+    def _embed(self, texts: List[str], vectors):
+        return vectors if vectors is not None else self.embeddings.embed_documents(texts)
+
+
+# FAISS
+class FaissBackend(VectorBackend):
+    """FAISS vectorstore của langchain (index.faiss + index.pkl), có rescoring nếu EMBED_RESCORE bật."""
+    name = "faiss"
+
+    def __init__(self, path: str, embeddings) -> None:
+        super().__init__(path, embeddings)
+        from langchain_community.vectorstores import FAISS
+        from app.utils.embedding_config import attach_rescoring
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Vector store not found: {path}")
+        vs = FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+        self.store = attach_rescoring(vs, path)
+        self._by_id: Optional[Dict[str, str]] = None
+
+    @classmethod
+    def create(cls, path: str, texts: List[str], metadatas: List[Dict[str, Any]], vectors, embeddings) -> "FaissBackend":
+        from langchain_community.vectorstores import FAISS
+        vs = FAISS.from_embeddings(list(zip(texts, [list(map(float, v)) for v in vectors])),
+                                   embedding=embeddings, metadatas=metadatas)
+        vs.save_local(path)
+        return cls(path, embeddings)
+
+    def count(self) -> int:
+        return int(self.store.index.ntotal)
+
+    def candidates_many(self, qmat, k: int, with_vectors: bool = False) -> List[List[Hit]]:
+        import faiss
+        import numpy as np
+        vs = self.store
+        qmat = np.array(qmat, dtype=np.float32)
+        if getattr(vs, "_normalize_L2", False):
+            faiss.normalize_L2(qmat)
+        k = min(k, self.count())
+        if k <= 0:
+            return [[] for _ in range(len(qmat))]
+        dists, idxs = vs.index.search(qmat, k)
+        out = []
+        for drow, irow in zip(dists, idxs):
+            hits = []
+            for d, j in zip(drow, irow):
+                if j == -1:
+                    continue
+                doc = vs.docstore.search(vs.index_to_docstore_id[int(j)])
+                vec = np.asarray(vs.index.reconstruct(int(j)), dtype=np.float32) if with_vectors else None
+                hits.append((float(d), _passage(doc.page_content, doc.metadata), vec))
+            out.append(hits)
+        return out
+
+    def _id_map(self) -> Dict[str, str]:
+        # metadata id → id trong docstore, dựng 1 lần (trước đây mỗi lần fetch phải quét toàn bộ docstore)
+        if self._by_id is None:
+            self._by_id = {
+                str((doc.metadata or {}).get("id")).strip(): key
+                for key, doc in (self.store.docstore._dict or {}).items()
+                if (doc.metadata or {}).get("id") is not None
+            }
+        return self._by_id
+
+    def fetch_by_ids(self, ids: Sequence[str]) -> List[Passage]:
+        by_id = self._id_map()
+        out = []
+        for i in ids:
+            key = by_id.get(str(i).strip())
+            if key is not None:
+                doc = self.store.docstore.search(key)
+                out.append(_passage(doc.page_content, doc.metadata))
+        return out
+
+    def upsert(self, texts: List[str], metadatas: List[Dict[str, Any]],
+               vectors: Optional[List[List[float]]] = None) -> int:
+        from app.utils.embedding_config import VECTORS_FILE
+        # delete + add_embeddings đánh số lại hàng → vectors_f32.npy (rescoring, build_vector_shards) sẽ lệch với docstore
+        # kể cả khi EMBED_RESCORE=0 → chỉ upsert được index không có file này
+        if os.path.exists(os.path.join(self.path, VECTORS_FILE)):
+            raise NotImplementedError(f"Index có {VECTORS_FILE} (index lượng tử hóa) → build lại bằng scripts.ingest_vector_db")
+        by_id = self._id_map()
+        stale = [by_id[str(m.get("id")).strip()] for m in metadatas if str(m.get("id")).strip() in by_id]
+        if stale:
+            self.store.delete(stale)
+        vectors = self._embed(texts, vectors)
+        self.store.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas)
+        self._by_id = None
+        return len(texts)
+
+    def save(self) -> None:
+        self.store.save_local(self.path)
+
+
+# CHROMA
+class ChromaBackend(VectorBackend):
+    """Chroma lưu trên đĩa (persist_directory), chromadb chỉ cần khi chọn backend này."""
+    name = "chroma"
+    COLLECTION = "langchain"  # tên collection mặc định khi ingest bằng Chroma.from_texts
+    BATCH = 4000
+
+    def __init__(self, path: str, embeddings) -> None:
+        super().__init__(path, embeddings)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Vector store not found: {path}")
+        self.store = self._open(path, embeddings)
+        self.collection = self.store._collection
+
+    @classmethod
+    def _open(cls, path: str, embeddings):
+        try:
+            from langchain_chroma import Chroma
+        except ImportError:
+            try:
+                from langchain_community.vectorstores import Chroma
+            except ImportError as e:
+                raise ImportError("VECTOR_DB_BACKEND=chroma cần cài chromadb (pip install chromadb)") from e
+        return Chroma(collection_name=cls.COLLECTION, persist_directory=path, embedding_function=embeddings)
+
+    @classmethod
+    def create(cls, path: str, texts: List[str], metadatas: List[Dict[str, Any]], vectors, embeddings) -> "ChromaBackend":
+        os.makedirs(path, exist_ok=True)
+        backend = cls.__new__(cls)
+        VectorBackend.__init__(backend, path, embeddings)
+        backend.store = cls._open(path, embeddings)
+        backend.collection = backend.store._collection
+        backend.upsert(texts, metadatas, vectors)
+        return backend
+
+    def count(self) -> int:
+        return int(self.collection.count())
+
+    def candidates_many(self, qmat, k: int, with_vectors: bool = False) -> List[List[Hit]]:
+        import numpy as np
+        k = min(k, self.count())
+        if k <= 0:
+            return [[] for _ in range(len(qmat))]
+        include = ["documents", "metadatas", "distances"] + (["embeddings"] if with_vectors else [])
+        res = self.collection.query(query_embeddings=np.asarray(qmat, dtype=np.float32).tolist(),
+                                    n_results=k, include=include)
+        out = []
+        for qi in range(len(res["ids"])):
+            vecs = res.get("embeddings")
+            out.append([
+                (float(d), _passage(text, meta),
+                 np.asarray(vecs[qi][j], dtype=np.float32) if with_vectors else None)
+                for j, (d, text, meta) in enumerate(zip(res["distances"][qi], res["documents"][qi], res["metadatas"][qi]))
+            ])
+        return out
+
+    @staticmethod
+    def _id_values(ids: Sequence[str]) -> List[Any]:
+        # id trong metadata có thể là chuỗi hoặc số (tùy lúc ingest) → so cả 2 dạng
+        values: List[Any] = []
+        for i in ids:
+            s = str(i).strip()
+            values.append(s)
+            if s.isdigit():
+                values.append(int(s))
+        return values
+
+    def fetch_by_ids(self, ids: Sequence[str]) -> List[Passage]:
+        ids = [str(i).strip() for i in ids]
+        if not ids:
+            return []
+        res = self.collection.get(where={"id": {"$in": self._id_values(ids)}}, include=["documents", "metadatas"])
+        found = {}
+        for text, meta in zip(res["documents"], res["metadatas"]):
+            p = _passage(text, meta)
+            found.setdefault(p.id, p)
+        return [found[i] for i in ids if i in found]
+
+    def upsert(self, texts: List[str], metadatas: List[Dict[str, Any]],
+               vectors: Optional[List[List[float]]] = None) -> int:
+        ids = [str(m.get("id")).strip() for m in metadatas]
+        # bài cũ có thể được ingest với id ngẫu nhiên (Chroma.from_texts) → xóa theo metadata id trước
+        self.collection.delete(where={"id": {"$in": self._id_values(ids)}})
+        vectors = [list(map(float, v)) for v in self._embed(texts, vectors)]
+        for s in range(0, len(texts), self.BATCH):
+            e = s + self.BATCH
+            self.collection.upsert(ids=ids[s:e], embeddings=vectors[s:e], documents=texts[s:e], metadatas=metadatas[s:e])
+        return len(texts)
+
+    def save(self) -> None:
+        # chromadb >= 0.4 tự ghi xuống đĩa
+        persist = getattr(self.store, "persist", None)
+        if callable(persist):
+            try:
+                persist()
+            except Exception:
+                pass
+
+
+_BACKEND_CLASSES = {"faiss": FaissBackend, "chroma": ChromaBackend}
+
+
+def default_path(backend: str) -> str:
+    return DEFAULT_PATHS.get(backend, DEFAULT_PATHS["faiss"])
+
+
+def backend_class(name: str):
+    name = (name or "faiss").lower()
+    if name not in _BACKEND_CLASSES:
+        raise ValueError(f"❌ VECTOR_DB_BACKEND không hợp lệ: {name} (chọn {BACKENDS})")
+    return _BACKEND_CLASSES[name]
+
+
+def make_backend(name: str, path: str, embeddings) -> VectorBackend:
+    return backend_class(name)(path, embeddings)
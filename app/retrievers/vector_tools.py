@@ -3,23 +3,21 @@ from __future__ import annotations
 from typing import Any, Dict, List, Optional, Tuple
 import os, time, math
 from dataclasses import dataclass
-from dotenv import load_dotenv
-from langchain_openai import OpenAIEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain_core.documents import Document
-import streamlit as st
+from app.config import get_var
+from app.utils.caching import LRUCache
+from app.utils.embedding_config import EmbeddingConfig, make_embeddings
+from app.retrievers.vector_backends import default_path
 
+# langchain / faiss / numpy chỉ được import khi thật sự embedding / load index
 
 # Cấu hình
-load_dotenv()
-def get_var(key, default=None, section="general"):
-    try:
-        return st.secrets[section].get(key, default)
-    except Exception:
-        return os.getenv(key, default)
-    
 EMBED_MODEL = get_var("OPENAI_EMBED_MODEL", "text-embedding-3-small")
-VECTOR_STORE_PATH = get_var("VECTOR_STORE_PATH", ".vector_store/text_embeddings")
+VECTOR_DB_BACKEND = str(get_var("VECTOR_DB_BACKEND", "faiss")).lower()
+VECTOR_STORE_PATH = get_var("VECTOR_STORE_PATH", default_path(VECTOR_DB_BACKEND))
+EMBED_CACHE_SIZE = int(get_var("EMBED_CACHE_SIZE", 2048))
+
+# Cache embedding câu hỏi dùng chung trong process (answer cache + vector search cùng 1 lần gọi API)
+_EMBED_CACHE = LRUCache(maxsize=EMBED_CACHE_SIZE)
 
 # Khai báo kiểu dữ liệu
 @dataclass
@@ -35,87 +33,184 @@ class VectorResult:
     passages: List[Passage]
     took_ms: int
     error: Optional[str] = None
+    mmr_skipped: bool = False
 
 class VectorClient:
     # Khởi tạo biến
     def __init__(self,
                  index_path: str = VECTOR_STORE_PATH,
-                 emb_model: str = EMBED_MODEL) -> None:
+                 emb_model: str = EMBED_MODEL,
+                 backend: str = VECTOR_DB_BACKEND) -> None:
         self.index_path = index_path
         self.emb_model = emb_model
-        self._vs = None
+        self.backend = backend
+        self._backend = None
+        self._backend_stamp = None
         self._emb = None
+        self._emb_config = None
+
+    # Cấu hình embedding của index (số chiều / kiểu lưu) → câu hỏi được embedding khớp với index
+    @property
+    def emb_config(self) -> EmbeddingConfig:
+        if self._emb_config is None:
+            self._emb_config = EmbeddingConfig.for_index(self.index_path, model=self.emb_model)
+        return self._emb_config
 
     # Dùng model từ biến cấu hình
     def _get_embeddings(self):
         if self._emb is None:
-            self._emb = OpenAIEmbeddings(model=self.emb_model)
+            self._emb = make_embeddings(self.emb_config)
         return self._emb
 
-    # Load vector store (FAISS) nếu không có thì báo lỗi
+    def _cache_key(self, query: str):
+        return (self.emb_model, self.emb_config.dimensions, query.strip())
+
+    # Embedding câu hỏi (có cache theo model + số chiều + nội dung câu hỏi)
+    def embed_query(self, query: str) -> List[float]:
+        key = self._cache_key(query)
+        hit, vec = _EMBED_CACHE.get(key)
+        if hit:
+            return vec
+        vec = self._get_embeddings().embed_query(query)
+        _EMBED_CACHE.set(key, vec)
+        return vec
+
+    def has_cached_embedding(self, query: str) -> bool:
+        return _EMBED_CACHE.peek(self._cache_key(query))[0]
+
+    # Embedding nhiều câu hỏi trong 1 request (chỉ gọi API cho câu chưa có trong cache)
+    def embed_many(self, queries: List[str]) -> List[List[float]]:
+        vecs: List[Optional[List[float]]] = []
+        missing: Dict[str, List[int]] = {}
+        for i, q in enumerate(queries):
+            hit, vec = _EMBED_CACHE.get(self._cache_key(q))
+            vecs.append(vec if hit else None)
+            if not hit:
+                missing.setdefault(q.strip(), []).append(i)
+        if missing:
+            texts = list(missing)
+            for text, vec in zip(texts, self._get_embeddings().embed_documents(texts)):
+                _EMBED_CACHE.set(self._cache_key(text), vec)
+                for i in missing[text]:
+                    vecs[i] = vec
+        return vecs
+
+    # Backend lưu vector (FAISS / Chroma, xem app/retrievers/vector_backends.py), nạp lần đầu khi cần
+    def _load_backend(self):
+        if self._backend is None:
+            from app.retrievers.vector_backends import make_backend
+            self._backend_stamp = self._index_stamp()
+            self._backend = make_backend(self.backend, self.index_path, self._get_embeddings())
+        return self._backend
+
+    # Dấu phiên bản index trên đĩa: mtime mới nhất của các file trong thư mục index
+    def _index_stamp(self) -> Optional[float]:
+        try:
+            with os.scandir(self.index_path) as entries:
+                return max((e.stat().st_mtime for e in entries if e.is_file()), default=None)
+        except OSError:
+            return None
+
+    # Index đã được dựng lại (scripts/ingest_vector_db.py) → bỏ backend + cấu hình embedding đang giữ, lần sau nạp lại
+    def reload_if_changed(self) -> bool:
+        if self._backend is None or self._index_stamp() == self._backend_stamp:
+            return False
+        self._backend, self._emb_config, self._emb = None, None, None
+        print(f"🔄 Index vector đã thay đổi, nạp lại: {self.index_path}")
+        return True
+
+    # Vectorstore langchain bên dưới backend (giữ cho code cũ)
     def _load_vs(self):
-        if self._vs is None:
-            emb = self._get_embeddings()
-            if not os.path.exists(self.index_path):
-                raise FileNotFoundError(f"Vector store not found: {self.index_path}")
-            self._vs = FAISS.load_local(self.index_path, emb, allow_dangerous_deserialization=True)
-        return self._vs
+        return self._load_backend().store
+
+    # Chọn k passage từ danh sách ứng viên [(khoảng cách, Passage, vector)] đã xếp theo khoảng cách
+    @staticmethod
+    def _pick(qvec, hits, k: int, mmr: bool, diversity_threshold: Optional[float] = None) -> Tuple[List[Passage], bool]:
+        """Trả về (passages, mmr_skipped). MMR → điểm pseudo-sim 1/(1+d), không MMR → khoảng cách gốc."""
+        skipped = False
+        if mmr and hits:
+            if diversity_threshold is not None:
+                from app.utils.latency_budget import is_diverse
+                skipped = is_diverse([h[2] for h in hits[:k]], diversity_threshold)
+            if not skipped:
+                import numpy as np
+                from langchain_community.vectorstores.utils import maximal_marginal_relevance
+                picked = maximal_marginal_relevance(np.asarray(qvec, dtype=np.float32), np.vstack([h[2] for h in hits]),
+                                                    k=k, lambda_mult=0.5)
+                hits = [hits[i] for i in picked]
+        passages = []
+        for dist, p, _ in hits[:k]:
+            passages.append(Passage(id=p.id, text=p.text, score=1.0 / (1.0 + dist) if mmr else dist, metadata=p.metadata))
+        return passages, skipped
 
     # Hàm tìm kiếm văn bản tương tự
-    def search(self, query: str, k: int = 10, mmr: bool = True) -> VectorResult:
+    def search(self, query: str, k: int = 10, mmr: bool = True, fetch_k: Optional[int] = None,
+               diversity_threshold: Optional[float] = None) -> VectorResult:
+        """
+        fetch_k: số ứng viên cho MMR (mặc định theo k).
+        diversity_threshold: nếu top-k ứng viên đã đa dạng (cosine trung bình < ngưỡng) → bỏ qua MMR.
+        """
         start = time.time()
         passages: List[Passage] = []
+        skipped = False
         err = None
         try:
-            vs = self._load_vs()
-            if mmr:
-                docs: List[Document] = vs.max_marginal_relevance_search(query, k=k, fetch_k=min(25, max(10, k*2)))
-            else:
-                docs: List[Document] = vs.similarity_search_with_score(query, k=k)  # returns (Document, score)
-                # normalize to consistent structure
-                passages = [
-                    Passage(
-                        id=(doc.metadata or {}).get("id"),
-                        text=doc.page_content,
-                        score=score if isinstance(score, (int, float)) else None,
-                        metadata=doc.metadata or {},
-                    )
-                    for doc, score in docs
-                ]
-                took_ms = int((time.time() - start)*1000)
-                return VectorResult(passages=passages, took_ms=took_ms, error=None)
-
-            # for MMR path, FAISS doesn't return scores; do a second pass to get scores:
-            # compute embedding for query and dot-product with stored vectors is not trivial here,
-            # so we fallback to a similarity_search_with_score small k for scoring.
-            docs_scored = vs.similarity_search_with_score(query, k=min(k, 10))
-            score_map = {}
-            for doc, sc in docs_scored:
-                # lower score => closer (depending on distance metric), we convert to pseudo-sim
-                try:
-                    sim = 1.0 / (1.0 + float(sc))
-                except Exception:
-                    sim = None
-                score_map.get("dummy", None)
-                # index by text hash (rough), or id if available
-                key = (doc.metadata or {}).get("id") or hash(doc.page_content)
-                score_map[key] = sim
-
-            # build result
-            for d in docs:
-                pid = (d.metadata or {}).get("id")
-                key = pid or hash(d.page_content)
-                passages.append(Passage(
-                    id=pid,
-                    text=d.page_content,
-                    score=score_map.get(key),
-                    metadata=d.metadata or {}
-                ))
+            backend = self._load_backend()
+            qvec = self.embed_query(query)
+            # MMR: 1 lần tìm fetch_k ứng viên (kèm vector) dùng cho cả kiểm tra đa dạng, MMR và chấm điểm
+            fetch_k = max(k, fetch_k or min(25, max(10, k*2))) if mmr else k
+            hits = backend.candidates(qvec, fetch_k, with_vectors=mmr)
+            passages, skipped = self._pick(qvec, hits, k, mmr, diversity_threshold)
         except Exception as e:
             err = str(e)
         took_ms = int((time.time() - start) * 1000)
-        return VectorResult(passages=passages, took_ms=took_ms, error=err)
+        return VectorResult(passages=passages, took_ms=took_ms, error=err, mmr_skipped=skipped)
+
+    # Tìm kiếm nhiều câu hỏi: 1 request embedding + 1 lần search trên ma trận câu hỏi
+    def search_many(self, queries: List[str], k: int = 10, mmr: bool = True) -> List[VectorResult]:
+        """
+        Cùng kết quả với gọi search() cho từng câu, nhưng gộp embedding + search của backend.
+        took_ms của mỗi câu = phần chia đều của bước gộp + thời gian MMR riêng của câu đó.
+        """
+        if not queries:
+            return []
+        start = time.time()
+        try:
+            backend = self._load_backend()
+            qvecs = self.embed_many(queries)
+            fetch_k = max(k, min(25, max(10, k*2))) if mmr else k
+            all_hits = backend.candidates_many(qvecs, fetch_k, with_vectors=mmr)
+        except Exception as e:
+            took_ms = int((time.time() - start) * 1000)
+            return [VectorResult(passages=[], took_ms=took_ms, error=str(e)) for _ in queries]
+        shared_ms = (time.time() - start) * 1000 / len(queries)
+
+        results: List[VectorResult] = []
+        for qvec, hits in zip(qvecs, all_hits):
+            t0 = time.time()
+            passages: List[Passage] = []
+            err = None
+            try:
+                passages, _ = self._pick(qvec, hits, k, mmr)
+            except Exception as e:
+                err = str(e)
+            took_ms = int(shared_ms + (time.time() - t0) * 1000)
+            results.append(VectorResult(passages=passages, took_ms=took_ms, error=err))
+        return results
+
+    # Lấy lại bài theo id (đúng thứ tự id, bỏ id trùng / không có)
+    def fetch_by_ids(self, ids: List[str], limit: int = 3) -> List[Passage]:
+        wanted = list(dict.fromkeys(str(x).strip() for x in ids if x))
+        return self._load_backend().fetch_by_ids(wanted)[:limit]
 
+    # Thêm / thay bài theo metadata "id" (vectors=None → embedding bằng model của index), ghi xuống đĩa nếu save
+    def upsert(self, texts: List[str], metadatas: List[Dict[str, Any]],
+               vectors: Optional[List[List[float]]] = None, save: bool = True) -> int:
+        backend = self._load_backend()
+        n = backend.upsert(texts, metadatas, vectors)
+        if save:
+            backend.save()
+        return n
 
     # Hợp nhất kết quả theo thuật toán Reciprocal Rank Fusion
     # Tái xếp hạng ưu tiên các passages có id trùng với graph
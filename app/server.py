@@ -0,0 +1,480 @@
+"""
+HTTP/JSON service cho Hybrid RAG (chỉ dùng thư viện chuẩn: http.server + concurrent.futures).
+Chạy:
+    python -m app.server [--host 0.0.0.0] [--port 8000]
+
+Endpoint:
+    GET  /health                 → trạng thái + số request đang chạy / đang chờ
+    POST /retrieve               {"query", "top_k"?, "limit"?, "budget_ms"?} → Graph + Vector + topN, không tổng hợp
+    POST /answer                 {"query", "top_k"?, "limit"?, "budget_ms"?} → câu trả lời đầy đủ
+    POST /answer/stream          như /answer, trả NDJSON: context → delta... → done
+    POST /warm                   {"source"?, "questions"?, "mode"?, "concurrency"?, "wait"?} → làm nóng cache trong process này
+                                 (source phải nằm trong WARM_SOURCE_DIRS; mỗi câu đi qua hàng đợi answer / retrieve,
+                                 concurrency tối đa bằng số worker của hàng đợi đó)
+
+- Gộp request trùng (single-flight): các câu hỏi giống nhau (đã chuẩn hóa) đến khi bản đầu tiên còn đang chạy
+  chỉ chờ kết quả của bản đó, không chạy lại pipeline. /answer và /answer/stream dùng chung 1 lần chạy.
+- Kiểm soát tải: mỗi loại việc có số worker cố định (SERVER_MAX_ANSWER: LLM, SERVER_MAX_RETRIEVE: Neo4j)
+  và hàng chờ giới hạn (SERVER_MAX_QUEUE); đầy → 429 ngay thay vì để request dồn lại.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, is_dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# Cho phép import module app/ khi chạy trực tiếp
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.config import get_var
+from app.utils.query_capture import capture
+
+
+SERVER_MAX_ANSWER = int(get_var("SERVER_MAX_ANSWER", 4))
+SERVER_MAX_RETRIEVE = int(get_var("SERVER_MAX_RETRIEVE", 8))
+SERVER_MAX_QUEUE = int(get_var("SERVER_MAX_QUEUE", 16))
+SERVER_REQUEST_TIMEOUT = float(get_var("SERVER_REQUEST_TIMEOUT", 120))
+# Nguồn câu hỏi mặc định khi làm nóng cache (log câu hỏi gần đây hoặc bộ câu hỏi mẫu)
+WARM_SOURCE = get_var("WARM_SOURCE", "data/Question.csv")
+# Hàng đợi đầy khi đang làm nóng → chờ rồi thử lại (việc làm nóng nhường request thật)
+WARM_RETRY_S = float(get_var("WARM_RETRY_S", 0.5))
+
+
+class Overloaded(Exception):
+    """Hàng chờ đã đầy → 429."""
+
+
+# SINGLE-FLIGHT
+class Flight:
+    """1 lần chạy pipeline; nhiều request cùng đọc chuỗi sự kiện (phát lại từ đầu cho người đến sau)."""
+
+    def __init__(self):
+        self.events: List[Tuple[str, Any]] = []
+        self.done = False
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self._cond = threading.Condition()
+
+    def publish(self, kind: str, data: Any):
+        with self._cond:
+            self.events.append((kind, data))
+            self._cond.notify_all()
+
+    def finish(self, result: Any = None, error: Optional[str] = None):
+        with self._cond:
+            self.result, self.error, self.done = result, error, True
+            self._cond.notify_all()
+
+    def iter_events(self, timeout: float = SERVER_REQUEST_TIMEOUT) -> Iterator[Tuple[str, Any]]:
+        deadline = time.time() + timeout
+        pos = 0
+        while True:
+            with self._cond:
+                while pos >= len(self.events) and not self.done:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise TimeoutError("request timeout")
+                    self._cond.wait(remaining)
+                pending, pos = self.events[pos:], len(self.events)
+                finished = self.done and pos >= len(self.events)
+            yield from pending
+            if finished:
+                return
+
+    def wait(self, timeout: float = SERVER_REQUEST_TIMEOUT) -> Any:
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.done, timeout):
+                raise TimeoutError("request timeout")
+        if self.error:
+            raise RuntimeError(self.error)
+        return self.result
+
+
+class WorkQueue:
+    """Executor có số worker cố định + hàng chờ giới hạn (đếm cả việc đang chạy lẫn đang chờ)."""
+
+    def __init__(self, name: str, workers: int, max_queue: int):
+        self.name = name
+        self.workers = max(1, workers)
+        self.capacity = self.workers + max(0, max_queue)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"{name}-worker")
+        self._pending = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def submit(self, fn: Callable, *args):
+        with self._lock:
+            if self._pending >= self.capacity:
+                self.rejected += 1
+                raise Overloaded(f"{self.name} queue full ({self._pending}/{self.capacity})")
+            self._pending += 1
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, _):
+        with self._lock:
+            self._pending -= 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"in_flight": self._pending, "capacity": self.capacity, "workers": self.workers,
+                    "rejected": self.rejected}
+
+
+class SingleFlight:
+    """key → Flight đang chạy; chỉ request đầu tiên đưa việc vào WorkQueue."""
+
+    def __init__(self):
+        self._flights: Dict[Tuple, Flight] = {}
+        self._lock = threading.Lock()
+        self.executions = 0
+        self.coalesced = 0
+
+    def join(self, key: Tuple, queue: WorkQueue, fn: Callable[[Flight], Any]) -> Flight:
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                return flight
+            flight = Flight()
+            # submit trong lock: nếu bị từ chối thì không để lại Flight mồ côi
+            queue.submit(self._run, key, flight, fn)
+            self._flights[key] = flight
+            self.executions += 1
+            return flight
+
+    def _run(self, key: Tuple, flight: Flight, fn: Callable[[Flight], Any]):
+        try:
+            flight.finish(result=fn(flight))
+        except Exception as e:
+            flight.finish(error=str(e))
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"executions": self.executions, "coalesced": self.coalesced, "active": len(self._flights)}
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(str(query or "").lower().split())
+
+
+# DỊCH VỤ
+def to_jsonable(obj: Any) -> Any:
+    if is_dataclass(obj):
+        return to_jsonable(asdict(obj))
+    if isinstance(obj, dict):
+        return {str(k): to_jsonable(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple, set)):
+        return [to_jsonable(v) for v in obj]
+    if obj is None or isinstance(obj, (str, int, float, bool)):
+        return obj
+    return str(obj)
+
+
+def retrieval_view(ctx: Dict[str, Any]) -> Dict[str, Any]:
+    """Phần kết quả truy xuất trả cho client (bỏ graph_records thô, giữ id + passage đã chọn)."""
+    return {
+        "query": ctx["query"],
+        "cypher_query": ctx.get("cypher_query"),
+        "cypher_params": ctx.get("cypher_params") or {},
+        "sub_queries": ctx.get("sub_queries") or [],
+        "graph_ids": ctx.get("graph_ids") or [],
+        "vector_ids": [p.id for p in ctx.get("vector_passages") or []],
+        "chosen_passages": to_jsonable(ctx.get("chosen_passages") or []),
+        "fusion": to_jsonable(ctx.get("fusion")),
+        "retrieval_plan": ctx.get("retrieval_plan"),
+        "partial": ctx.get("partial", False),
+        "missing_branches": ctx.get("missing_branches", []),
+        "timings": dict(ctx.get("timings") or {}),
+    }
+
+
+class RAGService:
+    def __init__(self, pipeline=None, max_answer: int = SERVER_MAX_ANSWER,
+                 max_retrieve: int = SERVER_MAX_RETRIEVE, max_queue: int = SERVER_MAX_QUEUE):
+        self._pipeline = pipeline
+        self._pipeline_lock = threading.Lock()
+        self.answer_queue = WorkQueue("answer", max_answer, max_queue)
+        self.retrieve_queue = WorkQueue("retrieve", max_retrieve, max_queue)
+        self.flights = SingleFlight()
+        self.warm_state: Dict[str, Any] = {"status": "idle"}
+        self._warm_lock = threading.Lock()
+
+    @property
+    def pipeline(self):
+        with self._pipeline_lock:
+            if self._pipeline is None:
+                from app.utils.answer_pipeline import get_answer_pipeline
+                self._pipeline = get_answer_pipeline()
+            return self._pipeline
+
+    def _run_answer(self, query: str, top_k: int, limit: int, budget_ms: Optional[int]) -> Callable[[Flight], Any]:
+        import asyncio
+
+        def run(flight: Flight):
+            def on_event(kind: str, data: Any):
+                flight.publish(kind, retrieval_view(data) if kind == "context" else data)
+            # capture theo HTTP request (handler), không ghi lần chạy chung của single-flight
+            result = asyncio.run(self.pipeline.answer_async(query, top_k=top_k, limit=limit, on_event=on_event,
+                                                            budget_ms=budget_ms, capture_query=False))
+            return {
+                "query": query,
+                "answer": result["answer"],
+                "answer_source": result["answer_source"],
+                "render_route": result.get("render_route"),
+                **{k: v for k, v in retrieval_view(result).items() if k != "query"},
+            }
+        return run
+
+    def _run_retrieve(self, query: str, top_k: int, limit: int, budget_ms: Optional[int]) -> Callable[[Flight], Any]:
+        import asyncio
+
+        def run(flight: Flight):
+            ctx = asyncio.run(self.pipeline.retrieve_async(query, top_k=top_k, limit=limit, budget_ms=budget_ms,
+                                                           capture_query=False))
+            return retrieval_view(ctx)
+        return run
+
+    def answer_flight(self, query: str, top_k: int = 10, limit: int = 3, budget_ms: Optional[int] = None) -> Flight:
+        key = ("answer", normalize_query(query), top_k, limit, budget_ms)
+        return self.flights.join(key, self.answer_queue, self._run_answer(query, top_k, limit, budget_ms))
+
+    def retrieve_flight(self, query: str, top_k: int = 10, limit: int = 3, budget_ms: Optional[int] = None) -> Flight:
+        key = ("retrieve", normalize_query(query), top_k, limit, budget_ms)
+        return self.flights.join(key, self.retrieve_queue, self._run_retrieve(query, top_k, limit, budget_ms))
+
+    def _warm_runner(self, mode: str) -> Callable[[str, int, int], Any]:
+        """Mỗi câu làm nóng đi qua single-flight + WorkQueue như request thật (tính vào giới hạn tải)."""
+        def run(question: str, top_k: int, limit: int):
+            deadline = time.time() + SERVER_REQUEST_TIMEOUT
+            while True:
+                try:
+                    flight = (self.retrieve_flight if mode == "retrieve" else self.answer_flight)(question, top_k, limit)
+                    return flight.wait()
+                except Overloaded:
+                    if time.time() + WARM_RETRY_S >= deadline:
+                        raise
+                    time.sleep(WARM_RETRY_S)
+        return run
+
+    def warm(self, source: Optional[str] = None, questions: Optional[List[str]] = None,
+             mode: Optional[str] = None, wait: bool = False, restrict_source: bool = False,
+             concurrency: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Làm nóng cache của process này (chạy nền, mỗi lúc 1 lượt); wait=True → chờ và trả báo cáo.
+        restrict_source: source do client gửi → chỉ chấp nhận file trong WARM_SOURCE_DIRS.
+        concurrency: mặc định WARM_CONCURRENCY, không vượt số worker của hàng đợi (answer / retrieve).
+        """
+        from app.utils.cache_warmer import WARM_CONCURRENCY, WARM_MODE, load_questions, resolve_source, warm_caches
+        mode = mode or WARM_MODE
+        queue = self.retrieve_queue if mode == "retrieve" else self.answer_queue
+        concurrency = max(1, min(int(concurrency or WARM_CONCURRENCY), queue.workers))
+        if source and restrict_source:
+            source = resolve_source(source)
+        with self._warm_lock:
+            busy = self.warm_state["status"] == "running"
+            if not busy and questions is None:
+                source = source or WARM_SOURCE
+                questions = load_questions(source)
+            if not busy:
+                self.warm_state = {"status": "running", "source": source or "request", "questions": len(questions),
+                                   "started_at": time.time()}
+        if busy:
+            return self.public_warm_state()
+
+        def run():
+            try:
+                # ingest_vector_db vừa dựng lại index → nạp index mới trước khi điền cache
+                reloaded = self.pipeline.vclient.reload_if_changed()
+                report = warm_caches(self.pipeline, questions, concurrency=concurrency, mode=mode,
+                                     runner=self._warm_runner(mode))
+                state = {"status": "done", "vector_reloaded": reloaded, **report}
+            except Exception as e:
+                state = {"status": "error", "error": str(e)}
+            with self._warm_lock:
+                self.warm_state = {**self.warm_state, **state, "finished_at": time.time()}
+
+        if wait:
+            run()
+        else:
+            threading.Thread(target=run, name="warm", daemon=True).start()
+        return self.public_warm_state()
+
+    def public_warm_state(self) -> Dict[str, Any]:
+        """Trạng thái làm nóng trả qua HTTP: không kèm nội dung câu hỏi (top_questions, câu lỗi)."""
+        with self._warm_lock:
+            warm = dict(self.warm_state)
+        warm.pop("top_questions", None)
+        warm["failed"] = len(warm.get("failed") or [])
+        return warm
+
+    def stats(self) -> Dict[str, Any]:
+        out = {"answer": self.answer_queue.stats(), "retrieve": self.retrieve_queue.stats(),
+               "single_flight": self.flights.stats()}
+        out["warm"] = self.public_warm_state()
+        planner = getattr(self._pipeline, "planner", None)
+        if planner is not None:
+            out["stages"] = planner.stats.summary()
+        from app.utils.llm_calls import llm_call_stats
+        out["llm"] = llm_call_stats()
+        return out
+
+
+# HTTP
+def make_handler(service: RAGService):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *args):
+            print(f"🌐 {self.address_string()} {fmt % args}")
+
+        def _send_json(self, status: int, payload: Dict[str, Any]):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            if status == 429:
+                self.send_header("Retry-After", "1")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _read_params(self) -> Tuple[str, int, int, Optional[int]]:
+            length = int(self.headers.get("Content-Length") or 0)
+            data = json.loads(self.rfile.read(length) or b"{}")
+            query = str(data.get("query") or "").strip()
+            if not query:
+                raise ValueError("missing 'query'")
+            budget_ms = data.get("budget_ms")
+            return query, int(data.get("top_k", 10)), int(data.get("limit", 3)), \
+                (int(budget_ms) if budget_ms is not None else None)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._send_json(200, {"status": "ok", **service.stats()})
+            else:
+                self._send_json(404, {"error": "not found"})
+
+        def _warm(self):
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+                data = json.loads(self.rfile.read(length) or b"{}")
+                state = service.warm(source=data.get("source"), questions=data.get("questions"),
+                                     mode=data.get("mode"), wait=bool(data.get("wait")), restrict_source=True,
+                                     concurrency=data.get("concurrency"))
+            except (ValueError, TypeError, OSError) as e:
+                self._send_json(400, {"error": str(e)})
+                return
+            self._send_json(200 if state["status"] != "running" else 202, state)
+
+        def do_POST(self):
+            if self.path == "/warm":
+                self._warm()
+                return
+            routes = {"/answer": self._answer, "/retrieve": self._retrieve, "/answer/stream": self._stream}
+            handler = routes.get(self.path)
+            if handler is None:
+                self._send_json(404, {"error": "not found"})
+                return
+            try:
+                query, top_k, limit, budget_ms = self._read_params()
+            except (ValueError, TypeError) as e:
+                self._send_json(400, {"error": str(e)})
+                return
+            started, status, payload, error = time.time(), 200, None, None
+            try:
+                payload = handler(query, top_k, limit, budget_ms)
+            except Overloaded as e:
+                status, error = 429, str(e)
+                self._send_json(429, {"error": "overloaded", "detail": str(e)})
+            except TimeoutError as e:
+                status, error = 504, str(e)
+                self._send_json(504, {"error": str(e)})
+            except Exception as e:
+                status, error = 500, str(e)
+                self._send_json(500, {"error": str(e)})
+            kind = "retrieve" if self.path == "/retrieve" else "answer"
+            capture(kind, query, started, top_k, limit, budget_ms, payload, error,
+                    source="server", endpoint=self.path, status=status)
+
+        def _answer(self, query: str, top_k: int, limit: int, budget_ms: Optional[int]):
+            payload = service.answer_flight(query, top_k, limit, budget_ms).wait()
+            self._send_json(200, payload)
+            return payload
+
+        def _retrieve(self, query: str, top_k: int, limit: int, budget_ms: Optional[int]):
+            payload = service.retrieve_flight(query, top_k, limit, budget_ms).wait()
+            self._send_json(200, payload)
+            return payload
+
+        def _stream(self, query: str, top_k: int, limit: int, budget_ms: Optional[int]):
+            flight = service.answer_flight(query, top_k, limit, budget_ms)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            def write(obj: Dict[str, Any]):
+                line = (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+                self.wfile.write(f"{len(line):X}\r\n".encode() + line + b"\r\n")
+                self.wfile.flush()
+
+            try:
+                for kind, data in flight.iter_events():
+                    write({"event": kind, "data": data})
+                if flight.error:
+                    write({"event": "error", "data": flight.error})
+                else:
+                    write({"event": "done", "data": {"answer_source": flight.result["answer_source"],
+                                                     "timings": flight.result["timings"]}})
+            except TimeoutError as e:
+                write({"event": "error", "data": str(e)})
+            except (BrokenPipeError, ConnectionResetError):
+                return flight.result  # client ngắt kết nối; lần chạy chung vẫn tiếp tục cho các request khác
+            self.wfile.write(b"0\r\n\r\n")
+            return flight.result
+
+    return Handler
+
+
+def serve(host: str = "127.0.0.1", port: int = 8000, service: Optional[RAGService] = None):
+    service = service or RAGService()
+    httpd = ThreadingHTTPServer((host, port), make_handler(service))
+    httpd.daemon_threads = True
+    print(f"🚀 Hybrid RAG server: http://{host}:{port}  "
+          f"(answer={service.answer_queue.workers}, retrieve={service.retrieve_queue.workers}, "
+          f"queue={SERVER_MAX_QUEUE})")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 Dừng server.")
+    finally:
+        httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP/JSON service cho Hybrid RAG")
+    parser.add_argument("--host", default=get_var("SERVER_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(get_var("SERVER_PORT", 8000)))
+    parser.add_argument("--warmup", action="store_true", help="Khởi tạo pipeline (FAISS, Neo4j) trước khi nhận request")
+    parser.add_argument("--warm-from", default=None,
+                        help="Làm nóng cache ở nền khi khởi động từ file câu hỏi (.csv / .jsonl / .txt)")
+    args = parser.parse_args()
+    service = RAGService()
+    if args.warmup:
+        _ = service.pipeline
+    if args.warm_from:
+        service.warm(source=args.warm_from)
+    serve(args.host, args.port, service)
+
+
+if __name__ == "__main__":
+    main()
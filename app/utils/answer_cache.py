@@ -0,0 +1,282 @@
+# app/utils/answer_cache.py
+"""
+Semantic answer cache cho toàn bộ pipeline Hybrid RAG.
+
+- Khóa: embedding câu hỏi (cosine nearest-neighbour ≥ threshold).
+- Mỗi entry lưu: câu hỏi, Cypher đã sinh, tập id đã chọn, câu trả lời, hạn dùng (TTL).
+- Chỉ trả câu trả lời khi tập id truy xuất lại trùng khớp với lúc lưu → không phục vụ dữ liệu cũ.
+  Cypher đã lưu chỉ được dùng lại cho đúng câu hỏi đó (same_question); câu hỏi chỉ gần giống
+  ("dưới 3 tỷ" / "dưới 5 tỷ") phải tự sinh Cypher rồi mới so tập id.
+- Lưu bền vững ra đĩa (vectors .npy + metadata .json), giới hạn số entry (bỏ entry ít dùng nhất).
+  Ghi đĩa ở luồng nền sau ANSWER_CACHE_SAVE_DELAY_S (gộp nhiều lần put / evict) → request không chờ I/O.
+"""
+import os
+import json
+import time
+import threading
+from dataclasses import dataclass, asdict, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+ANSWER_CACHE_DIR = os.getenv("ANSWER_CACHE_DIR", ".cache/answer_cache")
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", 1000))
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.95))
+ANSWER_CACHE_TTL_S = float(os.getenv("ANSWER_CACHE_TTL_S", 6 * 3600))
+ANSWER_CACHE_SAVE_DELAY_S = float(os.getenv("ANSWER_CACHE_SAVE_DELAY_S", 0.5))
+
+
+@dataclass
+class AnswerEntry:
+    question: str
+    cypher_query: Optional[str]
+    chosen_ids: List[str]
+    answer: str
+    created_at: float
+    expires_at: Optional[float] = None
+    last_used_at: float = 0.0
+    hits: int = 0
+    extra: Dict[str, Any] = field(default_factory=dict)
+    cypher_params: Dict[str, Any] = field(default_factory=dict)   # tham số của Cypher biên dịch (NL2CYPHER_MODE=spec)
+
+    def expired(self, now: Optional[float] = None) -> bool:
+        return self.expires_at is not None and self.expires_at <= (now or time.time())
+
+
+def question_key(question: str) -> str:
+    return " ".join((question or "").lower().split()).strip(" ?!.")
+
+
+def same_question(entry: AnswerEntry, question: str) -> bool:
+    """Entry được lưu cho đúng câu hỏi này (sau chuẩn hóa chữ hoa / khoảng trắng / dấu câu cuối)."""
+    return question_key(entry.question) == question_key(question)
+
+
+def _normalize(vec) -> np.ndarray:
+    v = np.asarray(vec, dtype=np.float32).reshape(-1)
+    norm = float(np.linalg.norm(v))
+    return v / norm if norm > 0 else v
+
+
+class SemanticAnswerCache:
+    """Cache câu trả lời theo độ tương đồng ngữ nghĩa của câu hỏi."""
+
+    def __init__(self, cache_dir: str = ANSWER_CACHE_DIR, maxsize: int = ANSWER_CACHE_SIZE,
+                 threshold: float = ANSWER_CACHE_THRESHOLD, ttl_s: Optional[float] = ANSWER_CACHE_TTL_S,
+                 save_delay_s: float = ANSWER_CACHE_SAVE_DELAY_S):
+        self.cache_dir = cache_dir
+        self.maxsize = max(1, int(maxsize))
+        self.threshold = threshold
+        self.ttl_s = ttl_s
+        self.save_delay_s = save_delay_s
+        self._entries: List[AnswerEntry] = []
+        self._vectors: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+        # ghi đĩa: _version tăng sau mỗi thay đổi, 1 luồng ghi chạy tới khi bản đã ghi là bản mới nhất
+        self._save_lock = threading.Lock()
+        self._version = 0
+        self._writer: Optional[threading.Thread] = None
+        self._loaded = False
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    # LƯU / ĐỌC
+    @property
+    def _meta_path(self) -> str:
+        return os.path.join(self.cache_dir, "entries.json")
+
+    @property
+    def _vec_path(self) -> str:
+        return os.path.join(self.cache_dir, "vectors.npy")
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        if not (os.path.exists(self._meta_path) and os.path.exists(self._vec_path)):
+            return
+        try:
+            with open(self._meta_path, "r", encoding="utf-8") as f:
+                entries = [AnswerEntry(**e) for e in json.load(f)]
+            vectors = np.load(self._vec_path)
+            if len(entries) == len(vectors):
+                self._entries, self._vectors = entries, vectors.astype(np.float32)
+                self._drop_expired()
+        except Exception as e:
+            print("⚠️ Không đọc được answer cache, bỏ qua:", e)
+
+    def _snapshot(self):
+        # gọi khi đang giữ self._lock; mảng vector luôn được thay mới (không sửa tại chỗ) nên giữ tham chiếu là đủ
+        return self._version, [asdict(e) for e in self._entries], self._vectors
+
+    def _write(self, meta: List[Dict[str, Any]], vectors: Optional[np.ndarray]):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_meta, tmp_vec = self._meta_path + ".tmp", self._vec_path + ".tmp.npy"
+        with open(tmp_meta, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        np.save(tmp_vec, vectors if vectors is not None else np.zeros((0, 0), dtype=np.float32))
+        os.replace(tmp_vec, self._vec_path)
+        os.replace(tmp_meta, self._meta_path)
+
+    def _schedule_save(self):
+        """Gọi khi đang giữ self._lock sau mỗi thay đổi: luồng nền ghi bản mới nhất, không chặn request."""
+        self._version += 1
+        if self._writer is None:
+            # không daemon → process (CLI / batch) chờ lần ghi cuối rồi mới thoát
+            self._writer = threading.Thread(target=self._write_loop, name="answer-cache-save")
+            self._writer.start()
+
+    def _write_loop(self):
+        while True:
+            time.sleep(self.save_delay_s)
+            with self._lock:
+                version, meta, vectors = self._snapshot()
+            try:
+                with self._save_lock:
+                    self._write(meta, vectors)
+            except Exception as e:
+                print("⚠️ Không ghi được answer cache:", e)
+            with self._lock:
+                if self._version == version:
+                    self._writer = None
+                    return
+
+    def flush(self):
+        """Ghi ngay bản hiện tại (đồng bộ)."""
+        with self._lock:
+            _, meta, vectors = self._snapshot()
+        with self._save_lock:
+            self._write(meta, vectors)
+
+    def _drop_expired(self):
+        now = time.time()
+        keep = [i for i, e in enumerate(self._entries) if not e.expired(now)]
+        if len(keep) != len(self._entries):
+            self._entries = [self._entries[i] for i in keep]
+            self._vectors = self._vectors[keep] if keep else None
+
+    # TRA CỨU
+    def _nearest(self, embedding) -> Optional[Tuple[AnswerEntry, float]]:
+        if self._vectors is None or not len(self._entries):
+            return None
+        q = _normalize(embedding)
+        if q.shape[0] != self._vectors.shape[1]:
+            return None
+        sims = self._vectors @ q
+        now = time.time()
+        for idx in np.argsort(-sims):
+            if sims[idx] < self.threshold:
+                break
+            entry = self._entries[int(idx)]
+            if not entry.expired(now):
+                return entry, round(float(sims[idx]), 4)
+        return None
+
+    def lookup(self, embedding) -> Optional[Tuple[AnswerEntry, float]]:
+        """(entry gần nhất, cosine) nếu cosine ≥ threshold và chưa hết hạn, ngược lại None."""
+        with self._lock:
+            self._ensure_loaded()
+            hit = self._nearest(embedding)
+            if hit is None:
+                self.misses += 1
+            return hit
+
+    def contains(self, embedding) -> bool:
+        """Như lookup() nhưng không tính vào thống kê (đo độ phủ cache)."""
+        with self._lock:
+            self._ensure_loaded()
+            return self._nearest(embedding) is not None
+
+    def validate(self, entry: AnswerEntry, chosen_ids: List[str], evict: bool = True) -> bool:
+        """
+        Chỉ dùng lại câu trả lời khi tập id truy xuất hiện tại trùng với lúc lưu.
+        evict=False (câu hỏi chỉ gần giống): lệch tập id không có nghĩa entry đã cũ → giữ nguyên entry.
+        """
+        ok = set(map(str, chosen_ids)) == set(map(str, entry.chosen_ids))
+        with self._lock:
+            if ok:
+                self.hits += 1
+                entry.hits += 1
+                entry.last_used_at = time.time()
+            elif not evict:
+                self.misses += 1
+            else:
+                # Dữ liệu đã đổi → bỏ entry cũ, lần sau sẽ được ghi lại bằng câu trả lời mới
+                self.stale += 1
+                for i, e in enumerate(self._entries):
+                    if e is entry:
+                        self._entries.pop(i)
+                        self._vectors = np.delete(self._vectors, i, axis=0) if self._entries else None
+                        self._schedule_save()
+                        break
+        return ok
+
+    # GHI
+    def put(self, question: str, embedding, cypher_query: Optional[str], chosen_ids: List[str],
+            answer: str, ttl_s: Optional[float] = None,
+            cypher_params: Optional[Dict[str, Any]] = None) -> AnswerEntry:
+        now = time.time()
+        ttl = self.ttl_s if ttl_s is None else ttl_s
+        entry = AnswerEntry(
+            question=question,
+            cypher_query=cypher_query,
+            cypher_params=dict(cypher_params or {}),
+            chosen_ids=[str(x) for x in chosen_ids],
+            answer=answer,
+            created_at=now,
+            expires_at=now + ttl if ttl else None,
+            last_used_at=now,
+        )
+        vec = _normalize(embedding)[None, :]
+        with self._lock:
+            self._ensure_loaded()
+            # Cùng câu hỏi → thay entry cũ
+            for i, e in enumerate(self._entries):
+                if e.question == question:
+                    self._entries.pop(i)
+                    self._vectors = np.delete(self._vectors, i, axis=0) if len(self._entries) else None
+                    break
+            if self._vectors is not None and self._vectors.shape[1] != vec.shape[1]:
+                self._entries, self._vectors = [], None
+            self._entries.append(entry)
+            self._vectors = vec if self._vectors is None else np.vstack([self._vectors, vec])
+            self._drop_expired()
+            if len(self._entries) > self.maxsize:
+                order = sorted(range(len(self._entries)), key=lambda i: self._entries[i].last_used_at)
+                keep = sorted(order[len(self._entries) - self.maxsize:])
+                self._entries = [self._entries[i] for i in keep]
+                self._vectors = self._vectors[keep]
+            self._schedule_save()
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries, self._vectors = [], None
+            self._loaded = True
+            self._version += 1
+        self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._ensure_loaded()
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "threshold": self.threshold,
+            }
+
+
+_SHARED_CACHE: Optional[SemanticAnswerCache] = None
+
+
+def get_answer_cache() -> SemanticAnswerCache:
+    """Answer cache dùng chung trong process (CLI, batch, Streamlit)."""
+    global _SHARED_CACHE
+    if _SHARED_CACHE is None:
+        _SHARED_CACHE = SemanticAnswerCache()
+    return _SHARED_CACHE
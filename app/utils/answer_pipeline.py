@@ -0,0 +1,350 @@
+# app/utils/answer_pipeline.py
+"""
+Pipeline trả lời dùng chung cho CLI, batch và Streamlit:
+câu hỏi → (answer cache) → Graph + Vector song song → chọn topN → LLM tổng hợp
+(hoặc dựng bằng khung khi kết quả thuần cấu trúc, xem answer_renderer.needs_llm).
+"""
+import os
+import math
+import time
+import asyncio
+from typing import Any, Callable, Dict, List, Optional, Tuple, TYPE_CHECKING
+
+from app.retrievers.hybrid_retriever import HybridRetrieverParallel
+from app.utils.answer_cache import SemanticAnswerCache, get_answer_cache, same_question
+from app.utils.listing_cards import ListingCardStore
+from app.utils.dedup import AliasStore
+from app.utils.answer_renderer import needs_llm, render_answer
+from app.utils.fusion import FUSION_STRATEGY, FUSION_VECTOR_K, FusionEngine
+from app.utils.latency_budget import LatencyPlanner, get_latency_planner
+from app.utils.query_decomposer import QUERY_DECOMPOSE_ENABLED, SubQuery, decompose
+from app.utils.query_capture import capture
+from app.utils.hybrid_helpers import (
+    load_answer_rule,
+    build_id_map_from_graph_records,
+    select_topN_by_priority,
+    build_synthesis_input,
+    llm_summarize_answer,
+    llm_stream_answer,
+)
+
+if TYPE_CHECKING:
+    from openai import OpenAI
+
+
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") != "0"
+
+
+class HybridAnswerPipeline:
+    """Giữ retriever / client / rule tổng hợp để dùng lại giữa các câu hỏi."""
+
+    def __init__(self, model: str = OPENAI_MODEL, client: Optional["OpenAI"] = None,
+                 answer_cache: Optional[SemanticAnswerCache] = None, use_answer_cache: bool = ANSWER_CACHE_ENABLED,
+                 fusion_strategy: str = FUSION_STRATEGY, planner: Optional[LatencyPlanner] = None,
+                 decompose_queries: bool = QUERY_DECOMPOSE_ENABLED):
+        self.model = model
+        if client is None:
+            from openai import OpenAI
+            client = OpenAI()
+        self.client = client
+        self.hybrid = HybridRetrieverParallel()
+        self.vclient = self.hybrid.vector
+        self.synth_rule = load_answer_rule()
+        self.answer_cache = (answer_cache or get_answer_cache()) if use_answer_cache else None
+        self.cards = ListingCardStore()
+        # id bài trùng (Neo4j vẫn giữ đủ) → id chuẩn đã được index trong FAISS
+        self.aliases = AliasStore()
+        # weighted: chấm điểm vector hóa trên nhiều ứng viên (FUSION_VECTOR_K) thay cho chọn theo ưu tiên
+        self.fusion = FusionEngine() if fusion_strategy == "weighted" else None
+        # Chọn top_k / few-shot k / fetch_k theo ngân sách độ trễ (LATENCY_BUDGET_MS), ghi nhận thời gian từng bước
+        self.planner = planner or get_latency_planner()
+        # Câu hỏi ghép (nhiều quận) → truy xuất song song từng câu con, gộp lại rồi tổng hợp 1 lần
+        self.decompose_queries = decompose_queries
+
+    async def retrieve_async(self, user_query: str, top_k: int = 10, limit: int = 3,
+                             budget_ms: Optional[int] = None, capture_query: bool = True) -> Dict[str, Any]:
+        """
+        Bước 1–3: answer cache → Graph + Vector song song → chọn topN (chưa tổng hợp câu trả lời).
+        capture_query: ghi request vào QUERY_CAPTURE_PATH nếu bật (server tự ghi theo HTTP request → False).
+        """
+        started, ctx, error = time.time(), None, None
+        try:
+            with self.planner.load:
+                ctx = await self._retrieve(user_query, top_k, limit, budget_ms)
+            return ctx
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            if capture_query:
+                capture("retrieve", user_query, started, top_k, limit, budget_ms, ctx, error, source="pipeline")
+
+    async def _retrieve(self, user_query: str, top_k: int, limit: int, budget_ms: Optional[int]) -> Dict[str, Any]:
+        timings: Dict[str, int] = {}
+        plan = self.planner.plan(top_k=top_k, limit=limit, budget_ms=budget_ms)
+        top_k, limit = plan.top_k, plan.fill_limit
+
+        # 1 Tra answer cache theo embedding câu hỏi
+        cached, similarity, embedding = None, None, None
+        if self.answer_cache is not None:
+            t0 = time.time()
+            try:
+                embedding = self.vclient.embed_query(user_query)
+                cached, similarity = self.answer_cache.lookup(embedding) or (None, None)
+            except Exception as e:
+                print("⚠️ Bỏ qua answer cache:", e)
+            timings["cache_lookup_ms"] = int((time.time() - t0) * 1000)
+
+        # 2 Graph + Vector song song (cache hit đúng câu hỏi → dùng lại Cypher đã sinh, bỏ qua LLM sinh Cypher;
+        #   câu hỏi chỉ gần giống tự sinh Cypher để tập id kiểm tra ở bước 4 phản ánh đúng câu hỏi mới)
+        #   câu hỏi ghép → mỗi câu con chạy Graph + Vector riêng, các câu con chạy đồng thời
+        sub_queries = decompose(user_query) if self.decompose_queries else []
+        search_k = max(top_k, FUSION_VECTOR_K) if self.fusion is not None else top_k
+        reuse = cached if cached is not None and same_question(cached, user_query) else None
+        t0 = time.time()
+        if len(sub_queries) > 1:
+            parts = await asyncio.gather(*[
+                self.hybrid.search(user_query=sub.text, top_k=search_k, plan=plan, deadline_ms=plan.retrieval_deadline_ms)
+                for sub in sub_queries
+            ])
+            hybrid_result = merge_hybrid_results(sub_queries, parts)
+        else:
+            parts = []
+            hybrid_result = await self.hybrid.search(
+                user_query=user_query,
+                top_k=search_k,
+                cypher_query=reuse.cypher_query if reuse else None,
+                cypher_params=reuse.cypher_params if reuse else None,
+                plan=plan,
+                deadline_ms=plan.retrieval_deadline_ms,
+            )
+        timings["hybrid_ms"] = int((time.time() - t0) * 1000)
+        stage_timings = {**hybrid_result.get("graph_timings", {}), "vector_ms": hybrid_result.get("vector_time_ms")}
+        timings.update({k: v for k, v in stage_timings.items() if k.endswith("_ms") and v is not None})
+        self.planner.record({k[:-3]: v for k, v in stage_timings.items() if k.endswith("_ms")})
+        plan.few_shot_k = hybrid_result.get("graph_timings", {}).get("few_shot_k", plan.few_shot_k)
+        plan.mmr = plan.mmr and not hybrid_result.get("vector_mmr_skipped", False)
+
+        graph_records = hybrid_result["graph_records"]
+        graph_ids = self.aliases.canonicalize_ids(hybrid_result["graph_ids"])
+        vector_passages = hybrid_result["vector_passages"]
+        graph_id_map = build_id_map_from_graph_records(graph_records, aliases=self.aliases)
+
+        # 3 Chọn topN passage theo ID (hoặc theo điểm tổng hợp của FusionEngine)
+        #   câu hỏi ghép: chọn riêng cho từng câu con rồi xen kẽ để ý nào cũng có căn đại diện
+        t0 = time.time()
+        if parts:
+            per_part = math.ceil(limit / len(parts))
+            picks = [self._select(self.aliases.canonicalize_ids(r["graph_ids"]), r["vector_passages"],
+                                  graph_id_map, per_part) for r in parts]
+            chosen_passages = _interleave([p for p, _ in picks], max(limit, len(parts)))
+            fusion_explanations = [e for _, ex in picks for e in (ex or [])] if self.fusion is not None else None
+        else:
+            chosen_passages, fusion_explanations = self._select(graph_ids, vector_passages, graph_id_map, limit)
+        timings["fusion_ms"] = int((time.time() - t0) * 1000)
+
+        return {
+            "query": user_query,
+            "cached_entry": cached,
+            "cache_similarity": similarity,
+            "query_embedding": embedding,
+            "cypher_query": hybrid_result.get("cypher_query"),
+            "cypher_params": hybrid_result.get("cypher_params") or {},
+            "graph_records": graph_records,
+            "graph_ids": graph_ids,
+            "graph_id_map": graph_id_map,
+            "vector_passages": vector_passages,
+            "chosen_passages": chosen_passages,
+            "fusion": fusion_explanations,
+            "sub_queries": [sub.text for sub in sub_queries] if parts else [],
+            "retrieval_plan": plan.to_dict(),
+            # hết hạn chót / 1 nhánh lỗi → chỉ có dữ liệu từ nhánh còn lại
+            "partial": hybrid_result.get("partial", False),
+            "missing_branches": hybrid_result.get("missing_branches", []),
+            "timings": timings,
+        }
+
+    def _select(self, graph_ids, vector_passages, graph_id_map, limit: int):
+        """(passage được chọn, giải thích điểm của FusionEngine hoặc None)."""
+        if self.fusion is not None:
+            fused = self.fusion.fuse(graph_ids, vector_passages, graph_id_map, top_n=limit, vclient=self.vclient)
+            return fused.passages, fused.explanations
+        return select_topN_by_priority(graph_ids, vector_passages, self.vclient, graph_id_map, fill_limit=limit), None
+
+    async def answer_async(self, user_query: str, top_k: int = 10, limit: int = 3,
+                           model: Optional[str] = None,
+                           on_event: Optional[Callable[[str, Any], None]] = None,
+                           budget_ms: Optional[int] = None, capture_query: bool = True) -> Dict[str, Any]:
+        """
+        Chạy trọn pipeline cho 1 câu hỏi, trả về câu trả lời + dữ liệu trung gian + thời gian.
+        on_event (tùy chọn): nhận ("context", kết quả truy xuất) rồi ("delta", đoạn câu trả lời) khi đang sinh.
+        budget_ms: ngân sách độ trễ của request (mặc định LATENCY_BUDGET_MS, 0 = tham số tĩnh).
+        capture_query: ghi request vào QUERY_CAPTURE_PATH nếu bật (server tự ghi theo HTTP request → False).
+        """
+        started, result, error = time.time(), None, None
+        try:
+            with self.planner.load:
+                result = await self._answer(user_query, top_k, limit, model, on_event, budget_ms)
+            return result
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            if capture_query:
+                capture("answer", user_query, started, top_k, limit, budget_ms, result, error, source="pipeline")
+
+    async def _answer(self, user_query: str, top_k: int, limit: int, model: Optional[str],
+                      on_event: Optional[Callable[[str, Any], None]], budget_ms: Optional[int]) -> Dict[str, Any]:
+        model = model or self.model
+        total_start = time.time()
+        ctx = await self._retrieve(user_query, top_k, limit, budget_ms)
+        limit = ctx["retrieval_plan"]["fill_limit"]
+        cached, embedding = ctx.pop("cached_entry"), ctx.pop("query_embedding")
+        chosen_passages, graph_id_map = ctx["chosen_passages"], ctx["graph_id_map"]
+        chosen_ids = [str(p.id).strip() for p in chosen_passages if p.id]
+        timings = ctx["timings"]
+        if on_event is not None:
+            on_event("context", ctx)
+
+        # 4 Tổng hợp: dùng lại câu trả lời nếu tập id trùng khớp,
+        #   kết quả thuần cấu trúc → dựng bằng khung, còn lại gọi LLM
+        t0 = time.time()
+        route = None
+        if cached and self.answer_cache.validate(cached, chosen_ids, evict=same_question(cached, user_query)):
+            answer = cached.answer
+            answer_source = "cache"
+            if on_event is not None:
+                on_event("delta", answer)
+        else:
+            answer, answer_source, route = self.synthesize(
+                user_query, chosen_passages, graph_id_map, limit=limit, model=model, on_event=on_event)
+            # câu trả lời một phần không được lưu (lần hỏi sau cần bản đầy đủ);
+            # câu hỏi ghép không lưu Cypher (nhiều câu Cypher, lần sau vẫn tách lại)
+            if self.answer_cache is not None and embedding is not None and chosen_ids and not ctx["partial"]:
+                cypher_query = None if ctx["sub_queries"] else ctx.get("cypher_query")
+                self.answer_cache.put(user_query, embedding, cypher_query, chosen_ids, answer,
+                                      cypher_params=ctx.get("cypher_params"))
+        timings["llm_ms"] = int((time.time() - t0) * 1000)
+        # p95 tổng hợp (hạn chót truy xuất) chỉ tính lần thực sự gọi LLM, không tính cache / khung dựng sẵn
+        if answer_source == "llm":
+            self.planner.record({"synthesis": timings["llm_ms"]})
+        timings["total_ms"] = int((time.time() - total_start) * 1000)
+
+        return {
+            "query": user_query,
+            "answer": answer,
+            "answer_source": answer_source,
+            "render_route": route,
+            "cache_similarity": ctx.get("cache_similarity"),
+            **{k: ctx[k] for k in ("cypher_query", "cypher_params", "graph_records", "graph_ids", "graph_id_map",
+                                   "vector_passages", "chosen_passages", "fusion", "sub_queries", "retrieval_plan",
+                                   "partial", "missing_branches")},
+            "timings": timings,
+        }
+
+    def synthesize(self, user_query: str, chosen_passages, graph_id_map: Dict[str, Dict[str, Any]],
+                   limit: int = 3, model: Optional[str] = None,
+                   on_event: Optional[Callable[[str, Any], None]] = None) -> Tuple[str, str, str]:
+        """
+        Bước tổng hợp (không truy xuất): kết quả thuần cấu trúc → dựng bằng khung, còn lại gọi LLM.
+        Trả về (câu trả lời, nguồn "llm" | "template", lý do định tuyến).
+        """
+        use_llm, route = needs_llm(user_query, chosen_passages, graph_id_map, expected=limit)
+        if not use_llm:
+            answer = render_answer(chosen_passages, graph_id_map, cards=self.cards)
+            if on_event is not None:
+                on_event("delta", answer)
+            return answer, "template", route
+        synthesis_payload = build_synthesis_input(chosen_passages, graph_id_map, cards=self.cards)
+        if on_event is None:
+            return llm_summarize_answer(self.client, user_query, self.synth_rule, synthesis_payload,
+                                        model or self.model), "llm", route
+        parts = []
+        for piece in llm_stream_answer(self.client, user_query, self.synth_rule, synthesis_payload, model or self.model):
+            parts.append(piece)
+            on_event("delta", piece)
+        return "".join(parts).strip(), "llm", route
+
+    def prewarm(self, queries, few_shot_k: int = 10) -> Dict[str, int]:
+        """
+        Gộp trước các lần gọi embedding cho cả lô câu hỏi (batch / warm cache):
+        embedding câu hỏi (answer cache + vector search) và ví dụ few-shot NL2Cypher.
+        """
+        timings = {}
+        t0 = time.time()
+        self.vclient.embed_many(queries)
+        timings["embed_ms"] = int((time.time() - t0) * 1000)
+        t0 = time.time()
+        self.hybrid.graph.retriever.retrieve_examples_many(queries, k=few_shot_k)
+        timings["few_shot_ms"] = int((time.time() - t0) * 1000)
+        return timings
+
+    def answer(self, user_query: str, top_k: int = 10, limit: int = 3,
+               model: Optional[str] = None, budget_ms: Optional[int] = None,
+               capture_query: bool = True) -> Dict[str, Any]:
+        return asyncio.run(self.answer_async(user_query, top_k=top_k, limit=limit, model=model, budget_ms=budget_ms,
+                                             capture_query=capture_query))
+
+
+def merge_hybrid_results(sub_queries: List[SubQuery], parts: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Gộp kết quả HybridRetrieverParallel.search của các câu con thành 1 kết quả (id trùng chỉ giữ 1 lần)."""
+    records, seen = [], set()
+    for r in parts:
+        for rec in r["graph_records"]:
+            rid = str(rec.get("id") or "").strip()
+            if rid and rid in seen:
+                continue
+            seen.add(rid)
+            records.append(rec)
+    # Các câu con chạy song song → thời gian mỗi bước = câu con chậm nhất
+    graph_timings: Dict[str, Any] = {}
+    for r in parts:
+        for k, v in (r.get("graph_timings") or {}).items():
+            if isinstance(v, (int, float)):
+                graph_timings[k] = max(graph_timings.get(k, v), v)
+    vector_times = [r["vector_time_ms"] for r in parts if r.get("vector_time_ms") is not None]
+    missing = [b for r in parts for b in r.get("missing_branches", [])]
+    return {
+        "query": " | ".join(sub.text for sub in sub_queries),
+        "graph_records": records,
+        "graph_ids": [str(rec.get("id")).strip() for rec in records if rec.get("id")],
+        "vector_passages": _interleave([r["vector_passages"] for r in parts], sum(len(r["vector_passages"]) for r in parts)),
+        "vector_time_ms": max(vector_times) if vector_times else None,
+        "vector_error": next((r["vector_error"] for r in parts if r.get("vector_error")), None),
+        "vector_mmr_skipped": all(r.get("vector_mmr_skipped") for r in parts),
+        "graph_timings": graph_timings,
+        "graph_error": next((r["graph_error"] for r in parts if r.get("graph_error")), None),
+        "cypher_query": "\n\n".join(f"// {sub.text}\n{r['cypher_query']}"
+                                     for sub, r in zip(sub_queries, parts) if r.get("cypher_query")) or None,
+        "partial": any(r.get("partial") for r in parts),
+        "missing_branches": list(dict.fromkeys(missing)),
+        "took_ms": max(r.get("took_ms", 0) for r in parts),
+    }
+
+
+def _interleave(lists, limit: int):
+    """Lấy xen kẽ phần tử đầu của từng danh sách (bỏ passage trùng id) tới khi đủ limit."""
+    out, seen = [], set()
+    for i in range(max((len(x) for x in lists), default=0)):
+        for items in lists:
+            if i < len(items):
+                pid = str(items[i].id).strip() if items[i].id else None
+                if pid is not None and pid in seen:
+                    continue
+                seen.add(pid)
+                out.append(items[i])
+                if len(out) >= limit:
+                    return out
+    return out
+
+
+_SHARED_PIPELINE: Optional[HybridAnswerPipeline] = None
+
+
+def get_answer_pipeline() -> HybridAnswerPipeline:
+    """Pipeline dùng chung trong process (tránh load lại FAISS / Neo4j driver mỗi câu hỏi)."""
+    global _SHARED_PIPELINE
+    if _SHARED_PIPELINE is None:
+        _SHARED_PIPELINE = HybridAnswerPipeline()
+    return _SHARED_PIPELINE
@@ -0,0 +1,190 @@
+# app/utils/answer_renderer.py
+"""
+Dựng câu trả lời không cần LLM cho các câu hỏi dạng "liệt kê" khi mọi căn được chọn
+đều có đủ thuộc tính có cấu trúc từ Neo4j (quận, diện tích, giá).
+
+- `needs_llm(...)`  → router: quyết định có cần gọi LLM tổng hợp hay không (kèm lý do).
+- `render_answer(...)` → câu trả lời theo thứ tự khung 📍🏠📏💰📜🛋️📞 của answer_synthesis.txt,
+  kèm đoạn so sánh ngắn + lời mời xem thêm. Chỉ dựng các dòng có dữ liệu trong bản ghi / card,
+  không thêm câu nào mà dữ liệu không nói (pháp lý "sẵn sàng giao dịch", phong thủy...).
+"""
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.retrievers.vector_tools import Passage
+from app.utils.listing_cards import clean_description
+
+
+# auto: router tự quyết · llm: luôn gọi LLM · template: luôn dựng bằng khung
+ANSWER_RENDER_MODE = os.getenv("ANSWER_RENDER_MODE", "auto").lower()
+SNIPPET_MAX_TOKENS = int(os.getenv("ANSWER_SNIPPET_MAX_TOKENS", 60))
+
+# Trường bắt buộc để dựng câu trả lời bằng khung
+REQUIRED_FIELDS = ["district_name", "area_m2", "price_ty_vnd"]
+NUMERIC_FIELDS = ["area_m2", "price_ty_vnd"]
+
+# Câu hỏi cần tư vấn / so sánh / giải thích → để LLM viết
+ADVISORY_PATTERNS = [
+    r"so sánh", r"\bnên\b", r"tư vấn", r"(tại|vì) sao", r"đánh giá", r"ưu (điểm|nhược)",
+    r"nhược điểm", r"có đáng", r"phong thủy", r"hợp tuổi", r"giải thích", r"lời khuyên",
+    r"khác nhau", r"tốt hơn", r"đầu tư", r"sinh lời", r"xu hướng", r"dự báo",
+]
+_ADVISORY_RE = re.compile("|".join(ADVISORY_PATTERNS), re.IGNORECASE)
+
+
+# ROUTER
+def _num(value: Any) -> Optional[str]:
+    try:
+        return f"{float(value):g}"
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_blank(value: Any) -> bool:
+    return value is None or value == "" or value == [] or (isinstance(value, list) and not any(value))
+
+
+def needs_llm(user_query: str, chosen_passages: List[Passage], graph_id_map: Dict[str, Dict[str, Any]],
+              expected: int = 3, mode: Optional[str] = None) -> Tuple[bool, str]:
+    """
+    Trả về (cần LLM?, lý do).
+    mode=template vẫn gọi LLM nếu dữ liệu không đủ để dựng khung (căn chỉ có trong vector / thiếu trường).
+    """
+    mode = (mode or ANSWER_RENDER_MODE).lower()
+    if mode == "llm":
+        return True, "mode=llm"
+
+    if not chosen_passages:
+        return True, "no_results"
+    for p in chosen_passages:
+        record = graph_id_map.get(str(p.id).strip()) if p.id else None
+        if record is None:
+            return True, "vector_only_result"
+        missing = [f for f in REQUIRED_FIELDS if _is_blank(record.get(f))]
+        missing += [f for f in NUMERIC_FIELDS if f not in missing and _num(record.get(f)) is None]
+        if missing:
+            return True, f"missing_fields:{','.join(missing)}"
+    if mode == "template":
+        return False, "mode=template"
+
+    # Khung trả lời luôn yêu cầu đủ số căn → thiếu căn thì để LLM gợi ý thêm
+    if len(chosen_passages) < expected:
+        return True, "too_few_results"
+    if _ADVISORY_RE.search(user_query or ""):
+        return True, "advisory_question"
+    return False, "structured_list"
+
+
+# DỰNG CÂU TRẢ LỜI
+def _as_list(value: Any) -> List[str]:
+    if _is_blank(value):
+        return []
+    values = value if isinstance(value, list) else [value]
+    out = []
+    for v in values:
+        s = " ".join(str(v or "").split())
+        if s and s.lower() not in {x.lower() for x in out}:
+            out.append(s)
+    return out
+
+
+def _title(text: str) -> str:
+    return " ".join(w[:1].upper() + w[1:] for w in str(text).split())
+
+
+def _sentence(text: str) -> str:
+    text = text.strip()
+    return text[:1].upper() + text[1:] if text else text
+
+
+def _card_fields(card: Optional[str]) -> Dict[str, str]:
+    """Tách các dòng `Khóa: giá trị` trong listing card."""
+    fields = {}
+    for line in (card or "").splitlines():
+        key, sep, value = line.partition(":")
+        if sep and value.strip():
+            fields[key.strip()] = value.strip()
+    return fields
+
+
+def _render_listing(record: Dict[str, Any], passage: Passage, card: Optional[str]) -> Dict[str, Any]:
+    card_fields = _card_fields(card)
+    district = _title(record.get("district_name") or "")
+    address = " ".join(str(record.get("full_address") or "").split()) or card_fields.get("Địa chỉ", "")
+    ptypes = _as_list(record.get("property_type"))
+    designs = _as_list(record.get("house_design"))
+    directions = _as_list(record.get("direction"))
+    legal = _as_list(record.get("legal_status"))
+    amenities = _as_list(record.get("internal_amenities"))
+    facilities = _as_list(record.get("near_facilities"))
+    area, price = _num(record.get("area_m2")), _num(record.get("price_ty_vnd"))
+    contact_name = " ".join(str(record.get("contact_name") or "").split())
+    phones = _as_list(record.get("contact_phone"))
+    contact = " – ".join(x for x in [contact_name, ", ".join(phones[:2])] if x) or card_fields.get("Liên hệ", "")
+
+    snippet = card_fields.get("Mô tả") or clean_description(passage.text or "", max_tokens=SNIPPET_MAX_TOKENS)
+
+    lines = [f"📍 {district} – {address}" if address else f"📍 {district}"]
+    house = ptypes[:1] + designs[:1] + ([f"hướng {', '.join(directions[:2])}"] if directions else [])
+    if house:
+        lines.append(f"🏠 {_sentence(', '.join(house))}.")
+    lines.append(f"📏 Diện tích {area}m², 💰 giá khoảng {price} tỷ.")
+    if legal:
+        lines.append(f"📜 {_sentence(', '.join(legal[:2]))}.")
+    highlights = amenities[:4] + ([f"gần {', '.join(facilities[:3])}"] if facilities else [])
+    if highlights:
+        lines.append(f"🛋️ {_sentence(', '.join(highlights))}.")
+    if snippet:
+        lines.append(snippet)
+    if contact:
+        lines.append(f"📞 Liên hệ: {contact}")
+    return {"district": district, "area": float(area), "price": float(price), "text": "\n".join(lines)}
+
+
+def _label_items(items: List[Dict[str, Any]]):
+    """Tên gọi từng căn trong đoạn so sánh: "căn ở Cầu Giấy", trùng quận → "căn thứ 2 (Cầu Giấy)"."""
+    counts = {}
+    for it in items:
+        counts[it["district"]] = counts.get(it["district"], 0) + 1
+    for i, it in enumerate(items, 1):
+        it["label"] = f"căn ở {it['district']}" if counts[it["district"]] == 1 else f"căn thứ {i} ({it['district']})"
+
+
+def _render_tradeoff(items: List[Dict[str, Any]]) -> str:
+    _label_items(items)
+    cheapest = min(items, key=lambda x: x["price"])
+    largest = max(items, key=lambda x: x["area"])
+    best_value = min(items, key=lambda x: x["price"] / x["area"] if x["area"] else float("inf"))
+    parts = []
+    if cheapest is not largest:
+        parts.append(
+            f"{cheapest['label']} có giá tốt nhất ({cheapest['price']:g} tỷ), "
+            f"trong khi {largest['label']} rộng nhất ({largest['area']:g}m²)"
+        )
+    else:
+        parts.append(
+            f"{cheapest['label']} vừa có giá tốt nhất ({cheapest['price']:g} tỷ) "
+            f"vừa rộng nhất ({cheapest['area']:g}m²)"
+        )
+    if best_value["area"]:
+        unit = best_value["price"] * 1000 / best_value["area"]
+        parts.append(f"tính theo đơn giá, {best_value['label']} hợp lý nhất (khoảng {unit:.0f} triệu/m²)")
+    return (
+        f"Các căn trên đều đáng cân nhắc: {'; '.join(parts)}.\n"
+        "Bạn có thể cân nhắc tùy theo nhu cầu về vị trí hoặc không gian sống. "
+        "Nếu muốn, tôi có thể gửi thêm một số lựa chọn tương tự để bạn xem thêm."
+    )
+
+
+def render_answer(chosen_passages: List[Passage], graph_id_map: Dict[str, Dict[str, Any]], cards=None) -> str:
+    """Dựng câu trả lời từ thuộc tính Neo4j + đoạn mô tả ngắn (chỉ gọi khi needs_llm(...) trả về False)."""
+    items = []
+    for p in chosen_passages:
+        pid = str(p.id).strip()
+        card = cards.get(pid) if cards is not None else None
+        items.append(_render_listing(graph_id_map[pid], p, card))
+    blocks = [f"Dưới đây là {len(items)} căn phù hợp với yêu cầu của bạn:"]
+    blocks += [it["text"] for it in items]
+    blocks.append(_render_tradeoff(items))
+    return "\n\n".join(blocks)
@@ -0,0 +1,203 @@
+# app/utils/cache_warmer.py
+"""
+Làm nóng các tầng cache sau mỗi lần deploy / nạp lại dữ liệu, từ log câu hỏi gần đây hoặc data/Question.csv.
+
+- load_questions(): đọc .csv (cột question / query), .jsonl (trường question / query) hoặc .txt (mỗi dòng 1 câu).
+- resolve_source(): file nguồn do client gửi (POST /warm) phải nằm trong WARM_SOURCE_DIRS.
+- dedupe_questions(): gộp câu trùng sau chuẩn hóa, câu hỏi nhiều nhất được làm nóng trước.
+- warm_caches(): embedding theo lô + few-shot (pipeline.prewarm), rồi chạy pipeline cho từng câu với số luồng
+  giới hạn (WARM_CONCURRENCY) → điền cache embedding, Cypher, kết quả Neo4j và (mode=answer) answer cache.
+  Server truyền `runner` để mỗi câu đi qua hàng đợi / kiểm soát tải như request thật.
+- cache_coverage(): tỉ lệ câu hỏi đã có trong từng tầng cache (không làm lệch thống kê hit/miss).
+
+Cache embedding / Cypher / Neo4j nằm trong bộ nhớ của process → làm nóng trong process đang phục vụ
+(`POST /warm` của app/server.py, `--warm-from` khi khởi động); scripts/warm_caches.py gọi endpoint đó qua --url.
+"""
+import os
+import csv
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.utils.answer_cache import question_key
+from app.utils.query_decomposer import decompose
+
+
+WARM_CONCURRENCY = int(os.getenv("WARM_CONCURRENCY", 4))
+# answer: điền cả answer cache (gọi LLM tổng hợp) · retrieve: chỉ embedding / Cypher / Neo4j
+WARM_MODE = os.getenv("WARM_MODE", "answer").lower()
+WARM_TOP = int(os.getenv("WARM_TOP", 0))
+# Thư mục được phép làm nguồn câu hỏi khi client gửi "source" (phân tách bằng dấu phẩy)
+WARM_SOURCE_DIRS = [d.strip() for d in os.getenv("WARM_SOURCE_DIRS", "data,logs").split(",") if d.strip()]
+LAYERS = ("embedding", "cypher", "neo4j", "answer")
+
+
+# ĐỌC CÂU HỎI
+def normalize_question(question: str) -> str:
+    return question_key(question)
+
+
+def resolve_source(path: str, allowed_dirs: Optional[List[str]] = None) -> str:
+    """Đường dẫn thật của file nguồn; ValueError nếu nằm ngoài các thư mục cho phép (chặn đọc file tùy ý)."""
+    real = os.path.realpath(path)
+    for folder in (WARM_SOURCE_DIRS if allowed_dirs is None else allowed_dirs):
+        root = os.path.realpath(folder)
+        if os.path.commonpath([real, root]) == root and real != root:
+            return real
+    raise ValueError(f"source phải nằm trong WARM_SOURCE_DIRS ({', '.join(WARM_SOURCE_DIRS)})")
+
+
+def load_questions(path: str) -> List[str]:
+    ext = os.path.splitext(path)[1].lower()
+    questions: List[str] = []
+    with open(path, "r", encoding="utf-8-sig") as f:
+        if ext == ".csv":
+            for row in csv.DictReader(f):
+                q = row.get("question") or row.get("query")
+                if q:
+                    questions.append(q)
+        elif ext in (".jsonl", ".ndjson", ".log"):
+            for line in f:
+                try:
+                    obj = json.loads(line)
+                except ValueError:
+                    continue
+                if not isinstance(obj, dict) or obj.get("kind") == "refine":
+                    # câu tinh chỉnh hội thoại ("rẻ hơn thì sao") không phải câu hỏi độc lập
+                    continue
+                q = obj.get("question") or obj.get("query")
+                if q:
+                    questions.append(str(q))
+        else:
+            questions = [line.strip() for line in f if line.strip()]
+    return questions
+
+
+def dedupe_questions(questions: List[str], top: int = WARM_TOP) -> List[Tuple[str, int]]:
+    """[(câu hỏi, số lần xuất hiện)] theo số lần giảm dần; top > 0 → chỉ giữ top câu."""
+    counts: Dict[str, int] = {}
+    first: Dict[str, Tuple[int, str]] = {}
+    for i, q in enumerate(questions):
+        key = normalize_question(q)
+        if not key:
+            continue
+        counts[key] = counts.get(key, 0) + 1
+        first.setdefault(key, (i, q.strip()))
+    order = sorted(counts, key=lambda k: (-counts[k], first[k][0]))
+    if top > 0:
+        order = order[:top]
+    return [(first[k][1], counts[k]) for k in order]
+
+
+# ĐỘ PHỦ
+def question_layers(pipeline, question: str) -> Dict[str, bool]:
+    """Tầng cache nào đã có câu hỏi này (câu hỏi ghép: mọi câu con đều phải có Cypher / kết quả Neo4j)."""
+    vclient, graph = pipeline.vclient, pipeline.hybrid.graph
+    subs = [s.text for s in decompose(question)] if getattr(pipeline, "decompose_queries", False) else [question]
+    graph_layers = [graph.cached_layers(s) for s in subs]
+    embedded = vclient.has_cached_embedding(question)
+    answer = False
+    if pipeline.answer_cache is not None and embedded:
+        answer = pipeline.answer_cache.contains(vclient.embed_query(question))
+    return {
+        "embedding": embedded and all(vclient.has_cached_embedding(s) for s in subs),
+        "cypher": all(g["cypher"] for g in graph_layers),
+        "neo4j": all(g["neo4j"] for g in graph_layers),
+        "answer": answer,
+    }
+
+
+def cache_coverage(pipeline, questions: List[str]) -> Dict[str, float]:
+    if not questions:
+        return {layer: 0.0 for layer in LAYERS}
+    rows = [question_layers(pipeline, q) for q in questions]
+    return {layer: round(sum(r[layer] for r in rows) / len(rows), 4) for layer in LAYERS}
+
+
+# LÀM NÓNG
+def warm_caches(pipeline, questions: List[str], concurrency: int = WARM_CONCURRENCY, mode: str = WARM_MODE,
+                top: int = WARM_TOP, top_k: int = 10, limit: int = 3,
+                runner: Optional[Callable[[str, int, int], Any]] = None) -> Dict[str, Any]:
+    """
+    Làm nóng cache cho các câu hỏi (đã gộp trùng), trả về báo cáo độ phủ trước / sau.
+    runner(question, top_k, limit): cách chạy 1 câu (mặc định gọi thẳng pipeline theo mode).
+    """
+    start = time.time()
+    ranked = dedupe_questions(questions, top=top)
+    unique = [q for q, _ in ranked]
+    print(f"🔥 Làm nóng cache: {len(questions)} câu hỏi → {len(unique)} câu không trùng "
+          f"(mode={mode}, concurrency={concurrency})")
+    before = cache_coverage(pipeline, unique)
+
+    timings: Dict[str, Any] = {}
+    try:
+        timings.update(pipeline.prewarm(unique))
+    except Exception as e:
+        print("⚠️ Bỏ qua bước embedding theo lô:", e)
+
+    failed: List[Dict[str, str]] = []
+    done = [0]
+    lock = threading.Lock()
+
+    def run(question: str):
+        try:
+            if runner is not None:
+                runner(question, top_k, limit)
+            elif mode == "retrieve":
+                import asyncio
+                asyncio.run(pipeline.retrieve_async(question, top_k=top_k, limit=limit, capture_query=False))
+            else:
+                # câu làm nóng không phải lưu lượng thật → không ghi vào QUERY_CAPTURE_PATH
+                pipeline.answer(question, top_k=top_k, limit=limit, capture_query=False)
+        except Exception as e:
+            with lock:
+                failed.append({"question": question, "error": str(e)})
+        with lock:
+            done[0] += 1
+            if done[0] % 10 == 0 or done[0] == len(unique):
+                print(f"🔥 {done[0]}/{len(unique)} câu đã làm nóng")
+
+    t0 = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="warm") as pool:
+        list(pool.map(run, unique))
+    timings["pipeline_ms"] = int((time.time() - t0) * 1000)
+
+    after = cache_coverage(pipeline, unique)
+    report = {
+        "questions": len(questions),
+        "unique": len(unique),
+        "mode": mode,
+        "concurrency": concurrency,
+        "failed": failed,
+        "coverage_before": before,
+        "coverage_after": after,
+        "top_questions": [{"question": q, "count": c} for q, c in ranked[:10]],
+        "timings": timings,
+        "took_s": round(time.time() - start, 2),
+    }
+    print(f"✅ Làm nóng xong sau {report['took_s']}s · lỗi {len(failed)} · độ phủ {after}")
+    return report
+
+
+def request_warm(url: Optional[str] = None, source: Optional[str] = None, timeout: float = 10) -> Optional[Dict]:
+    """
+    Nhờ server đang chạy làm nóng cache ở nền (gọi sau khi nạp lại graph / vector).
+    url mặc định WARM_URL (vd http://127.0.0.1:8000); không cấu hình → bỏ qua.
+    """
+    import urllib.request
+    url = url or os.getenv("WARM_URL")
+    if not url:
+        return None
+    payload = {"source": source} if source else {}
+    req = urllib.request.Request(url.rstrip("/") + "/warm", data=json.dumps(payload).encode("utf-8"),
+                                 headers={"Content-Type": "application/json"}, method="POST")
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            body = json.loads(resp.read() or b"{}")
+        print(f"🔥 Đã yêu cầu server làm nóng cache: {body}")
+        return body
+    except Exception as e:
+        print(f"⚠️ Không gửi được yêu cầu làm nóng tới {url}: {e}")
+        return None
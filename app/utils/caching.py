@@ -0,0 +1,140 @@
+# app/utils/caching.py
+"""
+Tiện ích cache dùng chung cho pipeline:
+- LRUCache: giới hạn kích thước, TTL theo từng entry, thread-safe, có bộ đếm hit/miss.
+- canonicalize_cypher: chuẩn hóa Cypher (bỏ comment, gộp khoảng trắng ngoài chuỗi, bỏ ';').
+- make_cache_key: băm các thành phần khóa thành chuỗi ổn định.
+"""
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+
+class LRUCache:
+    """LRU cache giới hạn số entry, TTL mặc định hoặc theo từng entry."""
+
+    def __init__(self, maxsize: int = 1024, ttl_s: Optional[float] = None):
+        self.maxsize = max(0, int(maxsize))
+        self.ttl_s = ttl_s
+        self._data: "OrderedDict[Hashable, Tuple[Any, Optional[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """Trả (hit, value). Entry hết hạn được xóa và tính là miss."""
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, expires_at = item
+                if expires_at is None or expires_at > time.time():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._data[key]
+                self.expirations += 1
+            self.misses += 1
+            return False, None
+
+    def peek(self, key: Hashable) -> Tuple[bool, Any]:
+        """Như get() nhưng không tính hit/miss và không đổi thứ tự LRU (dùng để đo độ phủ cache)."""
+        with self._lock:
+            item = self._data.get(key)
+        if item is None or (item[1] is not None and item[1] <= time.time()):
+            return False, None
+        return True, item[0]
+
+    def set(self, key: Hashable, value: Any, ttl_s: Optional[float] = None) -> None:
+        if self.maxsize == 0:
+            return
+        ttl = self.ttl_s if ttl_s is None else ttl_s
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        """Vô hiệu hóa toàn bộ entry (vd: khi graph version thay đổi)."""
+        with self._lock:
+            if self._data:
+                self.invalidations += 1
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+
+def canonicalize_cypher(cypher: str) -> str:
+    """
+    Chuẩn hóa Cypher để 2 truy vấn chỉ khác định dạng có cùng khóa cache:
+    bỏ comment `//`, gộp khoảng trắng (giữ nguyên nội dung trong chuỗi), bỏ ';' cuối.
+    """
+    if not cypher:
+        return ""
+    out = []
+    quote = None
+    i, n = 0, len(cypher)
+    pending_space = False
+    while i < n:
+        ch = cypher[i]
+        if quote:
+            out.append(ch)
+            if ch == "\\" and i + 1 < n:
+                out.append(cypher[i + 1])
+                i += 2
+                continue
+            if ch == quote:
+                quote = None
+            i += 1
+            continue
+        if ch in ("'", '"', "`"):
+            if pending_space and out:
+                out.append(" ")
+            pending_space = False
+            quote = ch
+            out.append(ch)
+        elif ch == "/" and cypher.startswith("//", i):
+            while i < n and cypher[i] != "\n":
+                i += 1
+            pending_space = True
+            continue
+        elif ch.isspace():
+            pending_space = True
+        else:
+            if pending_space and out:
+                out.append(" ")
+            pending_space = False
+            out.append(ch)
+        i += 1
+    return "".join(out).strip().rstrip(";").strip()
+
+
+def make_cache_key(*parts: Any) -> str:
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
@@ -0,0 +1,256 @@
+# app/utils/conversation.py
+"""
+Chế độ hội thoại: câu hỏi tiếp theo dùng lại tập ứng viên của lần truy xuất trước.
+
+ConversationSession giữ record Neo4j, passage vector, bộ lọc phạm vi (FilterSpec của câu hỏi gốc)
+và bộ lọc tinh chỉnh cộng dồn. Mỗi câu hỏi mới:
+- tinh chỉnh ("còn căn nào rẻ hơn không?", "chỉ lấy căn sổ đỏ", "căn nào rộng nhất") → lọc + xếp lại
+  trong bộ nhớ (vài ms) rồi chỉ tổng hợp 1 lần;
+- đổi phạm vi (quận / loại nhà khác, nới khoảng giá / diện tích) hoặc câu hỏi không liên quan
+  → chạy lại toàn bộ pipeline (NL2Cypher + Neo4j + FAISS) và làm mới phiên.
+Tinh chỉnh không còn căn nào → truy xuất lại với câu hỏi gốc + câu tinh chỉnh.
+
+CONVERSATION_REFINE_ENABLED=0 → mọi câu hỏi đều truy xuất lại như trước.
+"""
+import os
+import re
+import time
+import asyncio
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.retrievers.vector_tools import Passage
+from app.utils.filter_spec import FilterSpec, parse_question, parse_relative
+from app.utils.hybrid_helpers import select_topN_by_priority, vector_fetch_by_ids
+from app.utils.query_capture import capture
+
+
+CONVERSATION_REFINE_ENABLED = os.getenv("CONVERSATION_REFINE_ENABLED", "1") != "0"
+# Câu ngắn chỉ nêu thêm điều kiện ("sổ đỏ, hướng nam thôi") cũng coi là tinh chỉnh
+CONVERSATION_MAX_REFINE_WORDS = int(os.getenv("CONVERSATION_MAX_REFINE_WORDS", 10))
+
+# Dấu hiệu câu hỏi nối tiếp kết quả trước
+FOLLOWUP_PATTERNS = [
+    r"^còn\b", r"\bchỉ (lấy|xem|cần|giữ)\b", r"\btrong (số|đó|mấy|các căn)\b", r"\b(những|các|mấy) căn (này|đó|trên|vừa rồi)\b",
+    r"\bcăn nào\b", r"\bthì sao\b", r"\blọc\b", r"\bbỏ (căn|những)\b", r"\bưu tiên\b", r"\bsắp xếp\b", r"\bthôi\b",
+]
+_FOLLOWUP_RE = re.compile("|".join(FOLLOWUP_PATTERNS), re.IGNORECASE)
+# Người dùng chủ động bắt đầu tìm kiếm mới
+_RESET_RE = re.compile(r"\b(tìm (lại|mới)|câu hỏi (mới|khác)|hỏi (mới|khác))\b", re.IGNORECASE)
+
+
+class ConversationSession:
+    """Trạng thái hội thoại của 1 người dùng (1 REPL CLI / 1 phiên Streamlit), không dùng chung giữa các phiên."""
+
+    def __init__(self, refine_enabled: bool = CONVERSATION_REFINE_ENABLED):
+        self.refine_enabled = refine_enabled
+        self.reset()
+
+    def reset(self):
+        self.base_query: Optional[str] = None
+        self.scope = FilterSpec()          # bộ lọc của câu hỏi đã truy xuất
+        self.refinement = FilterSpec()     # điều kiện cộng dồn từ các câu tinh chỉnh
+        self.cypher_query: Optional[str] = None
+        self.graph_records: List[Dict[str, Any]] = []
+        self.graph_id_map: Dict[str, Dict[str, Any]] = {}
+        self.vector_passages: List[Passage] = []
+        self.shown_ids: List[str] = []     # các căn vừa hiển thị (mốc cho "rẻ hơn", "rộng hơn")
+        self.excluded_ids: set = set()
+        self.turns: List[Dict[str, Any]] = []
+
+    @property
+    def has_context(self) -> bool:
+        return bool(self.base_query and (self.graph_records or self.vector_passages))
+
+    # QUYẾT ĐỊNH
+    def classify(self, question: str) -> Tuple[str, str]:
+        """("refine" | "full", lý do)."""
+        if not self.refine_enabled:
+            return "full", "disabled"
+        if not self.has_context:
+            return "full", "no_context"
+        if _RESET_RE.search(question):
+            return "full", "reset"
+        spec = parse_question(question)
+        if not spec.within(self.scope):
+            return "full", "scope_change"
+        if parse_relative(question):
+            return "refine", "relative"
+        if _FOLLOWUP_RE.search(question):
+            return "refine", "followup"
+        if not spec.is_empty() and len(question.split()) <= CONVERSATION_MAX_REFINE_WORDS:
+            return "refine", "extra_filter"
+        return "full", "new_question"
+
+    # CẬP NHẬT SAU TRUY XUẤT ĐẦY ĐỦ
+    def start(self, question: str, result: Dict[str, Any]):
+        self.reset_candidates()
+        self.base_query = question
+        self.scope = parse_question(question)
+        self.cypher_query = result.get("cypher_query")
+        self.graph_records = list(result.get("graph_records") or [])
+        self.graph_id_map = dict(result.get("graph_id_map") or {})
+        self.vector_passages = list(result.get("vector_passages") or [])
+        self.shown_ids = [str(p.id).strip() for p in result.get("chosen_passages") or [] if p.id]
+
+    def reset_candidates(self):
+        self.refinement = FilterSpec()
+        self.excluded_ids = set()
+
+    # TINH CHỈNH TRONG BỘ NHỚ
+    def _apply_relative(self, spec: FilterSpec, relative: List[str]) -> FilterSpec:
+        """"rẻ hơn" → giá < căn rẻ nhất vừa hiển thị; "rộng hơn" → diện tích > căn rộng nhất; bỏ các căn đã hiển thị."""
+        shown = [self.graph_id_map[i] for i in self.shown_ids if i in self.graph_id_map]
+        prices = [float(r["price_ty_vnd"]) for r in shown if _is_number(r.get("price_ty_vnd"))]
+        areas = [float(r["area_m2"]) for r in shown if _is_number(r.get("area_m2"))]
+        extra = FilterSpec()
+        if "cheaper" in relative and prices:
+            extra.price_max, extra.sort = min(prices), "price_asc"
+        if "pricier" in relative and prices:
+            extra.price_min, extra.sort = max(prices), "price_desc"
+        if "larger" in relative and areas:
+            extra.area_min, extra.sort = max(areas), "area_desc"
+        if "smaller" in relative and areas:
+            extra.area_max, extra.sort = min(areas), "area_asc"
+        if relative:
+            self.excluded_ids.update(self.shown_ids)
+        return spec.merge(extra)
+
+    def candidates(self, spec: FilterSpec) -> Tuple[List[str], List[Passage]]:
+        """(graph id đã lọc + xếp lại, passage vector đã lọc) từ tập ứng viên của phiên."""
+        seen, graph_ids = set(), []
+        records = [(rid, r) for rid, r in self.graph_id_map.items()]
+        if spec.sort:
+            records.sort(key=lambda item: spec.sort_key(item[1]))
+        for rid, record in records:
+            if rid in self.excluded_ids or id(record) in seen or not spec.matches(record):
+                continue
+            # id bài trùng và id chuẩn cùng trỏ tới 1 record → chỉ giữ id đầu tiên
+            seen.add(id(record))
+            graph_ids.append(rid)
+        passages, kept = [], set(graph_ids)
+        for p in self.vector_passages:
+            pid = str(p.id).strip() if p.id else None
+            if not pid or pid in self.excluded_ids:
+                continue
+            if pid in self.graph_id_map:
+                if pid in kept:
+                    passages.append(p)
+            elif spec.matches(None, p.text):
+                passages.append(p)
+        if spec.sort:
+            # Có yêu cầu sắp xếp → thứ tự do Graph quyết định, căn chỉ có trong vector xếp sau
+            order = {gid: i for i, gid in enumerate(graph_ids)}
+            passages.sort(key=lambda p: order.get(str(p.id).strip(), len(order)))
+        return graph_ids, passages
+
+    @staticmethod
+    def _pick_in_order(vclient, graph_ids: List[str], passages: List[Passage], limit: int) -> List[Passage]:
+        """"rẻ nhất" / "rộng nhất": giữ đúng thứ tự Graph (không ưu tiên căn trùng Vector), thiếu thì bù từ Vector."""
+        vector_by_id = {str(p.id).strip(): p for p in passages if p.id}
+        missing = [g for g in graph_ids[:limit] if g not in vector_by_id]
+        if missing:
+            vector_by_id.update({p.id: p for p in vector_fetch_by_ids(vclient, missing, limit=len(missing))})
+        chosen = [vector_by_id[g] for g in graph_ids[:limit] if g in vector_by_id]
+        for p in passages:
+            if len(chosen) >= limit:
+                break
+            if p not in chosen:
+                chosen.append(p)
+        return chosen
+
+    async def _refine(self, pipeline, question: str, limit: int, model: Optional[str],
+                      on_event: Optional[Callable[[str, Any], None]], reason: str) -> Optional[Dict[str, Any]]:
+        total_start = time.time()
+        t0 = time.time()
+        spec = self._apply_relative(self.refinement.merge(parse_question(question)), parse_relative(question))
+        graph_ids, passages = self.candidates(spec)
+        limit = spec.limit or limit
+        if spec.sort:
+            chosen = self._pick_in_order(pipeline.vclient, graph_ids, passages, limit)
+        else:
+            chosen = select_topN_by_priority(graph_ids, passages, pipeline.vclient, self.graph_id_map, fill_limit=limit)
+        refine_ms = int((time.time() - t0) * 1000)
+        if not chosen:
+            return None
+        self.refinement = spec
+
+        ctx = {
+            "query": question,
+            "cypher_query": self.cypher_query,
+            "graph_records": [self.graph_id_map[g] for g in graph_ids],
+            "graph_ids": graph_ids,
+            "graph_id_map": self.graph_id_map,
+            "vector_passages": passages,
+            "chosen_passages": chosen,
+            "fusion": None,
+            "sub_queries": [],
+            "retrieval_plan": {},
+            "partial": False,
+            "missing_branches": [],
+        }
+        if on_event is not None:
+            on_event("context", ctx)
+        # LLM cần ngữ cảnh câu hỏi gốc để hiểu câu tinh chỉnh ngắn
+        synthesis_query = f"{self.base_query}\nCâu hỏi tiếp theo: {question}"
+        t0 = time.time()
+        answer, answer_source, route = pipeline.synthesize(
+            synthesis_query, chosen, self.graph_id_map, limit=limit, model=model, on_event=on_event)
+        llm_ms = int((time.time() - t0) * 1000)
+        self.shown_ids = [str(p.id).strip() for p in chosen if p.id]
+        return {
+            **ctx,
+            "answer": answer,
+            "answer_source": answer_source,
+            "render_route": route,
+            "cache_similarity": None,
+            "session": {"mode": "refine", "reason": reason, "filter": spec.to_dict(), "base_query": self.base_query},
+            "timings": {"hybrid_ms": 0, "refine_ms": refine_ms, "fusion_ms": refine_ms, "llm_ms": llm_ms,
+                        "total_ms": int((time.time() - total_start) * 1000)},
+        }
+
+    # HỎI
+    async def ask_async(self, pipeline, question: str, top_k: int = 10, limit: int = 3,
+                        model: Optional[str] = None, on_event: Optional[Callable[[str, Any], None]] = None,
+                        budget_ms: Optional[int] = None) -> Dict[str, Any]:
+        """Trả lời trong phiên: tinh chỉnh trên tập ứng viên cũ nếu được, ngược lại chạy pipeline đầy đủ."""
+        mode, reason = self.classify(question)
+        result = None
+        if mode == "refine":
+            # pipeline chỉ ghi câu chạy đầy đủ → tự ghi lượt tinh chỉnh vào QUERY_CAPTURE_PATH, loại "refine"
+            # (câu tinh chỉnh chỉ có nghĩa trong phiên → phát lại / làm nóng cache bỏ qua)
+            started, error = time.time(), None
+            try:
+                result = await self._refine(pipeline, question, limit, model, on_event, reason)
+            except Exception as e:
+                error = str(e)
+                raise
+            finally:
+                if result is not None or error is not None:
+                    capture("refine", question, started, top_k, limit, budget_ms, result, error,
+                            source="conversation", session_mode="refine", base_query=self.base_query)
+            if result is None:
+                # Lọc hết ứng viên → truy xuất lại với đủ ngữ cảnh
+                mode, reason = "full", "no_candidates"
+        if result is None:
+            query = f"{self.base_query}, {question}" if reason == "no_candidates" else question
+            result = await pipeline.answer_async(query, top_k=top_k, limit=limit, model=model,
+                                                 on_event=on_event, budget_ms=budget_ms)
+            self.start(query, result)
+            result["session"] = {"mode": "full", "reason": reason, "filter": self.scope.to_dict(),
+                                 "base_query": self.base_query}
+        self.turns.append({"question": question, "mode": mode, "reason": reason,
+                           "total_ms": result["timings"].get("total_ms")})
+        return result
+
+    def ask(self, pipeline, question: str, top_k: int = 10, limit: int = 3,
+            model: Optional[str] = None, budget_ms: Optional[int] = None) -> Dict[str, Any]:
+        return asyncio.run(self.ask_async(pipeline, question, top_k=top_k, limit=limit, model=model,
+                                          budget_ms=budget_ms))
+
+
+def _is_number(value: Any) -> bool:
+    try:
+        float(value)
+        return True
+    except (TypeError, ValueError):
+        return False
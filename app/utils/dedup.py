@@ -0,0 +1,194 @@
+# app/utils/dedup.py
+"""
+Phát hiện bài đăng gần trùng (đăng lại nhiều lần, sửa vài chữ) bằng MinHash + LSH.
+
+- Shingle: các cụm k ký tự của mô tả đã chuẩn hóa (chữ thường, bỏ dấu câu, gộp khoảng trắng).
+- MinHash: `num_perm` hàm băm dạng (a*x + b) mod p, tính vector hóa bằng NumPy.
+- LSH: chia chữ ký thành `bands` dải, bài trùng dải → ứng viên; giữ cặp có Jaccard ước lượng ≥ threshold.
+- Gom nhóm bằng union-find, mỗi nhóm giữ 1 id chuẩn (canonical), các id còn lại là alias.
+
+Chỉ id chuẩn được đưa vào FAISS; bản đồ alias → canonical được lưu cạnh index để
+ghép id trả về từ Neo4j (đồ thị vẫn giữ đủ mọi bài) với passage trong VectorDB.
+"""
+import os
+import re
+import json
+import zlib
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+
+DEDUP_ALIASES_PATH = os.getenv("DEDUP_ALIASES_PATH", ".vector_store/dedup_aliases.json")
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", 0.8))
+DEDUP_NUM_PERM = int(os.getenv("DEDUP_NUM_PERM", 128))
+DEDUP_BANDS = int(os.getenv("DEDUP_BANDS", 32))
+DEDUP_SHINGLE_SIZE = int(os.getenv("DEDUP_SHINGLE_SIZE", 5))
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+# CHUẨN HÓA + SHINGLE
+def normalize_text(text: str) -> str:
+    return " ".join(re.sub(r"[^\w\s]", " ", str(text or "").lower()).split())
+
+
+def shingles(text: str, k: int = DEDUP_SHINGLE_SIZE) -> np.ndarray:
+    """Tập hash (uint32) các cụm k ký tự."""
+    norm = normalize_text(text)
+    if len(norm) <= k:
+        grams = {norm} if norm else set()
+    else:
+        grams = {norm[i:i + k] for i in range(len(norm) - k + 1)}
+    return np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+
+
+# MINHASH
+class MinHasher:
+    def __init__(self, num_perm: int = DEDUP_NUM_PERM, seed: int = 1):
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.a = rng.randint(1, _MAX_HASH, size=num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, _MAX_HASH, size=num_perm, dtype=np.uint64)
+
+    def signature(self, hashes: np.ndarray) -> np.ndarray:
+        if hashes.size == 0:
+            return np.full(self.num_perm, _MAX_HASH, dtype=np.uint64)
+        # (n_shingles, num_perm) → min theo từng hàm băm
+        phv = (np.outer(hashes, self.a) + self.b) % _MERSENNE_PRIME & _MAX_HASH
+        return phv.min(axis=0)
+
+    def signatures(self, texts: Iterable[str], k: int = DEDUP_SHINGLE_SIZE) -> np.ndarray:
+        return np.vstack([self.signature(shingles(t, k)) for t in texts]) if texts else np.zeros((0, self.num_perm))
+
+
+# GOM NHÓM
+@dataclass
+class DedupResult:
+    canonical_ids: List[str]
+    aliases: Dict[str, str] = field(default_factory=dict)   # alias id → canonical id
+    groups: Dict[str, List[str]] = field(default_factory=dict)  # canonical id → [alias ids]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "documents": len(self.canonical_ids) + len(self.aliases),
+            "canonical": len(self.canonical_ids),
+            "aliases": len(self.aliases),
+            "groups": len(self.groups),
+        }
+
+
+def _find(parent: List[int], i: int) -> int:
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def find_near_duplicates(ids: Sequence[str], texts: Sequence[str], threshold: float = DEDUP_THRESHOLD,
+                         num_perm: int = DEDUP_NUM_PERM, bands: int = DEDUP_BANDS,
+                         shingle_size: int = DEDUP_SHINGLE_SIZE,
+                         priority: Optional[Dict[str, float]] = None) -> DedupResult:
+    """
+    Nhóm các bài gần trùng (Jaccard ước lượng ≥ threshold).
+    priority: id → điểm ưu tiên làm canonical (cao hơn được giữ); mặc định ưu tiên mô tả dài hơn.
+    """
+    n = len(ids)
+    if n == 0:
+        return DedupResult(canonical_ids=[])
+    rows = num_perm // bands
+    sigs = MinHasher(num_perm).signatures(texts, shingle_size)
+
+    buckets = defaultdict(list)
+    for band in range(bands):
+        chunk = np.ascontiguousarray(sigs[:, band * rows:(band + 1) * rows])
+        for i in range(n):
+            buckets[(band, chunk[i].tobytes())].append(i)
+
+    # so mọi cặp trong 1 bucket (không chỉ với phần tử đầu); cặp đã chung nhóm thì bỏ qua
+    parent = list(range(n))
+    checked = set()
+    for members in buckets.values():
+        if len(members) < 2:
+            continue
+        for x, i in enumerate(members):
+            for j in members[x + 1:]:
+                if (i, j) in checked:
+                    continue
+                checked.add((i, j))
+                ra, rb = _find(parent, i), _find(parent, j)
+                if ra != rb and float(np.mean(sigs[i] == sigs[j])) >= threshold:
+                    parent[rb] = ra
+
+    clusters = defaultdict(list)
+    for i in range(n):
+        clusters[_find(parent, i)].append(i)
+
+    def _rank(i: int):
+        score = priority.get(ids[i], 0.0) if priority else 0.0
+        return (-score, -len(texts[i] or ""), len(str(ids[i])), str(ids[i]))
+
+    canonical, aliases, groups = [], {}, {}
+    for members in clusters.values():
+        members.sort(key=_rank)
+        head = str(ids[members[0]])
+        canonical.append(head)
+        if len(members) > 1:
+            groups[head] = [str(ids[i]) for i in members[1:]]
+            for i in members[1:]:
+                aliases[str(ids[i])] = head
+    order = {str(x): i for i, x in enumerate(ids)}
+    canonical.sort(key=lambda x: order[x])
+    return DedupResult(canonical_ids=canonical, aliases=aliases, groups=groups)
+
+
+# LƯU / TRA CỨU ALIAS
+def save_aliases(result: DedupResult, path: str = DEDUP_ALIASES_PATH) -> str:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"aliases": result.aliases, "groups": result.groups}, f, ensure_ascii=False)
+    os.replace(tmp, path)
+    return path
+
+
+class AliasStore:
+    """alias id → canonical id (đọc lại khi file được dựng lại; chưa dedup thì id giữ nguyên)."""
+
+    def __init__(self, path: str = DEDUP_ALIASES_PATH):
+        self.path = path
+        self._aliases: Dict[str, str] = {}
+        self._mtime = None
+
+    def _refresh(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            self._aliases, self._mtime = {}, None
+            return
+        if mtime != self._mtime:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._aliases = json.load(f).get("aliases") or {}
+            self._mtime = mtime
+
+    def canonical(self, listing_id) -> str:
+        self._refresh()
+        lid = str(listing_id).strip()
+        return self._aliases.get(lid, lid)
+
+    def canonicalize_ids(self, ids: Iterable) -> List[str]:
+        """Đổi sang id chuẩn, bỏ trùng, giữ thứ tự."""
+        self._refresh()
+        out = []
+        for x in ids:
+            cid = self._aliases.get(str(x).strip(), str(x).strip())
+            if cid and cid not in out:
+                out.append(cid)
+        return out
+
+    def __len__(self) -> int:
+        self._refresh()
+        return len(self._aliases)
@@ -0,0 +1,186 @@
+# app/utils/embedding_config.py
+"""
+Cấu hình embedding dùng chung cho ingest_vector_db, NL2CypherRetriever và VectorClient.
+
+- EMBED_DIMENSIONS: rút gọn số chiều (text-embedding-3-* hỗ trợ tham số `dimensions`,
+  vector trả về đã được chuẩn hóa lại). 0 = giữ nguyên (1536).
+- EMBED_STORAGE: float32 | float16 | int8 → FAISS IndexScalarQuantizer (fp16 / 8bit) thay cho IndexFlatL2.
+- EMBED_RESCORE: khi index đã lượng tử hóa, tìm shortlist k * EMBED_RESCORE_FACTOR rồi chấm lại khoảng cách
+  chính xác từ file vector float32 (np.memmap → dùng chung page cache giữa các worker, không nhân bản RAM).
+
+Cấu hình lúc build được lưu cạnh index (embedding_config.json); lúc load, câu hỏi luôn được embedding
+theo đúng cấu hình của index đó.
+"""
+import os
+import json
+from dataclasses import dataclass, asdict
+from typing import Optional
+
+from app.config import get_var
+
+
+EMBED_MODEL = get_var("OPENAI_EMBED_MODEL", "text-embedding-3-small")
+EMBED_DIMENSIONS = int(get_var("EMBED_DIMENSIONS", 0))
+EMBED_STORAGE = str(get_var("EMBED_STORAGE", "float32")).lower()
+EMBED_RESCORE = str(get_var("EMBED_RESCORE", "0")) != "0"
+EMBED_RESCORE_FACTOR = int(get_var("EMBED_RESCORE_FACTOR", 4))
+
+CONFIG_FILE = "embedding_config.json"
+VECTORS_FILE = "vectors_f32.npy"
+STORAGE_TYPES = ("float32", "float16", "int8")
+
+
+@dataclass
+class EmbeddingConfig:
+    model: str = EMBED_MODEL
+    dimensions: int = EMBED_DIMENSIONS
+    storage: str = EMBED_STORAGE
+
+    def __post_init__(self):
+        self.dimensions = int(self.dimensions or 0)
+        self.storage = str(self.storage or "float32").lower()
+        if self.storage not in STORAGE_TYPES:
+            raise ValueError(f"❌ EMBED_STORAGE không hợp lệ: {self.storage} (chọn {STORAGE_TYPES})")
+
+    def save(self, folder: str) -> str:
+        path = os.path.join(folder, CONFIG_FILE)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(asdict(self), f)
+        return path
+
+    @classmethod
+    def load(cls, folder: str) -> Optional["EmbeddingConfig"]:
+        """Cấu hình đã dùng để build index (None nếu index cũ, build trước khi có file này)."""
+        path = os.path.join(folder, CONFIG_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(**json.load(f))
+
+    @classmethod
+    def for_index(cls, folder: str, model: str = EMBED_MODEL) -> "EmbeddingConfig":
+        """Cấu hình của index có sẵn (FAISS / Chroma); index FAISS cũ không có file cấu hình → 1536 chiều float32."""
+        saved = cls.load(folder)
+        if saved is not None:
+            return saved
+        if os.path.exists(os.path.join(folder, "index.faiss")):
+            return cls(model=model, dimensions=0, storage="float32")
+        return cls(model=model)
+
+
+def make_embeddings(config: EmbeddingConfig):
+    """OpenAIEmbeddings theo cấu hình, gọi qua chính sách deadline / retry / hedging (app/utils/llm_calls.py)."""
+    from langchain_openai import OpenAIEmbeddings
+    from app.utils.llm_calls import LLM_POLICY_ENABLED, wrap_embeddings
+    kwargs = {"model": config.model}
+    if config.dimensions:
+        kwargs["dimensions"] = config.dimensions
+    if not LLM_POLICY_ENABLED:
+        return OpenAIEmbeddings(**kwargs)
+    return wrap_embeddings(OpenAIEmbeddings(**kwargs, max_retries=0))
+
+
+# VECTOR / INDEX
+def truncate_vectors(mat, dimensions: int):
+    """Giữ `dimensions` chiều đầu rồi chuẩn hóa L2 lại (tương đương tham số `dimensions` của API)."""
+    import numpy as np
+    mat = np.asarray(mat, dtype=np.float32)
+    if dimensions and dimensions < mat.shape[1]:
+        mat = mat[:, :dimensions]
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    return mat / np.where(norms > 0, norms, 1.0)
+
+
+def index_vectors(index):
+    """Toàn bộ vector trong index dạng float32 (n, d)."""
+    import numpy as np
+    return np.asarray(index.reconstruct_n(0, index.ntotal), dtype=np.float32)
+
+
+def build_index(vectors, storage: str = "float32"):
+    """IndexFlatL2 (float32) hoặc IndexScalarQuantizer (fp16 / 8bit), cùng metric L2 với FAISS của langchain."""
+    import faiss
+    import numpy as np
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    d = vectors.shape[1]
+    if storage == "float32":
+        index = faiss.IndexFlatL2(d)
+    else:
+        qtype = faiss.ScalarQuantizer.QT_fp16 if storage == "float16" else faiss.ScalarQuantizer.QT_8bit
+        index = faiss.IndexScalarQuantizer(d, qtype, faiss.METRIC_L2)
+        index.train(vectors)
+    index.add(vectors)
+    return index
+
+
+def index_nbytes(index) -> int:
+    """Kích thước phần mã vector trong RAM."""
+    code_size = getattr(index, "code_size", None) or index.d * 4
+    return int(code_size) * int(index.ntotal)
+
+
+class RescoringIndex:
+    """
+    Bọc index đã lượng tử hóa: tìm shortlist k*factor rồi chấm lại L2 chính xác từ vector float32 (memmap).
+    Đủ giao diện mà FAISS vectorstore của langchain dùng (search / reconstruct / ntotal / d).
+    """
+
+    def __init__(self, base, vectors, factor: int = EMBED_RESCORE_FACTOR):
+        self.base = base
+        self.vectors = vectors
+        self.factor = max(1, int(factor))
+
+    @property
+    def d(self) -> int:
+        return self.base.d
+
+    @property
+    def ntotal(self) -> int:
+        return self.base.ntotal
+
+    def search(self, x, k: int):
+        import numpy as np
+        x = np.asarray(x, dtype=np.float32)
+        _, cand = self.base.search(x, min(self.ntotal, k * self.factor))
+        out_d = np.full((x.shape[0], k), np.inf, dtype=np.float32)
+        out_i = np.full((x.shape[0], k), -1, dtype=np.int64)
+        for qi in range(x.shape[0]):
+            # id tăng dần → đọc memmap tuần tự hơn
+            ids = np.sort(cand[qi][cand[qi] >= 0])
+            if not ids.size:
+                continue
+            dist = ((np.asarray(self.vectors[ids]) - x[qi]) ** 2).sum(axis=1)
+            top = np.argsort(dist, kind="stable")[:k]
+            out_d[qi, :top.size] = dist[top]
+            out_i[qi, :top.size] = ids[top]
+        return out_d, out_i
+
+    def reconstruct(self, i: int):
+        import numpy as np
+        return np.asarray(self.vectors[int(i)], dtype=np.float32)
+
+
+def apply_storage(vs, folder: str, config: EmbeddingConfig):
+    """
+    Trước khi save_local: thay index của FAISS vectorstore theo `config.storage`,
+    lưu vector float32 (cho rescoring) + file cấu hình vào thư mục index.
+    """
+    import numpy as np
+    os.makedirs(folder, exist_ok=True)
+    vectors = index_vectors(vs.index)
+    if config.storage != "float32":
+        np.save(os.path.join(folder, VECTORS_FILE), vectors)
+        vs.index = build_index(vectors, config.storage)
+    elif os.path.exists(os.path.join(folder, VECTORS_FILE)):
+        os.remove(os.path.join(folder, VECTORS_FILE))
+    config.save(folder)
+    return vs
+
+
+def attach_rescoring(vs, folder: str, rescore: bool = EMBED_RESCORE, factor: int = EMBED_RESCORE_FACTOR):
+    """Sau khi load_local: bật rescoring chính xác nếu được cấu hình và có file vector float32."""
+    path = os.path.join(folder, VECTORS_FILE)
+    if rescore and os.path.exists(path):
+        import numpy as np
+        vs.index = RescoringIndex(vs.index, np.load(path, mmap_mode="r"), factor)
+    return vs
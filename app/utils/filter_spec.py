@@ -0,0 +1,281 @@
+# app/utils/filter_spec.py
+"""
+Bộ lọc có cấu trúc của 1 câu hỏi (quận, loại nhà, khoảng giá, diện tích, hướng, pháp lý, tiện ích, sắp xếp).
+
+- parse_question(): tách bộ lọc từ câu hỏi tiếng Việt bằng luật (không gọi LLM):
+  "nhà 5 tầng sổ đỏ ở Thanh Xuân dưới 5 tỷ" → districts=[thanh xuân], price_max=5, legal=[sổ đỏ], amenities=[5 tầng].
+- parse_relative(): các yêu cầu tương đối so với kết quả trước ("rẻ hơn", "rộng hơn", ...).
+- FilterSpec.matches() / apply_filter(): lọc + sắp xếp record Neo4j (hoặc passage vector) trong bộ nhớ.
+
+Tên quận / hướng / pháp lý được chuẩn hóa về chữ thường như trong graph ("thanh xuân", "tây nam").
+"""
+import re
+from dataclasses import asdict, dataclass, field, fields
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+HANOI_DISTRICTS = [
+    "ba đình", "hoàn kiếm", "tây hồ", "long biên", "cầu giấy", "đống đa", "hai bà trưng", "hoàng mai",
+    "thanh xuân", "nam từ liêm", "bắc từ liêm", "hà đông", "sơn tây", "ba vì", "chương mỹ", "đan phượng",
+    "đông anh", "gia lâm", "hoài đức", "mê linh", "mỹ đức", "phú xuyên", "phúc thọ", "quốc oai", "sóc sơn",
+    "thạch thất", "thanh oai", "thanh trì", "thường tín", "ứng hòa",
+]
+# Tên dài trước để "nam từ liêm" không bị bắt thành "từ liêm"
+_DISTRICT_RE = re.compile(
+    r"(?<!\w)(" + "|".join(sorted(map(re.escape, HANOI_DISTRICTS), key=len, reverse=True)) + r")(?!\w)")
+
+PROPERTY_TYPES = {
+    "biệt thự": r"biệt thự",
+    "chung cư mini": r"chung cư mini|ccmn",
+    "chung cư": r"chung cư(?! mini)",
+    "căn hộ": r"căn hộ",
+    "tòa nhà": r"tòa nhà|toà nhà",
+    "đất": r"(?:mảnh|lô|thửa) đất|đất nền",
+}
+DIRECTIONS = ["đông nam", "đông bắc", "tây nam", "tây bắc", "đông", "tây", "nam", "bắc"]
+_DIRECTION_RE = re.compile(r"hướng\s+(" + "|".join(DIRECTIONS) + r")(?!\w)")
+LEGAL_KEYWORDS = ["sổ đỏ", "sổ hồng", "chính chủ", "pháp lý rõ ràng"]
+AMENITY_KEYWORDS = ["thang máy", "nội thất", "gara", "điều hòa", "sân phơi", "phòng thờ", "sân vườn", "bể bơi"]
+FACILITY_KEYWORDS = ["trung tâm thương mại", "bệnh viện", "trường học", "đại học", "công viên", "siêu thị",
+                     "phố cổ", "hồ tây", "chợ", "trường", "hồ"]
+# "gần" + tối đa 2 từ đệm + tiện ích; trong cửa sổ đó lấy từ khóa dài nhất ("gần trường đại học" → "đại học")
+_NEAR_RE = re.compile(r"gần(?=((?:\s+\w+){1,6}))")
+_FACILITY_RE = re.compile(
+    r"(?<!\w)(" + "|".join(sorted(map(re.escape, FACILITY_KEYWORDS), key=len, reverse=True)) + r")(?!\w)")
+_FACILITY_MAX_PREFIX_WORDS = 2
+_FLOORS_RE = re.compile(r"(\d+)\s*tầng")
+
+# Giá "khoảng 4 tỷ" → 4 ± 15%
+APPROX_RATIO = 0.15
+_NUM = r"(\d+(?:[.,]\d+)?)"
+_PRICE_UNIT = r"\s*(tỷ|tỉ|triệu|tr)(?!\w)"
+_AREA_UNIT = r"\s*(m2|m²|mét vuông|m vuông)(?!\w)"
+_MAX_WORDS = r"(?:dưới|không quá|tối đa|rẻ hơn|nhỏ hơn|ít hơn|thấp hơn|chưa tới|chưa đến|<=?)"
+_MIN_WORDS = r"(?:trên|đắt hơn|rộng hơn|lớn hơn|cao hơn|hơn|tối thiểu|ít nhất|>=?)"
+
+SORTS = ("price_asc", "price_desc", "area_asc", "area_desc")
+_SORT_PATTERNS = [
+    ("price_asc", r"rẻ nhất|giá (?:thấp|tốt|mềm) nhất"),
+    ("price_desc", r"đắt nhất|giá cao nhất"),
+    ("area_desc", r"rộng nhất|(?:diện tích )?lớn nhất|to nhất"),
+    ("area_asc", r"nhỏ nhất|hẹp nhất"),
+]
+# Yêu cầu tương đối (không có số đi kèm): so với các căn vừa hiển thị
+_RELATIVE_PATTERNS = [
+    ("cheaper", r"rẻ hơn|giá (?:thấp|mềm|tốt) hơn|mềm hơn"),
+    ("pricier", r"đắt hơn|giá cao hơn"),
+    ("larger", r"rộng hơn|to hơn|(?:diện tích )?lớn hơn"),
+    ("smaller", r"nhỏ hơn|hẹp hơn|bé hơn"),
+]
+
+
+@dataclass
+class FilterSpec:
+    districts: List[str] = field(default_factory=list)
+    property_types: List[str] = field(default_factory=list)
+    price_min: Optional[float] = None          # tỷ VNĐ
+    price_max: Optional[float] = None
+    area_min: Optional[float] = None           # m²
+    area_max: Optional[float] = None
+    directions: List[str] = field(default_factory=list)
+    legal: List[str] = field(default_factory=list)
+    amenities: List[str] = field(default_factory=list)
+    facilities: List[str] = field(default_factory=list)
+    sort: Optional[str] = None                 # một trong SORTS
+    limit: Optional[int] = None
+
+    def is_empty(self) -> bool:
+        return not any(getattr(self, f.name) not in (None, []) for f in fields(self))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {k: v for k, v in asdict(self).items() if v not in (None, [])}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "FilterSpec":
+        known = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in (data or {}).items() if k in known})
+
+    def merge(self, other: "FilterSpec") -> "FilterSpec":
+        """Gộp bộ lọc của câu hỏi tiếp theo: cận số lấy phần giao, danh sách từ khóa cộng dồn, sort/limit ghi đè."""
+        out = FilterSpec.from_dict(asdict(self))
+        out.districts = other.districts or out.districts
+        out.property_types = other.property_types or out.property_types
+        for name in ("directions", "legal", "amenities", "facilities"):
+            setattr(out, name, _union(getattr(out, name), getattr(other, name)))
+        out.price_min = _max_opt(out.price_min, other.price_min)
+        out.price_max = _min_opt(out.price_max, other.price_max)
+        out.area_min = _max_opt(out.area_min, other.area_min)
+        out.area_max = _min_opt(out.area_max, other.area_max)
+        out.sort = other.sort or out.sort
+        out.limit = other.limit or out.limit
+        return out
+
+    def within(self, scope: "FilterSpec") -> bool:
+        """
+        True nếu bộ lọc này chỉ thu hẹp `scope` (lọc lại tập ứng viên cũ là đủ);
+        False khi đổi quận / loại nhà hoặc nới rộng khoảng giá, diện tích → cần truy xuất lại.
+        """
+        if self.districts and not set(self.districts) <= set(scope.districts):
+            return False
+        if self.property_types and not set(self.property_types) <= set(scope.property_types):
+            return False
+        for lo_name, hi_name in (("price_min", "price_max"), ("area_min", "area_max")):
+            lo, hi = getattr(self, lo_name), getattr(self, hi_name)
+            scope_lo, scope_hi = getattr(scope, lo_name), getattr(scope, hi_name)
+            if scope_lo is not None and lo is not None and lo < scope_lo:
+                return False
+            if scope_hi is not None and hi is not None and hi > scope_hi:
+                return False
+        return True
+
+    # LỌC TRONG BỘ NHỚ
+    def matches(self, record: Optional[Dict[str, Any]], text: str = "") -> bool:
+        """
+        record: thuộc tính Neo4j của căn (None nếu căn chỉ có trong vector → chỉ khớp được theo từ khóa trong text).
+        Trường số / quận / loại nhà không có dữ liệu → không khớp (không khẳng định được căn thỏa điều kiện).
+        """
+        record = record or {}
+        text = (text or "").lower()
+        if self.districts and str(record.get("district_name") or "").strip().lower() not in self.districts:
+            return False
+        if self.property_types:
+            ptype = _joined(record.get("property_type"))
+            if not any(t in ptype for t in self.property_types):
+                return False
+        for value, lo, hi in ((_float(record.get("price_ty_vnd")), self.price_min, self.price_max),
+                              (_float(record.get("area_m2")), self.area_min, self.area_max)):
+            if lo is None and hi is None:
+                continue
+            if value is None or (lo is not None and value < lo) or (hi is not None and value > hi):
+                return False
+        keyword_checks = (
+            (self.directions, _joined(record.get("direction")), any),
+            (self.legal, _joined(record.get("legal_status")), all),
+            (self.amenities, _joined(record.get("internal_amenities"), record.get("house_design")), all),
+            (self.facilities, _joined(record.get("near_facilities")), all),
+        )
+        for keywords, haystack, combine in keyword_checks:
+            if keywords and not combine(k in haystack or k in text for k in keywords):
+                return False
+        return True
+
+    def sort_key(self, record: Optional[Dict[str, Any]]):
+        """Khóa sắp xếp theo self.sort (căn thiếu giá trị xếp cuối)."""
+        name = "price_ty_vnd" if (self.sort or "").startswith("price") else "area_m2"
+        value = _float((record or {}).get(name))
+        if value is None:
+            return (1, 0.0)
+        return (0, -value if (self.sort or "").endswith("desc") else value)
+
+
+def apply_filter(records: Iterable[Dict[str, Any]], spec: FilterSpec) -> List[Dict[str, Any]]:
+    """Lọc record Neo4j theo spec, giữ thứ tự gốc (hoặc theo spec.sort), cắt theo spec.limit."""
+    out = [r for r in records if spec.matches(r)]
+    if spec.sort in SORTS:
+        out.sort(key=spec.sort_key)
+    return out[:spec.limit] if spec.limit else out
+
+
+# PHÂN TÍCH CÂU HỎI
+def _float(value: Any) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _joined(*values: Any) -> str:
+    parts = []
+    for v in values:
+        parts.extend(v if isinstance(v, list) else [v])
+    return " | ".join(str(p).lower() for p in parts if p)
+
+
+def _union(a: List[str], b: List[str]) -> List[str]:
+    return a + [x for x in b if x not in a]
+
+
+def _min_opt(a: Optional[float], b: Optional[float]) -> Optional[float]:
+    return b if a is None else a if b is None else min(a, b)
+
+
+def _max_opt(a: Optional[float], b: Optional[float]) -> Optional[float]:
+    return b if a is None else a if b is None else max(a, b)
+
+
+def _to_number(raw: str, unit: str) -> float:
+    value = float(raw.replace(",", "."))
+    return value / 1000 if unit in ("triệu", "tr") else value
+
+
+def _parse_range(text: str, unit_re: str) -> Tuple[Optional[float], Optional[float], str]:
+    """Tìm (min, max) theo đơn vị unit_re; phần đã khớp bị xóa khỏi text để không bị đọc lại."""
+    lo = hi = None
+    m = re.search(rf"(?:từ\s*)?{_NUM}\s*(?:tỷ|tỉ|m2|m²)?\s*(?:-|–|đến|tới)\s*{_NUM}{unit_re}", text)
+    if m:
+        unit = m.group(3)
+        lo, hi = sorted((_to_number(m.group(1), unit), _to_number(m.group(2), unit)))
+        return lo, hi, text[:m.start()] + " " + text[m.end():]
+    for pattern, is_max in ((rf"{_MAX_WORDS}\s*{_NUM}{unit_re}", True), (rf"(?:từ|{_MIN_WORDS})\s*{_NUM}{unit_re}", False)):
+        m = re.search(pattern, text)
+        if m:
+            value = _to_number(m.group(1), m.group(2))
+            hi, lo = (value, lo) if is_max else (hi, value)
+            text = text[:m.start()] + " " + text[m.end():]
+    if lo is None and hi is None:
+        m = re.search(rf"{_NUM}{unit_re}", text)
+        if m:
+            value = _to_number(m.group(1), m.group(2))
+            lo, hi = round(value * (1 - APPROX_RATIO), 3), round(value * (1 + APPROX_RATIO), 3)
+            text = text[:m.start()] + " " + text[m.end():]
+    return lo, hi, text
+
+
+def _find_keywords(text: str, keywords: List[str]) -> List[str]:
+    found = []
+    for k in keywords:
+        # "trường" không tính lại khi đã có "trường học"
+        if re.search(rf"(?<!\w){re.escape(k)}(?!\w)", text) and not any(k in f for f in found):
+            found.append(k)
+    return found
+
+
+def find_districts(text: str) -> List[Tuple[int, int, str]]:
+    """Vị trí các tên quận trong text đã viết thường: [(start, end, tên quận)]."""
+    return [(m.start(), m.end(), m.group(1)) for m in _DISTRICT_RE.finditer(text)]
+
+
+def _find_facilities(t: str) -> List[str]:
+    found = []
+    for near in _NEAR_RE.finditer(t):
+        window = near.group(1)
+        hits = [m.group(1) for m in _FACILITY_RE.finditer(window)
+                if len(window[:m.start()].split()) <= _FACILITY_MAX_PREFIX_WORDS]
+        if hits:
+            found.append(max(hits, key=len))
+    return list(dict.fromkeys(found))
+
+
+def parse_question(text: str) -> FilterSpec:
+    """Bộ lọc có cấu trúc từ câu hỏi tiếng Việt (luật + từ khóa, trường không nhận ra thì để trống)."""
+    t = " ".join((text or "").lower().split())
+    spec = FilterSpec()
+    spec.price_min, spec.price_max, t = _parse_range(t, _PRICE_UNIT)
+    spec.area_min, spec.area_max, t = _parse_range(t, _AREA_UNIT)
+    spec.districts = list(dict.fromkeys(_DISTRICT_RE.findall(t)))
+    spec.property_types = [name for name, pattern in PROPERTY_TYPES.items() if re.search(pattern, t)]
+    spec.directions = list(dict.fromkeys(_DIRECTION_RE.findall(t)))
+    spec.legal = _find_keywords(t, LEGAL_KEYWORDS)
+    spec.amenities = _find_keywords(t, AMENITY_KEYWORDS) + [f"{n} tầng" for n in _FLOORS_RE.findall(t)]
+    spec.facilities = _find_facilities(t)
+    for name, pattern in _SORT_PATTERNS:
+        if re.search(pattern, t):
+            spec.sort = name
+            break
+    return spec
+
+
+def parse_relative(text: str) -> List[str]:
+    """Yêu cầu so với kết quả trước: cheaper / pricier / larger / smaller ("rẻ hơn 5 tỷ" là cận tuyệt đối, không tính)."""
+    t = " ".join((text or "").lower().split())
+    return [name for name, pattern in _RELATIVE_PATTERNS if re.search(rf"(?:{pattern})(?!\s*\d)", t)]
@@ -0,0 +1,185 @@
+# app/utils/fusion.py
+"""
+Fusion engine vector hóa (NumPy) cho Graph + Vector.
+
+Chấm điểm toàn bộ ứng viên (hàng trăm id từ Neo4j + FAISS) trong một lần:
+    score = w_rrf * RRF(graph_rank, vector_rank)
+          + w_semantic * S_sem
+          + w_hop * 1/(1+hop)
+          + w_relation * w_rel
+- RRF: 1/(k + rank) cộng dồn trên 2 danh sách, chuẩn hóa về [0, 1].
+- S_sem: điểm tương đồng từ VectorDB (Passage.score, càng cao càng gần), 0 nếu không có.
+- hop: 0 nếu id có ở cả Graph và Vector, 1 nếu chỉ có ở Graph, `default_hop_no_match` nếu chỉ ở Vector.
+- w_rel: cùng công thức với hybrid_helpers.estimate_relation_weight (0.5..1.0), tính trên ma trận đặc trưng.
+
+Trả về top-N passage kèm giải thích từng thành phần điểm (cũng được ghi vào Passage.metadata).
+"""
+import os
+from dataclasses import dataclass, field, asdict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app.retrievers.vector_tools import Passage
+
+
+# priority: giữ thuật toán cũ (select_topN_by_priority) · weighted: dùng FusionEngine
+FUSION_STRATEGY = os.getenv("FUSION_STRATEGY", "priority").lower()
+# Số passage lấy từ VectorDB khi dùng weighted (nhiều ứng viên hơn → recall tốt hơn)
+FUSION_VECTOR_K = int(os.getenv("FUSION_VECTOR_K", 100))
+
+# Đặc trưng record Graph dùng cho relation weight (khớp estimate_relation_weight)
+RELATION_FEATURES = ["legal_red_book", "property_type", "full_address", "internal_amenities", "near_facilities"]
+RELATION_FEATURE_WEIGHTS = np.array([0.2, 0.1, 0.05, 0.05, 0.05], dtype=np.float32)
+
+
+@dataclass
+class FusionConfig:
+    rrf_k: int = 60
+    w_rrf: float = 0.4
+    w_semantic: float = 0.3
+    w_hop: float = 0.2
+    w_relation: float = 0.1
+    default_hop_no_match: int = 2
+
+    @classmethod
+    def from_env(cls) -> "FusionConfig":
+        cfg = cls()
+        for name in ("rrf_k", "w_rrf", "w_semantic", "w_hop", "w_relation", "default_hop_no_match"):
+            raw = os.getenv(f"FUSION_{name.upper()}")
+            if raw:
+                setattr(cfg, name, type(getattr(cfg, name))(raw))
+        return cfg
+
+
+@dataclass
+class FusionResult:
+    passages: List[Passage]
+    explanations: List[Dict[str, Any]] = field(default_factory=list)
+    n_candidates: int = 0
+
+
+def relation_feature_matrix(records: List[Optional[Dict[str, Any]]]) -> np.ndarray:
+    """Ma trận (n, len(RELATION_FEATURES)) 0/1 từ các record Graph (None → toàn 0)."""
+    feats = np.zeros((len(records), len(RELATION_FEATURES)), dtype=np.float32)
+    for i, rec in enumerate(records):
+        if not rec:
+            continue
+        legal_text = " ".join(str(x) for x in (rec.get("legal_status") or [])).lower()
+        feats[i] = (
+            "sổ đỏ" in legal_text or "chính chủ" in legal_text,
+            bool(rec.get("property_type")),
+            bool(rec.get("full_address")),
+            bool(rec.get("internal_amenities")),
+            bool(rec.get("near_facilities")),
+        )
+    return feats
+
+
+def relation_weights(records: List[Optional[Dict[str, Any]]]) -> np.ndarray:
+    """Vector hóa estimate_relation_weight: 0.5 + Σ đặc trưng, kẹp trong [0.5, 1.0]."""
+    w = 0.5 + relation_feature_matrix(records) @ RELATION_FEATURE_WEIGHTS
+    return np.clip(w, 0.5, 1.0)
+
+
+class FusionEngine:
+    """Xếp hạng ứng viên Graph + Vector bằng phép toán mảng thay cho vòng lặp trên Passage."""
+
+    def __init__(self, config: Optional[FusionConfig] = None):
+        self.config = config or FusionConfig.from_env()
+
+    def score(self, graph_ids: List[str], vector_passages: List[Passage],
+              graph_id_map: Dict[str, Dict[str, Any]]) -> Dict[str, np.ndarray]:
+        """Tính các thành phần điểm cho toàn bộ ứng viên (union id Graph ∪ Vector)."""
+        cfg = self.config
+        graph_rank: Dict[str, int] = {}
+        for gid in graph_ids:
+            gid = str(gid).strip()
+            if gid and gid not in graph_rank:
+                graph_rank[gid] = len(graph_rank) + 1
+        vector_rank: Dict[str, int] = {}
+        vector_score: Dict[str, float] = {}
+        for p in vector_passages:
+            pid = str(p.id).strip() if p.id else ""
+            if pid and pid not in vector_rank:
+                vector_rank[pid] = len(vector_rank) + 1
+                if isinstance(p.score, (int, float)):
+                    vector_score[pid] = float(p.score)
+
+        ids = list(graph_rank) + [pid for pid in vector_rank if pid not in graph_rank]
+        n = len(ids)
+        g_rank = np.array([graph_rank.get(i, 0) for i in ids], dtype=np.float32)
+        v_rank = np.array([vector_rank.get(i, 0) for i in ids], dtype=np.float32)
+        in_graph, in_vector = g_rank > 0, v_rank > 0
+
+        rrf = (np.where(in_graph, 1.0 / (cfg.rrf_k + g_rank), 0.0)
+               + np.where(in_vector, 1.0 / (cfg.rrf_k + v_rank), 0.0))
+        rrf = rrf / (2.0 / (cfg.rrf_k + 1))
+        semantic = np.clip(np.array([vector_score.get(i, 0.0) for i in ids], dtype=np.float32), 0.0, 1.0)
+        hop = np.where(in_graph & in_vector, 0, np.where(in_graph, 1, cfg.default_hop_no_match)).astype(np.float32)
+        rel = relation_weights([graph_id_map.get(i) for i in ids]) if n else np.zeros(0, dtype=np.float32)
+
+        total = (cfg.w_rrf * rrf + cfg.w_semantic * semantic
+                 + cfg.w_hop * (1.0 / (1.0 + hop)) + cfg.w_relation * rel)
+        return {
+            "ids": np.array(ids, dtype=object),
+            "score": total.astype(np.float32),
+            "rrf": rrf.astype(np.float32),
+            "semantic": semantic,
+            "hop": hop,
+            "relation_weight": rel.astype(np.float32),
+            "graph_rank": g_rank,
+            "vector_rank": v_rank,
+        }
+
+    def fuse(self, graph_ids: List[str], vector_passages: List[Passage],
+             graph_id_map: Dict[str, Dict[str, Any]], top_n: int = 3, vclient=None) -> FusionResult:
+        """
+        Top-N passage theo điểm tổng hợp.
+        Id chỉ có ở Graph được lấy lại văn bản từ VectorDB (1 lượt cho các ứng viên đầu bảng);
+        id không lấy được văn bản thì bỏ qua và xét ứng viên kế tiếp.
+        """
+        s = self.score(graph_ids, vector_passages, graph_id_map)
+        order = np.argsort(-s["score"], kind="stable")
+        by_id = {}
+        for p in vector_passages:
+            pid = str(p.id).strip() if p.id else ""
+            if pid and pid not in by_id:
+                by_id[pid] = p
+
+        # Lấy lại văn bản cho các id chỉ có ở Graph nằm trong vùng đầu bảng
+        head = [s["ids"][i] for i in order[: max(top_n * 3, top_n)]]
+        missing = [pid for pid in head if pid not in by_id]
+        if missing and vclient is not None:
+            from app.utils.hybrid_helpers import vector_fetch_by_ids
+            for p in vector_fetch_by_ids(vclient, missing, limit=len(missing)):
+                by_id.setdefault(str(p.id).strip(), p)
+
+        chosen, explanations = [], []
+        for i in order:
+            pid = s["ids"][i]
+            p = by_id.get(pid)
+            if p is None:
+                continue
+            expl = {
+                "id": pid,
+                "score": round(float(s["score"][i]), 4),
+                "rrf": round(float(s["rrf"][i]), 4),
+                "semantic": round(float(s["semantic"][i]), 4),
+                "hop": int(s["hop"][i]),
+                "relation_weight": round(float(s["relation_weight"][i]), 3),
+                "graph_rank": int(s["graph_rank"][i]) or None,
+                "vector_rank": int(s["vector_rank"][i]) or None,
+            }
+            meta = p.metadata or {}
+            meta["fusion"] = expl
+            meta["confidence"] = expl["score"]
+            p.metadata = meta
+            chosen.append(p)
+            explanations.append(expl)
+            if len(chosen) >= top_n:
+                break
+        return FusionResult(passages=chosen, explanations=explanations, n_candidates=len(s["ids"]))
+
+    def describe(self) -> Dict[str, Any]:
+        return asdict(self.config)
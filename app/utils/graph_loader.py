@@ -0,0 +1,360 @@
+# app/utils/graph_loader.py
+"""
+Bulk loader: data/project-meta-kg.csv → đồ thị Neo4j theo schema trong nl2cypher_vi.txt
+
+(:City)-[:HAS_LOCATION]->(:District)-[:HAS_PROPERTY]->(:Property)
+(:Property)-[:HAS_PRICE|HAS_AREA|HAS_AMENITY|...]->(...)
+
+- Tách các cột đa trị ngăn cách bằng "|".
+- Ghi theo lô lớn `UNWIND $rows` với MERGE idempotent trên khóa có constraint.
+- Mỗi loại quan hệ chạy song song trên một luồng riêng (các lô trong cùng loại chạy tuần tự
+  để tránh tranh chấp lock khi MERGE cùng một node giá trị). Các luồng vẫn cùng khóa node Property
+  → mọi lệnh ghi đi qua `executor.write_query` (execute_write: driver tự retry DeadlockDetected).
+- Chế độ incremental: so sánh content_hash theo id bài đăng, chỉ nạp lại bài thay đổi.
+- Read model (app/retrievers/read_model.py): trường phi chuẩn hóa được ghi cùng node Property;
+  cuối mỗi lần nạp điền nốt các căn cũ chưa có và đánh dấu GraphMeta.read_model.
+"""
+import csv
+import json
+import time
+import hashlib
+import threading
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from app.retrievers.graph_schema import (
+    GRAPH_VERSION_BUMP_CYPHER,
+    LC_PROPERTY,
+    bump_graph_version,
+    constraint_statements,
+    index_statements,
+)
+from app.retrievers.read_model import PROPERTY_SET_CYPHER, READ_MODEL_VERSION, backfill_read_model
+
+
+CITY_NAME = "bất động sản hà nội"
+DEFAULT_BATCH_SIZE = 1000
+
+
+# CHUẨN HÓA DỮ LIỆU CSV
+def _is_empty(value) -> bool:
+    return value is None or str(value).strip().lower() in ("", "nan", "none", "null")
+
+
+def normalize_name(value) -> Optional[str]:
+    """Chữ thường, gộp khoảng trắng thừa. Trả None nếu rỗng."""
+    if _is_empty(value):
+        return None
+    return " ".join(str(value).split()).lower()
+
+
+def split_multi(value) -> List[str]:
+    """'nội thất sang trọng| cao cấp' → ['nội thất sang trọng', 'cao cấp'] (bỏ trùng, giữ thứ tự)."""
+    if _is_empty(value):
+        return []
+    out: List[str] = []
+    for part in str(value).split("|"):
+        name = normalize_name(part)
+        if name and name not in out:
+            out.append(name)
+    return out
+
+
+def parse_number(value) -> Optional[float]:
+    """'56' → 56.0, '3,5' → 3.5; không parse được → None."""
+    if _is_empty(value):
+        return None
+    try:
+        return float(str(value).strip().replace(",", "."))
+    except ValueError:
+        return None
+
+
+def _row_hash(row: Dict[str, Any]) -> str:
+    payload = json.dumps(row, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def parse_listing(raw: Dict[str, str]) -> Optional[Dict[str, Any]]:
+    """Một dòng CSV → dict đã chuẩn hóa để ghi vào đồ thị."""
+    listing_id = str(raw.get("id") or "").strip()
+    if not listing_id:
+        return None
+    row = {
+        "id": listing_id,
+        "district": normalize_name(raw.get("district_name")),
+        "property_type": normalize_name(raw.get("property_type")),
+        "address": normalize_name(raw.get("full_address")),
+        "price": parse_number(raw.get("total_price")),
+        "area": parse_number(raw.get("area_m2")),
+        "designs": split_multi(raw.get("house_design")),
+        "amenities": split_multi(raw.get("internal_amenities")),
+        "legal": split_multi(raw.get("legal_status")),
+        "directions": split_multi(raw.get("direction")),
+        "facilities": split_multi(raw.get("near_facilities")),
+        "contact_name": normalize_name(raw.get("contact_name")),
+        "contact_phones": split_multi(raw.get("contact_phone")),
+    }
+    row["hash"] = _row_hash(row)
+    return row
+
+
+def load_listings(csv_path: str = "data/project-meta-kg.csv") -> List[Dict[str, Any]]:
+    """Đọc CSV (có BOM) và trả danh sách listing đã chuẩn hóa (id không trùng)."""
+    listings: Dict[str, Dict[str, Any]] = {}
+    with open(csv_path, "r", encoding="utf-8-sig", newline="") as f:
+        for raw in csv.DictReader(f):
+            row = parse_listing(raw)
+            if row:
+                listings[row["id"]] = row
+    return list(listings.values())
+
+
+# CÂU LỆNH CYPHER
+PROPERTY_CYPHER = f"""
+UNWIND $rows AS row
+MERGE (city:City {{name: $city}})
+MERGE (p:Property {{id: row.id}})
+SET p.content_hash = row.hash{PROPERTY_SET_CYPHER}
+WITH city, p, row
+WHERE row.district IS NOT NULL
+MERGE (d:District {{name: row.district}})
+SET d.{LC_PROPERTY} = row.district
+MERGE (city)-[:HAS_LOCATION]->(d)
+MERGE (d)-[:HAS_PROPERTY]->(p)
+"""
+
+
+@dataclass
+class RelationSpec:
+    """Một loại quan hệ Property → node tên/giá trị."""
+    rel_type: str
+    label: str
+    field: str
+    key: str = "name"
+
+    def cypher(self) -> str:
+        # SET (không phải ON CREATE SET): node giá trị có sẵn từ lần nạp cũ cũng được gán name_lc
+        set_lc = f"\nSET n.{LC_PROPERTY} = v" if self.key == "name" else ""
+        return (
+            "UNWIND $rows AS row\n"
+            "MATCH (p:Property {id: row.id})\n"
+            "UNWIND row.values AS v\n"
+            f"MERGE (n:{self.label} {{{self.key}: v}}){set_lc}\n"
+            f"MERGE (p)-[:{self.rel_type}]->(n)"
+        )
+
+    def rows(self, listings: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        out = []
+        for r in listings:
+            value = r.get(self.field)
+            values = value if isinstance(value, list) else ([] if value is None else [value])
+            if values:
+                out.append({"id": r["id"], "values": values})
+        return out
+
+
+RELATION_SPECS: List[RelationSpec] = [
+    RelationSpec("HAS_PROPERTY_TYPE", "PropertyType", "property_type"),
+    RelationSpec("HAS_DESIGN", "HouseDesign", "designs"),
+    RelationSpec("HAS_AMENITY", "Amenity", "amenities"),
+    RelationSpec("HAS_DIRECTION", "Direction", "directions"),
+    RelationSpec("HAS_LEGAL_STATUS", "LegalStatus", "legal"),
+    RelationSpec("HAS_PRICE", "PriceVND", "price", key="value"),
+    RelationSpec("HAS_AREA", "Area", "area", key="value"),
+    RelationSpec("LOCATED_AT", "Address", "address"),
+    RelationSpec("NEAR_FACILITY", "Facility", "facilities"),
+]
+
+CONTACT_CYPHER = """
+UNWIND $rows AS row
+MATCH (p:Property {id: row.id})
+MERGE (c:Contact {id: row.id})
+MERGE (p)-[:HAS_CONTACT]->(c)
+FOREACH (nm IN CASE WHEN row.name IS NULL THEN [] ELSE [row.name] END |
+  MERGE (cn:ContactName {name: nm})
+  MERGE (c)-[:HAS_CONTACT_NAME]->(cn))
+FOREACH (ph IN row.phones |
+  MERGE (cp:ContactPhone {number: ph})
+  MERGE (c)-[:HAS_CONTACT_PHONE]->(cp))
+"""
+
+EXISTING_HASHES_CYPHER = "MATCH (p:Property) RETURN p.id AS id, p.content_hash AS hash"
+
+DETACH_CHANGED_CYPHER = [
+    # Xóa Contact riêng của bài đăng (tạo lại sau)
+    "UNWIND $ids AS id MATCH (:Property {id: id})-[:HAS_CONTACT]->(c:Contact) DETACH DELETE c",
+    # Xóa quan hệ đi ra + quan hệ quận → bài đăng, giữ nguyên node Property
+    "UNWIND $ids AS id MATCH (p:Property {id: id})-[r]->() DELETE r",
+    "UNWIND $ids AS id MATCH (:District)-[h:HAS_PROPERTY]->(p:Property {id: id}) DELETE h",
+]
+
+DELETE_REMOVED_CYPHER = [
+    "UNWIND $ids AS id MATCH (:Property {id: id})-[:HAS_CONTACT]->(c:Contact) DETACH DELETE c",
+    "UNWIND $ids AS id MATCH (p:Property {id: id}) DETACH DELETE p",
+]
+
+
+def _contact_rows(listings: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [
+        {"id": r["id"], "name": r["contact_name"], "phones": r["contact_phones"]}
+        for r in listings
+        if r["contact_name"] or r["contact_phones"]
+    ]
+
+
+def _batches(rows: List[Any], size: int):
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+# LOADER
+class GraphLoader:
+    """
+    Nạp project-meta-kg.csv vào Neo4j.
+    `executor` chỉ cần có `run_query(cypher, params)` → Neo4jExecutor hoặc RecordingExecutor;
+    nếu có `write_query` (retry lỗi tạm thời) thì các lệnh ghi dùng hàm này.
+    """
+
+    def __init__(self, executor, batch_size: int = DEFAULT_BATCH_SIZE, workers: int = 4,
+                 city: str = CITY_NAME, verbose: bool = True):
+        self.executor = executor
+        self.batch_size = max(1, int(batch_size))
+        self.workers = max(1, int(workers))
+        self.city = city
+        self.verbose = verbose
+
+    def _log(self, *args):
+        if self.verbose:
+            print(*args)
+
+    def _write(self, cypher: str, params: dict = None):
+        write = getattr(self.executor, "write_query", None) or self.executor.run_query
+        return write(cypher, params)
+
+    def _run_batches(self, cypher: str, rows: List[Dict[str, Any]], **params) -> int:
+        n = 0
+        for batch in _batches(rows, self.batch_size):
+            self._write(cypher, {"rows": batch, **params})
+            n += 1
+        return n
+
+    def ensure_schema(self):
+        """Constraint/index cần cho MERGE (idempotent)."""
+        for stmt in constraint_statements() + index_statements():
+            try:
+                self.executor.run_query(stmt)
+            except Exception as e:
+                self._log(f"⚠️ Bỏ qua: {stmt}\n   ↳ {e}")
+
+    def existing_hashes(self) -> Dict[str, str]:
+        rows = self.executor.run_query(EXISTING_HASHES_CYPHER) or []
+        return {str(r.get("id")): r.get("hash") for r in rows if r.get("id") is not None}
+
+    def plan_incremental(self, listings: List[Dict[str, Any]]) -> Dict[str, List]:
+        """So khớp hash theo id → (mới, thay đổi, không đổi, bị xóa)."""
+        existing = self.existing_hashes()
+        current = {r["id"]: r for r in listings}
+        new = [r for i, r in current.items() if i not in existing]
+        changed = [r for i, r in current.items() if i in existing and existing[i] != r["hash"]]
+        unchanged = [i for i, r in current.items() if existing.get(i) == r["hash"]]
+        removed = [i for i in existing if i not in current]
+        return {"new": new, "changed": changed, "unchanged": unchanged, "removed": removed}
+
+    def write_listings(self, listings: List[Dict[str, Any]]) -> Dict[str, int]:
+        """Ghi Property/District rồi các quan hệ (song song theo loại quan hệ)."""
+        stats: Dict[str, int] = {}
+        if not listings:
+            return stats
+
+        start = time.time()
+        stats["Property"] = self._run_batches(PROPERTY_CYPHER, listings, city=self.city,
+                                               read_model=READ_MODEL_VERSION)
+        self._log(f"🏠 Property/District: {len(listings)} bài ({int((time.time() - start) * 1000)} ms)")
+
+        jobs = {spec.rel_type: (spec.cypher(), spec.rows(listings)) for spec in RELATION_SPECS}
+        jobs["HAS_CONTACT"] = (CONTACT_CYPHER, _contact_rows(listings))
+
+        def _job(rel_type: str):
+            cypher, rows = jobs[rel_type]
+            t0 = time.time()
+            n = self._run_batches(cypher, rows)
+            self._log(f"🔗 {rel_type}: {len(rows)} dòng / {n} lô ({int((time.time() - t0) * 1000)} ms)")
+            return rel_type, n
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for rel_type, n in pool.map(_job, list(jobs)):
+                stats[rel_type] = n
+        return stats
+
+    def load(self, listings: List[Dict[str, Any]], incremental: bool = False,
+             ensure_schema: bool = True) -> Dict[str, Any]:
+        """Nạp toàn bộ (full) hoặc chỉ phần thay đổi (incremental)."""
+        start = time.time()
+        if ensure_schema:
+            self.ensure_schema()
+
+        report: Dict[str, Any] = {"mode": "incremental" if incremental else "full"}
+        if incremental:
+            plan = self.plan_incremental(listings)
+            to_write = plan["new"] + plan["changed"]
+            changed_ids = [r["id"] for r in plan["changed"]]
+            self._log(
+                f"🧮 Mới: {len(plan['new'])} · Thay đổi: {len(changed_ids)} · "
+                f"Giữ nguyên: {len(plan['unchanged'])} · Bị xóa: {len(plan['removed'])}"
+            )
+            for stmt in DETACH_CHANGED_CYPHER:
+                for batch in _batches(changed_ids, self.batch_size):
+                    self._write(stmt, {"ids": batch})
+            for stmt in DELETE_REMOVED_CYPHER:
+                for batch in _batches(plan["removed"], self.batch_size):
+                    self._write(stmt, {"ids": batch})
+            report.update({k: len(v) for k, v in plan.items()})
+        else:
+            to_write = listings
+            report["new"] = len(listings)
+
+        report["batches"] = self.write_listings(to_write)
+        report["read_model_backfilled"] = backfill_read_model(self.executor, self.batch_size)
+        if report["read_model_backfilled"]:
+            self._log(f"🗃️ Read model: điền lại {report['read_model_backfilled']} căn nạp trước đây")
+        if to_write or report.get("removed") or report["read_model_backfilled"]:
+            report["graph_version"] = bump_graph_version(self.executor)
+        report["took_ms"] = int((time.time() - start) * 1000)
+        self._log(f"✅ Hoàn tất nạp đồ thị ({report['mode']}) trong {report['took_ms']} ms")
+        return report
+
+
+# EXECUTOR GIẢ LẬP (chạy loader không cần Neo4j)
+class RecordingExecutor:
+    """
+    Stand-in cho Neo4jExecutor: ghi lại (cypher, params) thay vì gửi tới DB.
+    Mô phỏng content_hash của Property để chế độ incremental chạy được cục bộ.
+    """
+
+    def __init__(self, existing_hashes: Optional[Dict[str, str]] = None):
+        self.calls: List[Dict[str, Any]] = []
+        self.hashes: Dict[str, str] = dict(existing_hashes or {})
+        self.version = 0
+        self._lock = threading.Lock()
+
+    def run_query(self, cypher_query: str, params: dict = None):
+        params = params or {}
+        with self._lock:
+            self.calls.append({"cypher": cypher_query, "params": params})
+            if cypher_query == EXISTING_HASHES_CYPHER:
+                return [{"id": i, "hash": h} for i, h in self.hashes.items()]
+            if cypher_query == GRAPH_VERSION_BUMP_CYPHER:
+                self.version += 1
+                return [{"version": self.version}]
+            if cypher_query == PROPERTY_CYPHER:
+                for row in params.get("rows", []):
+                    self.hashes[row["id"]] = row["hash"]
+            elif cypher_query == DELETE_REMOVED_CYPHER[-1]:
+                for i in params.get("ids", []):
+                    self.hashes.pop(i, None)
+        return []
+
+    def close(self):
+        pass
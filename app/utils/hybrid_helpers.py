@@ -1,10 +1,13 @@
 # app/utils/hybrid_helpers.py
 import os
 import json
-from typing import List, Dict, Any
-from openai import OpenAI
+from typing import List, Dict, Any, Iterator, TYPE_CHECKING
 
 from app.retrievers.vector_tools import VectorClient, Passage
+from app.utils.llm_calls import chat_completion, stream_completion
+
+if TYPE_CHECKING:
+    from openai import OpenAI
 
 
 
@@ -18,35 +21,27 @@ def load_answer_rule(path: str = "app/prompts/answer_synthesis.txt") -> str:
 
 
 # Tạo map ID -> Record (từ Neo4j)
-def build_id_map_from_graph_records(records: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
-    """Tạo map id -> record (thuộc tính từ Neo4j)."""
+def build_id_map_from_graph_records(records: List[Dict[str, Any]], aliases=None) -> Dict[str, Dict[str, Any]]:
+    """
+    Tạo map id -> record (thuộc tính từ Neo4j).
+    aliases (AliasStore): record của bài trùng cũng được gắn vào id chuẩn đang có trong VectorDB.
+    """
     id_map = {}
     for r in records or []:
         rid = str(r.get("id") or "").strip()
         if rid:
             id_map[rid] = r
+    if aliases is not None:
+        for rid, r in list(id_map.items()):
+            id_map.setdefault(aliases.canonical(rid), r)
     return id_map
 
 
 
 # Fetch lại bài viết theo ID từ VectorDB
 def vector_fetch_by_ids(vclient: VectorClient, ids: List[str], limit: int = 3) -> List[Passage]:
-    """Truy xuất lại các bài theo ID từ VectorDB."""
-    vs = vclient._load_vs()
-    results: List[Passage] = []
-    wanted = set([str(x).strip() for x in ids if x])
-    try:
-        for _, doc in (vs.docstore._dict or {}).items():
-            mid = (doc.metadata or {}).get("id")
-            if mid and str(mid).strip() in wanted:
-                results.append(
-                    Passage(id=str(mid).strip(), text=doc.page_content or "", score=None, metadata=doc.metadata or {})
-                )
-                if len(results) >= limit:
-                    break
-    except Exception:
-        pass
-    return results
+    """Truy xuất lại các bài theo ID từ VectorDB (backend FAISS / Chroma / shard tự tra theo id)."""
+    return vclient.fetch_by_ids(ids, limit)
 
 
 
@@ -97,24 +92,34 @@ def select_topN_by_priority(
 
 
 # Chuẩn bị input tổng hợp (graph + vector)
-def build_synthesis_input(chosen_passages: List[Passage], graph_id_map: Dict[str, Dict[str, Any]]) -> str:
-    """Tạo text có cấu trúc để gửi LLM tổng hợp."""
-    blocks = []
+def _compact_graph_record(graph_info: Dict[str, Any]) -> Dict[str, Any]:
+    """Bỏ các trường rỗng (None, "", []) để giảm token gửi LLM."""
+    return {k: v for k, v in (graph_info or {}).items() if v not in (None, "", [], {})}
+
+
+def build_synthesis_input(
+    chosen_passages: List[Passage],
+    graph_id_map: Dict[str, Dict[str, Any]],
+    cards=None,
+) -> str:
+    """
+    Tạo text có cấu trúc để gửi LLM tổng hợp.
+    Nếu có `cards` (ListingCardStore) → dùng listing card gọn thay cho toàn bộ mô tả thô + JSON graph.
+    """
+    pretty = []
     for p in chosen_passages:
         pid = str(p.id).strip() if p.id else None
         graph_info = graph_id_map.get(pid) if pid else None
-        block = {
-            "id": pid or "N/A",
-            "graph": graph_info or {},
-            "vector_text": (p.text or "").strip(),
-        }
-        blocks.append(block)
-
-    pretty = []
-    for b in blocks:
-        pretty.append(
-            f"ID: {b['id']}\nGRAPH: {json.dumps(b['graph'], ensure_ascii=False)}\nTEXT: {b['vector_text']}"
-        )
+        card = cards.get(pid) if (cards is not None and pid) else None
+        if card:
+            source = "graph+vector" if graph_info else "vector"
+            pretty.append(f"ID: {pid}\nNGUỒN: {source}\nCARD:\n{card}")
+        else:
+            pretty.append(
+                f"ID: {pid or 'N/A'}\n"
+                f"GRAPH: {json.dumps(_compact_graph_record(graph_info), ensure_ascii=False)}\n"
+                f"TEXT: {(p.text or '').strip()}"
+            )
     return "\n\n---\n\n".join(pretty)
 
 
@@ -228,25 +233,48 @@ def rerank_by_confidence(passages: List[Passage]) -> List[Passage]:
 
 
 # Tổng hợp đầu ra cuối cùng bằng LLM
+def _synthesis_prompt(user_query: str, synthesis_rule: str, synthesis_payload: str) -> str:
+    return f"""{synthesis_rule}
+
+Dữ liệu đầu vào:
+{synthesis_payload}
+
+Câu hỏi người dùng:
+{user_query}
+"""
+
+
 def llm_summarize_answer(
-    client: OpenAI,
+    client: "OpenAI",
     user_query: str,
     synthesis_rule: str,
     synthesis_payload: str,
     model: str,
 ) -> str:
     """Gọi LLM để tổng hợp câu trả lời."""
-    prompt = f"""{synthesis_rule}
+    prompt = _synthesis_prompt(user_query, synthesis_rule, synthesis_payload)
+    resp = chat_completion(
+        client, "synthesis",
+        model=model,
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0.4,
+    )
+    return resp.choices[0].message.content.strip()
 
-Dữ liệu đầu vào:
-{synthesis_payload}
 
-Câu hỏi người dùng:
-{user_query}
-"""
-    resp = client.chat.completions.create(
+def llm_stream_answer(
+    client: "OpenAI",
+    user_query: str,
+    synthesis_rule: str,
+    synthesis_payload: str,
+    model: str,
+) -> Iterator[str]:
+    """Như llm_summarize_answer nhưng trả về từng đoạn text ngay khi LLM sinh ra (stream=True)."""
+    prompt = _synthesis_prompt(user_query, synthesis_rule, synthesis_payload)
+    # Bước "synthesis_stream": hedge theo đoạn text đầu tiên, deadline cho cả stream
+    yield from stream_completion(
+        client,
         model=model,
         messages=[{"role": "user", "content": prompt}],
         temperature=0.4,
     )
-    return resp.choices[0].message.content.strip()
@@ -0,0 +1,193 @@
+# app/utils/latency_budget.py
+"""
+Chọn tham số truy xuất theo ngân sách độ trễ của từng request (thay cho top_k / few-shot k / fetch_k cố định).
+
+- StageStats: cửa sổ trượt thời gian từng bước (few_shot, cypher_llm, neo4j, vector, synthesis) → p50 / p95.
+- LoadTracker: số request đang chạy trong process (tín hiệu tải).
+- LatencyPlanner.plan(): dự đoán p95 của request với tham số mặc định; vượt ngân sách hoặc đang quá tải
+  → giảm top_k / fetch_k / few-shot k (và cuối cùng là số căn tổng hợp) theo tỉ lệ áp lực.
+- Quyết định theo từng câu hỏi (không phụ thuộc tải):
+    · few-shot: ví dụ gần nhất khớp mạnh (khoảng cách ≤ FEW_SHOT_STRONG_DISTANCE) → chỉ giữ FEW_SHOT_MIN_K ví dụ;
+    · MMR: ứng viên vector đã đủ đa dạng (cosine trung bình < MMR_DIVERSITY_THRESHOLD) → bỏ bước MMR.
+
+LATENCY_BUDGET_MS=0 (mặc định): giữ nguyên tham số tĩnh như trước, chỉ ghi nhận thời gian từng bước.
+"""
+import os
+import threading
+from collections import deque
+from dataclasses import dataclass, field, asdict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+
+LATENCY_BUDGET_MS = int(os.getenv("LATENCY_BUDGET_MS", 0))
+LATENCY_WINDOW = int(os.getenv("LATENCY_WINDOW", 200))
+# Số request đồng thời mà process chịu được trước khi coi là quá tải
+LATENCY_TARGET_CONCURRENCY = int(os.getenv("LATENCY_TARGET_CONCURRENCY", 4))
+FEW_SHOT_K = int(os.getenv("FEW_SHOT_K", 10))
+FEW_SHOT_MIN_K = int(os.getenv("FEW_SHOT_MIN_K", 3))
+# L2² giữa 2 embedding đã chuẩn hóa = 2 - 2·cos → 0.2 ≈ cosine 0.9
+FEW_SHOT_STRONG_DISTANCE = float(os.getenv("FEW_SHOT_STRONG_DISTANCE", 0.2))
+MMR_DIVERSITY_THRESHOLD = float(os.getenv("MMR_DIVERSITY_THRESHOLD", 0.85))
+MIN_TOP_K = int(os.getenv("MIN_TOP_K", 5))
+
+STAGES = ("few_shot", "cypher_llm", "neo4j", "vector", "synthesis")
+
+
+def default_fetch_k(k: int) -> int:
+    """Số ứng viên MMR mặc định (cùng công thức với VectorClient.search)."""
+    return max(k, min(25, max(10, k * 2)))
+
+
+# THỐNG KÊ
+class StageStats:
+    """Thời gian gần nhất của từng bước (thread-safe)."""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self._samples: Dict[str, deque] = {}
+        self._window = window
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, ms: float):
+        with self._lock:
+            self._samples.setdefault(stage, deque(maxlen=self._window)).append(float(ms))
+
+    def count(self, stage: str) -> int:
+        with self._lock:
+            return len(self._samples.get(stage) or [])
+
+    def percentile(self, stage: str, q: float = 95) -> Optional[float]:
+        with self._lock:
+            samples = list(self._samples.get(stage) or [])
+        return float(np.percentile(samples, q)) if samples else None
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        out = {}
+        for stage in list(self._samples):
+            p50, p95 = self.percentile(stage, 50), self.percentile(stage, 95)
+            out[stage] = {"p50_ms": round(p50, 1), "p95_ms": round(p95, 1), "n": len(self._samples[stage])}
+        return out
+
+
+class LoadTracker:
+    def __init__(self):
+        self.inflight = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        with self._lock:
+            self.inflight += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self._lock:
+            self.inflight -= 1
+
+
+# KẾ HOẠCH TRUY XUẤT
+@dataclass
+class RetrievalPlan:
+    top_k: int
+    few_shot_k: int = FEW_SHOT_K
+    # ví dụ gần nhất khớp mạnh → chỉ dùng chừng này ví dụ (None = luôn dùng few_shot_k)
+    few_shot_strong_k: Optional[int] = None
+    mmr: bool = True
+    fetch_k: Optional[int] = None
+    # bỏ MMR nếu ứng viên đã đa dạng (None = luôn chạy MMR)
+    mmr_diversity_threshold: Optional[float] = None
+    fill_limit: int = 3
+    budget_ms: int = 0
+    # hạn chót cho Graph + Vector (None = RETRIEVAL_DEADLINE_MS): phần ngân sách còn lại sau bước tổng hợp
+    retrieval_deadline_ms: Optional[int] = None
+    pressure: float = 0.0
+    reasons: List[str] = field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+class LatencyPlanner:
+    def __init__(self, budget_ms: int = LATENCY_BUDGET_MS,
+                 target_concurrency: int = LATENCY_TARGET_CONCURRENCY):
+        self.budget_ms = budget_ms
+        self.target_concurrency = max(1, target_concurrency)
+        self.stats = StageStats()
+        self.load = LoadTracker()
+
+    def predicted_ms(self) -> Optional[float]:
+        """p95 dự đoán: max(nhánh Graph, nhánh Vector) + tổng hợp (None khi chưa có dữ liệu)."""
+        p = {s: self.stats.percentile(s) for s in STAGES}
+        if all(v is None for v in p.values()):
+            return None
+        graph = (p["few_shot"] or 0) + (p["cypher_llm"] or 0) + (p["neo4j"] or 0)
+        return max(graph, p["vector"] or 0) + (p["synthesis"] or 0)
+
+    def plan(self, top_k: int = 10, limit: int = 3, budget_ms: Optional[int] = None) -> RetrievalPlan:
+        budget_ms = self.budget_ms if budget_ms is None else int(budget_ms)
+        plan = RetrievalPlan(top_k=top_k, fetch_k=default_fetch_k(top_k), fill_limit=limit, budget_ms=budget_ms)
+        if not budget_ms:
+            return plan
+
+        plan.few_shot_strong_k = FEW_SHOT_MIN_K
+        plan.mmr_diversity_threshold = MMR_DIVERSITY_THRESHOLD
+        synthesis_p95 = self.stats.percentile("synthesis") or 0
+        plan.retrieval_deadline_ms = int(max(budget_ms * 0.5, budget_ms - synthesis_p95))
+
+        # Áp lực = max(p95 dự đoán / ngân sách, số request đang chạy / sức chứa)
+        predicted = self.predicted_ms()
+        time_pressure = predicted / budget_ms if predicted else 0.0
+        load_pressure = self.load.inflight / self.target_concurrency
+        plan.pressure = round(max(time_pressure, load_pressure), 2)
+        if predicted:
+            plan.reasons.append(f"p95 dự đoán {int(predicted)}ms / ngân sách {budget_ms}ms")
+        if load_pressure > 1:
+            plan.reasons.append(f"tải {self.load.inflight}/{self.target_concurrency} request")
+        if plan.pressure <= 1:
+            return plan
+
+        scale = 1.0 / plan.pressure
+        plan.top_k = max(min(MIN_TOP_K, top_k), int(top_k * scale))
+        plan.fetch_k = max(plan.top_k, int(default_fetch_k(top_k) * scale))
+        plan.few_shot_k = max(FEW_SHOT_MIN_K, int(FEW_SHOT_K * scale))
+        plan.reasons.append(f"giảm top_k={plan.top_k}, fetch_k={plan.fetch_k}, few_shot_k={plan.few_shot_k}")
+        if plan.pressure > 2 and limit > 1:
+            # Quá tải nặng: bớt 1 căn khi tổng hợp (ít token → LLM trả lời nhanh hơn)
+            plan.fill_limit = limit - 1
+            plan.reasons.append(f"giảm fill_limit={plan.fill_limit}")
+        return plan
+
+    def record(self, stage_timings: Dict[str, Optional[float]]):
+        for stage, ms in stage_timings.items():
+            if stage in STAGES and ms is not None:
+                self.stats.record(stage, ms)
+
+
+def choose_few_shot(scored_examples, k: int, strong_k: Optional[int] = None,
+                    strong_distance: float = FEW_SHOT_STRONG_DISTANCE):
+    """Ví dụ gần nhất khớp mạnh → strong_k ví dụ đầu, ngược lại k ví dụ."""
+    if strong_k and scored_examples and scored_examples[0][1] <= strong_distance:
+        k = min(k, strong_k)
+    return [ex for ex, _ in scored_examples[:k]]
+
+
+def is_diverse(vectors, threshold: float = MMR_DIVERSITY_THRESHOLD) -> bool:
+    """Cosine trung bình giữa các cặp ứng viên < threshold → đã đủ đa dạng, MMR không đổi được nhiều."""
+    mat = np.asarray(vectors, dtype=np.float32)
+    if len(mat) < 2:
+        return True
+    mat = mat / np.maximum(np.linalg.norm(mat, axis=1, keepdims=True), 1e-12)
+    sims = mat @ mat.T
+    n = len(mat)
+    return float((sims.sum() - np.trace(sims)) / (n * (n - 1))) < threshold
+
+
+_SHARED_PLANNER: Optional[LatencyPlanner] = None
+
+
+def get_latency_planner() -> LatencyPlanner:
+    """Planner dùng chung trong process (thống kê + tải gộp giữa mọi request)."""
+    global _SHARED_PLANNER
+    if _SHARED_PLANNER is None:
+        _SHARED_PLANNER = LatencyPlanner()
+    return _SHARED_PLANNER
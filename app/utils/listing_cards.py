@@ -0,0 +1,212 @@
+# app/utils/listing_cards.py
+"""
+"Listing card" gọn cho từng bài đăng, dựng sẵn lúc ingest từ 2 CSV:
+- project-meta-kg.csv   → các thông tin chính đã chuẩn hóa (quận, giá, diện tích, pháp lý, ...)
+- project-text-semantic.csv → mô tả đã bỏ câu quảng cáo lặp lại của môi giới, bỏ câu trùng,
+                              cắt theo ngân sách token.
+Card được lưu cạnh vector index (JSON id → card) và tra theo id lúc tổng hợp câu trả lời.
+"""
+import os
+import re
+import csv
+import json
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+
+from app.utils.graph_loader import normalize_name, parse_number, split_multi
+
+
+LISTING_CARDS_PATH = os.getenv("LISTING_CARDS_PATH", ".vector_store/listing_cards.json")
+CARD_MAX_TOKENS = int(os.getenv("CARD_MAX_TOKENS", 120))
+# Câu xuất hiện ở ≥ N bài khác nhau được coi là câu mẫu của môi giới
+BOILERPLATE_MIN_DOCS = int(os.getenv("CARD_BOILERPLATE_MIN_DOCS", 3))
+
+BOILERPLATE_PATTERNS = [
+    r"^(liên hệ|lh|hotline|gọi ngay|quan tâm|call|zalo)\b",
+    r"chúng tôi tự hào",
+    r"miễn (phí )?môi giới|không (cài cắm|tính phí)|miễn phí xem nhà|xem nhà miễn phí",
+    r"hân hạnh|cam kết|tư vấn (miễn phí|pháp lý)|hỗ trợ pháp lý",
+    r"nhận (mua|bán|kí gửi|ký gửi)|chuyên (bđs|nhà|mua bán)",
+    r"^(mô tả|thiết kế|cam kết|liên hệ xem nhà)\s*:?$",
+    # số điện thoại VN: 0xxx / +84xxx, 10–11 chữ số (cho phép dấu cách / chấm / gạch);
+    # không khớp giá tiền kiểu "4.500.000.000" (không bắt đầu bằng 0 / 84, hoặc đứng sau chữ số)
+    r"(?<![\d.,])(?:\+84|84|0)(?:[\s.\-]?\d){9,10}(?![\d])",
+]
+_BOILERPLATE_RE = [re.compile(p, re.IGNORECASE) for p in BOILERPLATE_PATTERNS]
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?])\s+|\r?\n+")
+_BULLET_RE = re.compile(r"^[\s\-\+\*\.•·–]+")
+
+
+# ĐẾM TOKEN
+_ENCODER = None
+
+
+def count_tokens(text: str) -> int:
+    """Đếm token bằng tiktoken nếu có, nếu không ước lượng ~3 ký tự / token (tiếng Việt)."""
+    global _ENCODER
+    if _ENCODER is None:
+        try:
+            import tiktoken
+            _ENCODER = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _ENCODER = False
+    if _ENCODER:
+        return len(_ENCODER.encode(text))
+    return max(1, len(text) // 3)
+
+
+# LÀM SẠCH MÔ TẢ
+def _sentence_key(sentence: str) -> str:
+    return " ".join(re.sub(r"[^\w\s]", " ", sentence.lower()).split())
+
+
+def split_sentences(text: str) -> List[str]:
+    out = []
+    for part in _SENTENCE_SPLIT_RE.split(str(text or "")):
+        s = _BULLET_RE.sub("", part).strip()
+        if len(_sentence_key(s)) >= 3:
+            out.append(s)
+    return out
+
+
+def boilerplate_keys(texts: Iterable[str], min_docs: int = BOILERPLATE_MIN_DOCS) -> set:
+    """Các câu lặp lại ở nhiều bài (đếm mỗi bài 1 lần)."""
+    df = Counter()
+    for text in texts:
+        df.update({_sentence_key(s) for s in split_sentences(text)})
+    return {key for key, n in df.items() if n >= min_docs}
+
+
+def clean_description(text: str, boilerplate: set = frozenset(), max_tokens: int = CARD_MAX_TOKENS) -> str:
+    """Bỏ câu quảng cáo / liên hệ / trùng lặp, cắt theo ngân sách token (theo câu)."""
+    seen, kept, used = set(), [], 0
+    for sentence in split_sentences(text):
+        key = _sentence_key(sentence)
+        if key in seen or key in boilerplate:
+            continue
+        if any(p.search(sentence) for p in _BOILERPLATE_RE):
+            continue
+        seen.add(key)
+        # Tiêu đề viết hoa toàn bộ → chuyển về dạng câu
+        if sentence.isupper():
+            sentence = sentence.capitalize()
+        tokens = count_tokens(sentence)
+        if used + tokens > max_tokens:
+            break
+        kept.append(sentence.rstrip(" .") + ".")
+        used += tokens
+    return " ".join(kept)
+
+
+# DỰNG CARD
+def _fmt_number(value: Optional[float]) -> Optional[str]:
+    if value is None:
+        return None
+    return f"{value:g}"
+
+
+def _join(values: List[str], limit: int) -> str:
+    return ", ".join(values[:limit])
+
+
+def build_card_facts(meta: Dict[str, str]) -> List[str]:
+    """Các dòng thông tin chính (đã chuẩn hóa) từ project-meta-kg.csv."""
+    district = " ".join(str(meta.get("district_name") or "").split())
+    ptype = normalize_name(meta.get("property_type"))
+    designs = split_multi(meta.get("house_design"))
+    price = _fmt_number(parse_number(meta.get("total_price")))
+    area = _fmt_number(parse_number(meta.get("area_m2")))
+    legal = split_multi(meta.get("legal_status"))
+    directions = split_multi(meta.get("direction"))
+    amenities = split_multi(meta.get("internal_amenities"))
+    facilities = split_multi(meta.get("near_facilities"))
+    address = " ".join(str(meta.get("full_address") or "").split()) if normalize_name(meta.get("full_address")) else ""
+    contact_name = " ".join(str(meta.get("contact_name") or "").split()) if normalize_name(meta.get("contact_name")) else ""
+    phones = split_multi(meta.get("contact_phone"))
+
+    facts = []
+    head = " · ".join(x for x in [
+        district or None,
+        " ".join(x for x in [ptype, _join(designs, 1)] if x) or None,
+        f"{area} m²" if area else None,
+        f"{price} tỷ" if price else None,
+    ] if x)
+    if head:
+        facts.append(head)
+    if address:
+        facts.append(f"Địa chỉ: {address.split(' | ')[0] if len(address) > 80 else address}")
+    if legal:
+        facts.append(f"Pháp lý: {_join(legal, 3)}")
+    if directions:
+        facts.append(f"Hướng: {_join(directions, 2)}")
+    if amenities:
+        facts.append(f"Tiện ích: {_join(amenities, 5)}")
+    if facilities:
+        facts.append(f"Gần: {_join(facilities, 5)}")
+    if contact_name or phones:
+        facts.append(f"Liên hệ: {' – '.join(x for x in [contact_name, _join(phones, 2)] if x)}")
+    return facts
+
+
+def build_listing_cards(meta_path: str = "data/project-meta-kg.csv",
+                        text_path: str = "data/project-text-semantic.csv",
+                        max_tokens: int = CARD_MAX_TOKENS) -> Dict[str, str]:
+    """Dựng card cho mọi id có trong 1 trong 2 CSV."""
+    with open(meta_path, "r", encoding="utf-8-sig", newline="") as f:
+        metas = {str(r.get("id") or "").strip(): r for r in csv.DictReader(f)}
+    with open(text_path, "r", encoding="utf-8-sig", newline="") as f:
+        texts = {str(r.get("id") or "").strip(): r.get("text") or "" for r in csv.DictReader(f)}
+    metas.pop("", None)
+    texts.pop("", None)
+
+    boilerplate = boilerplate_keys(texts.values())
+    cards: Dict[str, str] = {}
+    for listing_id in sorted(set(metas) | set(texts), key=lambda x: (len(x), x)):
+        lines = build_card_facts(metas[listing_id]) if listing_id in metas else []
+        budget = max(40, max_tokens - count_tokens("\n".join(lines)))
+        desc = clean_description(texts.get(listing_id, ""), boilerplate, max_tokens=budget)
+        if desc:
+            lines.append(f"Mô tả: {desc}")
+        if lines:
+            cards[listing_id] = "\n".join(lines)
+    return cards
+
+
+def save_listing_cards(cards: Dict[str, str], path: str = LISTING_CARDS_PATH) -> str:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(cards, f, ensure_ascii=False)
+    os.replace(tmp, path)
+    return path
+
+
+# TRA CỨU LÚC TRUY VẤN
+class ListingCardStore:
+    """Đọc card theo id (lazy, đọc lại khi file được dựng lại)."""
+
+    def __init__(self, path: str = LISTING_CARDS_PATH):
+        self.path = path
+        self._cards: Dict[str, str] = {}
+        self._mtime = None
+
+    def _refresh(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            self._cards, self._mtime = {}, None
+            return
+        if mtime != self._mtime:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._cards = json.load(f)
+            self._mtime = mtime
+
+    def get(self, listing_id) -> Optional[str]:
+        if listing_id is None:
+            return None
+        self._refresh()
+        return self._cards.get(str(listing_id).strip())
+
+    def __len__(self) -> int:
+        self._refresh()
+        return len(self._cards)
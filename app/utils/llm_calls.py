@@ -0,0 +1,262 @@
+# app/utils/llm_calls.py
+"""
+Gọi OpenAI (sinh Cypher, tổng hợp, embedding) qua 1 lớp chính sách chung:
+
+- Deadline theo từng bước (LLM_DEADLINE_<BƯỚC>_S): hết hạn → LLMDeadlineExceeded (TimeoutError), không treo cả câu trả lời.
+- Retry lỗi tạm thời (429, 5xx, mất kết nối, timeout) với backoff lũy thừa + jitter, tôn trọng Retry-After,
+  không bao giờ ngủ quá deadline còn lại. Retry nội bộ của SDK được tắt để không nhân đôi.
+- Hedging: lời gọi chưa xong sau p95 gần nhất của bước đó → gửi thêm 1 bản sao, lấy kết quả về trước.
+- Stream (stream_completion): bước riêng "synthesis_stream", đo / hedge theo thời gian tới đoạn text đầu tiên,
+  deadline tính cho cả stream → không kéo p95 của "synthesis" (gọi thường) xuống bằng thời gian mở kết nối.
+- Thống kê theo bước: số lần gọi / lỗi / retry / hedge / hedge thắng / timeout + p50 / p95 (llm_call_stats()).
+
+LLM_POLICY_ENABLED=0 → gọi thẳng như trước.
+"""
+import os
+import time
+import random
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from app.utils.latency_budget import StageStats
+from app.utils.profiling import profiled
+
+
+LLM_POLICY_ENABLED = os.getenv("LLM_POLICY_ENABLED", "1") != "0"
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 3))
+LLM_BACKOFF_BASE_S = float(os.getenv("LLM_BACKOFF_BASE_S", 0.5))
+LLM_BACKOFF_MAX_S = float(os.getenv("LLM_BACKOFF_MAX_S", 8))
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "1") != "0"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", 95))
+# Cần đủ mẫu để p95 có nghĩa; dưới mức này không hedge
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", 20))
+LLM_HEDGE_MIN_DELAY_S = float(os.getenv("LLM_HEDGE_MIN_DELAY_S", 0.3))
+LLM_MAX_WORKERS = int(os.getenv("LLM_MAX_WORKERS", 32))
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 256))
+
+STAGE_DEADLINES_S = {
+    "cypher": float(os.getenv("LLM_DEADLINE_CYPHER_S", 20)),
+    "synthesis": float(os.getenv("LLM_DEADLINE_SYNTHESIS_S", 30)),
+    "synthesis_stream": float(os.getenv("LLM_DEADLINE_SYNTHESIS_STREAM_S", 30)),
+    "embedding": float(os.getenv("LLM_DEADLINE_EMBEDDING_S", 10)),
+    "embedding_batch": float(os.getenv("LLM_DEADLINE_EMBEDDING_BATCH_S", 60)),
+}
+# Lô embedding lúc ingest: không hedge (bản sao tốn gấp đôi token cho lời gọi lớn)
+HEDGE_STAGES = {"cypher", "synthesis", "synthesis_stream", "embedding"}
+
+
+class LLMDeadlineExceeded(TimeoutError):
+    """Lời gọi LLM / embedding không xong trong deadline của bước."""
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """429 / 5xx / lỗi kết nối / timeout của SDK OpenAI (không import openai để kiểm tra)."""
+    status = getattr(exc, "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    return type(exc).__name__ in ("APIConnectionError", "APITimeoutError", "RateLimitError",
+                                  "InternalServerError", "ConnectionError", "ReadTimeout")
+
+
+def retry_after_s(exc: BaseException) -> Optional[float]:
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class LLMCaller:
+    def __init__(self, max_retries: int = LLM_MAX_RETRIES, hedge: bool = LLM_HEDGE_ENABLED,
+                 deadlines: Optional[Dict[str, float]] = None):
+        self.max_retries = max_retries
+        self.hedge = hedge
+        self.deadlines = dict(STAGE_DEADLINES_S, **(deadlines or {}))
+        self.latency = StageStats()
+        self._counters: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=LLM_MAX_WORKERS, thread_name_prefix="llm-call")
+
+    def _count(self, stage: str, key: str, n: int = 1):
+        with self._lock:
+            counters = self._counters.setdefault(
+                stage, {"calls": 0, "ok": 0, "errors": 0, "retries": 0, "hedges": 0, "hedge_wins": 0, "timeouts": 0})
+            counters[key] += n
+
+    def hedge_delay_s(self, stage: str) -> Optional[float]:
+        if not self.hedge or stage not in HEDGE_STAGES:
+            return None
+        if self.latency.count(stage) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        return max(LLM_HEDGE_MIN_DELAY_S, self.latency.percentile(stage, LLM_HEDGE_PERCENTILE) / 1000)
+
+    def call(self, stage: str, fn: Callable[[], Any], deadline_s: Optional[float] = None, hedge: bool = True) -> Any:
+        """Chạy fn() với deadline + retry + hedging của bước `stage`."""
+        if not LLM_POLICY_ENABLED:
+            return fn()
+        self._count(stage, "calls")
+        deadline = time.monotonic() + (deadline_s or self.deadlines.get(stage, 30))
+        attempt = 0
+        while True:
+            try:
+                result = self._attempt(stage, fn, deadline, hedge)
+                self._count(stage, "ok")
+                return result
+            except LLMDeadlineExceeded:
+                self._count(stage, "timeouts")
+                raise
+            except Exception as e:
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    self._count(stage, "errors")
+                    raise
+                delay = retry_after_s(e) or min(LLM_BACKOFF_MAX_S, LLM_BACKOFF_BASE_S * (2 ** attempt))
+                delay = random.uniform(delay / 2, delay)
+                if time.monotonic() + delay >= deadline:
+                    self._count(stage, "timeouts")
+                    raise LLMDeadlineExceeded(f"{stage}: hết deadline khi chờ retry ({e})") from e
+                print(f"🔁 Retry {stage} lần {attempt + 1} sau {delay:.1f}s: {type(e).__name__}")
+                self._count(stage, "retries")
+                time.sleep(delay)
+                attempt += 1
+
+    def _attempt(self, stage: str, fn: Callable[[], Any], deadline: float, hedge: bool) -> Any:
+        start = time.monotonic()
+        hedge_at = self.hedge_delay_s(stage) if hedge else None
+        primary = self._executor.submit(profiled(fn))
+        pending = {primary}
+        hedged, last_exc = False, None
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                # ghi cả lần quá hạn để p95 phản ánh đúng phần đuôi
+                self.latency.record(stage, (now - start) * 1000)
+                raise LLMDeadlineExceeded(f"{stage}: quá deadline")
+            timeout = deadline - now
+            if hedge_at is not None and not hedged:
+                timeout = min(timeout, max(0.0, start + hedge_at - now))
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for f in done:
+                if f.exception() is None:
+                    self.latency.record(stage, (time.monotonic() - start) * 1000)
+                    if f is not primary:
+                        self._count(stage, "hedge_wins")
+                    return f.result()
+                last_exc = f.exception()
+            if not pending:
+                raise last_exc
+            if hedge_at is not None and not hedged and time.monotonic() - start >= hedge_at:
+                # Bản gốc chậm hơn p95 → gửi bản sao; bản thua tự kết thúc, kết quả bị bỏ qua
+                pending.add(self._executor.submit(profiled(fn)))
+                hedged = True
+                self._count(stage, "hedges")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = {k: dict(v) for k, v in self._counters.items()}
+        latency = self.latency.summary()
+        for stage, c in counters.items():
+            c.update(latency.get(stage, {}))
+        return counters
+
+
+_SHARED_CALLER: Optional[LLMCaller] = None
+_CALLER_LOCK = threading.Lock()
+
+
+def get_llm_caller() -> LLMCaller:
+    global _SHARED_CALLER
+    with _CALLER_LOCK:
+        if _SHARED_CALLER is None:
+            _SHARED_CALLER = LLMCaller()
+        return _SHARED_CALLER
+
+
+def llm_call_stats() -> Dict[str, Any]:
+    return get_llm_caller().stats() if _SHARED_CALLER is not None else {}
+
+
+# CHAT COMPLETION
+def chat_completion(client, stage: str, hedge: bool = True, **create_kwargs):
+    """client.chat.completions.create(**create_kwargs) qua chính sách của `stage` (retry SDK tắt, timeout = deadline)."""
+    caller = get_llm_caller()
+    if LLM_POLICY_ENABLED and hasattr(client, "with_options"):
+        client = client.with_options(max_retries=0, timeout=caller.deadlines.get(stage, 30))
+    return caller.call(stage, lambda: client.chat.completions.create(**create_kwargs), hedge=hedge)
+
+
+def _delta_text(chunk) -> Optional[str]:
+    if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+        return chunk.choices[0].delta.content
+    return None
+
+
+def stream_completion(client, stage: str = "synthesis_stream", **create_kwargs) -> Iterator[str]:
+    """
+    Từng đoạn text của client.chat.completions.create(stream=True, ...).
+    Mở stream + chờ đoạn text đầu tiên chạy qua chính sách của `stage` (retry / hedge trước khi người dùng
+    nhận được chữ nào, thống kê = time-to-first-token); deadline của `stage` tính cho cả stream,
+    quá hạn giữa chừng → đóng stream và LLMDeadlineExceeded.
+    """
+    caller = get_llm_caller()
+    deadline_s = caller.deadlines.get(stage, 30)
+    if LLM_POLICY_ENABLED and hasattr(client, "with_options"):
+        client = client.with_options(max_retries=0, timeout=deadline_s)
+    deadline = time.monotonic() + deadline_s
+
+    def _open():
+        stream = client.chat.completions.create(stream=True, **create_kwargs)
+        chunks = iter(stream)
+        for chunk in chunks:
+            text = _delta_text(chunk)
+            if text:
+                return stream, chunks, text
+        return stream, chunks, None
+
+    # Bản hedge thua vẫn giữ stream mở tới khi bị thu gom; chỉ xảy ra khi bản gốc chậm hơn p95
+    stream, chunks, first = caller.call(stage, _open, deadline_s=deadline_s)
+    try:
+        if first:
+            yield first
+        for chunk in chunks:
+            if LLM_POLICY_ENABLED and time.monotonic() >= deadline:
+                caller._count(stage, "timeouts")
+                raise LLMDeadlineExceeded(f"{stage}: quá deadline khi đang stream")
+            text = _delta_text(chunk)
+            if text:
+                yield text
+    finally:
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()
+
+
+# EMBEDDING
+_RESILIENT_CLS = None
+
+
+def wrap_embeddings(base):
+    """Bọc OpenAIEmbeddings: embed_query → bước 'embedding', embed_documents → từng lô EMBED_BATCH_SIZE."""
+    global _RESILIENT_CLS
+    if _RESILIENT_CLS is None:
+        from langchain_core.embeddings import Embeddings
+
+        class ResilientEmbeddings(Embeddings):
+            def __init__(self, inner):
+                self.inner = inner
+
+            def embed_query(self, text: str) -> List[float]:
+                return get_llm_caller().call("embedding", lambda: self.inner.embed_query(text))
+
+            def embed_documents(self, texts: List[str]) -> List[List[float]]:
+                texts = list(texts)
+                out: List[List[float]] = []
+                for i in range(0, len(texts), EMBED_BATCH_SIZE):
+                    chunk = texts[i:i + EMBED_BATCH_SIZE]
+                    # Lô nhỏ (batch câu hỏi) vẫn được hedge như câu đơn
+                    stage = "embedding" if len(texts) <= 16 else "embedding_batch"
+                    out.extend(get_llm_caller().call(stage, lambda c=chunk: self.inner.embed_documents(c)))
+                return out
+
+        _RESILIENT_CLS = ResilientEmbeddings
+    return _RESILIENT_CLS(base)
@@ -0,0 +1,350 @@
+# app/utils/profiling.py
+"""
+Profile theo từng câu hỏi cho main_cli / evaluate_rag_batch (`--profile`).
+
+- cprofile: cProfile cho thread chính + mọi việc được đẩy vào thread pool (nhánh Graph / Vector, gọi OpenAI)
+  → mỗi thread 1 profile riêng (bọc bằng profiled() lúc submit), gộp vào câu hỏi đang chạy.
+  Giới hạn: Python ≥ 3.12 chỉ cho 1 cProfile hoạt động trong cả process (sys.monitoring) → trong khi profiler
+  của thread chính đang chạy, việc trong thread pool chạy không profile (đếm ở threads_unprofiled của câu hỏi);
+  dùng thêm chế độ sample để thấy các thread đó.
+- tracemalloc: cấp phát tăng thêm sau câu hỏi (top dòng code) + đỉnh bộ nhớ.
+- sample: luồng lấy mẫu stack của mọi thread mỗi PROFILE_SAMPLE_MS ms (bỏ thread đang rảnh), ghi collapsed stack
+  (dùng được với flamegraph.pl / speedscope).
+
+Mỗi câu hỏi → q<NNN>.prof / .txt / .collapsed trong thư mục profile; report() gộp tất cả thành hotspots.txt + summary.json,
+kèm thời gian theo nhóm: LangChain, pickle, chuyển đổi record Neo4j, OpenAI / HTTP, FAISS, NumPy, code của app.
+"""
+import os
+import sys
+import json
+import time
+import threading
+import functools
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "results/profiles")
+PROFILE_SAMPLE_MS = float(os.getenv("PROFILE_SAMPLE_MS", 5))
+PROFILE_TOP = int(os.getenv("PROFILE_TOP", 30))
+MODES = ("cprofile", "tracemalloc", "sample")
+DEFAULT_MODES = ("cprofile", "tracemalloc")
+
+# Nhóm hàm theo file (khớp nhóm đầu tiên), thời gian = tổng self time của các hàm trong nhóm
+CATEGORIES: List[Tuple[str, Callable[[str, str], bool]]] = [
+    # thread chính chờ nhánh trong thread pool / event loop chờ I/O → tách riêng để không lẫn với thời gian xử lý
+    ("chờ (event loop / lock)", lambda f, n: f == "~" and any(s in n for s in ("select.epoll", "select.select", "select.poll",
+                                                                             "_thread.lock", "_thread.RLock"))),
+    ("pickle", lambda f, n: "pickle" in f or "_pickle" in n),
+    ("neo4j: chuyển đổi record", lambda f, n: "/neo4j/" in f and any(s in f for s in ("_data", "hydration", "_codec", "/graph/"))),
+    ("neo4j: driver / mạng", lambda f, n: "/neo4j/" in f),
+    ("langchain", lambda f, n: "langchain" in f),
+    ("openai / http", lambda f, n: any(s in f for s in ("/openai/", "/httpx/", "/httpcore/", "/h11/", "/anyio/"))),
+    ("ssl / socket", lambda f, n: f.endswith(("ssl.py", "socket.py")) or any(s in n for s in ("_ssl.", "_socket.", "socket'"))),
+    ("faiss", lambda f, n: "faiss" in f or "faiss" in n),
+    ("numpy", lambda f, n: "/numpy/" in f or "numpy." in n),
+    ("pandas", lambda f, n: "/pandas/" in f),
+    ("json", lambda f, n: "/json/" in f or "_json." in n),
+    ("app", lambda f, n: os.sep + "app" + os.sep in f),
+]
+
+# Hàm lá của thread đang rảnh (chờ việc / chờ lock) → không tính mẫu
+_IDLE_LEAVES = {("threading.py", "wait"), ("threading.py", "_wait_for_tstate_lock"), ("queue.py", "get"),
+                ("selectors.py", "select"), ("thread.py", "_worker")}
+
+_ACTIVE: Optional["QueryProfiler"] = None
+
+
+def categorize(filename: str, funcname: str) -> str:
+    for name, match in CATEGORIES:
+        if match(filename, funcname):
+            return name
+    return "khác"
+
+
+def profiled(fn: Callable) -> Callable:
+    """
+    Bọc hàm trước khi submit vào thread pool: đang profile (cprofile) → hàm chạy dưới cProfile riêng của thread đó
+    và được gộp vào câu hỏi đang chạy; không profile → trả lại đúng fn (không tốn gì thêm).
+    """
+    profiler = _ACTIVE
+    if profiler is None or "cprofile" not in profiler.modes:
+        return fn
+    query = profiler.current
+
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        import cProfile
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+        except ValueError:
+            # "Another profiling tool is already active" (Python ≥ 3.12) → chạy bình thường, không làm hỏng nhánh
+            profiler.skip_thread(query)
+            return fn(*args, **kwargs)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            prof.disable()
+            profiler.add_thread_profile(query, prof)
+    return run
+
+
+class StackSampler:
+    """Lấy mẫu stack của mọi thread (trừ chính nó) theo chu kỳ, đếm theo collapsed stack."""
+
+    def __init__(self, interval_ms: float = PROFILE_SAMPLE_MS):
+        self.interval_s = max(0.001, interval_ms / 1000)
+        self.counts: Dict[str, int] = {}
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _stack(self, frame) -> Optional[List[str]]:
+        leaf = frame.f_code
+        if (os.path.basename(leaf.co_filename), leaf.co_name) in _IDLE_LEAVES:
+            return None
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{getattr(code, 'co_qualname', code.co_name)} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        return stack[::-1]
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval_s):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = self._stack(frame)
+                if stack is None:
+                    continue
+                key = ";".join([names.get(ident, str(ident))] + stack)
+                self.counts[key] = self.counts.get(key, 0) + 1
+                self.samples += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def top_functions(self, n: int = PROFILE_TOP) -> List[Tuple[str, int]]:
+        """Hàm xuất hiện ở lá stack nhiều nhất (self samples)."""
+        leaves: Dict[str, int] = {}
+        for key, c in self.counts.items():
+            leaf = key.rsplit(";", 1)[-1].rsplit(":", 1)[0] + ")"
+            leaves[leaf] = leaves.get(leaf, 0) + c
+        return sorted(leaves.items(), key=lambda kv: -kv[1])[:n]
+
+
+class QueryProfiler:
+    """Bọc từng câu hỏi bằng `with profiler.profile(label):`, gọi report() khi xong để ghi báo cáo gộp."""
+
+    def __init__(self, modes=DEFAULT_MODES, out_dir: Optional[str] = None,
+                 sample_ms: float = PROFILE_SAMPLE_MS, top: int = PROFILE_TOP):
+        modes = [m.strip().lower() for m in (modes.split(",") if isinstance(modes, str) else modes) if m.strip()]
+        bad = [m for m in modes if m not in MODES]
+        if bad:
+            raise ValueError(f"❌ Chế độ profile không hợp lệ: {bad} (chọn {MODES})")
+        self.modes = tuple(modes)
+        self.out_dir = out_dir or os.path.join(PROFILE_DIR, datetime.now().strftime("%Y%m%d_%H%M%S"))
+        self.sample_ms = sample_ms
+        self.top = top
+        self.current: Optional[str] = None
+        self.queries: List[Dict[str, Any]] = []
+        self._thread_profiles: Dict[str, List[Any]] = {}
+        self._unprofiled: Dict[str, int] = {}
+        self._samples: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.out_dir, exist_ok=True)
+
+    def add_thread_profile(self, query: Optional[str], prof) -> None:
+        with self._lock:
+            self._thread_profiles.setdefault(query, []).append(prof)
+
+    def skip_thread(self, query: Optional[str]) -> None:
+        with self._lock:
+            self._unprofiled[query] = self._unprofiled.get(query, 0) + 1
+
+    @contextmanager
+    def profile(self, label: str):
+        global _ACTIVE
+        import cProfile
+        import tracemalloc
+
+        name = f"q{len(self.queries) + 1:03d}"
+        self.current = name
+        entry: Dict[str, Any] = {"name": name, "label": label}
+        prof = sampler = None
+        started_tracing = False
+        if "tracemalloc" in self.modes:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(10)
+                started_tracing = True
+            tracemalloc.reset_peak()
+            mem_before = tracemalloc.take_snapshot()
+        if "sample" in self.modes:
+            sampler = StackSampler(self.sample_ms)
+            sampler.start()
+        if "cprofile" in self.modes:
+            prof = cProfile.Profile()
+        _ACTIVE = self
+        start, cpu_start = time.perf_counter(), time.process_time()
+        if prof is not None:
+            prof.enable()
+        try:
+            yield entry
+        finally:
+            if prof is not None:
+                prof.disable()
+            if sampler is not None:
+                sampler.stop()
+            entry["wall_ms"] = round((time.perf_counter() - start) * 1000, 1)
+            entry["cpu_ms"] = round((time.process_time() - cpu_start) * 1000, 1)
+            _ACTIVE = None
+            self.current = None
+            lines = [f"# {name}: {label}", f"wall {entry['wall_ms']} ms · cpu {entry['cpu_ms']} ms (mọi thread)", ""]
+            with self._lock:
+                unprofiled = self._unprofiled.pop(name, 0)
+            if unprofiled:
+                entry["threads_unprofiled"] = unprofiled
+                lines += [f"⚠️ {unprofiled} việc trong thread pool chạy không cProfile (Python ≥ 3.12: 1 profiler / process)", ""]
+            if prof is not None:
+                lines += self._write_cprofile(name, prof, entry)
+            if "tracemalloc" in self.modes:
+                lines += self._memory_report(mem_before, entry)
+                if started_tracing:
+                    tracemalloc.stop()
+            if sampler is not None:
+                lines += self._write_samples(name, sampler, entry)
+            with open(os.path.join(self.out_dir, f"{name}.txt"), "w", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+            self.queries.append(entry)
+            print(f"🔬 Profile {name} ({entry['wall_ms']} ms): {os.path.join(self.out_dir, name + '.txt')}")
+
+    # TỪNG CÂU HỎI
+    def _write_cprofile(self, name: str, prof, entry: Dict[str, Any]) -> List[str]:
+        import pstats
+        stats = pstats.Stats(prof)
+        with self._lock:
+            threads = self._thread_profiles.pop(name, [])
+        for p in threads:
+            stats.add(p)
+        path = os.path.join(self.out_dir, f"{name}.prof")
+        stats.dump_stats(path)
+        entry["threads_profiled"] = len(threads)
+        entry["categories_ms"] = category_times(stats)
+        return [f"## cProfile (thread chính + {len(threads)} lượt chạy trong thread pool) → {path}",
+                *format_categories(entry["categories_ms"]), "",
+                *format_stats(stats, "cumulative", self.top), "",
+                *format_stats(stats, "tottime", self.top), ""]
+
+    def _memory_report(self, before, entry: Dict[str, Any]) -> List[str]:
+        import tracemalloc
+        after = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        diff = after.compare_to(before, "lineno")
+        entry["mem_peak_kb"] = round(peak / 1024, 1)
+        entry["mem_growth_kb"] = round(sum(d.size_diff for d in diff) / 1024, 1)
+        lines = [f"## tracemalloc: đỉnh {entry['mem_peak_kb']} KB · tăng thêm {entry['mem_growth_kb']} KB"]
+        for d in diff[: self.top]:
+            if d.size_diff:
+                lines.append(f"{d.size_diff / 1024:>10.1f} KB {d.count_diff:>+7} khối  {d.traceback[0]}")
+        return lines + [""]
+
+    def _write_samples(self, name: str, sampler: StackSampler, entry: Dict[str, Any]) -> List[str]:
+        path = os.path.join(self.out_dir, f"{name}.collapsed")
+        with open(path, "w", encoding="utf-8") as f:
+            for key, c in sorted(sampler.counts.items(), key=lambda kv: -kv[1]):
+                f.write(f"{key} {c}\n")
+        with self._lock:
+            for key, c in sampler.counts.items():
+                self._samples[key] = self._samples.get(key, 0) + c
+        entry["samples"] = sampler.samples
+        lines = [f"## Lấy mẫu mỗi {self.sample_ms} ms: {sampler.samples} mẫu → {path}"]
+        lines += [f"{c:>7}  {fn}" for fn, c in sampler.top_functions(self.top)]
+        return lines + [""]
+
+    # BÁO CÁO GỘP
+    def report(self) -> Optional[str]:
+        """Gộp mọi câu hỏi đã profile → hotspots.txt + summary.json (+ all.collapsed), trả về đường dẫn hotspots.txt."""
+        if not self.queries:
+            return None
+        import pstats
+        lines = [f"# Hotspot gộp {len(self.queries)} câu hỏi (chế độ: {', '.join(self.modes)})", ""]
+        lines.append(f"{'câu':<5} {'wall ms':>9} {'cpu ms':>9} {'đỉnh KB':>9}  nội dung")
+        for q in self.queries:
+            lines.append(f"{q['name']:<5} {q['wall_ms']:>9} {q['cpu_ms']:>9} {q.get('mem_peak_kb', '-'):>9}  {q['label'][:70]}")
+        lines.append("")
+        summary: Dict[str, Any] = {"modes": list(self.modes), "queries": self.queries}
+        unprofiled = sum(q.get("threads_unprofiled", 0) for q in self.queries)
+        if unprofiled:
+            summary["threads_unprofiled"] = unprofiled
+            lines += [f"⚠️ {unprofiled} việc trong thread pool không có cProfile (Python ≥ 3.12 chỉ cho 1 profiler / process)"
+                      " → các hàm của nhánh Graph / Vector có thể thiếu trong bảng dưới; xem thêm chế độ sample.", ""]
+
+        prof_files = [os.path.join(self.out_dir, f"{q['name']}.prof") for q in self.queries
+                      if os.path.exists(os.path.join(self.out_dir, f"{q['name']}.prof"))]
+        if prof_files:
+            stats = pstats.Stats(*prof_files)
+            stats.dump_stats(os.path.join(self.out_dir, "all.prof"))
+            summary["categories_ms"] = category_times(stats)
+            lines += ["## Thời gian theo nhóm (self time, mọi thread)", *format_categories(summary["categories_ms"]), ""]
+            lines += format_stats(stats, "cumulative", self.top) + [""] + format_stats(stats, "tottime", self.top) + [""]
+        if self._samples:
+            with open(os.path.join(self.out_dir, "all.collapsed"), "w", encoding="utf-8") as f:
+                for key, c in sorted(self._samples.items(), key=lambda kv: -kv[1]):
+                    f.write(f"{key} {c}\n")
+            lines.append("## Lấy mẫu: collapsed stack gộp → all.collapsed")
+
+        path = os.path.join(self.out_dir, "hotspots.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        with open(os.path.join(self.out_dir, "summary.json"), "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        print(f"🔬 Báo cáo hotspot gộp: {path}")
+        return path
+
+
+# ĐỊNH DẠNG
+def category_times(stats) -> Dict[str, float]:
+    """Tổng self time (ms) theo nhóm, sắp giảm dần."""
+    totals: Dict[str, float] = {}
+    for (filename, _, funcname), (_, _, tottime, _, _) in stats.stats.items():
+        cat = categorize(filename.replace("\\", "/"), funcname)
+        totals[cat] = totals.get(cat, 0.0) + tottime * 1000
+    return {k: round(v, 1) for k, v in sorted(totals.items(), key=lambda kv: -kv[1])}
+
+
+def format_categories(cats: Dict[str, float]) -> List[str]:
+    total = sum(cats.values()) or 1.0
+    return [f"{ms:>10.1f} ms {100 * ms / total:>5.1f}%  {name}" for name, ms in cats.items()]
+
+
+def format_stats(stats, sort: str, top: int) -> List[str]:
+    """Top hàm theo cumulative / tottime, dạng bảng gọn (không in qua stdout như print_stats)."""
+    rows = []
+    for (filename, line, funcname), (_, ncalls, tottime, cumtime, _) in stats.stats.items():
+        rows.append((cumtime if sort == "cumulative" else tottime, ncalls, tottime, cumtime, filename, line, funcname))
+    rows.sort(key=lambda r: -r[0])
+    title = "cộng dồn (cumtime)" if sort == "cumulative" else "tự thân (tottime)"
+    out = [f"## Top {top} theo thời gian {title}", f"{'ncalls':>9} {'tottime ms':>11} {'cumtime ms':>11}  hàm"]
+    for _, ncalls, tottime, cumtime, filename, line, funcname in rows[:top]:
+        where = f"{_short_path(filename)}:{line}({funcname})" if filename != "~" else funcname
+        out.append(f"{ncalls:>9} {tottime * 1000:>11.1f} {cumtime * 1000:>11.1f}  {where}")
+    return out
+
+
+def _short_path(filename: str) -> str:
+    filename = filename.replace("\\", "/")
+    for marker in ("site-packages/", "/app/", "/lib/python"):
+        if marker in filename:
+            return filename.split(marker, 1)[1] if marker != "/app/" else "app/" + filename.split(marker, 1)[1]
+    return filename
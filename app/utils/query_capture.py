@@ -0,0 +1,102 @@
+# app/utils/query_capture.py
+"""
+Ghi lại từng request (JSONL, 1 dòng / request) để phát lại đúng hình dạng tải thật (scripts/replay_queries.py)
+và làm nguồn câu hỏi cho cache warmer (trường "query").
+
+- QUERY_CAPTURE_PATH: file JSONL (rỗng = tắt) · QUERY_CAPTURE_SAMPLE: tỉ lệ request được ghi (0..1)
+- Mỗi dòng: thời điểm đến (ts), loại (answer / retrieve / refine), tham số (top_k, limit, budget_ms), độ trễ,
+  Cypher đã sinh, câu con, id Graph / id được chọn, nguồn câu trả lời, thời gian từng bước, lỗi (nếu có).
+- Pipeline (CLI, batch, Streamlit) ghi ở HybridAnswerPipeline.answer_async / retrieve_async, lượt tinh chỉnh trong
+  hội thoại ghi ở ConversationSession với kind="refine" (query = câu tinh chỉnh, kèm base_query; không phát lại
+  được như request độc lập nên replay / cache warmer bỏ qua); server ghi theo từng HTTP request (kể cả request được
+  gộp single-flight và request bị 429). Cache warmer không ghi (capture_query=False).
+"""
+import os
+import json
+import time
+import random
+import threading
+from typing import Any, Dict, Optional
+
+
+QUERY_CAPTURE_PATH = os.getenv("QUERY_CAPTURE_PATH", "")
+QUERY_CAPTURE_SAMPLE = float(os.getenv("QUERY_CAPTURE_SAMPLE", 1.0))
+
+
+class QueryCapture:
+    def __init__(self, path: str, sample: float = QUERY_CAPTURE_SAMPLE):
+        self.path = path
+        self.sample = sample
+        self.written = 0
+        self._lock = threading.Lock()
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def record(self, entry: Dict[str, Any]) -> None:
+        if self.sample < 1.0 and random.random() >= self.sample:
+            return
+        line = json.dumps(entry, ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            self.written += 1
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+_CAPTURE: Optional[QueryCapture] = None
+_CAPTURE_LOCK = threading.Lock()
+
+
+def get_query_capture() -> Optional[QueryCapture]:
+    """QueryCapture dùng chung trong process (None nếu QUERY_CAPTURE_PATH không được đặt)."""
+    global _CAPTURE
+    if not QUERY_CAPTURE_PATH:
+        return None
+    with _CAPTURE_LOCK:
+        if _CAPTURE is None:
+            _CAPTURE = QueryCapture(QUERY_CAPTURE_PATH)
+        return _CAPTURE
+
+
+def capture_entry(kind: str, query: str, started: float, top_k: int, limit: int, budget_ms: Optional[int],
+                  result: Optional[Dict[str, Any]] = None, error: Optional[str] = None, **extra) -> Dict[str, Any]:
+    """1 dòng capture từ kết quả pipeline (ctx của retrieve hoặc kết quả answer) hoặc từ payload HTTP."""
+    result = result or {}
+    chosen = result.get("chosen_passages") or []
+    entry = {
+        "ts": round(started, 3),
+        "kind": kind,
+        "query": query,
+        "top_k": top_k,
+        "limit": limit,
+        "budget_ms": budget_ms,
+        "latency_ms": int((time.time() - started) * 1000),
+        "cypher_query": result.get("cypher_query"),
+        "cypher_params": result.get("cypher_params") or {},
+        "sub_queries": result.get("sub_queries") or [],
+        "graph_ids": list(result.get("graph_ids") or [])[:50],
+        "chosen_ids": [str(p.get("id") if isinstance(p, dict) else p.id) for p in chosen],
+        "answer_source": result.get("answer_source"),
+        "partial": result.get("partial", False),
+        "timings": dict(result.get("timings") or {}),
+        "error": error,
+    }
+    entry.update(extra)
+    return entry
+
+
+def capture(kind: str, query: str, started: float, top_k: int, limit: int, budget_ms: Optional[int],
+            result: Optional[Dict[str, Any]] = None, error: Optional[str] = None, **extra) -> None:
+    """Ghi 1 request nếu capture đang bật; lỗi khi ghi không được làm hỏng request."""
+    cap = get_query_capture()
+    if cap is None:
+        return
+    try:
+        cap.record(capture_entry(kind, query, started, top_k, limit, budget_ms, result, error, **extra))
+    except Exception as e:
+        print("⚠️ Không ghi được query capture:", e)
@@ -0,0 +1,87 @@
+# app/utils/query_decomposer.py
+"""
+Tách câu hỏi ghép thành các câu hỏi con để truy xuất song song (thay cho 1 prompt NL2Cypher lớn + 1 lượt FAISS lẫn 2 ý).
+
+- Liệt kê nhiều quận: "so sánh nhà 4 tỷ ở Cầu Giấy và Thanh Xuân"
+    → "tìm nhà 4 tỷ ở Cầu Giấy" · "tìm nhà 4 tỷ ở Thanh Xuân" (phần điều kiện chung được giữ nguyên).
+- Nhiều vế, mỗi vế 1 quận: "nhà 5 tầng ở Đống Đa và biệt thự ở Tây Hồ"
+    → "nhà 5 tầng ở Đống Đa" · "biệt thự ở Tây Hồ".
+Mỗi câu con gần với mẫu trong Cypher_template.csv hơn (sinh Cypher nhanh, khớp few-shot, dùng lại cache Cypher).
+Câu hỏi 1 quận (hoặc không nêu quận) giữ nguyên.
+
+QUERY_DECOMPOSE_ENABLED=0 → tắt.
+"""
+import os
+import re
+from dataclasses import dataclass
+from typing import List
+
+from app.utils.filter_spec import find_districts
+
+
+QUERY_DECOMPOSE_ENABLED = os.getenv("QUERY_DECOMPOSE_ENABLED", "1") != "0"
+DECOMPOSE_MAX_SUBQUERIES = int(os.getenv("DECOMPOSE_MAX_SUBQUERIES", 4))
+
+# Khoảng giữa 2 tên quận chỉ gồm từ nối → đang liệt kê quận
+_ENUM_GAP_RE = re.compile(r"^(?:[\s,;/&]|và|với|hoặc|hay|cùng|so với|quận|huyện|q\.)*$")
+_DISTRICT_PREFIX_RE = re.compile(r"(?:quận|huyện|q\.)\s*$")
+# Chỗ tách vế: từ nối cuối cùng nằm giữa 2 quận
+_CLAUSE_SPLIT_RE = re.compile(r"\s*(?:;|,|\bvà\b|\bvới\b|\bhoặc\b|\bhay\b|\bcòn\b|\bso với\b)\s*")
+_COMPARE_PREFIX_RE = re.compile(r"^(?:hãy\s+|cho (?:tôi|mình)\s+)?so sánh(?:\s+giữa)?\s+", re.IGNORECASE)
+
+
+@dataclass
+class SubQuery:
+    text: str
+    focus: str      # quận mà câu con phụ trách
+
+
+def _title(name: str) -> str:
+    return " ".join(w[:1].upper() + w[1:] for w in name.split())
+
+
+def _as_search(text: str) -> str:
+    """"so sánh nhà ..." → "tìm nhà ..." (câu con là 1 truy vấn tìm kiếm, phần so sánh để bước tổng hợp làm)."""
+    text = text.strip(" ,;.")
+    stripped = _COMPARE_PREFIX_RE.sub("", text)
+    return f"tìm {stripped}" if stripped != text else text
+
+
+def decompose(question: str, max_parts: int = DECOMPOSE_MAX_SUBQUERIES) -> List[SubQuery]:
+    """Danh sách câu hỏi con (1 phần tử = không cần tách)."""
+    text = " ".join((question or "").split())
+    # Chữ thường theo từng ký tự, giữ nguyên ký tự nào đổi độ dài khi lower() ("İ")
+    # → vị trí tìm trên `low` cắt đúng trên `text`, câu con giữ chữ hoa gốc
+    low = "".join(c if len(c.lower()) != 1 else c.lower() for c in text)
+    hits, seen = [], set()
+    for start, end, name in find_districts(low):
+        if name not in seen:
+            seen.add(name)
+            hits.append((start, end, name))
+    if len(hits) < 2 or max_parts < 2:
+        return [SubQuery(text=question, focus=hits[0][2] if hits else "")]
+    hits = hits[:max_parts]
+
+    gaps = [low[hits[i - 1][1]:hits[i][0]] for i in range(1, len(hits))]
+    if all(_ENUM_GAP_RE.match(g) for g in gaps):
+        # Liệt kê: thay cả cụm "quận A và quận B" bằng từng quận
+        span_start = hits[0][0]
+        prefix = _DISTRICT_PREFIX_RE.search(low[:span_start])
+        keep_prefix = text[prefix.start():span_start] if prefix else ""
+        head, tail = text[:span_start - len(keep_prefix)], text[hits[-1][1]:]
+        return [SubQuery(text=_as_search(f"{head}{keep_prefix}{_title(name)}{tail}"), focus=name)
+                for _, _, name in hits]
+
+    # Nhiều vế: cắt tại từ nối cuối cùng giữa 2 quận liên tiếp
+    cuts = []
+    for i in range(1, len(hits)):
+        lo, hi = hits[i - 1][1], hits[i][0]
+        splits = list(_CLAUSE_SPLIT_RE.finditer(low, lo, hi))
+        if not splits:
+            return [SubQuery(text=question, focus="")]
+        cuts.append((splits[-1].start(), splits[-1].end()))
+    parts, pos = [], 0
+    for (cut_start, cut_end), (_, _, name) in zip(cuts + [(len(text), len(text))], hits):
+        parts.append(SubQuery(text=_as_search(text[pos:cut_start]), focus=name))
+        pos = cut_end
+    return parts
@@ -0,0 +1,127 @@
+"""
+So sánh recall / độ trễ / bộ nhớ giữa index hiện tại (1536 chiều float32) và các cấu hình rút gọn:
+số chiều (EMBED_DIMENSIONS) × kiểu lưu (float32 / float16 / int8) × có / không rescoring chính xác.
+Ground truth = top-k của index đầy đủ float32.
+Chạy:
+    python -m scripts.benchmark_embedding_storage                              # dùng .vector_store/text_embeddings
+    python -m scripts.benchmark_embedding_storage --embed-queries              # câu hỏi thật từ data/Question.csv (gọi API)
+    python -m scripts.benchmark_embedding_storage --synthetic 5000             # không cần index / API
+"""
+
+import os
+import sys
+import csv
+import time
+import argparse
+from datetime import datetime
+
+import numpy as np
+
+# Cho phép import module app/
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.utils.embedding_config import (
+    EMBED_MODEL,
+    EmbeddingConfig,
+    RescoringIndex,
+    build_index,
+    index_nbytes,
+    make_embeddings,
+    truncate_vectors,
+)
+
+
+def load_base_vectors(args) -> np.ndarray:
+    if args.synthetic:
+        rng = np.random.default_rng(0)
+        # Vector có cấu trúc (tổ hợp của ít hướng chính) cho gần với embedding thật hơn nhiễu thuần
+        basis = rng.normal(size=(64, args.dim)).astype(np.float32)
+        mix = rng.normal(size=(args.synthetic, 64)).astype(np.float32) ** 3
+        return truncate_vectors(mix @ basis + 0.1 * rng.normal(size=(args.synthetic, args.dim)), 0)
+    import faiss
+    index = faiss.read_index(os.path.join(args.index, "index.faiss"))
+    return np.asarray(index.reconstruct_n(0, index.ntotal), dtype=np.float32)
+
+
+def load_queries(args, base: np.ndarray) -> np.ndarray:
+    if args.embed_queries:
+        with open(args.questions, "r", encoding="utf-8") as f:
+            questions = [r["question"] for r in csv.DictReader(f) if r.get("question")][: args.n_queries]
+        emb = make_embeddings(EmbeddingConfig(model=EMBED_MODEL, dimensions=0))
+        return truncate_vectors(emb.embed_documents(questions), 0)
+    # Không gọi API: lấy ngẫu nhiên vector bài đăng + nhiễu nhỏ làm câu hỏi
+    rng = np.random.default_rng(1)
+    picks = rng.choice(len(base), size=min(args.n_queries, len(base)), replace=False)
+    return truncate_vectors(base[picks] + 0.05 * rng.normal(size=(len(picks), base.shape[1])), 0)
+
+
+def evaluate(index, queries: np.ndarray, truth: np.ndarray, k: int):
+    latencies, hits = [], 0
+    for qi in range(len(queries)):
+        t0 = time.perf_counter()
+        _, ids = index.search(queries[qi: qi + 1], k)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        hits += len(set(ids[0].tolist()) & set(truth[qi].tolist()))
+    lat = np.asarray(latencies)
+    return hits / truth.size, float(lat.mean()), float(np.percentile(lat, 95))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark số chiều / kiểu lưu embedding")
+    parser.add_argument("--index", default=".vector_store/text_embeddings", help="Thư mục FAISS hiện tại")
+    parser.add_argument("--synthetic", type=int, default=0, help="Dùng N vector tổng hợp thay cho index")
+    parser.add_argument("--dim", type=int, default=1536, help="Số chiều khi dùng --synthetic")
+    parser.add_argument("--embed-queries", action="store_true", help="Embedding câu hỏi thật (gọi API)")
+    parser.add_argument("--questions", default="data/Question.csv")
+    parser.add_argument("--n-queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--dims", type=int, nargs="+", default=[0, 768, 512, 256])
+    parser.add_argument("--storages", nargs="+", default=["float32", "float16", "int8"])
+    parser.add_argument("--rescore-factor", type=int, default=4)
+    args = parser.parse_args()
+
+    base = load_base_vectors(args)
+    queries = load_queries(args, base)
+    print(f"📦 {len(base)} vector × {base.shape[1]} chiều, {len(queries)} câu hỏi, k={args.k}")
+
+    _, truth = build_index(base, "float32").search(queries, args.k)
+
+    rows = []
+    for dims in args.dims:
+        docs_d, queries_d = truncate_vectors(base, dims), truncate_vectors(queries, dims)
+        for storage in args.storages:
+            index = build_index(docs_d, storage)
+            variants = [("no", index)]
+            if storage != "float32":
+                variants.append(("yes", RescoringIndex(index, docs_d, args.rescore_factor)))
+            for rescore, idx in variants:
+                recall, mean_ms, p95_ms = evaluate(idx, queries_d, truth, args.k)
+                nbytes = index_nbytes(index)
+                rows.append({
+                    "dimensions": docs_d.shape[1],
+                    "storage": storage,
+                    "rescore": rescore,
+                    f"recall@{args.k}": round(recall, 4),
+                    "mean_ms": round(mean_ms, 3),
+                    "p95_ms": round(p95_ms, 3),
+                    "bytes_per_vector": nbytes // max(1, index.ntotal),
+                    "index_mb": round(nbytes / 1e6, 2),
+                })
+
+    print(f"\n{'dims':>5} {'storage':>8} {'rescore':>7} {'recall':>7} {'mean ms':>8} {'p95 ms':>8} {'B/vec':>7} {'MB':>7}")
+    for r in rows:
+        print(f"{r['dimensions']:>5} {r['storage']:>8} {r['rescore']:>7} {r[f'recall@{args.k}']:>7} "
+              f"{r['mean_ms']:>8} {r['p95_ms']:>8} {r['bytes_per_vector']:>7} {r['index_mb']:>7}")
+    print("   (rescore=yes: thêm vector float32 trên đĩa, đọc qua memmap dùng chung giữa các worker)")
+
+    os.makedirs("results", exist_ok=True)
+    out = os.path.join("results", f"embedding_storage_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
+    with open(out, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"\n💾 Đã lưu báo cáo: {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""
+So sánh các backend vector (FAISS / Chroma) trên cùng dữ liệu data/project-text-semantic.csv và cùng bộ vector:
+thời gian build / nạp, độ trễ p50 / p95 (tìm thường, MMR, fetch theo id), bộ nhớ (RSS tăng khi nạp, dung lượng đĩa)
+và recall@k so với top-k chính xác (NumPy, L2 trên toàn bộ vector).
+Chạy:
+    python -m scripts.benchmark_vector_backends                         # embedding băm từ (không gọi API)
+    python -m scripts.benchmark_vector_backends --embed                 # embedding thật (OPENAI_EMBED_MODEL, gọi API)
+    python -m scripts.benchmark_vector_backends --backends faiss --limit 2000
+Mỗi backend được build trong thư mục tạm, rồi nạp lại như lúc chạy thật (VectorClient) trước khi đo.
+"""
+
+import os
+import re
+import sys
+import csv
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from langchain_core.embeddings import Embeddings
+
+# Cho phép import module app/
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.retrievers.vector_backends import BACKENDS, backend_class, make_backend
+from app.retrievers.vector_tools import VectorClient
+from app.utils.embedding_config import EMBED_MODEL, EmbeddingConfig, make_embeddings, truncate_vectors
+
+
+class HashEmbeddings(Embeddings):
+    """Embedding túi-từ băm vào `dim` chiều: có tương đồng từ vựng thật, không cần API, kết quả lặp lại được."""
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def _vec(self, text: str):
+        v = np.zeros(self.dim, dtype=np.float32)
+        for w in re.findall(r"\w+", text.lower()):
+            v[int(hashlib.md5(w.encode("utf-8")).hexdigest(), 16) % self.dim] += 1.0
+        return truncate_vectors(v[None, :], 0)[0].tolist()
+
+    def embed_documents(self, texts):
+        return [self._vec(t) for t in texts]
+
+    def embed_query(self, text):
+        return self._vec(text)
+
+
+def rss_mb() -> float:
+    """RSS hiện tại của process (Linux: /proc, nơi khác: đỉnh RSS)."""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def dir_mb(path: str) -> float:
+    total = sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+    return total / 1e6
+
+
+def percentiles(samples):
+    arr = np.asarray(samples) if samples else np.zeros(1)
+    return round(float(np.percentile(arr, 50)), 3), round(float(np.percentile(arr, 95)), 3)
+
+
+def timed(fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    out = fn(*args, **kwargs)
+    return out, (time.perf_counter() - t0) * 1000
+
+
+def load_corpus(args):
+    df = pd.read_csv(args.data)
+    df["id"] = df["id"].astype(str).str.strip()
+    if args.limit:
+        df = df.head(args.limit)
+    texts = df["text"].astype(str).tolist()
+    metadatas = [{"id": i} for i in df["id"]]
+    with open(args.questions, "r", encoding="utf-8-sig") as f:
+        questions = [r["question"] for r in csv.DictReader(f) if r.get("question")][: args.n_queries]
+    return texts, metadatas, questions
+
+
+def bench_backend(name, args, texts, metadatas, doc_vecs, qmat, truth, emb):
+    row = {"backend": name}
+    folder = tempfile.mkdtemp(prefix=f"vb_{name}_")
+    try:
+        _, build_ms = timed(backend_class(name).create, folder, texts, metadatas, doc_vecs, emb)
+        rss0 = rss_mb()
+        backend, load_ms = timed(make_backend, name, folder, emb)
+        row.update({
+            "build_s": round(build_ms / 1000, 2),
+            "load_ms": round(load_ms, 1),
+            "rss_load_mb": round(rss_mb() - rss0, 1),
+            "disk_mb": round(dir_mb(folder), 2),
+        })
+
+        # Tìm kiếm thường: đo trực tiếp trên backend (không tính embedding)
+        lat, hits = [], 0
+        for qi in range(len(qmat)):
+            res, ms = timed(backend.candidates, qmat[qi], args.k)
+            lat.append(ms)
+            hits += len({p.id for _, p, _ in res} & truth[qi])
+        row["search_p50_ms"], row["search_p95_ms"] = percentiles(lat)
+        row[f"recall@{args.k}"] = round(hits / max(1, sum(len(t) for t in truth)), 4)
+
+        # MMR qua VectorClient (fetch_k ứng viên kèm vector + chọn MMR), embedding lấy từ cache
+        client = VectorClient(index_path=folder, backend=name)
+        client._emb, client._backend = emb, backend
+        fetch_k = max(args.k, min(25, max(10, args.k * 2)))
+        lat = []
+        for qi in range(len(qmat)):
+            t0 = time.perf_counter()
+            cand = backend.candidates(qmat[qi], fetch_k, with_vectors=True)
+            client._pick(qmat[qi], cand, args.k, mmr=True)
+            lat.append((time.perf_counter() - t0) * 1000)
+        row["mmr_p50_ms"], row["mmr_p95_ms"] = percentiles(lat)
+
+        # Fetch theo id (bước ghép Graph → Vector): 3 id ngẫu nhiên mỗi lần
+        rng = np.random.default_rng(0)
+        ids = [m["id"] for m in metadatas]
+        lat = []
+        for _ in range(len(qmat)):
+            _, ms = timed(client.fetch_by_ids, list(rng.choice(ids, size=3, replace=False)), 3)
+            lat.append(ms)
+        row["fetch_p50_ms"], row["fetch_p95_ms"] = percentiles(lat)
+
+        # Upsert 1 bài (thay bài có sẵn)
+        _, ms = timed(backend.upsert, texts[:1], metadatas[:1], doc_vecs[:1].tolist())
+        row["upsert_ms"] = round(ms, 1)
+        row["error"] = ""
+    except Exception as e:
+        row["error"] = f"{type(e).__name__}: {e}"
+        print(f"⚠️ Bỏ qua {name}: {row['error']}")
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark backend vector (FAISS / Chroma)")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=list(BACKENDS))
+    parser.add_argument("--data", default="data/project-text-semantic.csv")
+    parser.add_argument("--questions", default="data/Question.csv")
+    parser.add_argument("--limit", type=int, default=0, help="Chỉ dùng N bài đầu (0 = tất cả)")
+    parser.add_argument("--n-queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--embed", action="store_true", help="Embedding thật bằng OPENAI_EMBED_MODEL (gọi API)")
+    parser.add_argument("--dim", type=int, default=256, help="Số chiều của embedding băm (khi không --embed)")
+    args = parser.parse_args()
+
+    texts, metadatas, questions = load_corpus(args)
+    if args.embed:
+        emb = make_embeddings(EmbeddingConfig(model=EMBED_MODEL))
+    else:
+        emb = HashEmbeddings(args.dim)
+    t0 = time.time()
+    doc_vecs = np.asarray(emb.embed_documents(texts), dtype=np.float32)
+    qmat = np.asarray(emb.embed_documents(questions), dtype=np.float32)
+    print(f"📦 {len(texts)} bài × {doc_vecs.shape[1]} chiều, {len(questions)} câu hỏi, k={args.k} "
+          f"(embedding {'API' if args.embed else 'băm'} mất {time.time() - t0:.1f}s)")
+
+    # Ground truth: top-k L2 chính xác trên toàn bộ vector
+    d2 = (qmat ** 2).sum(1)[:, None] - 2 * qmat @ doc_vecs.T + (doc_vecs ** 2).sum(1)[None, :]
+    top = np.argsort(d2, axis=1, kind="stable")[:, : args.k]
+    truth = [{metadatas[j]["id"] for j in row} for row in top]
+
+    rows = [bench_backend(name, args, texts, metadatas, doc_vecs, qmat, truth, emb) for name in args.backends]
+
+    cols = ["backend", "build_s", "load_ms", "rss_load_mb", "disk_mb", "search_p50_ms", "search_p95_ms",
+            "mmr_p50_ms", "mmr_p95_ms", "fetch_p50_ms", "fetch_p95_ms", "upsert_ms", f"recall@{args.k}"]
+    print("\n" + " ".join(f"{c:>13}" for c in cols))
+    for r in rows:
+        print(" ".join(f"{str(r.get(c, '-')):>13}" for c in cols))
+    print("   (rss_load_mb: RSS tăng khi nạp index trong process benchmark, backend chạy sau có thể hưởng thư viện đã nạp)")
+
+    os.makedirs("results", exist_ok=True)
+    out = os.path.join("results", f"vector_backends_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
+    with open(out, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=cols + ["error"], extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"\n💾 Đã lưu báo cáo: {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Bootstrap schema/index cho Neo4j + báo cáo PROFILE trước/sau cho toàn bộ template.
+Chạy:
+    python -m scripts.bootstrap_neo4j_indexes
+    python -m scripts.bootstrap_neo4j_indexes --skip-profile
+    python -m scripts.bootstrap_neo4j_indexes --read-model      # PROFILE sau: template đọc read model trên Property
+    python -m scripts.bootstrap_neo4j_indexes --export-templates data/Cypher_template_indexed.csv
+"""
+
+import os
+import sys
+import csv
+import argparse
+from datetime import datetime
+
+import pandas as pd
+from dotenv import load_dotenv
+
+# Cho phép import module app/
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.retrievers.graph_tools import Neo4jExecutor
+from app.retrievers.graph_schema import bootstrap_schema, rewrite_cypher_for_indexes
+from app.retrievers.read_model import rewrite_cypher_for_read_model
+
+
+TEMPLATE_PATH = "data/Cypher_template.csv"
+REPORT_FIELDS = [
+    "idx", "question",
+    "before_db_hits", "after_db_hits",
+    "before_ms", "after_ms",
+    "before_label_scans", "after_label_scans",
+    "before_rows", "after_rows", "same_ids", "error",
+]
+
+
+def load_templates(path: str, limit: int = None):
+    df = pd.read_csv(path)
+    if not {"Question", "Cypher"}.issubset(df.columns):
+        raise ValueError("❌ CSV phải có 2 cột: 'Question' và 'Cypher'")
+    rows = list(zip(df["Question"].astype(str), df["Cypher"].astype(str)))
+    return rows[:limit] if limit else rows
+
+
+def profile_all(executor: Neo4jExecutor, templates, rewrite: bool, read_model: bool = False):
+    """PROFILE từng template (bản gốc hoặc bản đã viết lại; read_model: ưu tiên dạng 1 node / căn)."""
+    out = []
+    for i, (_, cypher) in enumerate(templates, 1):
+        query = cypher
+        if rewrite:
+            query = (read_model and rewrite_cypher_for_read_model(cypher)) or rewrite_cypher_for_indexes(cypher)
+        try:
+            out.append(executor.profile_query(query))
+        except Exception as e:
+            out.append({"error": str(e)})
+        if i % 20 == 0:
+            print(f"   … {i}/{len(templates)}")
+    return out
+
+
+def write_report(path: str, templates, before, after):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        for i, ((question, _), b, a) in enumerate(zip(templates, before, after), 1):
+            writer.writerow({
+                "idx": i,
+                "question": question,
+                "before_db_hits": b.get("db_hits"),
+                "after_db_hits": a.get("db_hits"),
+                "before_ms": b.get("took_ms"),
+                "after_ms": a.get("took_ms"),
+                "before_label_scans": b.get("label_scans"),
+                "after_label_scans": a.get("label_scans"),
+                "before_rows": b.get("rows"),
+                "after_rows": a.get("rows"),
+                "same_ids": b.get("ids") == a.get("ids"),
+                "error": b.get("error") or a.get("error") or "",
+            })
+
+
+def print_summary(before, after):
+    ok = [(b, a) for b, a in zip(before, after) if "error" not in b and "error" not in a]
+    if not ok:
+        print("⚠️ Không có template nào PROFILE thành công.")
+        return
+    hits_b = sum(b["db_hits"] for b, _ in ok)
+    hits_a = sum(a["db_hits"] for _, a in ok)
+    ms_b = sum(b["took_ms"] for b, _ in ok)
+    ms_a = sum(a["took_ms"] for _, a in ok)
+    mismatched = sum(1 for b, a in ok if b.get("ids") != a.get("ids"))
+    print("\n───────────────────────────────")
+    print("📊 TỔNG HỢP PROFILE")
+    print("───────────────────────────────")
+    print(f"🔸 Template thành công:   {len(ok)}/{len(before)}")
+    print(f"🔸 dbHits trước → sau:    {hits_b} → {hits_a}")
+    print(f"🔸 Thời gian trước → sau: {ms_b} ms → {ms_a} ms")
+    print(f"🔸 Kết quả khác nhau:     {mismatched}")
+    print("───────────────────────────────\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tạo index/constraint Neo4j và PROFILE các template Cypher")
+    parser.add_argument("--templates", default=TEMPLATE_PATH, help="CSV template (Question, Cypher)")
+    parser.add_argument("--limit", type=int, default=None, help="Chỉ PROFILE N template đầu")
+    parser.add_argument("--skip-profile", action="store_true", help="Chỉ tạo index, không PROFILE")
+    parser.add_argument("--report", default=None, help="Đường dẫn CSV báo cáo PROFILE")
+    parser.add_argument("--export-templates", default=None, help="Ghi template đã viết lại ra CSV")
+    parser.add_argument("--read-model", action="store_true",
+                        help="PROFILE sau dùng read model trên Property (template không nhận ra dạng thì dùng name_lc)")
+    args = parser.parse_args()
+
+    load_dotenv()
+    templates = load_templates(args.templates, args.limit)
+    print(f"📂 Đã đọc {len(templates)} template từ {args.templates}")
+
+    if args.export_templates:
+        with open(args.export_templates, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f, quoting=csv.QUOTE_ALL)
+            writer.writerow(["Question", "Cypher"])
+            for question, cypher in templates:
+                writer.writerow([question, rewrite_cypher_for_indexes(cypher)])
+        print(f"💾 Đã ghi template dùng index vào: {args.export_templates}")
+
+    executor = Neo4jExecutor()
+    try:
+        before = []
+        if not args.skip_profile:
+            print("\n⏱ PROFILE trước khi tạo index...")
+            before = profile_all(executor, templates, rewrite=False)
+
+        print("\n🧱 Tạo constraint / index / name_lc...")
+        bootstrap_schema(executor)
+
+        if not args.skip_profile:
+            print("\n⏱ PROFILE sau khi tạo index (Cypher đã viết lại)...")
+            after = profile_all(executor, templates, rewrite=True, read_model=args.read_model)
+            report_path = args.report or os.path.join(
+                "results", f"index_profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+            )
+            write_report(report_path, templates, before, after)
+            print_summary(before, after)
+            print(f"👉 Báo cáo chi tiết: {os.path.abspath(report_path)}")
+    finally:
+        executor.close()
+
+
+if __name__ == "__main__":
+    main()
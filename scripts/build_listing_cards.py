@@ -0,0 +1,40 @@
+"""
+Dựng lại listing card (tóm tắt gọn từng bài đăng) dùng khi LLM tổng hợp câu trả lời.
+Chạy:
+    python -m scripts.build_listing_cards
+    python -m scripts.build_listing_cards --max-tokens 100
+"""
+
+import os
+import sys
+import argparse
+
+# Cho phép import module app/
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.utils.listing_cards import (
+    CARD_MAX_TOKENS,
+    LISTING_CARDS_PATH,
+    build_listing_cards,
+    count_tokens,
+    save_listing_cards,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dựng listing card từ 2 file CSV")
+    parser.add_argument("--meta", default="data/project-meta-kg.csv", help="CSV metadata bài đăng")
+    parser.add_argument("--text", default="data/project-text-semantic.csv", help="CSV mô tả bài đăng")
+    parser.add_argument("--max-tokens", type=int, default=CARD_MAX_TOKENS, help="Ngân sách token mỗi card")
+    parser.add_argument("--out", default=LISTING_CARDS_PATH, help="File JSON đầu ra")
+    args = parser.parse_args()
+
+    cards = build_listing_cards(args.meta, args.text, max_tokens=args.max_tokens)
+    path = save_listing_cards(cards, args.out)
+    sizes = [count_tokens(c) for c in cards.values()] or [0]
+    print(f"💾 Đã lưu {len(cards)} listing card vào: {path}")
+    print(f"📏 Token/card: trung bình {sum(sizes) / len(sizes):.0f}, lớn nhất {max(sizes)}")
+
+
+if __name__ == "__main__":
+    main()
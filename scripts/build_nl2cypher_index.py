@@ -0,0 +1,53 @@
+"""
+Đồng bộ index ví dụ few-shot NL2Cypher với data/Cypher_template.csv (offline, trước / sau khi sửa mẫu).
+Chỉ câu hỏi mới / đã sửa được embedding; phiên bản mới được ghi vào versions/v<N> rồi mới đổi CURRENT,
+server đang chạy tự nạp bản mới sau tối đa NL2CYPHER_CHECK_S giây.
+Chạy:
+    python -m scripts.build_nl2cypher_index            # build tăng dần
+    python -m scripts.build_nl2cypher_index --check    # chỉ báo index có cũ so với CSV không
+    python -m scripts.build_nl2cypher_index --force    # embedding lại toàn bộ (vd đổi EMBED_DIMENSIONS)
+"""
+
+import os
+import sys
+import argparse
+
+# Cho phép import module app/
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.config import load_env
+from app.retrievers.nl2cypher_index import current_dir, is_stale, read_meta, sync_index
+from app.utils.embedding_config import EMBED_MODEL, EmbeddingConfig, make_embeddings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build tăng dần index few-shot NL2Cypher")
+    parser.add_argument("--csv", default="data/Cypher_template.csv", help="CSV mẫu (Question, Cypher)")
+    parser.add_argument("--store", default=".vector_store/nl2cypher_index", help="Thư mục index")
+    parser.add_argument("--check", action="store_true", help="Chỉ kiểm tra, không build")
+    parser.add_argument("--force", action="store_true", help="Embedding lại toàn bộ theo cấu hình hiện tại")
+    args = parser.parse_args()
+
+    load_env()
+    folder = current_dir(args.store)
+    meta = read_meta(folder)
+    stale = is_stale(args.csv, args.store)
+    print(f"📦 Index hiện tại: {folder or 'chưa có'} (v{meta.get('version', '?')}) · "
+          f"{'cũ so với CSV' if stale else 'khớp CSV'}")
+    if args.check:
+        sys.exit(1 if stale else 0)
+    if not stale and not args.force:
+        print("✅ Không có gì thay đổi")
+        return
+
+    # Giữ cấu hình của index đang phục vụ (câu hỏi được embedding khớp); --force theo cấu hình môi trường
+    config = EmbeddingConfig(model=EMBED_MODEL) if args.force or folder is None else EmbeddingConfig.for_index(folder, model=EMBED_MODEL)
+    stats = sync_index(args.csv, args.store, make_embeddings(config), config, force=args.force)
+    if stats.get("locked"):
+        print("⏳ Process khác đang build index, thử lại sau")
+        sys.exit(1)
+    print(f"📊 {stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Chia FAISS index văn bản hiện có thành N shard cho ShardedVectorClient (không cần embedding lại).
+Chạy:
+    python -m scripts.build_vector_shards --shards 4                      # chia theo hash id
+    python -m scripts.build_vector_shards --shards 4 --partition district # chia theo quận
+    python -m scripts.build_vector_shards --only shard_02                 # build lại 1 shard (hot reload)
+"""
+
+import os
+import sys
+import shutil
+import pickle
+import argparse
+
+import numpy as np
+import pandas as pd
+
+# Cho phép import module app/
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.retrievers.sharded_vector import (
+    VECTOR_SHARDS_DIR,
+    assign_shards,
+    read_manifest,
+    write_manifest,
+    write_shard,
+)
+from app.utils.embedding_config import VECTORS_FILE, EmbeddingConfig
+
+
+def load_source(index_dir: str):
+    """(vectors float32, docs) theo đúng thứ tự hàng trong FAISS index gốc."""
+    import faiss
+    index = faiss.read_index(os.path.join(index_dir, "index.faiss"))
+    with open(os.path.join(index_dir, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    vec_path = os.path.join(index_dir, VECTORS_FILE)
+    if os.path.exists(vec_path):
+        vectors = np.load(vec_path)
+    else:
+        vectors = np.asarray(index.reconstruct_n(0, index.ntotal), dtype=np.float32)
+    docs = []
+    for row in range(index.ntotal):
+        doc = docstore.search(index_to_docstore_id[row])
+        meta = dict(doc.metadata or {})
+        docs.append({"id": str(meta.get("id", "")).strip(), "text": doc.page_content, "metadata": meta})
+    return vectors, docs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chia FAISS index văn bản thành nhiều shard")
+    parser.add_argument("--index", default=".vector_store/text_embeddings", help="Thư mục FAISS gốc")
+    parser.add_argument("--out", default=VECTOR_SHARDS_DIR, help="Thư mục shard")
+    parser.add_argument("--shards", type=int, default=4, help="Số shard (≈ số process tìm kiếm)")
+    parser.add_argument("--partition", choices=["hash", "district"], default="hash")
+    parser.add_argument("--meta", default="data/project-meta-kg.csv", help="CSV lấy quận theo id (--partition district)")
+    parser.add_argument("--only", nargs="+", help="Chỉ build lại các shard này, giữ nguyên phần còn lại")
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    previous = read_manifest(args.out) or {}
+    emb_config = EmbeddingConfig.for_index(args.index)
+    if args.only and previous:
+        # Build lại 1 phần: giữ cách chia của lần trước
+        args.shards, args.partition = len(previous["shards"]), previous["partition"]
+
+    vectors, docs = load_source(args.index)
+    print(f"📦 Index gốc: {len(docs)} bài × {vectors.shape[1]} chiều ({emb_config.storage})")
+
+    districts = None
+    if args.partition == "district":
+        meta = pd.read_csv(args.meta, dtype=str)
+        districts = dict(zip(meta["id"].str.strip(), meta["district_name"].fillna("").str.strip().str.lower()))
+    # chia theo hàng: mọi hàng cùng id (kể cả bài không có id → "") vào cùng 1 shard, không hàng nào bị bỏ
+    rows_by_id = {}
+    for row, doc in enumerate(docs):
+        rows_by_id.setdefault(doc["id"], []).append(row)
+    shared = len(docs) - len(rows_by_id)
+    if shared:
+        print(f"⚠️ {shared} hàng trùng id với hàng khác (hoặc không có id) → giữ cả, cùng shard với id đó")
+    assignment = assign_shards(list(rows_by_id), args.shards, args.partition, districts)
+
+    version = int(previous.get("version", 0)) + 1
+    old_paths = {s["name"]: s["path"] for s in previous.get("shards", [])}
+    shards = []
+    for name, ids in assignment.items():
+        if args.only and name not in args.only and name in old_paths:
+            shards.append(next(s for s in previous["shards"] if s["name"] == name))
+            continue
+        rows = [r for i in ids for r in rows_by_id[i]]
+        rel = write_shard(args.out, name, version, vectors[rows], [docs[r] for r in rows], emb_config.storage)
+        shards.append({"name": name, "path": rel, "count": len(rows)})
+        print(f"💾 {name}: {len(rows)} bài → {rel}")
+
+    manifest = {
+        "version": version,
+        "partition": args.partition,
+        "embedding": {"model": emb_config.model, "dimensions": emb_config.dimensions, "storage": emb_config.storage},
+        "shards": shards,
+    }
+    path = write_manifest(args.out, manifest)
+    print(f"✅ Đã ghi manifest v{version}: {path}")
+
+    # Dọn thư mục shard không còn được tham chiếu (giữ bản của manifest trước cho truy vấn đang chạy)
+    keep = {s["path"] for s in shards} | set(old_paths.values())
+    for entry in os.listdir(args.out):
+        full = os.path.join(args.out, entry)
+        if os.path.isdir(full) and entry not in keep:
+            shutil.rmtree(full, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
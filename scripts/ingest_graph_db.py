@@ -0,0 +1,70 @@
+"""
+Nạp data/project-meta-kg.csv vào Neo4j (bulk UNWIND + MERGE).
+Chạy:
+    python -m scripts.ingest_graph_db                  # nạp toàn bộ
+    python -m scripts.ingest_graph_db --incremental    # chỉ nạp bài mới / thay đổi theo id
+    python -m scripts.ingest_graph_db --dry-run        # chạy với executor giả lập, không cần Neo4j
+"""
+
+import os
+import sys
+import re
+import argparse
+from collections import Counter
+
+from dotenv import load_dotenv
+
+# Cho phép import module app/
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.utils.graph_loader import GraphLoader, RecordingExecutor, load_listings, DEFAULT_BATCH_SIZE
+from app.utils.cache_warmer import request_warm
+
+
+DATA_PATH = "data/project-meta-kg.csv"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk loader project-meta-kg.csv → Neo4j")
+    parser.add_argument("--csv", default=DATA_PATH, help="File CSV metadata bài đăng")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Số dòng mỗi lô UNWIND")
+    parser.add_argument("--workers", type=int, default=4, help="Số luồng song song (theo loại quan hệ)")
+    parser.add_argument("--incremental", action="store_true", help="Chỉ nạp bài mới/thay đổi, xóa bài đã gỡ")
+    parser.add_argument("--skip-schema", action="store_true", help="Không tạo constraint/index")
+    parser.add_argument("--dry-run", action="store_true", help="Dùng RecordingExecutor thay cho Neo4j")
+    args = parser.parse_args()
+
+    load_dotenv()
+    print(f"📂 Đang đọc dữ liệu từ: {args.csv}")
+    listings = load_listings(args.csv)
+    print(f"✅ Số bài đăng: {len(listings)}")
+
+    if args.dry_run:
+        executor = RecordingExecutor()
+    else:
+        from app.retrievers.graph_tools import Neo4jExecutor
+        executor = Neo4jExecutor()
+
+    try:
+        loader = GraphLoader(executor, batch_size=args.batch_size, workers=args.workers)
+        report = loader.load(listings, incremental=args.incremental, ensure_schema=not args.skip_schema)
+        print("📊 Báo cáo:", report)
+        if not args.dry_run:
+            # Graph version đã đổi → cache Neo4j của server bị xóa; nhờ server làm nóng lại (WARM_URL)
+            request_warm()
+    finally:
+        executor.close()
+
+    if args.dry_run:
+        def _kind(cypher: str) -> str:
+            rel = re.findall(r"MERGE \(\w+\)-\[:(\w+)\]->", cypher)
+            return rel[0] if rel else cypher.strip().splitlines()[0][:60]
+
+        kinds = Counter(_kind(call["cypher"]) for call in executor.calls)
+        print(f"\n🧪 Dry-run: {len(executor.calls)} câu lệnh đã ghi lại")
+        for head, n in kinds.most_common():
+            print(f"   {n:>4} × {head}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,17 @@
 import os
+import sys
 import pandas as pd
 from dotenv import load_dotenv
-from langchain_openai import OpenAIEmbeddings
 from langchain_community.vectorstores import FAISS, Chroma
 
+# Cho phép import module app/
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.utils.listing_cards import build_listing_cards, save_listing_cards
+from app.utils.dedup import find_near_duplicates, save_aliases
+from app.utils.embedding_config import EmbeddingConfig, apply_storage, make_embeddings
+from app.utils.cache_warmer import request_warm
+
 # Load biến môi trường
 load_dotenv()
 
@@ -11,6 +19,11 @@ DATA_PATH = "data/project-text-semantic.csv"
 VDB_DIR = os.getenv("VECTOR_DB_DIR", ".vector_store")
 BACKEND = os.getenv("VECTOR_DB_BACKEND", "faiss").lower()
 EMBED_MODEL = os.getenv("OPENAI_EMBED_MODEL", "text-embedding-3-small")
+# Số chiều / kiểu lưu vector: EMBED_DIMENSIONS, EMBED_STORAGE (xem app/utils/embedding_config.py)
+EMB_CONFIG = EmbeddingConfig(model=EMBED_MODEL)
+META_PATH = "data/project-meta-kg.csv"
+# Gộp bài đăng gần trùng trước khi embedding (0 = tắt)
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "1") != "0"
 
 os.makedirs(VDB_DIR, exist_ok=True)
 
@@ -21,30 +34,67 @@ df = pd.read_csv(DATA_PATH)
 if not {"id", "text"}.issubset(df.columns):
     raise ValueError("❌ File CSV phải có 2 cột: 'id' và 'text'")
 
+print(f"✅ Số bài rao: {len(df)}")
+
+# Gộp bài đăng gần trùng (MinHash/LSH): chỉ embedding id chuẩn, lưu alias → canonical để ghép với Neo4j
+df["id"] = df["id"].astype(str).str.strip()
+groups = {}
+if DEDUP_ENABLED:
+    graph_ids = set(pd.read_csv(META_PATH)["id"].astype(str).str.strip()) if os.path.exists(META_PATH) else set()
+    dedup = find_near_duplicates(
+        df["id"].tolist(),
+        df["text"].astype(str).tolist(),
+        priority={i: 1.0 for i in graph_ids},
+    )
+    aliases_path = save_aliases(dedup, os.path.join(VDB_DIR, "dedup_aliases.json"))
+    groups = dedup.groups
+    df = df[df["id"].isin(set(dedup.canonical_ids))]
+    print(f"🧹 Gộp bài gần trùng: {dedup.stats()} → alias lưu tại {aliases_path}")
+elif os.path.exists(os.path.join(VDB_DIR, "dedup_aliases.json")):
+    os.remove(os.path.join(VDB_DIR, "dedup_aliases.json"))
+
 print(f"✅ Số bài rao cần embedding: {len(df)}")
 
 # Chuẩn bị dữ liệu embedding 
 texts = df["text"].astype(str).tolist()
-metadatas = [{"id": str(row["id"])} for _, row in df.iterrows()]
+metadatas = [
+    {"id": row["id"], "aliases": ",".join(groups[row["id"]])} if row["id"] in groups else {"id": row["id"]}
+    for _, row in df.iterrows()
+]
 
 # Tạo embedding 
-print(f"🧠 Đang tạo embedding bằng model: {EMBED_MODEL}")
-emb = OpenAIEmbeddings(model=EMBED_MODEL)
+print(f"🧠 Đang tạo embedding bằng model: {EMBED_MODEL} "
+      f"(dimensions={EMB_CONFIG.dimensions or 'mặc định'}, storage={EMB_CONFIG.storage})")
+emb = make_embeddings(EMB_CONFIG)
 
 if BACKEND == "faiss":
     vdb = FAISS.from_texts(texts, embedding=emb, metadatas=metadatas)
     save_path = os.path.join(VDB_DIR, "text_embeddings")
+    apply_storage(vdb, save_path, EMB_CONFIG)
     vdb.save_local(save_path)
     print(f"💾 Đã lưu FAISS vào: {save_path}")
 else:
     save_path = os.path.join(VDB_DIR, "text_embeddings_chroma")
+    # id của Chroma = id bài đăng → VectorClient.upsert thay đúng bài khi nạp lại
     vdb = Chroma.from_texts(
         texts,
         embedding=emb,
         metadatas=metadatas,
+        ids=[m["id"] for m in metadatas],
         persist_directory=save_path
     )
-    vdb.persist()
+    if hasattr(vdb, "persist"):
+        vdb.persist()
+    # Chroma luôn lưu float32; lưu cấu hình để VectorClient embedding câu hỏi đúng số chiều
+    EmbeddingConfig(model=EMBED_MODEL, dimensions=EMB_CONFIG.dimensions).save(save_path)
     print(f"💾 Đã lưu Chroma vào: {save_path}")
 
+# Dựng listing card gọn (dùng khi tổng hợp câu trả lời thay cho mô tả thô)
+cards = build_listing_cards(text_path=DATA_PATH)
+cards_path = save_listing_cards(cards)   # LISTING_CARDS_PATH: cùng file ListingCardStore đọc
+print(f"🗂️ Đã lưu {len(cards)} listing card vào: {cards_path}")
+
 print("✅ Hoàn tất embedding text dataset!")
+
+# Server (WARM_URL) làm nóng lại cache sau khi dữ liệu vector đổi
+request_warm()
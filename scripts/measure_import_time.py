@@ -0,0 +1,82 @@
+"""
+Đo thời gian import từng module của app (mỗi module chạy trong 1 process Python mới, dùng -X importtime).
+Chạy:
+    python -m scripts.measure_import_time
+    python -m scripts.measure_import_time --modules app.main_cli app.utils.answer_pipeline --top 15
+"""
+
+import os
+import re
+import sys
+import argparse
+import subprocess
+from collections import defaultdict
+
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+DEFAULT_MODULES = [
+    "app.config",
+    "app.retrievers.graph_tools",
+    "app.retrievers.vector_tools",
+    "app.retrievers.hybrid_retriever",
+    "app.utils.hybrid_helpers",
+    "app.utils.answer_pipeline",
+    "app.main_cli",
+    "app.evaluate_rag_batch",
+]
+# Các thư viện nặng không nên bị kéo vào lúc import
+HEAVY_PACKAGES = ["streamlit", "langchain_openai", "langchain_community", "faiss", "neo4j", "openai", "pandas"]
+
+_LINE_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure(module: str, repeat: int = 3):
+    """Lấy lần chạy nhanh nhất: (tổng µs, {package: µs}, [(self µs, module)])."""
+    best = None
+    for _ in range(repeat):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=ROOT, capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            err = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "lỗi"
+            return None, {}, [], err
+        total, packages, selfs = 0, defaultdict(int), []
+        for line in proc.stderr.splitlines():
+            m = _LINE_RE.match(line)
+            if not m:
+                continue
+            self_us, cum_us, indent, name = int(m.group(1)), int(m.group(2)), m.group(3), m.group(4)
+            selfs.append((self_us, name))
+            packages[name.split(".")[0]] += self_us
+            if name == module:
+                total = cum_us
+        if best is None or total < best[0]:
+            best = (total, packages, selfs)
+    total, packages, selfs = best
+    return total, packages, sorted(selfs, reverse=True), None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Đo thời gian import các module của app")
+    parser.add_argument("--modules", nargs="+", default=DEFAULT_MODULES, help="Danh sách module cần đo")
+    parser.add_argument("--repeat", type=int, default=3, help="Số lần đo mỗi module (lấy lần nhanh nhất)")
+    parser.add_argument("--top", type=int, default=0, help="In thêm N module con tốn thời gian nhất")
+    args = parser.parse_args()
+
+    print(f"{'module':<36} {'ms':>8}  thư viện nặng bị import")
+    print("─" * 80)
+    for module in args.modules:
+        total, packages, selfs, err = measure(module, args.repeat)
+        if err:
+            print(f"{module:<36} {'-':>8}  ❌ {err}")
+            continue
+        heavy = [f"{p} {packages[p] / 1000:.0f}ms" for p in HEAVY_PACKAGES if p in packages]
+        print(f"{module:<36} {total / 1000:>8.1f}  {', '.join(heavy) or '✅ không có'}")
+        for self_us, name in selfs[: args.top]:
+            print(f"    {self_us / 1000:>7.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
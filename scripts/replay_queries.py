@@ -0,0 +1,251 @@
+"""
+Phát lại request đã ghi (QUERY_CAPTURE_PATH, JSONL) theo đúng nhịp đến thật, đo throughput + độ trễ p50 / p95 / p99.
+Chạy:
+    python -m scripts.replay_queries logs/queries.jsonl --url http://127.0.0.1:8000            # server thật, nhịp ghi lại
+    python -m scripts.replay_queries logs/queries.jsonl --url http://127.0.0.1:8000 --speed 4  # nhanh gấp 4 lần
+    python -m scripts.replay_queries logs/queries.jsonl --url http://127.0.0.1:8000 --rate 20  # Poisson 20 req/s
+    python -m scripts.replay_queries logs/queries.jsonl --target local                         # pipeline trong process này
+    python -m scripts.replay_queries logs/queries.jsonl --target fake --fake-workers 4          # giả lập, không cần dịch vụ
+
+Vòng hở (open-loop): request được gửi đúng thời điểm dự kiến dù các request trước chưa xong
+→ hàng đợi tích lại như ngoài thật khi quá tải. Độ trễ tính từ thời điểm dự kiến (không phải lúc thực sự gửi)
+nên không bị che bởi việc bộ phát bị chậm (coordinated omission); "dispatch_lag" cho biết bộ phát trễ bao nhiêu.
+--target fake: mỗi request ngủ đúng latency_ms đã ghi × --fake-scale, tối đa --fake-workers request cùng lúc
+→ thử nhanh hình dạng tải / dung lượng hàng đợi mà không cần Neo4j, OpenAI.
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import random
+import argparse
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+# Cho phép import module app/
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+
+# loại request gửi lại được như request độc lập (refine = lượt tinh chỉnh trong phiên hội thoại → bỏ qua)
+REPLAY_KINDS = ("answer", "retrieve")
+
+
+def load_capture(path: str, kinds=None, limit: int = 0):
+    """Các dòng capture hợp lệ, sắp theo thời điểm đến (ts)."""
+    entries, skipped = [], 0
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                obj = json.loads(line)
+            except ValueError:
+                continue
+            if not isinstance(obj, dict) or not obj.get("query"):
+                continue
+            if obj.get("kind", "answer") not in REPLAY_KINDS:
+                skipped += 1
+                continue
+            if kinds and obj.get("kind", "answer") not in kinds:
+                continue
+            entries.append(obj)
+    if skipped:
+        print(f"⏭️ Bỏ qua {skipped} dòng không phát lại được (lượt tinh chỉnh hội thoại)")
+    entries.sort(key=lambda e: float(e.get("ts") or 0))
+    return entries[:limit] if limit else entries
+
+
+def schedule(entries, speed: float = 1.0, rate: float = 0.0, seed: int = 0):
+    """Độ lệch (giây) so với lúc bắt đầu cho từng request: nhịp ghi lại / speed, hoặc Poisson `rate` req/s."""
+    if rate > 0:
+        rng = random.Random(seed)
+        offsets, t = [], 0.0
+        for _ in entries:
+            offsets.append(t)
+            t += rng.expovariate(rate)
+        return offsets
+    t0 = float(entries[0].get("ts") or 0) if entries else 0.0
+    return [max(0.0, (float(e.get("ts") or t0) - t0) / speed) for e in entries]
+
+
+# TARGET: mỗi target nhận 1 dòng capture, trả về status (200 = thành công)
+def http_target(url: str, timeout: float):
+    def send(entry):
+        path = "/retrieve" if entry.get("kind") == "retrieve" else "/answer"
+        payload = {k: entry.get(k) for k in ("query", "top_k", "limit", "budget_ms") if entry.get(k) is not None}
+        req = urllib.request.Request(url.rstrip("/") + path, data=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"}, method="POST")
+        try:
+            with urllib.request.urlopen(req, timeout=timeout) as resp:
+                resp.read()
+                return resp.status
+        except urllib.error.HTTPError as e:
+            return e.code
+    return send
+
+
+def local_target():
+    import asyncio
+    from app.utils.answer_pipeline import get_answer_pipeline
+    pipeline = get_answer_pipeline()
+
+    def send(entry):
+        kwargs = {"top_k": entry.get("top_k") or 10, "limit": entry.get("limit") or 3,
+                  "budget_ms": entry.get("budget_ms"), "capture_query": False}
+        if entry.get("kind") == "retrieve":
+            asyncio.run(pipeline.retrieve_async(entry["query"], **kwargs))
+        else:
+            asyncio.run(pipeline.answer_async(entry["query"], **kwargs))
+        return 200
+    return send
+
+
+def fake_target(scale: float, workers: int):
+    """Giả lập dịch vụ có `workers` luồng xử lý, mỗi request tốn đúng latency_ms đã ghi × scale."""
+    slots = threading.Semaphore(workers)
+
+    def send(entry):
+        with slots:
+            time.sleep(max(0, entry.get("latency_ms") or 0) / 1000 * scale)
+        return 200 if not entry.get("error") else 500
+    return send
+
+
+def replay(entries, offsets, send, concurrency: int):
+    """Phát vòng hở: bộ lập lịch ngủ tới thời điểm dự kiến rồi đẩy request vào pool, không chờ kết quả."""
+    rows = [None] * len(entries)
+    start = time.perf_counter()
+
+    def run(i: int, due: float):
+        # sent = lúc worker thật sự bắt đầu → dispatch_lag gồm cả thời gian chờ slot trong pool
+        sent = time.perf_counter()
+        try:
+            status, error = send(entries[i]), ""
+        except Exception as e:
+            status, error = "error", f"{type(e).__name__}: {e}"
+        done = time.perf_counter()
+        rows[i] = {
+            "i": i,
+            "kind": entries[i].get("kind", "answer"),
+            "query": entries[i]["query"],
+            "status": status,
+            "due_s": round(due - start, 4),
+            "latency_ms": round((done - due) * 1000, 2),
+            "service_ms": round((done - sent) * 1000, 2),
+            "dispatch_lag_ms": round((sent - due) * 1000, 2),
+            "recorded_ms": entries[i].get("latency_ms"),
+            "error": error,
+        }
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for i, off in enumerate(offsets):
+            due = start + off
+            wait = due - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            pool.submit(run, i, due)
+    duration = time.perf_counter() - start
+    return [r for r in rows if r is not None], duration
+
+
+def summarize(rows, offsets, duration: float) -> dict:
+    ok = [r for r in rows if r["status"] == 200]
+    statuses = {}
+    for r in rows:
+        statuses[str(r["status"])] = statuses.get(str(r["status"]), 0) + 1
+
+    def pct(values):
+        if not values:
+            return {}
+        arr = np.asarray(values)
+        return {f"p{q}": round(float(np.percentile(arr, q)), 1) for q in (50, 90, 95, 99)} | {
+            "max": round(float(arr.max()), 1)}
+
+    span = offsets[-1] if offsets else 0.0
+    return {
+        "sent": len(rows),
+        "ok": len(ok),
+        "statuses": statuses,
+        "duration_s": round(duration, 2),
+        "offered_rps": round(len(rows) / span, 2) if span > 0 else None,
+        "throughput_rps": round(len(ok) / duration, 2) if duration > 0 else None,
+        "latency_ms": pct([r["latency_ms"] for r in ok]),
+        "service_ms": pct([r["service_ms"] for r in ok]),
+        "dispatch_lag_ms": pct([r["dispatch_lag_ms"] for r in rows]),
+    }
+
+
+def print_report(report: dict):
+    print("\n───────────────────────────────")
+    print("🔁 BÁO CÁO PHÁT LẠI")
+    print("───────────────────────────────")
+    print(f"🎯 {report['target']} · nhịp {report['arrival']} · concurrency={report['concurrency']}")
+    print(f"📨 Gửi {report['sent']} · thành công {report['ok']} · status {report['statuses']}")
+    print(f"⏱ {report['duration_s']}s · offered {report['offered_rps']} req/s → throughput {report['throughput_rps']} req/s")
+    for key in ("latency_ms", "service_ms", "dispatch_lag_ms"):
+        print(f"   {key:<16} {report[key]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Phát lại request đã ghi (QUERY_CAPTURE_PATH) theo nhịp thật hoặc nhịp scale")
+    parser.add_argument("capture", nargs="?", default=os.getenv("QUERY_CAPTURE_PATH"), help="File capture JSONL")
+    parser.add_argument("--target", choices=["url", "local", "fake"], default=None,
+                        help="url: server HTTP (--url) · local: pipeline trong process · fake: ngủ theo latency đã ghi")
+    parser.add_argument("--url", default=None, help="Server cần phát lại (vd http://127.0.0.1:8000)")
+    parser.add_argument("--speed", type=float, default=1.0, help="Nén nhịp ghi lại (2 = nhanh gấp đôi)")
+    parser.add_argument("--rate", type=float, default=0.0, help="Bỏ nhịp ghi lại, dùng Poisson N req/s")
+    parser.add_argument("--limit", type=int, default=0, help="Chỉ phát N request đầu (0 = tất cả)")
+    parser.add_argument("--kind", choices=["answer", "retrieve"], action="append", default=None,
+                        help="Chỉ phát loại request này (lặp lại được)")
+    parser.add_argument("--concurrency", type=int, default=256, help="Số request đang chờ tối đa phía bộ phát")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Timeout mỗi request HTTP (giây)")
+    parser.add_argument("--fake-scale", type=float, default=1.0, help="--target fake: nhân latency đã ghi")
+    parser.add_argument("--fake-workers", type=int, default=4, help="--target fake: số request xử lý đồng thời")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="Báo cáo JSON (mặc định results/replay_<thời gian>.json, kèm .csv)")
+    args = parser.parse_args()
+
+    if not args.capture:
+        parser.error("cần file capture (tham số hoặc QUERY_CAPTURE_PATH)")
+    target = args.target or ("url" if args.url else "fake")
+    if target == "url" and not args.url:
+        parser.error("--target url cần --url")
+
+    entries = load_capture(args.capture, kinds=args.kind, limit=args.limit)
+    if not entries:
+        print(f"⚠️ Không có request nào trong {args.capture}")
+        return
+    offsets = schedule(entries, speed=args.speed, rate=args.rate, seed=args.seed)
+    arrival = f"Poisson {args.rate} req/s" if args.rate > 0 else f"ghi lại ×{args.speed}"
+    print(f"📂 {args.capture}: {len(entries)} request trong {offsets[-1]:.1f}s ({arrival})")
+
+    if target == "url":
+        send = http_target(args.url, args.timeout)
+    elif target == "local":
+        send = local_target()
+    else:
+        send = fake_target(args.fake_scale, args.fake_workers)
+
+    rows, duration = replay(entries, offsets, send, args.concurrency)
+    report = {"target": args.url if target == "url" else target, "arrival": arrival,
+              "concurrency": args.concurrency, **summarize(rows, offsets, duration)}
+    print_report(report)
+
+    out = args.out or os.path.join("results", f"replay_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    with open(os.path.splitext(out)[0] + ".csv", "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()) if rows else ["i"])
+        writer.writeheader()
+        writer.writerows(sorted(rows, key=lambda r: r["i"]))
+    print(f"\n💾 Đã lưu báo cáo: {out}")
+
+
+if __name__ == "__main__":
+    main()
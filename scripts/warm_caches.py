@@ -0,0 +1,93 @@
+"""
+Làm nóng cache (embedding, Cypher, kết quả Neo4j, câu trả lời) sau deploy / nạp lại dữ liệu.
+Chạy:
+    python -m scripts.warm_caches --url http://127.0.0.1:8000                      # server làm nóng chính nó
+    python -m scripts.warm_caches --url http://127.0.0.1:8000 --source logs/queries.jsonl --top 200
+    python -m scripts.warm_caches                                                   # trong process này (answer cache trên đĩa)
+
+Cache embedding / Cypher / Neo4j nằm trong bộ nhớ của process đang phục vụ → dùng --url để server tự làm nóng;
+không có --url chỉ còn answer cache (lưu trên đĩa) có tác dụng cho process khác, báo cáo độ phủ vẫn đầy đủ.
+"""
+
+import os
+import sys
+import json
+import argparse
+import urllib.request
+from datetime import datetime
+
+# Cho phép import module app/
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.utils.cache_warmer import LAYERS, WARM_CONCURRENCY, WARM_MODE, WARM_TOP, load_questions, warm_caches
+
+
+def warm_remote(url: str, questions, mode: str, concurrency: int = WARM_CONCURRENCY) -> dict:
+    # server giới hạn concurrency theo số worker của hàng đợi answer / retrieve
+    payload = {"questions": questions, "mode": mode, "concurrency": concurrency, "wait": True}
+    req = urllib.request.Request(url.rstrip("/") + "/warm", data=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+                                 headers={"Content-Type": "application/json"}, method="POST")
+    with urllib.request.urlopen(req, timeout=None) as resp:
+        return json.loads(resp.read())
+
+
+def print_report(report: dict):
+    if report.get("status") == "running":
+        print(f"⏳ Server đang làm nóng một lượt khác: {report}")
+        return
+    print("\n───────────────────────────────")
+    print("🔥 BÁO CÁO LÀM NÓNG CACHE")
+    print("───────────────────────────────")
+    print(f"📥 Câu hỏi: {report.get('questions')} → {report.get('unique')} câu không trùng "
+          f"(mode={report.get('mode')}, concurrency={report.get('concurrency')})")
+    before, after = report.get("coverage_before") or {}, report.get("coverage_after") or {}
+    for layer in LAYERS:
+        print(f"   {layer:<10} {before.get(layer, 0) * 100:5.1f}% → {after.get(layer, 0) * 100:5.1f}%")
+    # Qua HTTP server chỉ trả số câu lỗi (không trả nội dung câu hỏi)
+    failed = report.get("failed") or []
+    print(f"❌ Lỗi: {failed if isinstance(failed, int) else len(failed)}")
+    for item in (failed if isinstance(failed, list) else [])[:5]:
+        print(f"   • {item['question'][:60]} → {item['error'][:80]}")
+    print(f"⏱ {report.get('took_s')}s · {report.get('timings')}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Làm nóng cache từ log câu hỏi hoặc data/Question.csv")
+    parser.add_argument("--source", action="append", default=None,
+                        help="File câu hỏi .csv / .jsonl / .txt (lặp lại được), mặc định data/Question.csv")
+    parser.add_argument("--top", type=int, default=WARM_TOP, help="Chỉ làm nóng N câu hỏi xuất hiện nhiều nhất (0 = tất cả)")
+    parser.add_argument("--mode", choices=["answer", "retrieve"], default=WARM_MODE,
+                        help="answer: điền cả answer cache (gọi LLM) · retrieve: chỉ embedding / Cypher / Neo4j")
+    parser.add_argument("--concurrency", type=int, default=WARM_CONCURRENCY, help="Số câu hỏi chạy đồng thời")
+    parser.add_argument("--url", default=os.getenv("WARM_URL"), help="Server cần làm nóng (vd http://127.0.0.1:8000)")
+    parser.add_argument("--report", default=None, help="Ghi báo cáo JSON (mặc định results/warm_report_<thời gian>.json)")
+    args = parser.parse_args()
+
+    questions = []
+    for path in args.source or ["data/Question.csv"]:
+        loaded = load_questions(path)
+        print(f"📂 {path}: {len(loaded)} câu hỏi")
+        questions.extend(loaded)
+
+    if args.url:
+        from app.utils.cache_warmer import dedupe_questions
+        # Gộp trùng + cắt top ở đây để chỉ gửi danh sách gọn cho server
+        ranked = dedupe_questions(questions, top=args.top)
+        print(f"🌐 Gửi {len(ranked)} câu hỏi tới {args.url}/warm ...")
+        report = warm_remote(args.url, [q for q, _ in ranked], args.mode, args.concurrency)
+        report["questions"] = len(questions)
+    else:
+        from app.utils.answer_pipeline import get_answer_pipeline
+        report = warm_caches(get_answer_pipeline(), questions, concurrency=args.concurrency, mode=args.mode,
+                             top=args.top)
+
+    print_report(report)
+    out = args.report or os.path.join("results", f"warm_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"💾 Báo cáo: {out}")
+
+
+if __name__ == "__main__":
+    main()